@@ -68,6 +68,22 @@ def test(session: Session) -> None:
 			session.log('Generating XML Coverage report...')
 			session.run('python', '-m', 'coverage', 'xml', f'--rcfile={ROOT_DIR / "pyproject.toml"}')
 
+@nox.session(reuse_venv = True, venv_params = ['--system-site-packages'])
+def bench(session: Session) -> None:
+	OUTPUT_DIR = BUILD_DIR / 'bench'
+	OUTPUT_DIR.mkdir(parents = True, exist_ok = True)
+
+	session.install('-e', '.')
+
+	session.env['SQUISHY_TEST_BENCHMARKS'] = '1'
+	session.env['TORII_TEST_INHIBIT_VCD']  = '1'
+
+	with session.chdir(OUTPUT_DIR):
+		session.log('Running benchmarks...')
+		session.run(
+			'python', '-m', 'unittest', 'discover', '-s', str(ROOT_DIR), '-k', 'Benchmark', *session.posargs
+		)
+
 @nox.session(name = 'watch-docs', reuse_venv = True)
 def watch_docs(session: Session) -> None:
 	OUTPUT_DIR = BUILD_DIR / 'docs'
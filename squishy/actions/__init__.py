@@ -5,6 +5,7 @@ The Squishy CLI (and to some extent, the eventual REPL), consists mainly of invo
 
 Currently there are the following actions:
 * :py:mod:`squishy.actions.applet` - Everything to do with building and running Squishy Applets.
+* :py:mod:`squishy.actions.pcap` - Tools for working with PCAPNG captures.
 * :py:mod:`squishy.actions.provision` - Used for producing device images for hardware.
 
 There are two primary types of actions, the first is the :py:class:`SquishyAction`, this is the
@@ -0,0 +1,238 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import json
+import logging       as log
+from argparse        import ArgumentParser, Namespace
+from pathlib         import Path
+
+from rich.console    import Console
+
+from ..core.pcapng   import Query, SCSIFrameType, capture_stats, merge_captures, slice_capture
+from ..device        import SquishyDevice
+from .               import SquishyAction
+
+__all__ = (
+	'PCAPAction',
+)
+
+class PCAPAction(SquishyAction):
+	'''
+	Work with PCAPNG Captures
+
+	This action collects together the tools for working with ``LINKTYPE_PARALLEL_SCSI`` captures after the
+	fact, without needing to go through Wireshark.
+
+	The ``query`` tool finds the frames that match a query expression, see :py:mod:`squishy.core.pcapng.query`
+	for what can go in one, and either lists them, or writes them out to a new capture.
+
+	The ``slice`` tool copies a time window of a capture, and optionally only the traffic to or from some devices,
+	out to a new capture, and the ``merge`` tool interleaves several captures, such as those from a few analyzers
+	on the same bus, into one by timestamp. Neither of them decodes the packets, see
+	:py:mod:`squishy.core.pcapng.splice`.
+
+	The ``stats`` tool goes over a capture once and prints a summary of it, the commands and data for each
+	initiator, target, and LUN, the latency of each command, and how busy the bus was over time, either as tables or
+	as JSON for feeding into something else.
+
+	'''
+
+	name         = 'pcap'
+	description  = 'Work with PCAPNG captures'
+	requires_dev = False
+
+	def register_args(self, parser: ArgumentParser) -> None:
+		pcap_parser = parser.add_subparsers(
+			dest     = 'pcap_action',
+			required = True
+		)
+
+		query = pcap_parser.add_parser('query', help = 'Find the frames in a capture that match a query')
+
+		query.add_argument(
+			'capture',
+			type = Path,
+			help = 'The capture to search'
+		)
+
+		query.add_argument(
+			'expression',
+			type = str,
+			help = 'The query, e.g. \'type == COMMAND and dest == 3 and opcode == 0x28\''
+		)
+
+		query.add_argument(
+			'--output', '-o',
+			type    = Path,
+			default = None,
+			help    = 'Write the matching frames to this capture rather than listing them'
+		)
+
+		index_opts = query.add_mutually_exclusive_group()
+
+		index_opts.add_argument(
+			'--build-index',
+			action = 'store_true',
+			help   = 'Build the SCSI index next to the capture if it is missing or out of date'
+		)
+
+		index_opts.add_argument(
+			'--no-index',
+			action = 'store_true',
+			help   = 'Don\'t use the SCSI index even if there is one, and go through the whole capture'
+		)
+
+		slice_cmd = pcap_parser.add_parser('slice', help = 'Copy a time window or some devices out of a capture')
+
+		slice_cmd.add_argument(
+			'capture',
+			type = Path,
+			help = 'The capture to slice'
+		)
+
+		slice_cmd.add_argument(
+			'output',
+			type = Path,
+			help = 'The capture to write the slice to'
+		)
+
+		slice_cmd.add_argument(
+			'--start', '-s',
+			type    = int,
+			default = None,
+			help    = 'The timestamp in nanoseconds to start the slice at'
+		)
+
+		slice_cmd.add_argument(
+			'--end', '-e',
+			type    = int,
+			default = None,
+			help    = 'The timestamp in nanoseconds to end the slice before'
+		)
+
+		slice_cmd.add_argument(
+			'--device', '-d',
+			dest    = 'devices',
+			type    = int,
+			action  = 'append',
+			default = None,
+			help    = 'Only keep the SCSI traffic to or from this device ID, can be given more than once'
+		)
+
+		merge = pcap_parser.add_parser('merge', help = 'Merge several captures into one by timestamp')
+
+		merge.add_argument(
+			'output',
+			type = Path,
+			help = 'The capture to write the merged packets to'
+		)
+
+		merge.add_argument(
+			'captures',
+			type  = Path,
+			nargs = '+',
+			help  = 'The captures to merge'
+		)
+
+		stats = pcap_parser.add_parser('stats', help = 'Summarize the SCSI traffic in a capture')
+
+		stats.add_argument(
+			'capture',
+			type = Path,
+			help = 'The capture to summarize'
+		)
+
+		stats.add_argument(
+			'--json', '-j',
+			action = 'store_true',
+			help   = 'Print the statistics as JSON rather than as tables'
+		)
+
+		stats.add_argument(
+			'--slots',
+			type    = int,
+			default = 120,
+			help    = 'The number of slots in the bus utilization timeline'
+		)
+
+	def _query(self, args: Namespace) -> int:
+		try:
+			query = Query(args.expression)
+		except ValueError as e:
+			log.error(str(e))
+			return 1
+
+		index = False if args.no_index else (True if args.build_index else None)
+
+		try:
+			if args.output is not None:
+				count = query.write(args.capture, args.output, index = index)
+				log.info(f'Wrote {count} matching frames to \'{args.output}\'')
+				return 0
+
+			console = Console()
+			count   = 0
+			for frame in query.frames(args.capture, index = index):
+				try:
+					kind = SCSIFrameType(frame.frame_type).name
+				except ValueError:
+					kind = f'{frame.frame_type:#04x}'
+				console.out(
+					f'{frame.timestamp:>20} {kind:<16} {frame.orig_id} -> {frame.dest_id} {frame.data_len:>8} '
+					f'{frame.data[:16].hex()}', highlight = False
+				)
+				count += 1
+		except (OSError, ValueError) as e:
+			log.error(f'Unable to query \'{args.capture}\': {e}')
+			return 1
+
+		log.info(f'Found {count} matching frames')
+		return 0
+
+	def _slice(self, args: Namespace) -> int:
+		try:
+			count = slice_capture(args.capture, args.output, start = args.start, end = args.end, devices = args.devices)
+		except (OSError, ValueError) as e:
+			log.error(f'Unable to slice \'{args.capture}\': {e}')
+			return 1
+
+		log.info(f'Wrote {count} packets to \'{args.output}\'')
+		return 0
+
+	def _merge(self, args: Namespace) -> int:
+		try:
+			count = merge_captures(args.captures, args.output)
+		except (OSError, ValueError) as e:
+			log.error(f'Unable to merge captures: {e}')
+			return 1
+
+		log.info(f'Merged {count} packets from {len(args.captures)} captures into \'{args.output}\'')
+		return 0
+
+	def _stats(self, args: Namespace) -> int:
+		try:
+			stats = capture_stats(args.capture, timeline_slots = args.slots)
+		except (OSError, ValueError) as e:
+			log.error(f'Unable to read \'{args.capture}\': {e}')
+			return 1
+
+		console = Console()
+		# NOTE: This is meant to be piped into something else, so it's written out as-is without any wrapping
+		if args.json:
+			console.out(json.dumps(stats.to_dict(), indent = 2), highlight = False)
+			return 0
+
+		for table in stats.tables():
+			console.print(table)
+		return 0
+
+	def run(self, args: Namespace, dev: SquishyDevice | None = None) -> int:
+		match args.pcap_action:
+			case 'query':
+				return self._query(args)
+			case 'slice':
+				return self._slice(args)
+			case 'merge':
+				return self._merge(args)
+			case 'stats':
+				return self._stats(args)
+		return 1
@@ -6,6 +6,7 @@ from pathlib       import Path
 
 from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn
 
+from ..core.config import BootloaderConfig
 from ..device      import SquishyDevice
 from ..gateware    import SquishyBootloader
 from ..paths       import SQUISHY_BUILD_BOOT
@@ -60,6 +61,22 @@ class ProvisionAction(SquishySynthAction):
 			help   = 'Generate a whole-device flash image, not just the bootloader.'
 		)
 
+		boot_opts = parser.add_argument_group('Bootloader Options')
+
+		boot_opts.add_argument(
+			'--dfu-transfer-size',
+			type    = int,
+			default = None,
+			help    = 'The DFU transfer size in bytes, defaults to the platform specific size'
+		)
+
+		boot_opts.add_argument(
+			'--dfu-fifo-depth',
+			type    = int,
+			default = None,
+			help    = 'Bootloader bitstream FIFO depth in bytes, a power of 2, twice the transfer size to double-buffer'
+		)
+
 	def run(self, args: Namespace, dev: SquishyDevice | None) -> int:
 		# Get the platform
 		platform_type = self.get_platform(args, dev)
@@ -86,9 +103,27 @@ class ProvisionAction(SquishySynthAction):
 		if args.build_dir is not None:
 			build_dir = Path(args.build_dir)
 
-		# TODO(aki): Booloader opts etc
+		# If we have been asked to override the DFU transfer parameters, fill in the blanks from the platform
+		boot_cfg: BootloaderConfig | None = None
+		if args.dfu_transfer_size is not None or args.dfu_fifo_depth is not None:
+			transfer_size = args.dfu_transfer_size
+			fifo_depth    = args.dfu_fifo_depth
+
+			if transfer_size is None:
+				transfer_size = plat.bootloader_cfg.transfer_size
+				if fifo_depth is not None:
+					transfer_size = min(transfer_size, fifo_depth)
+
+			try:
+				boot_cfg = BootloaderConfig(transfer_size = transfer_size, fifo_depth = fifo_depth)
+			except ValueError as e:
+				log.error(f'Invalid bootloader configuration: {e}')
+				return 1
+
+			log.info(f'Using DFU transfer size of {boot_cfg.transfer_size} bytes, FIFO depth {boot_cfg.fifo_depth}')
+
 		bootloader = SquishyBootloader(
-			serial_number = serial, revision = plat.revision
+			serial_number = serial, revision = plat.revision, config = boot_cfg
 		)
 
 		boot_name = f'squishy_boot_v{plat.revision_str}'
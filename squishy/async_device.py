@@ -0,0 +1,574 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the :py:class:`AsyncSquishyDevice` object, an :py:mod:`asyncio` native counterpart
+to :py:class:`squishy.device.SquishyDevice`.
+
+Rather than blocking on each USB transfer, transfers are submitted with the libusb asynchronous API and are
+completed by a single event handling thread per :py:class:`usb1.USBContext`, which then hands the result back
+to the event loop that is awaiting it. This allows for many devices, and any streams on them, to be driven
+concurrently from a single event loop without having to push everything into executor threads.
+
+The descriptor handling, bookkeeping, and the DFU state machine are shared with
+:py:class:`squishy.device.SquishyDevice`, which is wrapped by the :py:class:`AsyncSquishyDevice`, only the I/O
+the state machine asks for is done differently.
+
+'''
+
+import asyncio
+import logging                           as log
+from collections.abc                     import Iterable
+from contextlib                          import AsyncExitStack
+from threading                           import Lock, Thread
+from time                                import perf_counter_ns, time_ns
+from typing                              import Any, Self, TypeVar
+
+from rich.progress                       import Progress
+from usb1                                import (
+	TRANSFER_COMPLETED, TRANSFER_NO_DEVICE, TRANSFER_OVERFLOW, TRANSFER_STALL, TRANSFER_TIMED_OUT, USBContext,
+	USBDeviceHandle, USBError, USBErrorInterrupted, USBErrorIO, USBErrorNoDevice, USBErrorNotFound,
+	USBErrorOverflow, USBErrorPipe, USBErrorTimeout, USBTransfer,
+)
+from usb1.libusb1                        import (
+	LIBUSB_DT_STRING, LIBUSB_ENDPOINT_DIR_MASK, LIBUSB_ENDPOINT_IN, LIBUSB_ENDPOINT_OUT, LIBUSB_RECIPIENT_DEVICE,
+	LIBUSB_REQUEST_GET_DESCRIPTOR, LIBUSB_REQUEST_TYPE_STANDARD,
+)
+from usb_construct.types                 import LanguageIDs
+
+from .core.dfu                           import DFUState, DFUStatus
+from .core.usbtrace                      import ControlTransfer, USBControlTracer
+from .device                             import (
+	_DEFAULT_TIMEOUT, _REATTACH_POLL_INTERVAL, DeviceContainer, SquishyDevice, _ControlRead, _ControlWrite,
+	_DFUStep, _DFUSteps, _find_if, _is_squishy, _libusb_context, _Reattach, _Reset, _Sleep,
+)
+
+__all__ = (
+	'AsyncSquishyDevice',
+	'submit_transfer',
+	'usb_event_thread',
+)
+
+# How long the event thread waits on libusb before checking if it should stop, in seconds
+_EVENT_TIMEOUT = 0.1
+
+# The maximum length of a USB string descriptor
+_STRING_DESC_LEN = 255
+
+T = TypeVar('T')
+
+# Map the libusb transfer status onto the exception we would get from the synchronous API
+_TRANSFER_ERRORS: dict[int, type[USBError]] = {
+	TRANSFER_TIMED_OUT: USBErrorTimeout,
+	TRANSFER_STALL:     USBErrorPipe,
+	TRANSFER_NO_DEVICE: USBErrorNoDevice,
+	TRANSFER_OVERFLOW:  USBErrorOverflow,
+}
+
+class _USBEventThread(Thread):
+	''' Handles all of the libusb events for a single :py:class:`usb1.USBContext` on behalf of its users '''
+
+	def __init__(self, ctx: USBContext) -> None:
+		super().__init__(name = 'squishy-usb-events', daemon = True)
+
+		self._ctx     = ctx
+		self._running = True
+		self.users    = 0
+
+	def run(self) -> None:
+		while self._running:
+			try:
+				self._ctx.handleEventsTimeout(_EVENT_TIMEOUT)
+			except USBErrorInterrupted:
+				pass
+
+	def stop(self) -> None:
+		self._running = False
+		self._ctx.interruptEventHandler()
+		self.join()
+
+# NOTE: These are keyed by `id()` as we only care about the identity of the context
+_EVENT_THREADS: dict[int, _USBEventThread] = {}
+_EVENT_THREADS_LOCK = Lock()
+
+def _acquire_event_thread(ctx: USBContext) -> None:
+	''' Register a user of the event thread for the context, starting it if needed '''
+
+	with _EVENT_THREADS_LOCK:
+		thread = _EVENT_THREADS.get(id(ctx))
+		if thread is None:
+			thread = _EVENT_THREADS[id(ctx)] = _USBEventThread(ctx)
+			thread.start()
+		thread.users += 1
+
+def _release_event_thread(ctx: USBContext) -> None:
+	''' Drop a user of the event thread for the context, stopping it if it was the last one '''
+
+	with _EVENT_THREADS_LOCK:
+		thread = _EVENT_THREADS[id(ctx)]
+		thread.users -= 1
+		if thread.users > 0:
+			return
+		del _EVENT_THREADS[id(ctx)]
+
+	thread.stop()
+
+class usb_event_thread:
+	'''
+	Hold a reference to the event handling thread for a libusb context.
+
+	Asynchronous transfers are only completed while there is at least one user of the event thread
+	for the context they are on, this is used as a context manager around anything that submits them.
+
+	.. code-block:: python
+
+		with usb_event_thread(ctx):
+			await submit_transfer(transfer)
+
+	Parameters
+	----------
+	ctx : usb1.USBContext | None
+		The context to handle events for, if None the context shared with :py:class:`SquishyDevice` is used.
+
+	'''
+
+	def __init__(self, ctx: USBContext | None = None) -> None:
+		self._ctx = ctx if ctx is not None else _libusb_context()
+
+	def __enter__(self) -> USBContext:
+		_acquire_event_thread(self._ctx)
+		return self._ctx
+
+	def __exit__(self, *_) -> None:
+		_release_event_thread(self._ctx)
+
+async def submit_transfer(transfer: USBTransfer) -> USBTransfer:
+	'''
+	Submit a set-up transfer and wait for it to complete.
+
+	The callback on the transfer is replaced, and if the waiting task is cancelled the transfer is cancelled too.
+
+	Parameters
+	----------
+	transfer : usb1.USBTransfer
+		The transfer to submit.
+
+	Returns
+	-------
+	usb1.USBTransfer
+		The completed transfer.
+
+	Raises
+	------
+	usb1.USBError
+		If the transfer failed, the exception matches what the synchronous API would have raised.
+	'''
+
+	loop   = asyncio.get_running_loop()
+	future = loop.create_future()
+
+	def _resolve(xfr: USBTransfer) -> None:
+		if future.done():
+			return
+
+		status = xfr.getStatus()
+		if status == TRANSFER_COMPLETED:
+			future.set_result(xfr)
+		else:
+			error = _TRANSFER_ERRORS.get(status, USBErrorIO)
+			future.set_exception(error(error.value))
+
+	def _completed(xfr: USBTransfer) -> None:
+		# NOTE: This is called from the event thread, so we need to get back onto the loop
+		try:
+			loop.call_soon_threadsafe(_resolve, xfr)
+		except RuntimeError:
+			# The loop has gone away out from under us, there is no one to tell
+			pass
+
+	transfer.setCallback(_completed)
+	transfer.submit()
+
+	try:
+		return await future
+	except asyncio.CancelledError:
+		try:
+			transfer.cancel()
+		except USBErrorNotFound:
+			pass
+		raise
+
+async def _control_transfer(
+	handle: USBDeviceHandle, request_type: int, request: int, value: int, index: int,
+	data_or_len: bytes | bytearray | int, timeout: int
+) -> bytes:
+	''' Do a single asynchronous control transfer, returning any data read '''
+
+	transfer = handle.getTransfer()
+	transfer.setControl(request_type, request, value, index, data_or_len, timeout = timeout)
+	await submit_transfer(transfer)
+
+	return bytes(transfer.getBuffer()[:transfer.getActualLength()])
+
+async def _get_string_descriptor(handle: USBDeviceHandle, desc_index: int, timeout: int) -> str | None:
+	''' Asynchronously read a string descriptor in US English '''
+
+	if desc_index == 0:
+		return None
+
+	data = await _control_transfer(
+		handle,
+		LIBUSB_ENDPOINT_IN | LIBUSB_REQUEST_TYPE_STANDARD | LIBUSB_RECIPIENT_DEVICE,
+		LIBUSB_REQUEST_GET_DESCRIPTOR,
+		(LIBUSB_DT_STRING << 8) | desc_index,
+		LanguageIDs.ENGLISH_US,
+		_STRING_DESC_LEN,
+		timeout
+	)
+
+	# Make sure we actually got a string descriptor back
+	if len(data) < 2 or data[1] != LIBUSB_DT_STRING:
+		return None
+
+	return data[2:data[0]].decode('utf-16-le')
+
+class AsyncSquishyDevice:
+	'''
+	An :py:mod:`asyncio` native interface to Squishy hardware.
+
+	All of the USB transfers are done asynchronously, so none of the methods block the event loop, and
+	many devices can be used concurrently. The DFU state machine itself is shared with
+	:py:class:`squishy.device.SquishyDevice`, only the I/O is done differently.
+
+	The device needs to be opened before it can be used, either with :py:meth:`open`, or by using it as an
+	asynchronous context manager, which keeps the libusb event thread running until it is closed again.
+
+	Some example usage is as follows:
+
+	.. code-block:: python
+
+		async def main():
+			dev = await AsyncSquishyDevice.get_device()
+			async with dev:
+				print(await dev.get_altmodes())
+				await dev.upload(bitstream, 0)
+
+	Parameters
+	----------
+	dev : SquishyDevice
+		The device to wrap.
+
+	'''
+
+	@property
+	def device(self) -> SquishyDevice:
+		''' The wrapped synchronous device '''
+		return self._dev
+
+	@property
+	def serial(self) -> str:
+		''' The serial number of the device '''
+		return self._dev.serial
+
+	@property
+	def rev(self) -> tuple[int, int]:
+		''' The hardware revision of the device '''
+		return self._dev.rev
+
+	@property
+	def is_open(self) -> bool:
+		''' If the device is open '''
+		return self._stack is not None
+
+	def __init__(self, dev: SquishyDevice) -> None:
+		self._dev = dev
+		self._stack: AsyncExitStack | None = None
+
+	async def open(self) -> Self:
+		''' Start using the device, this is a no-op if it is already open '''
+
+		if self._stack is None:
+			async with AsyncExitStack() as stack:
+				stack.enter_context(usb_event_thread())
+				# Everything made it, so hang on to it until we're closed
+				self._stack = stack.pop_all()
+
+		return self
+
+	async def aclose(self) -> None:
+		''' Stop using the device, this does not close the wrapped :py:class:`SquishyDevice` '''
+
+		if self._stack is not None:
+			(stack, self._stack) = (self._stack, None)
+			await stack.aclose()
+
+	async def __aenter__(self) -> Self:
+		return await self.open()
+
+	async def __aexit__(self, *_) -> None:
+		await self.aclose()
+
+	def __repr__(self) -> str:
+		return f'<AsyncSquishyDevice SN=\'{self.serial}\' REV=\'{self.rev}\' >'
+
+	def __str__(self) -> str:
+		return str(self._dev)
+
+	def _ensure_open(self) -> None:
+		if self._stack is None:
+			raise RuntimeError(f'The device {self.serial} is not open')
+
+	async def _control_read(self, request_type: int, request: int, value: int, index: int, length: int) -> bytes:
+		''' Issue an asynchronous control read to the device, tracing it if we have a tracer '''
+
+		self._ensure_open()
+		handle  = self._dev._usb_handle
+		timeout = self._dev._timeout
+		# NOTE: Unlike `controlRead`, the transfer doesn't set the direction for us
+		request_type = (request_type & ~LIBUSB_ENDPOINT_DIR_MASK) | LIBUSB_ENDPOINT_IN
+
+		if self._dev._tracer is None:
+			return await _control_transfer(handle, request_type, request, value, index, length, timeout)
+
+		data   = b''
+		status = 0
+		start  = time_ns()
+		begin  = perf_counter_ns()
+		try:
+			data = await _control_transfer(handle, request_type, request, value, index, length, timeout)
+			return data
+		except USBError as e:
+			status = e.value
+			raise
+		finally:
+			self._dev._trace(ControlTransfer(
+				start, request_type, request, value, index, length, perf_counter_ns() - begin, status, data
+			))
+
+	async def _control_write(
+		self, request_type: int, request: int, value: int, index: int, data: bytes | bytearray
+	) -> int:
+		''' Issue an asynchronous control write to the device, tracing it if we have a tracer '''
+
+		self._ensure_open()
+		handle  = self._dev._usb_handle
+		timeout = self._dev._timeout
+		request_type = (request_type & ~LIBUSB_ENDPOINT_DIR_MASK) | LIBUSB_ENDPOINT_OUT
+
+		if self._dev._tracer is None:
+			return len(await _control_transfer(handle, request_type, request, value, index, data, timeout))
+
+		status = 0
+		start  = time_ns()
+		begin  = perf_counter_ns()
+		try:
+			return len(await _control_transfer(handle, request_type, request, value, index, data, timeout))
+		except USBError as e:
+			status = e.value
+			raise
+		finally:
+			self._dev._trace(ControlTransfer(
+				start, request_type, request, value, index, len(data), perf_counter_ns() - begin, status, bytes(data)
+			))
+
+	async def _run(self, steps: _DFUSteps[T]) -> T:
+		''' Run the steps of part of the DFU state machine, awaiting each one, see :py:meth:`SquishyDevice._run` '''
+
+		(result, error) = (None, None)
+		while True:
+			try:
+				step = steps.send(result) if error is None else steps.throw(error)
+			except StopIteration as e:
+				return e.value
+
+			(result, error) = (None, None)
+			try:
+				result = await self._do_step(step)
+			except Exception as e:
+				error = e
+
+	async def _do_step(self, step: _DFUStep) -> Any:
+		''' Do the I/O for a single step of the DFU state machine '''
+
+		match step:
+			case _ControlRead():
+				return await self._control_read(step.request_type, step.request, step.value, step.index, step.length)
+			case _ControlWrite():
+				return await self._control_write(step.request_type, step.request, step.value, step.index, step.data)
+			case _Sleep():
+				await asyncio.sleep(step.seconds)
+			case _Reset():
+				await asyncio.to_thread(self._dev._usb_reset)
+			case _Reattach():
+				return await self._reattach(step.pid, step.timeout)
+
+	async def _get_dfu_status(self) -> tuple[DFUStatus, DFUState]:
+		''' Get the state and status for the DFU endpoint, see :py:meth:`SquishyDevice._get_dfu_status` '''
+
+		(status, _, state) = await self._run(self._dev._dfu_status_steps())
+		return (status, state)
+
+	async def _get_dfu_state(self) -> DFUState:
+		''' Get the state for the DFU endpoint, see :py:meth:`SquishyDevice._get_dfu_state` '''
+		return await self._run(self._dev._dfu_state_steps())
+
+	async def _reattach(self, pid: int | None, timeout: int) -> bool:
+		'''
+		Wait for the device to come back after a detach or reset and re-attach to it.
+
+		Parameters
+		----------
+		pid : int | None
+			The USB PID we expect the device to come back with, or None if any Squishy PID will do.
+
+		timeout : int
+			How long to wait for the device to come back in ms.
+
+		Returns
+		-------
+		bool
+			True if the device came back in time, otherwise False.
+		'''
+
+		self._dev._release_device()
+
+		loop     = asyncio.get_running_loop()
+		deadline = loop.time() + (timeout / 1000)
+		while (device := _find_if(await self.enumerate(), lambda dev: self._dev._is_same_device(dev, pid))) is None:
+			if loop.time() > deadline:
+				return False
+			await asyncio.sleep(_REATTACH_POLL_INTERVAL)
+
+		(_, _, dev) = device
+		self._dev._attach_device(dev)
+
+		return True
+
+	@classmethod
+	async def enumerate(cls: type[Self]) -> list[DeviceContainer]:
+		'''
+		Collect all of the attached Squishy devices.
+
+		Returns
+		-------
+		list[DeviceContainer]
+			A collection of Squishy hardware devices attached to the system.
+		'''
+
+		devices: list[DeviceContainer] = []
+
+		with usb_event_thread() as ctx:
+			for dev in ctx.getDeviceIterator(skip_on_error = True):
+				if not _is_squishy(dev):
+					continue
+
+				try:
+					hndl = dev.open()
+					try:
+						serial_number = await _get_string_descriptor(
+							hndl, dev.getSerialNumberDescriptor(), _DEFAULT_TIMEOUT
+						)
+					finally:
+						hndl.close()
+
+					if serial_number is None:
+						log.error(f'Suspected Squishy device at {dev.getBusNumber()} has no serial number')
+						continue
+
+					devices.append((serial_number, SquishyDevice._unpack_revision(dev.getbcdDevice()), dev))
+				except USBError as e:
+					log.error(f'Unable to open suspected Squishy device: {e}')
+					log.error('Maybe check your udev rules?')
+
+		return devices
+
+	@classmethod
+	async def get_device(
+		cls: type[Self], *, serial: str | None = None, first: bool = True, tracer: USBControlTracer | None = None
+	) -> Self | None:
+		'''
+		Returns an instance of the first :py:class:`AsyncSquishyDevice` attached to the system,
+		or if ``serial`` is specified the device with that serial number, if possible.
+
+		See :py:meth:`squishy.device.SquishyDevice.get_device` for details, the device still needs to be opened.
+
+		Returns
+		-------
+		AsyncSquishyDevice | None
+			The requested Squishy device if found, otherwise None
+		'''
+
+		found_device = SquishyDevice._select_device(await cls.enumerate(), serial, first)
+		if found_device is None:
+			return None
+
+		(serial_number, _, dev) = found_device
+		return cls(SquishyDevice(dev, serial_number, tracer = tracer))
+
+	async def get_altmodes(self) -> dict[int, str]:
+		'''
+		Get the DFU alt-modes and their names from the device.
+
+		Returns
+		-------
+		dict[int, str]
+			A mapping of the alt-mode endpoint and it's name.
+
+		Raises
+		------
+		RuntimeError
+			If the device is not open, the DFU interface is unknown, or the DFU control request times out.
+		'''
+
+		self._ensure_open()
+		alt_modes: dict[int, str] = {}
+		for alt in self._dev._get_dfu_alt_settings():
+			mode_id: int = alt.getAlternateSetting()
+			mode_name = await _get_string_descriptor(self._dev._usb_handle, alt.getDescriptor(), self._dev._timeout)
+
+			alt_modes[mode_id] = mode_name if mode_name is not None else f'mode {mode_id}'
+
+		return alt_modes
+
+	async def reset(self, *, wait: bool = False) -> bool:
+		'''
+		Invoke a DFU detach.
+
+		See :py:meth:`squishy.device.SquishyDevice.reset` for details.
+
+		Returns
+		-------
+		bool
+			True if the detach was successful, otherwise False
+		'''
+
+		return await self._run(self._dev._dfu_reset_steps(wait))
+
+	async def upload(self, data: bytes, altmode: int, progress: Progress | None = None) -> bool:
+		'''
+		Push firmware/gateware to device.
+
+		See :py:meth:`squishy.device.SquishyDevice.upload` for details.
+
+		Returns
+		-------
+		bool
+			Upload was successful, otherwise False
+		'''
+
+		return await self.upload_images(((altmode, data),), progress)
+
+	async def upload_images(
+		self, images: Iterable[tuple[int, bytes]], progress: Progress | None = None, *, reset: bool = False
+	) -> bool:
+		'''
+		Push multiple firmware/gateware images to the device in a single DFU session.
+
+		See :py:meth:`squishy.device.SquishyDevice.upload_images` for details.
+
+		Returns
+		-------
+		bool
+			All of the images were uploaded successfully, otherwise False
+		'''
+
+		return await self._run(self._dev._dfu_upload_steps(images, progress, reset))
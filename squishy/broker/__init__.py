@@ -0,0 +1,19 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+The ``squishyd`` device broker and its client.
+
+The broker itself lives in :py:mod:`squishy.broker.server`, and is not imported here as it needs libusb.
+
+'''
+
+from .client   import BrokerClient, BrokerDevice, BrokerStream, DeviceLease
+from .protocol import BrokerError
+
+__all__ = (
+	'BrokerClient',
+	'BrokerDevice',
+	'BrokerError',
+	'BrokerStream',
+	'DeviceLease',
+)
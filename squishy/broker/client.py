@@ -0,0 +1,405 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the client side of ``squishyd``, the Squishy device broker.
+
+The client is deliberately lightweight and doesn't need libusb, so things like the Wireshark extcap
+can list devices without having to pay for setting up a libusb context and enumerating everything.
+
+.. code-block:: python
+
+	if (broker := BrokerClient.connect()) is not None:
+		with broker, broker.lease() as lease:
+			with lease.open_stream(interface = 1) as stream:
+				for chunk in stream:
+					...
+
+'''
+
+import logging   as log
+import socket
+from collections import deque
+from itertools   import count
+from pathlib     import Path
+from time        import monotonic
+from typing      import Any, NamedTuple, Self
+
+from ..paths     import SQUISHY_BROKER_SOCKET
+from .protocol   import PROTOCOL_VERSION, BrokerError, Frame, FrameKind, encode_frame, recv_frame
+
+__all__ = (
+	'BrokerClient',
+	'BrokerDevice',
+	'BrokerStream',
+	'DeviceLease',
+)
+
+# The default timeout for requests to the broker, in seconds
+_DEFAULT_TIMEOUT = 5.0
+
+class BrokerDevice(NamedTuple):
+	''' A device known to the broker '''
+
+	serial: str
+	''' The serial number of the device '''
+	rev: tuple[int, int]
+	''' The hardware revision of the device '''
+	bus: int
+	''' The USB bus the device is on '''
+	address: int
+	''' The USB address of the device '''
+	dfu: bool
+	''' If the device is currently in DFU mode '''
+
+	@classmethod
+	def from_message(cls: type[Self], desc: dict[str, Any]) -> Self:
+		return cls(desc['serial'], tuple(desc['rev']), desc['bus'], desc['address'], desc['dfu'])
+
+class BrokerClient:
+	'''
+	A connection to ``squishyd``.
+
+	Parameters
+	----------
+	path : Path
+		The path of the broker socket. (default: :py:data:`squishy.paths.SQUISHY_BROKER_SOCKET`)
+
+	timeout : float | None
+		How long to wait for the broker to respond to a request in seconds, or None to wait forever. (default: 5.0)
+
+	Raises
+	------
+	OSError
+		If the broker couldn't be connected to.
+
+	BrokerError
+		If the broker speaks a different version of the protocol.
+
+	'''
+
+	def __init__(self, path: Path = SQUISHY_BROKER_SOCKET, *, timeout: float | None = _DEFAULT_TIMEOUT) -> None:
+		self._timeout = timeout
+		self._ids     = count(1)
+
+		self._events: deque[dict[str, Any]]         = deque()
+		self._data: dict[int, deque[bytes]]         = {}
+		self._closed_streams: dict[int, str | None] = {}
+
+		self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self._sock.settimeout(timeout)
+			self._sock.connect(str(path))
+
+			hello = self._request('hello')
+			if hello['protocol'] != PROTOCOL_VERSION:
+				raise BrokerError(
+					f'squishyd v{hello["version"]} speaks protocol version {hello["protocol"]}, '
+					f'we need {PROTOCOL_VERSION}'
+				)
+		except BaseException:
+			self._sock.close()
+			raise
+
+		self.version: str = hello['version']
+
+	@classmethod
+	def connect(
+		cls: type[Self], path: Path = SQUISHY_BROKER_SOCKET, *, timeout: float | None = _DEFAULT_TIMEOUT
+	) -> Self | None:
+		'''
+		Connect to the broker if it's running.
+
+		A broker that can't be talked to, because it's not responding or speaks a different protocol version, is
+		treated the same as there being no broker at all, so callers can fall back to using the devices directly.
+
+		Returns
+		-------
+		BrokerClient | None
+			The connection to the broker, or None if there is no usable broker to connect to.
+		'''
+
+		if not hasattr(socket, 'AF_UNIX') or not path.exists():
+			return None
+
+		try:
+			return cls(path, timeout = timeout)
+		except (FileNotFoundError, ConnectionRefusedError):
+			# Left behind by a broker that is no longer running
+			return None
+		except (OSError, BrokerError) as e:
+			log.warning(f'Unable to use squishyd on {path}, ignoring it: {e}')
+			return None
+
+	def close(self) -> None:
+		''' Disconnect from the broker, this releases any leases that are still held '''
+		self._sock.close()
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
+
+	def _send(
+		self, kind: FrameKind, *, channel: int = 0, message: dict[str, Any] | None = None, payload: bytes = b''
+	) -> None:
+		(header, data) = encode_frame(kind, channel = channel, message = message, payload = payload)
+		self._sock.sendall(header)
+		if len(data) > 0:
+			self._sock.sendall(data)
+
+	def _recv(self, deadline: float | None) -> Frame:
+		''' Receive the next frame, stashing any events and stream data '''
+
+		self._sock.settimeout(None if deadline is None else max(deadline - monotonic(), 0.001))
+		try:
+			frame = recv_frame(self._sock)
+		except socket.timeout:
+			raise TimeoutError('Timed out waiting for squishyd')
+
+		if frame is None:
+			raise BrokerError('squishyd closed the connection')
+
+		match frame.kind:
+			case FrameKind.EVENT:
+				event = frame.message or {}
+				if event.get('event') == 'stream_closed':
+					self._closed_streams[event['channel']] = event.get('error')
+				self._events.append(event)
+			case FrameKind.DATA:
+				# NOTE: Stream data can beat the response to opening the stream, so it's always kept
+				self._data.setdefault(frame.channel, deque()).append(frame.payload)
+
+		return frame
+
+	def _request(self, op: str, *, payload: bytes = b'', **args) -> Any:
+		''' Send a request and wait for its response '''
+		return self._request_payload(op, payload = payload, **args)[0]
+
+	def _request_payload(self, op: str, *, payload: bytes = b'', **args) -> tuple[Any, bytes]:
+		''' Send a request and wait for its response and payload '''
+
+		req_id   = next(self._ids)
+		deadline = None if self._timeout is None else monotonic() + self._timeout
+
+		self._send(FrameKind.REQUEST, message = { 'id': req_id, 'op': op, **args }, payload = payload)
+
+		while True:
+			frame = self._recv(deadline)
+			if frame.kind != FrameKind.RESPONSE or frame.message is None or frame.message.get('id') != req_id:
+				continue
+
+			if (error := frame.message.get('error')) is not None:
+				raise BrokerError(error)
+			return (frame.message.get('result'), frame.payload)
+
+	def devices(self) -> list[BrokerDevice]:
+		'''
+		Get the devices the broker knows about.
+
+		Returns
+		-------
+		list[BrokerDevice]
+			All of the attached Squishy devices.
+		'''
+		return [ BrokerDevice.from_message(desc) for desc in self._request('devices') ]
+
+	def lease(self, serial: str | None = None, *, shared: bool = False, remote: bool = True) -> 'DeviceLease':
+		'''
+		Take out a lease on a device.
+
+		Parameters
+		----------
+		serial : str | None
+			The serial number of the device, or None for the first device.
+
+		shared : bool
+			If the lease can be held alongside other shared leases. (default: False)
+
+		remote : bool
+			If the broker should open the device so control transfers and streams can go through it, otherwise
+			the lease is only advisory and the device must be opened directly. (default: True)
+
+		Returns
+		-------
+		DeviceLease
+			The lease on the device.
+
+		Raises
+		------
+		BrokerError
+			If there is no such device or it's already leased.
+		'''
+
+		result = self._request('lease', serial = serial, shared = shared, remote = remote)
+		return DeviceLease(self, result['lease'], BrokerDevice.from_message(result['device']))
+
+	def subscribe(self) -> None:
+		''' Start receiving device attach, detach, and change events '''
+		self._request('subscribe')
+
+	def next_event(self, timeout: float | None = None) -> dict[str, Any] | None:
+		'''
+		Get the next event from the broker.
+
+		Parameters
+		----------
+		timeout : float | None
+			How long to wait for an event in seconds, or None to wait forever.
+
+		Returns
+		-------
+		dict[str, Any] | None
+			The event, or None if there wasn't one before the timeout.
+		'''
+
+		deadline = None if timeout is None else monotonic() + timeout
+		while len(self._events) == 0:
+			try:
+				self._recv(deadline)
+			except TimeoutError:
+				return None
+		return self._events.popleft()
+
+class DeviceLease:
+	'''
+	A lease on a device from the broker.
+
+	This should not be constructed directly, see :py:meth:`BrokerClient.lease`.
+
+	Attributes
+	----------
+	lease_id : int
+		The broker assigned ID of this lease.
+
+	device : BrokerDevice
+		The device that is leased.
+
+	'''
+
+	def __init__(self, client: BrokerClient, lease_id: int, device: BrokerDevice) -> None:
+		self._client  = client
+		self.lease_id = lease_id
+		self.device   = device
+		self._held    = True
+
+	def release(self) -> None:
+		''' Give the lease back to the broker '''
+		if self._held:
+			self._held = False
+			self._client._request('release', lease = self.lease_id)
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.release()
+
+	def control_read(self, request_type: int, request: int, value: int, index: int, length: int) -> bytes:
+		''' Do a control read from the device, see :py:meth:`usb1.USBDeviceHandle.controlRead` '''
+
+		(_, data) = self._client._request_payload(
+			'control', lease = self.lease_id, request_type = request_type, request = request, value = value,
+			index = index, length = length
+		)
+		return data
+
+	def control_write(self, request_type: int, request: int, value: int, index: int, data: bytes) -> int:
+		''' Do a control write to the device, see :py:meth:`usb1.USBDeviceHandle.controlWrite` '''
+
+		result = self._client._request(
+			'control', lease = self.lease_id, request_type = request_type, request = request, value = value,
+			index = index, payload = data
+		)
+		return result['length']
+
+	def open_stream(
+		self, *, interface: int, in_ep: int | None = 1, out_ep: int | None = 1, transfer_size: int = 65536,
+		transfers: int = 16
+	) -> 'BrokerStream':
+		'''
+		Open a bulk stream to the applet through the broker.
+
+		See :py:class:`squishy.channel.StreamChannel` for the parameters.
+
+		Returns
+		-------
+		BrokerStream
+			The opened stream.
+		'''
+
+		result = self._client._request(
+			'stream_open', lease = self.lease_id, interface = interface, in_ep = in_ep, out_ep = out_ep,
+			transfer_size = transfer_size, transfers = transfers
+		)
+		return BrokerStream(self._client, result['channel'])
+
+class BrokerStream:
+	'''
+	A bulk stream to an applet forwarded by the broker.
+
+	This should not be constructed directly, see :py:meth:`DeviceLease.open_stream`.
+
+	'''
+
+	def __init__(self, client: BrokerClient, channel: int) -> None:
+		self._client  = client
+		self.channel  = channel
+		self._data    = client._data.setdefault(channel, deque())
+		self._open    = True
+
+	def read(self, timeout: float | None = None) -> bytes | None:
+		'''
+		Get the next chunk of data from the applet.
+
+		Parameters
+		----------
+		timeout : float | None
+			How long to wait for data in seconds, or None to wait forever.
+
+		Returns
+		-------
+		bytes | None
+			The received data, or None if the stream has been closed.
+
+		Raises
+		------
+		TimeoutError
+			If no data was received before the timeout.
+
+		BrokerError
+			If the stream was closed by the broker due to an error.
+		'''
+
+		deadline = None if timeout is None else monotonic() + timeout
+		while len(self._data) == 0:
+			if not self._open:
+				return None
+			if self.channel in self._client._closed_streams:
+				self._open = False
+				if (error := self._client._closed_streams.pop(self.channel)) is not None:
+					raise BrokerError(error)
+				return None
+			self._client._recv(deadline)
+		return self._data.popleft()
+
+	def __iter__(self):
+		while (chunk := self.read()) is not None:
+			yield chunk
+
+	def write(self, data: bytes) -> None:
+		''' Send data to the applet, any failures are reported as a ``stream_error`` event '''
+		self._client._send(FrameKind.DATA, channel = self.channel, payload = data)
+
+	def close(self) -> None:
+		''' Close the stream '''
+		if self._open:
+			self._open = False
+			self._client._request('stream_close', channel = self.channel)
+			self._client._data.pop(self.channel, None)
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
@@ -0,0 +1,226 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the wire protocol spoken between ``squishyd`` and its clients.
+
+Everything on the socket is a frame, which is a small fixed header, followed by an optional JSON message,
+and then an optional binary payload. The JSON message carries the requests, responses, and events, while
+the payload carries any control transfer data or bulk stream data without having to be encoded.
+
+.. code-block::
+
+	+------+-----+---------+-------------+-------------+---------+---------+
+	| kind | pad | channel | message len | payload len | message | payload |
+	|  u8  | u8  |   u16   |     u32     |     u32     |   ...   |   ...   |
+	+------+-----+---------+-------------+-------------+---------+---------+
+
+All of the header fields are little endian.
+
+'''
+
+import json
+from asyncio         import IncompleteReadError, StreamReader
+from enum            import IntEnum, unique
+from socket          import socket
+from struct          import Struct
+from typing          import Any, Final, NamedTuple
+
+__all__ = (
+	'BrokerError',
+	'Frame',
+	'FrameKind',
+	'PROTOCOL_VERSION',
+	'encode_frame',
+	'read_frame',
+	'recv_frame',
+)
+
+PROTOCOL_VERSION: Final = 1
+''' The version of the broker protocol, bumped on any incompatible change '''
+
+_FRAME_HEADER: Final = Struct('<BxHII')
+
+# Upper bounds so a bad peer can't get us to allocate all the memory
+_MAX_MESSAGE: Final = 1024 * 1024
+_MAX_PAYLOAD: Final = 16 * 1024 * 1024
+
+@unique
+class FrameKind(IntEnum):
+	''' The kind of broker protocol frame '''
+
+	REQUEST  = 0x00
+	''' A request from the client to the broker '''
+	RESPONSE = 0x01
+	''' The response from the broker to a request '''
+	EVENT    = 0x02
+	''' An unsolicited event from the broker, such as a device being attached '''
+	DATA     = 0x03
+	''' Bulk stream data, the channel is the stream the data belongs to '''
+
+class BrokerError(Exception):
+	''' An error reported by, or while talking to, ``squishyd`` '''
+
+class Frame(NamedTuple):
+	''' A single broker protocol frame '''
+
+	kind: FrameKind
+	''' The kind of frame '''
+	channel: int
+	''' The stream the frame belongs to, or 0 if it's not for a stream '''
+	message: dict[str, Any] | None
+	''' The decoded JSON message if there is one '''
+	payload: bytes
+	''' The binary payload of the frame '''
+
+def encode_frame(
+	kind: FrameKind, *, channel: int = 0, message: dict[str, Any] | None = None,
+	payload: bytes | bytearray | memoryview = b''
+) -> tuple[bytes, bytes | bytearray | memoryview]:
+	'''
+	Encode a frame.
+
+	The payload is kept separate from the header and message so large payloads don't need to be copied,
+	the result can be passed directly to :py:meth:`asyncio.StreamWriter.writelines` or :py:meth:`socket.socket.sendmsg`.
+
+	Parameters
+	----------
+	kind : FrameKind
+		The kind of frame.
+
+	channel : int
+		The stream the frame belongs to. (default: 0)
+
+	message : dict[str, Any] | None
+		The JSON message to send, if any.
+
+	payload : bytes | bytearray | memoryview
+		The binary payload to send, if any.
+
+	Returns
+	-------
+	tuple[bytes, bytes | bytearray | memoryview]
+		The encoded frame header and message, and the payload.
+
+	Raises
+	------
+	BrokerError
+		If the message or payload are too large.
+	'''
+
+	msg = b'' if message is None else json.dumps(message, separators = (',', ':')).encode('utf-8')
+
+	if len(msg) > _MAX_MESSAGE or len(payload) > _MAX_PAYLOAD:
+		raise BrokerError(f'Frame too large, message is {len(msg)} bytes and payload is {len(payload)} bytes')
+
+	return (_FRAME_HEADER.pack(kind, channel, len(msg), len(payload)) + msg, payload)
+
+def _decode_frame(header: bytes, body: bytes) -> Frame:
+	''' Build a frame from the raw header and the message and payload that followed it '''
+
+	(kind, channel, msg_len, _) = _FRAME_HEADER.unpack(header)
+
+	try:
+		kind = FrameKind(kind)
+	except ValueError:
+		raise BrokerError(f'Unknown frame kind {kind:#04x}')
+
+	message = None
+	if msg_len > 0:
+		try:
+			message = json.loads(body[:msg_len])
+		except ValueError as e:
+			raise BrokerError(f'Malformed frame message: {e}')
+
+	return Frame(kind, channel, message, body[msg_len:])
+
+def _frame_body_len(header: bytes) -> int:
+	''' Get the length of the message and payload following the header, making sure it's sensible '''
+
+	(_, _, msg_len, payload_len) = _FRAME_HEADER.unpack(header)
+
+	if msg_len > _MAX_MESSAGE or payload_len > _MAX_PAYLOAD:
+		raise BrokerError(f'Frame too large, message is {msg_len} bytes and payload is {payload_len} bytes')
+
+	return msg_len + payload_len
+
+async def read_frame(reader: StreamReader) -> Frame | None:
+	'''
+	Read a frame from an :py:mod:`asyncio` stream.
+
+	Parameters
+	----------
+	reader : asyncio.StreamReader
+		The stream to read from.
+
+	Returns
+	-------
+	Frame | None
+		The frame that was read, or None if the stream was closed cleanly between frames.
+
+	Raises
+	------
+	BrokerError
+		If the frame was malformed or truncated.
+	'''
+
+	try:
+		header = await reader.readexactly(_FRAME_HEADER.size)
+	except IncompleteReadError as e:
+		if len(e.partial) == 0:
+			return None
+		raise BrokerError('Truncated frame header')
+
+	try:
+		body = await reader.readexactly(_frame_body_len(header))
+	except IncompleteReadError:
+		raise BrokerError('Truncated frame')
+
+	return _decode_frame(header, body)
+
+def _recv_exactly(sock: socket, length: int) -> bytes | None:
+	''' Receive exactly ``length`` bytes from the socket, or None if it was closed before anything was received '''
+
+	buffer = bytearray(length)
+	view   = memoryview(buffer)
+	offset = 0
+
+	while offset < length:
+		count = sock.recv_into(view[offset:])
+		if count == 0:
+			if offset == 0:
+				return None
+			raise BrokerError('Connection closed in the middle of a frame')
+		offset += count
+
+	return bytes(buffer)
+
+def recv_frame(sock: socket) -> Frame | None:
+	'''
+	Receive a frame from a blocking socket.
+
+	Parameters
+	----------
+	sock : socket.socket
+		The socket to read from.
+
+	Returns
+	-------
+	Frame | None
+		The frame that was read, or None if the socket was closed cleanly between frames.
+
+	Raises
+	------
+	BrokerError
+		If the frame was malformed or truncated.
+	'''
+
+	header = _recv_exactly(sock, _FRAME_HEADER.size)
+	if header is None:
+		return None
+
+	body_len = _frame_body_len(header)
+	body     = _recv_exactly(sock, body_len) if body_len > 0 else b''
+	if body is None:
+		raise BrokerError('Connection closed in the middle of a frame')
+
+	return _decode_frame(header, body)
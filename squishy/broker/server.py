@@ -0,0 +1,569 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains ``squishyd``, the Squishy device broker.
+
+The broker owns the libusb context, keeps track of Squishy devices as they come and go, and caches their metadata
+so clients don't each need to enumerate and open every device just to find the one they want. Clients talk to
+it over a local socket with the protocol in :py:mod:`squishy.broker.protocol`, see
+:py:class:`squishy.broker.client.BrokerClient`.
+
+Access to a device is arbitrated with leases. An exclusive lease is the only lease on a device, while any number
+of shared leases can be held at once. A lease can either be *remote*, where the broker opens the device and the
+client does control transfers and bulk streams through it, or *direct*, where the lease is purely advisory and
+the client opens the device itself, this is what is used for things like DFU where the device re-enumerates.
+
+'''
+
+import asyncio
+import logging                 as log
+import os
+from argparse                  import ArgumentDefaultsHelpFormatter, ArgumentParser
+from dataclasses               import dataclass, field
+from itertools                 import count
+from pathlib                   import Path
+from typing                    import Any
+
+from rich                      import traceback
+from usb1                      import (
+	CAP_HAS_HOTPLUG, HOTPLUG_ENUMERATE, HOTPLUG_EVENT_DEVICE_ARRIVED, HOTPLUG_EVENT_DEVICE_LEFT, USBContext, USBDevice,
+	USBError, hasCapability,
+)
+from usb1.libusb1              import LIBUSB_ENDPOINT_IN
+from usb_construct.types       import LanguageIDs
+
+from ..                        import __version__
+from ..async_device            import AsyncSquishyDevice, usb_event_thread
+from ..channel                 import StreamChannel
+from ..core.config             import USB_DFU_PID, USB_VID
+from ..device                  import SquishyDevice, _is_squishy, _libusb_context, usb_device_handle
+from ..paths                   import SQUISHY_BROKER_SOCKET
+from .protocol                 import PROTOCOL_VERSION, BrokerError, FrameKind, encode_frame, read_frame
+
+__all__ = (
+	'SquishyBroker',
+	'main',
+)
+
+# How often to re-enumerate devices when libusb can't tell us about hotplug events, in seconds
+_DEFAULT_POLL_INTERVAL = 2.0
+
+# How long to let hotplug events settle before re-enumerating, so a burst of them only enumerates once
+_HOTPLUG_SETTLE = 0.1
+
+# How long to hold on to the leases on a device that went away, so it can re-enumerate (e.g. for DFU), in seconds
+_DEFAULT_LEASE_GRACE = 10.0
+
+@dataclass
+class _BrokerDevice:
+	''' The cached metadata for an attached device '''
+
+	serial: str
+	rev: tuple[int, int]
+	bus: int
+	address: int
+	pid: int
+	usb_dev: USBDevice
+
+	def describe(self) -> dict[str, Any]:
+		return {
+			'serial':  self.serial,
+			'rev':     list(self.rev),
+			'bus':     self.bus,
+			'address': self.address,
+			'dfu':     self.pid == USB_DFU_PID,
+		}
+
+@dataclass
+class _Lease:
+	''' A lease on a device held by a client '''
+
+	lease_id: int
+	serial: str
+	shared: bool
+	remote: bool
+	client: '_Client'
+
+@dataclass
+class _Stream:
+	''' A bulk stream being forwarded for a client '''
+
+	channel_id: int
+	lease: _Lease
+	channel: StreamChannel
+	pump: asyncio.Task | None = None
+
+@dataclass
+class _Client:
+	''' A connected client '''
+
+	writer: asyncio.StreamWriter
+	leases: dict[int, _Lease] = field(default_factory = dict)
+	streams: dict[int, _Stream] = field(default_factory = dict)
+	subscribed: bool = False
+
+	async def send(
+		self, kind: FrameKind, *, channel: int = 0, message: dict[str, Any] | None = None,
+		payload: bytes | bytearray | memoryview = b''
+	) -> None:
+		self.writer.writelines(encode_frame(kind, channel = channel, message = message, payload = payload))
+		await self.writer.drain()
+
+@dataclass
+class _OpenDevice:
+	''' A device the broker has open on behalf of remote leases '''
+
+	device: SquishyDevice
+	async_device: AsyncSquishyDevice
+	lock: asyncio.Lock = field(default_factory = asyncio.Lock)
+	users: int = 0
+
+class SquishyBroker:
+	'''
+	The Squishy device broker.
+
+	Parameters
+	----------
+	path : Path
+		The path of the socket to listen on. (default: :py:data:`squishy.paths.SQUISHY_BROKER_SOCKET`)
+
+	poll_interval : float
+		How often to re-enumerate devices in seconds if libusb doesn't support hotplug events. (default: 2.0)
+
+	lease_grace : float
+		How long the leases on a device that went away are kept in seconds, in case it comes back. (default: 10.0)
+
+	'''
+
+	def __init__(
+		self, path: Path = SQUISHY_BROKER_SOCKET, *, poll_interval: float = _DEFAULT_POLL_INTERVAL,
+		lease_grace: float = _DEFAULT_LEASE_GRACE
+	) -> None:
+		self._path          = path
+		self._poll_interval = poll_interval
+		self._lease_grace   = lease_grace
+
+		self._devices: dict[str, _BrokerDevice]  = {}
+		self._open: dict[str, _OpenDevice]       = {}
+		self._leases: dict[int, _Lease]          = {}
+		self._clients: list[_Client]             = []
+		self._expiring: dict[str, asyncio.Task]  = {}
+
+		self._lease_ids   = count(1)
+		self._channel_ids = count(1)
+
+		self._ctx: USBContext | None                 = None
+		self._loop: asyncio.AbstractEventLoop | None = None
+		self._refresh_pending                        = False
+		self._refresh_lock                           = asyncio.Lock()
+		self._enumerated                             = asyncio.Event()
+
+	@property
+	def devices(self) -> list[dict[str, Any]]:
+		''' The metadata of all the currently attached devices '''
+		return [ dev.describe() for dev in self._devices.values() ]
+
+	def _enumerate(self) -> dict[str, _BrokerDevice]:
+		'''
+		Collect the attached devices, only opening the ones we haven't seen before.
+
+		This is run in an executor, as opening new devices to read their serial numbers is a blocking operation.
+		'''
+
+		known   = { (dev.bus, dev.address, dev.pid): dev for dev in self._devices.values() }
+		devices: dict[str, _BrokerDevice] = {}
+
+		assert self._ctx is not None
+		for usb_dev in self._ctx.getDeviceIterator(skip_on_error = True):
+			if not _is_squishy(usb_dev):
+				continue
+
+			key = (usb_dev.getBusNumber(), usb_dev.getDeviceAddress(), usb_dev.getProductID())
+			if (cached := known.get(key)) is not None:
+				devices[cached.serial] = cached
+				continue
+
+			try:
+				with usb_device_handle(usb_dev) as hndl:
+					serial = hndl.getStringDescriptor(usb_dev.getSerialNumberDescriptor(), LanguageIDs.ENGLISH_US)
+			except USBError as e:
+				log.warning(f'Unable to get the serial number of {usb_dev}: {e}')
+				continue
+
+			devices[serial] = _BrokerDevice(
+				serial  = serial,
+				rev     = SquishyDevice._unpack_revision(usb_dev.getbcdDevice()),
+				bus     = key[0],
+				address = key[1],
+				pid     = key[2],
+				usb_dev = usb_dev,
+			)
+
+		return devices
+
+	async def _refresh(self) -> None:
+		''' Re-enumerate the devices and tell everyone what changed '''
+
+		await asyncio.sleep(_HOTPLUG_SETTLE)
+		self._refresh_pending = False
+
+		async with self._refresh_lock:
+			devices = await asyncio.get_running_loop().run_in_executor(None, self._enumerate)
+			(previous, self._devices) = (self._devices, devices)
+
+			# NOTE: A device that is re-enumerating, such as going into DFU mode, can be gone for a while, so the
+			#       direct leases on it are kept around for a bit in case it comes back. Any handle we have open
+			#       on it is dead either way.
+			for serial in previous.keys() - devices.keys():
+				log.info(f'Device {serial} detached')
+				await self._broadcast({ 'event': 'detached', 'serial': serial })
+				await self._drop_leases(serial, remote_only = True)
+				if any(lease.serial == serial for lease in self._leases.values()):
+					self._expiring[serial] = asyncio.ensure_future(self._expire_leases(serial))
+
+			for serial in devices.keys() - previous.keys():
+				log.info(f'Device {serial} attached')
+				if (expiring := self._expiring.pop(serial, None)) is not None:
+					expiring.cancel()
+				await self._broadcast({ 'event': 'attached', 'device': devices[serial].describe() })
+
+			# NOTE: A device that went into DFU mode (or back out) faster than we noticed has the same serial
+			#       but is a new USB device, so it's the same as it having detached and come back again.
+			for serial in devices.keys() & previous.keys():
+				if devices[serial] is not previous[serial]:
+					await self._broadcast({ 'event': 'changed', 'device': devices[serial].describe() })
+					await self._drop_leases(serial, remote_only = True)
+
+			self._enumerated.set()
+
+	async def _expire_leases(self, serial: str) -> None:
+		''' Drop the leases on a device that went away if it doesn't come back in time '''
+
+		await asyncio.sleep(self._lease_grace)
+
+		del self._expiring[serial]
+		log.info(f'Device {serial} did not come back, dropping its leases')
+		await self._drop_leases(serial)
+
+	def _schedule_refresh(self) -> None:
+		if not self._refresh_pending:
+			self._refresh_pending = True
+			asyncio.ensure_future(self._refresh())
+
+	def _hotplug(self, ctx: USBContext, dev: USBDevice, event: int) -> bool:
+		''' libusb hotplug callback, this is called from the event thread so we can't do anything USB here '''
+
+		if event in (HOTPLUG_EVENT_DEVICE_ARRIVED, HOTPLUG_EVENT_DEVICE_LEFT):
+			assert self._loop is not None
+			self._loop.call_soon_threadsafe(self._schedule_refresh)
+		return False
+
+	async def _poll(self) -> None:
+		while True:
+			self._schedule_refresh()
+			await asyncio.sleep(self._poll_interval)
+
+	async def _broadcast(self, event: dict[str, Any]) -> None:
+		for client in self._clients:
+			if client.subscribed:
+				try:
+					await client.send(FrameKind.EVENT, message = event)
+				except ConnectionError:
+					pass
+
+	async def _drop_leases(self, serial: str, *, remote_only: bool = False) -> None:
+		''' The device went away, so the leases on it are now invalid '''
+
+		for lease in [
+			lease for lease in self._leases.values() if lease.serial == serial and (lease.remote or not remote_only)
+		]:
+			try:
+				await lease.client.send(FrameKind.EVENT, message = { 'event': 'lease_lost', 'lease': lease.lease_id })
+			except ConnectionError:
+				pass
+			await self._release(lease)
+
+	async def _acquire(self, client: _Client, serial: str | None, shared: bool, remote: bool) -> _Lease:
+		''' Take out a lease on a device '''
+
+		if serial is None:
+			if len(self._devices) == 0:
+				raise BrokerError('No devices attached')
+			serial = next(iter(self._devices))
+
+		dev = self._devices.get(serial)
+		if dev is None:
+			raise BrokerError(f'No device with serial {serial}')
+
+		holders = [ lease for lease in self._leases.values() if lease.serial == serial ]
+		if len(holders) > 0 and (not shared or not all(lease.shared for lease in holders)):
+			raise BrokerError(f'Device {serial} is busy')
+
+		if remote:
+			opened = self._open.get(serial)
+			if opened is None:
+				device = SquishyDevice(dev.usb_dev, serial)
+				opened = self._open[serial] = _OpenDevice(device, await AsyncSquishyDevice(device).open())
+			opened.users += 1
+
+		lease = _Lease(next(self._lease_ids), serial, shared, remote, client)
+		self._leases[lease.lease_id] = lease
+		client.leases[lease.lease_id] = lease
+
+		log.debug(f'Leased {serial} as {lease.lease_id} (shared={shared}, remote={remote})')
+		return lease
+
+	async def _release(self, lease: _Lease) -> None:
+		''' Give up a lease, closing any streams on it and the device if no one else needs it '''
+
+		for stream in [ stream for stream in lease.client.streams.values() if stream.lease is lease ]:
+			self._close_stream(lease.client, stream)
+
+		self._leases.pop(lease.lease_id, None)
+		lease.client.leases.pop(lease.lease_id, None)
+
+		if lease.remote and (opened := self._open.get(lease.serial)) is not None:
+			opened.users -= 1
+			if opened.users == 0:
+				del self._open[lease.serial]
+				await opened.async_device.aclose()
+				try:
+					opened.device._release_device()
+				except USBError:
+					pass
+
+		log.debug(f'Released lease {lease.lease_id} on {lease.serial}')
+
+	def _close_stream(self, client: _Client, stream: _Stream) -> None:
+		client.streams.pop(stream.channel_id, None)
+		if stream.pump is not None:
+			stream.pump.cancel()
+		stream.channel.close()
+
+	def _get_lease(self, client: _Client, args: dict[str, Any], *, remote: bool = False) -> _Lease:
+		lease = client.leases.get(args.get('lease', 0))
+		if lease is None:
+			raise BrokerError(f'Unknown lease {args.get("lease")}')
+		if remote and not lease.remote:
+			raise BrokerError(f'Lease {lease.lease_id} is not a remote lease')
+		return lease
+
+	async def _pump_stream(self, client: _Client, stream: _Stream) -> None:
+		''' Forward everything from the device to the client, the socket provides the back-pressure '''
+
+		error: str | None = None
+		try:
+			async for chunk in stream.channel:
+				# NOTE: The chunk is a view of a ring slot that goes back to libusb on the next read, but the
+				#       transport holds on to what we give it until it's sent, so it needs to be copied
+				await client.send(FrameKind.DATA, channel = stream.channel_id, payload = bytes(chunk))
+		except ConnectionError:
+			return
+		except USBError as e:
+			error = str(e)
+
+		client.streams.pop(stream.channel_id, None)
+		stream.channel.close()
+		try:
+			await client.send(
+				FrameKind.EVENT, message = { 'event': 'stream_closed', 'channel': stream.channel_id, 'error': error }
+			)
+		except ConnectionError:
+			pass
+
+	async def _handle_request(self, client: _Client, args: dict[str, Any], payload: bytes) -> tuple[Any, bytes]:
+		''' Handle a single request, returning the result and any payload '''
+
+		match args.get('op'):
+			case 'hello':
+				return ({ 'version': __version__, 'protocol': PROTOCOL_VERSION }, b'')
+			case 'devices':
+				await self._enumerated.wait()
+				return (self.devices, b'')
+			case 'subscribe':
+				client.subscribed = True
+				return (None, b'')
+			case 'lease':
+				await self._enumerated.wait()
+				lease = await self._acquire(
+					client, args.get('serial'), bool(args.get('shared')), bool(args.get('remote', True))
+				)
+				return ({ 'lease': lease.lease_id, 'device': self._devices[lease.serial].describe() }, b'')
+			case 'release':
+				await self._release(self._get_lease(client, args))
+				return (None, b'')
+			case 'control':
+				lease  = self._get_lease(client, args, remote = True)
+				opened = self._open[lease.serial]
+				request_type = int(args['request_type'])
+				async with opened.lock:
+					if request_type & LIBUSB_ENDPOINT_IN:
+						data = await opened.async_device._control_read(
+							request_type, int(args['request']), int(args['value']), int(args['index']),
+							int(args['length'])
+						)
+						return ({ 'length': len(data) }, data)
+					written = await opened.async_device._control_write(
+						request_type, int(args['request']), int(args['value']), int(args['index']), payload
+					)
+					return ({ 'length': written }, b'')
+			case 'stream_open':
+				lease   = self._get_lease(client, args, remote = True)
+				channel = StreamChannel(
+					self._open[lease.serial].device, interface = int(args['interface']),
+					in_ep = args.get('in_ep', 1), out_ep = args.get('out_ep', 1),
+					transfer_size = int(args.get('transfer_size', 65536)), transfers = int(args.get('transfers', 16)),
+				)
+				channel.open()
+				stream = _Stream(next(self._channel_ids), lease, channel)
+				client.streams[stream.channel_id] = stream
+				if args.get('in_ep', 1) is not None:
+					stream.pump = asyncio.ensure_future(self._pump_stream(client, stream))
+				return ({ 'channel': stream.channel_id }, b'')
+			case 'stream_close':
+				stream = client.streams.get(args.get('channel', 0))
+				if stream is not None:
+					self._close_stream(client, stream)
+				return (None, b'')
+			case op:
+				raise BrokerError(f'Unknown request {op!r}')
+
+	async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		client = _Client(writer)
+		self._clients.append(client)
+
+		try:
+			while (frame := await read_frame(reader)) is not None:
+				match frame.kind:
+					case FrameKind.REQUEST:
+						args = frame.message or {}
+						response: dict[str, Any] = { 'id': args.get('id') }
+						payload = b''
+						try:
+							(response['result'], payload) = await self._handle_request(client, args, frame.payload)
+						except (BrokerError, USBError, RuntimeError, KeyError, ValueError, TypeError) as e:
+							response['error'] = str(e)
+						await client.send(FrameKind.RESPONSE, message = response, payload = payload)
+					case FrameKind.DATA:
+						stream = client.streams.get(frame.channel)
+						if stream is None:
+							continue
+						try:
+							await stream.channel.awrite(frame.payload)
+						except USBError as e:
+							await client.send(FrameKind.EVENT, message = {
+								'event': 'stream_error', 'channel': frame.channel, 'error': str(e)
+							})
+					case _:
+						raise BrokerError(f'Unexpected {frame.kind.name} frame from client')
+		except (BrokerError, ConnectionError) as e:
+			log.warning(f'Dropping client: {e}')
+		finally:
+			self._clients.remove(client)
+			for lease in list(client.leases.values()):
+				await self._release(lease)
+			writer.close()
+
+	async def serve(self) -> None:
+		''' Run the broker until cancelled '''
+
+		self._loop = asyncio.get_running_loop()
+		self._ctx  = _libusb_context()
+
+		self._path.parent.mkdir(mode = 0o700, parents = True, exist_ok = True)
+		if self._path.is_socket():
+			# Left behind by a broker that didn't shut down cleanly
+			self._path.unlink()
+
+		server = await asyncio.start_unix_server(self._serve_client, path = self._path)
+		os.chmod(self._path, 0o600)
+		log.info(f'squishyd listening on {self._path}')
+
+		with usb_event_thread(self._ctx):
+			poller: asyncio.Task | None = None
+			if hasCapability(CAP_HAS_HOTPLUG):
+				self._ctx.hotplugRegisterCallback(self._hotplug, flags = HOTPLUG_ENUMERATE, vendor_id = USB_VID)
+				# Make sure we have enumerated at least once, even if there is nothing attached yet
+				self._schedule_refresh()
+			else:
+				log.info(f'libusb has no hotplug support, polling for devices every {self._poll_interval}s')
+				poller = asyncio.ensure_future(self._poll())
+
+			try:
+				async with server:
+					await server.serve_forever()
+			finally:
+				if poller is not None:
+					poller.cancel()
+				for expiring in self._expiring.values():
+					expiring.cancel()
+				self._expiring.clear()
+				for client in list(self._clients):
+					for lease in list(client.leases.values()):
+						await self._release(lease)
+				self._path.unlink(missing_ok = True)
+
+def main() -> int:
+	'''
+	squishyd entrypoint.
+
+	Returns
+	-------
+	int
+		0 if execution was successful, otherwise any other integer on error
+
+	'''
+
+	# NOTE: Imported here as the CLI pulls in all of the actions
+	from ..cli import setup_logging
+
+	traceback.install()
+
+	parser = ArgumentParser(
+		formatter_class = ArgumentDefaultsHelpFormatter,
+		description     = 'Squishy device broker',
+		prog            = 'squishyd'
+	)
+
+	parser.add_argument(
+		'--socket', '-s',
+		type    = Path,
+		default = SQUISHY_BROKER_SOCKET,
+		help    = 'The path of the socket to listen on'
+	)
+
+	parser.add_argument(
+		'--poll-interval',
+		type    = float,
+		default = _DEFAULT_POLL_INTERVAL,
+		help    = 'How often to look for devices in seconds, if libusb does not support hotplug'
+	)
+
+	parser.add_argument(
+		'--lease-grace',
+		type    = float,
+		default = _DEFAULT_LEASE_GRACE,
+		help    = 'How long to keep the leases on a device that went away in seconds, in case it comes back'
+	)
+
+	parser.add_argument(
+		'--verbose', '-v',
+		action = 'store_true',
+		help   = 'Enable verbose output'
+	)
+
+	args = parser.parse_args()
+	setup_logging(args.verbose)
+
+	if not hasattr(asyncio, 'start_unix_server'):
+		log.error('squishyd needs Unix domain socket support, which is not available on this platform')
+		return 1
+
+	try:
+		asyncio.run(SquishyBroker(
+			args.socket, poll_interval = args.poll_interval, lease_grace = args.lease_grace
+		).serve())
+	except KeyboardInterrupt:
+		log.info('bye!')
+
+	return 0
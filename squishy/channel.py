@@ -0,0 +1,443 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the :py:class:`StreamChannel` object, the host side of the
+:py:class:`squishy.gateware.usb.stream.USBStreamChannel` bulk streaming channel.
+
+To keep the bulk IN endpoint busy, a pool of asynchronous transfers are kept submitted at all times. Each
+transfer owns a fixed slot in a single preallocated ring buffer that libusb writes into directly, and once
+a transfer completes its slot is handed to the consumer as a :py:class:`memoryview`, without any copies.
+The transfer is only resubmitted once the consumer is done with the slot, so a slow consumer will stop the
+host from accepting data from the device rather than having it silently overwritten.
+
+The transfers are completed by the shared libusb event thread from :py:mod:`squishy.async_device`, so
+channels can be used from both synchronous code and :py:mod:`asyncio` at the same time.
+
+'''
+
+import asyncio
+import logging                           as log
+from collections                         import deque
+from collections.abc                     import AsyncIterator, Iterator
+from contextlib                          import ExitStack
+from threading                           import Condition
+from time                                import monotonic
+from typing                              import Self
+
+from usb1                                import (
+	TRANSFER_CANCELLED, TRANSFER_COMPLETED, TRANSFER_TIMED_OUT, USBError, USBErrorIO, USBErrorNotFound, USBTransfer
+)
+from usb1.libusb1                        import LIBUSB_ENDPOINT_IN, LIBUSB_ENDPOINT_OUT
+
+from .async_device                       import _TRANSFER_ERRORS, submit_transfer, usb_event_thread
+from .device                             import _DEFAULT_TIMEOUT, SquishyDevice
+
+__all__ = (
+	'StreamChannel',
+)
+
+# How long to wait for the cancelled transfers to come back when closing the channel, in seconds
+_CANCEL_TIMEOUT = 1.0
+
+class StreamChannel:
+	'''
+	High-throughput bulk streaming channel to a Squishy applet.
+
+	The channel is opened with :py:meth:`open` or by using it as a context manager, after which the data the
+	applet sends can be read with :py:meth:`read` or :py:meth:`aread`, or by iterating over the channel.
+
+	.. code-block:: python
+
+		with StreamChannel(dev, interface = 1) as chan:
+			for chunk in chan:
+				sink.write(chunk)
+
+	The :py:class:`memoryview` returned from a read points directly into the ring buffer, and is only valid until
+	the next read or :py:meth:`release`, after which the slot it refers to is given back to libusb.
+
+	Parameters
+	----------
+	dev : SquishyDevice
+		The device the applet is running on.
+
+	interface : int
+		The USB interface number of the channel.
+
+	in_ep : int | None
+		The bulk IN endpoint number, or None if the channel is host to device only. (default: 1)
+
+	out_ep : int | None
+		The bulk OUT endpoint number, or None if the channel is device to host only. (default: 1)
+
+	transfer_size : int
+		The size of each bulk IN transfer in bytes, this must be a multiple of ``max_packet_size``. (default: 65536)
+
+	transfers : int
+		The number of bulk IN transfers to keep in flight. (default: 16)
+
+	max_packet_size : int
+		The ``wMaxPacketSize`` of the bulk endpoints. (default: 512)
+
+	timeout : int
+		The timeout in milliseconds for each bulk IN transfer, or 0 to never time out. (default: 0)
+
+	Attributes
+	----------
+	bytes_received : int
+		The total number of bytes received from the device.
+
+	transfers_completed : int
+		The total number of bulk IN transfers that completed with data.
+
+	errors : int
+		The number of bulk IN transfers or resubmissions that failed.
+
+	'''
+
+	def __init__(
+		self, dev: SquishyDevice, *, interface: int, in_ep: int | None = 1, out_ep: int | None = 1,
+		transfer_size: int = 65536, transfers: int = 16, max_packet_size: int = 512, timeout: int = 0
+	) -> None:
+		if in_ep is None and out_ep is None:
+			raise ValueError('A stream channel needs at least one of `in_ep` or `out_ep`')
+
+		if transfer_size <= 0 or transfer_size % max_packet_size != 0:
+			raise ValueError(f'Transfer size {transfer_size} must be a multiple of {max_packet_size}')
+
+		if transfers < 1:
+			raise ValueError(f'Need at least one transfer in flight, not {transfers}')
+
+		self._dev           = dev
+		self._interface     = interface
+		self._in_ep         = in_ep
+		self._out_ep        = out_ep
+		self._transfer_size = transfer_size
+		self._timeout       = timeout
+
+		# NOTE: The ring is one contiguous allocation, and each transfer gets a fixed slot in it
+		self._ring  = bytearray(transfer_size * transfers if in_ep is not None else 0)
+		self._slots = tuple(
+			memoryview(self._ring)[slot * transfer_size:(slot + 1) * transfer_size]
+			for slot in range(transfers if in_ep is not None else 0)
+		)
+
+		self._transfers: list[USBTransfer]             = []
+		self._cond                                     = Condition()
+		self._filled: deque[tuple[int, int]]           = deque()
+		self._held: int | None                         = None
+		self._waiters: list[asyncio.Future]            = []
+		self._inflight                                 = 0
+		self._error: USBError | None                   = None
+		self._stack: ExitStack | None                  = None
+		self._open                                     = False
+
+		self.bytes_received      = 0
+		self.transfers_completed = 0
+		self.errors              = 0
+
+	@property
+	def is_open(self) -> bool:
+		''' If the channel is open '''
+		return self._open
+
+	@property
+	def backlog(self) -> int:
+		''' The number of completed transfers waiting to be read '''
+		with self._cond:
+			return len(self._filled)
+
+	def open(self) -> None:
+		''' Claim the channel interface and start streaming from the device '''
+
+		if self._open:
+			return
+
+		with ExitStack() as stack:
+			stack.enter_context(self._dev._ensure_iface(self._interface))
+			stack.enter_context(usb_event_thread())
+
+			handle = self._dev._usb_handle
+			self._transfers = []
+			for slot, buffer in enumerate(self._slots if self._in_ep is not None else ()):
+				transfer = handle.getTransfer()
+				transfer.setBulk(
+					LIBUSB_ENDPOINT_IN | self._in_ep, buffer, callback = self._completed, user_data = slot,
+					timeout = self._timeout
+				)
+				self._transfers.append(transfer)
+
+			# Everything made it, so hang on to it until we're closed
+			self._stack = stack.pop_all()
+
+		self._error = None
+		self._open  = True
+
+		with self._cond:
+			for transfer in self._transfers:
+				transfer.submit()
+				self._inflight += 1
+
+	def close(self) -> None:
+		''' Stop streaming, wait for all of the in-flight transfers to be cancelled, and release the interface '''
+
+		if not self._open:
+			return
+
+		with self._cond:
+			self._open = False
+			self._held = None
+			self._filled.clear()
+
+		for transfer in self._transfers:
+			try:
+				transfer.cancel()
+			except USBErrorNotFound:
+				# It already completed, and won't be resubmitted now that we're closed
+				pass
+
+		with self._cond:
+			if not self._cond.wait_for(lambda: self._inflight == 0, _CANCEL_TIMEOUT):
+				log.warning(f'{self._inflight} transfers were still in flight after closing the stream channel')
+			self._wake_waiters()
+
+		self._transfers = []
+
+		assert self._stack is not None
+		(stack, self._stack) = (self._stack, None)
+		stack.close()
+
+	def __enter__(self) -> Self:
+		self.open()
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
+
+	async def __aenter__(self) -> Self:
+		self.open()
+		return self
+
+	async def __aexit__(self, *_) -> None:
+		self.close()
+
+	def _wake_waiters(self) -> None:
+		''' Wake up any tasks waiting in :py:meth:`aread`, must be called with the condition held '''
+
+		for waiter in self._waiters:
+			try:
+				waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+			except RuntimeError:
+				# The loop has gone away out from under us, there is no one to tell
+				pass
+		self._waiters.clear()
+
+	def _completed(self, transfer: USBTransfer) -> None:
+		''' Bulk IN transfer completion callback, called from the event thread '''
+
+		status = transfer.getStatus()
+		slot   = transfer.getUserData()
+		length = transfer.getActualLength()
+
+		with self._cond:
+			self._inflight -= 1
+
+			if not self._open or status == TRANSFER_CANCELLED:
+				self._cond.notify_all()
+				return
+
+			# NOTE: A timeout can still have moved some data, so we treat it like a short transfer
+			if status not in (TRANSFER_COMPLETED, TRANSFER_TIMED_OUT):
+				error = _TRANSFER_ERRORS.get(status, USBErrorIO)
+				self._fail(error(error.value))
+				return
+
+			if length == 0:
+				# Nothing for the consumer (a ZLP or an idle timeout), so put it right back
+				self._resubmit(slot)
+				return
+
+			self.bytes_received      += length
+			self.transfers_completed += 1
+			self._filled.append((slot, length))
+
+			self._cond.notify_all()
+			self._wake_waiters()
+
+	def _fail(self, error: USBError) -> None:
+		''' Record a transfer that can't be resubmitted, must be called with the condition held '''
+
+		self.errors += 1
+		if self._error is None:
+			self._error = error
+
+		self._cond.notify_all()
+		self._wake_waiters()
+
+	def _resubmit(self, slot: int) -> None:
+		''' Give a slot back to libusb, must be called with the condition held '''
+
+		if not self._open or self._error is not None:
+			return
+
+		try:
+			self._transfers[slot].submit()
+			self._inflight += 1
+		except USBError as e:
+			self._fail(e)
+
+	def release(self) -> None:
+		''' Give the slot from the last read back to libusb, invalidating the returned view '''
+
+		with self._cond:
+			if self._held is not None:
+				self._resubmit(self._held)
+				self._held = None
+
+	def _take(self) -> memoryview | None:
+		''' Take the next filled slot, must be called with the condition held '''
+
+		if self._held is not None:
+			self._resubmit(self._held)
+			self._held = None
+
+		if len(self._filled) > 0:
+			(slot, length) = self._filled.popleft()
+			self._held = slot
+			return self._slots[slot][:length]
+
+		if self._error is not None:
+			raise self._error
+
+		if not self._open:
+			return None
+
+		raise BlockingIOError()
+
+	def read(self, timeout: float | None = None) -> memoryview | None:
+		'''
+		Get the next chunk of data from the device.
+
+		Parameters
+		----------
+		timeout : float | None
+			How long to wait for data in seconds, or None to wait forever.
+
+		Returns
+		-------
+		memoryview | None
+			A view of the received data, valid until the next read or :py:meth:`release`, or None if the
+			channel has been closed.
+
+		Raises
+		------
+		TimeoutError
+			If no data was received before the timeout.
+
+		usb1.USBError
+			If the channel was stopped by a failed transfer, this is raised once all the data received before
+			the failure has been read.
+		'''
+
+		if self._in_ep is None:
+			raise ValueError('This stream channel has no IN endpoint')
+
+		deadline = None if timeout is None else monotonic() + timeout
+
+		with self._cond:
+			while True:
+				try:
+					return self._take()
+				except BlockingIOError:
+					pass
+
+				remaining = None if deadline is None else deadline - monotonic()
+				if remaining is not None and remaining <= 0:
+					raise TimeoutError('Timed out waiting for data from the stream channel')
+				self._cond.wait(remaining)
+
+	async def aread(self) -> memoryview | None:
+		'''
+		Asynchronously get the next chunk of data from the device.
+
+		See :py:meth:`read` for details, use :py:func:`asyncio.timeout` for timeouts.
+		'''
+
+		if self._in_ep is None:
+			raise ValueError('This stream channel has no IN endpoint')
+
+		loop = asyncio.get_running_loop()
+
+		while True:
+			with self._cond:
+				try:
+					return self._take()
+				except BlockingIOError:
+					pass
+
+				waiter = loop.create_future()
+				self._waiters.append(waiter)
+
+			try:
+				await waiter
+			finally:
+				with self._cond:
+					if waiter in self._waiters:
+						self._waiters.remove(waiter)
+
+	def __iter__(self) -> Iterator[memoryview]:
+		while (chunk := self.read()) is not None:
+			yield chunk
+
+	async def __aiter__(self) -> AsyncIterator[memoryview]:
+		while (chunk := await self.aread()) is not None:
+			yield chunk
+
+	def write(self, data: bytes | bytearray | memoryview, timeout: int | None = None) -> int:
+		'''
+		Send data to the applet.
+
+		Parameters
+		----------
+		data : bytes | bytearray | memoryview
+			The data to send.
+
+		timeout : int | None
+			The timeout in milliseconds, if None the device timeout is used.
+
+		Returns
+		-------
+		int
+			The number of bytes sent.
+		'''
+
+		if self._out_ep is None:
+			raise ValueError('This stream channel has no OUT endpoint')
+
+		return self._dev._usb_handle.bulkWrite(
+			LIBUSB_ENDPOINT_OUT | self._out_ep, data, _DEFAULT_TIMEOUT if timeout is None else timeout
+		)
+
+	async def awrite(self, data: bytes | bytearray | memoryview, timeout: int | None = None) -> int:
+		'''
+		Asynchronously send data to the applet.
+
+		A writable buffer, such as a :py:class:`bytearray`, is sent without being copied.
+
+		See :py:meth:`write` for details.
+		'''
+
+		if self._out_ep is None:
+			raise ValueError('This stream channel has no OUT endpoint')
+
+		transfer = self._dev._usb_handle.getTransfer()
+		transfer.setBulk(
+			LIBUSB_ENDPOINT_OUT | self._out_ep, data, timeout = _DEFAULT_TIMEOUT if timeout is None else timeout
+		)
+		await submit_transfer(transfer)
+
+		return transfer.getActualLength()
+
+def _wake(waiter: asyncio.Future) -> None:
+	''' Wake up a task waiting on the channel '''
+	if not waiter.done():
+		waiter.set_result(None)
@@ -1,6 +1,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 import logging          as log
 from argparse           import ArgumentDefaultsHelpFormatter, ArgumentParser
+from pathlib            import Path
 
 from rich               import traceback
 from rich.logging       import RichHandler
@@ -8,7 +9,10 @@ from rich.logging       import RichHandler
 from .                  import __version__
 from .actions           import SquishyAction
 from .actions.applet    import AppletAction
+from .actions.pcap      import PCAPAction
 from .actions.provision import ProvisionAction
+from .broker            import BrokerClient, BrokerError, DeviceLease
+from .core.usbtrace     import USBControlTracer
 from .device            import SquishyDevice
 from .paths             import initialize_dirs
 
@@ -18,6 +22,7 @@ __all__ = (
 
 AVAILABLE_ACTIONS = (
 	(AppletAction.name,    AppletAction()),
+	(PCAPAction.name,      PCAPAction()),
 	(ProvisionAction.name, ProvisionAction()),
 )
 
@@ -50,6 +55,23 @@ def setup_logging(verbose: bool = False) -> None:
 		]
 	)
 
+def log_usb_trace(tracer: USBControlTracer) -> None:
+	'''
+	Log the USB control transfer latency percentiles collected by the tracer.
+
+	Parameters
+	----------
+	tracer : USBControlTracer
+		The tracer to summarize.
+
+	'''
+
+	log.info(f'Traced {tracer.total} USB control transfers')
+	for (kind, (count, pcts)) in tracer.summary().items():
+		name = kind.name if kind is not None else 'Other'
+		latencies = ' '.join(f'p{pct}={lat / 1e6:.3f}ms' for pct, lat in pcts.items())
+		log.info(f'  {name:<10} n={count:<6} {latencies}')
+
 def main() -> int:
 	'''
 	Squishy CLI Entrypoint.
@@ -84,6 +106,19 @@ def main() -> int:
 		help   = 'Enable verbose output during synth and pnr'
 	)
 
+	parser.add_argument(
+		'--trace-usb',
+		action = 'store_true',
+		help   = 'Trace USB control transfers to the device and log their latencies on exit'
+	)
+
+	parser.add_argument(
+		'--trace-usb-pcap',
+		type    = Path,
+		metavar = 'FILE',
+		help    = 'Also write the USB control transfer trace to the given PCAPNG file, implies --trace-usb'
+	)
+
 	parser.add_argument(
 		'--version', '-V',
 		action  = 'version',
@@ -108,6 +143,13 @@ def main() -> int:
 	# Set-up logging *again* but if we want verbose output this time
 	setup_logging(args.verbose)
 
+	tracer: USBControlTracer | None = None
+	if args.trace_usb or args.trace_usb_pcap is not None:
+		tracer = USBControlTracer(pcapng = args.trace_usb_pcap)
+
+	broker: BrokerClient | None = None
+	lease: DeviceLease | None   = None
+
 	try:
 		# Get the specified action, and invoke it with the appropriate arguments
 		act: tuple[str, SquishyAction] = next(filter(lambda a: a[0] == args.action, AVAILABLE_ACTIONS), None)
@@ -120,7 +162,7 @@ def main() -> int:
 		serial: str | None = args.device
 
 		# This is now the specified device, or the first device, or no device
-		dev = SquishyDevice.get_device(serial = serial)
+		dev = SquishyDevice.get_device(serial = serial, tracer = tracer)
 
 		# This action requires a device, so we need ensure we have gotten one
 		if instance.requires_dev:
@@ -130,9 +172,38 @@ def main() -> int:
 
 			log.info(f'Selecting device: {dev}')
 
+			# If squishyd is running, we need to play nice with it and anyone else using it
+			# NOTE: This is only done for actions that need the device, so the ones that can do without it, like
+			#       the pcap tools, still work while something else has it leased, such as a running capture.
+			broker = BrokerClient.connect()
+
+		if dev is not None and broker is not None:
+			try:
+				lease = broker.lease(dev.serial, remote = False)
+			except BrokerError as e:
+				log.error(f'Unable to lease {dev} from squishyd: {e}')
+				return 1
+			except OSError as e:
+				# squishyd went away out from under us, so there is no one left to play nice with
+				log.warning(f'Lost the connection to squishyd, using {dev} directly: {e}')
+				broker.close()
+				broker = None
+
 		ret = instance.run(args, dev)
 
 		return ret
 	except KeyboardInterrupt:
 		log.info('bye!')
 		return 0
+	finally:
+		if tracer is not None:
+			log_usb_trace(tracer)
+			tracer.close()
+		if broker is not None:
+			# NOTE: Disconnecting releases the lease anyway, so we don't care if squishyd went away
+			if lease is not None:
+				try:
+					lease.release()
+				except (BrokerError, OSError):
+					pass
+			broker.close()
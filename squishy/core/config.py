@@ -23,6 +23,7 @@ __all__ = (
 	'USBConfig',
 	'SCSIConfig',
 	'FlashConfig',
+	'BootloaderConfig',
 
 	# Fixed/Default configurations
 	'USB_DFU_CONFIG',
@@ -283,6 +284,65 @@ class FlashConfig:
 		self.commands = commands
 
 
+class BootloaderConfig:
+	'''
+	Configuration options for the DFU bootloader gateware.
+
+	The DFU transfer size is advertised to the host in the DFU functional descriptor as ``wTransferSize``
+	and is the largest single ``DFU_DNLOAD`` the bootloader will accept, larger transfers mean fewer control
+	round-trips to program a slot. Each transfer is buffered in block RAM prior to being written to the
+	backing storage, so the FIFO depth must be able to hold at least one full transfer, and both should be
+	sized to fit within the block RAM budget of the platform.
+
+	If the FIFO can hold more than one full transfer, it is split into multiple buffers so the next transfer
+	can be received while the previous one is still being written to the backing storage.
+
+	Parameters
+	----------
+	transfer_size : int
+		The DFU transfer size in bytes.
+
+	fifo_depth : int | None
+		The depth in bytes of the bitstream FIFO, if None it is deep enough to double-buffer ``transfer_size``.
+
+	Attributes
+	----------
+	transfer_size : int
+		The DFU transfer size in bytes.
+
+	fifo_depth : int
+		The depth in bytes of the bitstream FIFO.
+
+	buffers : int
+		The number of full transfers the bitstream FIFO can hold at once.
+
+	Raises
+	------
+	ValueError
+		If the transfer size can't be represented in ``wTransferSize``, or the FIFO depth is not a power of 2 or
+		is too shallow to hold a full transfer.
+	'''
+
+	def __init__(self, *, transfer_size: int, fifo_depth: int | None = None) -> None:
+		if transfer_size <= 0 or transfer_size > 0xFFFF:
+			raise ValueError(f'DFU transfer size must be between 1 and 65535 bytes, not {transfer_size}')
+
+		if fifo_depth is None:
+			fifo_depth = 1 << (transfer_size * 2 - 1).bit_length()
+
+		if fifo_depth & (fifo_depth - 1) != 0:
+			raise ValueError(f'Bootloader FIFO depth must be a power of 2, not {fifo_depth}')
+
+		if fifo_depth < transfer_size:
+			raise ValueError(
+				f'Bootloader FIFO depth of {fifo_depth} is unable to hold a full {transfer_size} byte DFU transfer'
+			)
+
+		self.transfer_size = transfer_size
+		self.fifo_depth    = fifo_depth
+		self.buffers       = fifo_depth // transfer_size
+
+
 # Static/Default configurations
 
 USB_DFU_CONFIG = USBConfig(
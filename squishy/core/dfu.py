@@ -47,7 +47,7 @@ class DFUState(IntEnum):
 		}.get(self, f'Unknown DFU State: {int(self)}')
 
 	def __int__(self) -> int:
-		return int(self)
+		return self.value
 
 @unique
 class DFUStatus(IntEnum):
@@ -85,7 +85,7 @@ class DFUStatus(IntEnum):
 		}.get(self, f'Unknown DFU Status: {int(self)}')
 
 	def __int__(self) -> int:
-		return int(self)
+		return self.value
 
 @unique
 class DFURequests(IntEnum):
@@ -98,7 +98,7 @@ class DFURequests(IntEnum):
 	Abort     = 6
 
 	def __int__(self) -> int:
-		return int(self)
+		return self.value
 
 
 DFU_CLASS: tuple[int, int] = (
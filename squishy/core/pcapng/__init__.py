@@ -9,35 +9,165 @@ found at https://github.com/squishy-scsi/wireshark-scsi/blob/main/docs/LINKTYPE_
 
 '''
 
+import logging       as log
 from collections.abc import Iterable
-from datetime        import timedelta
+from datetime        import datetime, timedelta
 from enum            import IntEnum
-from io              import SEEK_END, SEEK_SET, BytesIO
+from functools       import cache
+from importlib       import import_module
+from io              import SEEK_END, SEEK_SET, BytesIO, IOBase
 from pathlib         import Path
-from typing          import BinaryIO, Final, Self
+from struct          import Struct as PackedStruct
+from threading       import local
+from time            import time_ns
+from typing          import TYPE_CHECKING, Any, BinaryIO, Final, Self
 
 from arrow           import Arrow, now
 from construct       import (
 	Aligned, BitsInteger, BitStruct, Bytes, Check, Computed, Const, CString, Default, Enum, Flag, GreedyRange, Hex,
-	HexDump, If, Int8ul, Int16ul, Int32ul, Int64ul, PaddedString, Pass, Rebuild, RepeatUntil, Struct, Switch,
+	HexDump, If, Int8ul, Int16ul, Int32ul, Int64sl, Int64ul, PaddedString, Pass, Rebuild, RepeatUntil, Struct, Switch,
 	len_, this,
 )
 
 from .linktype       import (
-	SCSIFrameType, linktype_parallel_scsi, scsi_bus_opt,
+	_PSF_HEADER, SCSIFrameType, scsi_bus_opt,
 )
+from .compress       import CompressedFile, Compression
+from .writer         import BackgroundWriter, OverflowPolicy
+
+if TYPE_CHECKING:
+	from .export      import SCSI_FRAME_DTYPE, SCSIFrames, export_scsi_frames
+	from .file        import CaptureFile, SyncPolicy
+	from .mapped      import MappedCapture
+	from .parallel    import export_scsi_frames_parallel
+	from .query       import Query, QueryFrame, decode_cdb
+	from .reader      import Block, EnhancedPacket, InterfaceDescription, PCAPNGReader, SectionHeader
+	from .recorder    import FlightRecorder, frame_trigger
+	from .rotate      import RotatingFile
+	from .sidecar     import IndexedFile, SCSIIndex, SCSIIndexRow, SCSIIndexWriter, build_scsi_index, scsi_index_path
+	from .splice      import merge_captures, slice_capture
+	from .stats       import CaptureStats, LogHistogram, capture_stats
+	from .transaction import SCSITransaction, TransactionAssembler, TransactionState, scsi_transactions
+
+# NOTE: Only the stream writer is needed to take a capture, so the rest of the capture tooling, some of which
+#       pulls in things like NumPy, is only imported once something from it is used, see `__getattr__`
+_LAZY_EXPORTS: Final[dict[str, str]] = {
+	name: module for (module, names) in (
+		('export',      ('SCSI_FRAME_DTYPE', 'SCSIFrames', 'export_scsi_frames')),
+		('file',        ('CaptureFile', 'SyncPolicy')),
+		('mapped',      ('MappedCapture', )),
+		('parallel',    ('export_scsi_frames_parallel', )),
+		('query',       ('Query', 'QueryFrame', 'decode_cdb')),
+		('reader',      ('Block', 'EnhancedPacket', 'InterfaceDescription', 'PCAPNGReader', 'SectionHeader')),
+		('recorder',    ('FlightRecorder', 'frame_trigger')),
+		('rotate',      ('RotatingFile', )),
+		('sidecar',     (
+			'IndexedFile', 'SCSIIndex', 'SCSIIndexRow', 'SCSIIndexWriter', 'build_scsi_index', 'scsi_index_path'
+		)),
+		('splice',      ('merge_captures', 'slice_capture')),
+		('stats',       ('CaptureStats', 'LogHistogram', 'capture_stats')),
+		('transaction', ('SCSITransaction', 'TransactionAssembler', 'TransactionState', 'scsi_transactions')),
+	) for name in names
+}
+
+def __getattr__(name: str) -> Any:
+	if (module := _LAZY_EXPORTS.get(name)) is None:
+		raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+	value = getattr(import_module(f'.{module}', __name__), name)
+	# Stash it so we only come through here the first time
+	globals()[name] = value
+	return value
+
+def __dir__() -> list[str]:
+	return sorted(globals().keys() | _LAZY_EXPORTS.keys())
 
 __all__ = (
+	'Block',
+	'CaptureFile',
+	'capture_stats',
+	'CaptureStats',
+	'CompressedFile',
+	'Compression',
+	'EnhancedPacket',
+	'export_scsi_frames',
+	'export_scsi_frames_parallel',
+	'FlightRecorder',
+	'build_scsi_index',
+	'decode_cdb',
+	'frame_trigger',
+	'IndexedFile',
+	'InterfaceDescription',
+	'LogHistogram',
+	'MappedCapture',
+	'merge_captures',
+	'OverflowPolicy',
+	'PacketEncoder',
+	'PCAPNGInterface',
+	'PCAPNGReader',
 	'PCAPNGStream',
+	'Query',
+	'QueryFrame',
+	'RotatingFile',
+	'scsi_index_path',
+	'SCSI_FRAME_DTYPE',
+	'SCSIFrames',
+	'SCSIIndex',
+	'SCSIIndexRow',
+	'SCSIIndexWriter',
+	'scsi_transactions',
+	'SCSITransaction',
+	'SectionHeader',
+	'slice_capture',
+	'SyncPolicy',
+	'TS_RESOLUTION_NS',
+	'TS_RESOLUTION_US',
+	'TransactionAssembler',
+	'TransactionState',
+	'ts_units',
 )
 
 
 TS_EPOCH: Final = Arrow(1970, 1, 1)
 
+TS_RESOLUTION_US: Final = 6
+''' The default ``if_tsresol`` of microseconds '''
+TS_RESOLUTION_NS: Final = 9
+''' An ``if_tsresol`` of nanoseconds '''
+
+def ts_units(resolution: int) -> int:
+	'''
+	Get the number of timestamp units per second for the given ``if_tsresol``.
+
+	Parameters
+	----------
+	resolution : int
+		The ``if_tsresol`` value, a negative power of 10, or a negative power of 2 if the MSB is set.
+
+	Returns
+	-------
+	int
+		The number of timestamp units in a second.
+	'''
+	if resolution & 0x80:
+		return 1 << (resolution & 0x7F)
+	return 10 ** resolution
+
 # Convert a raw PCAPNG timestamp to an Arrow datetime
 def _timestamp_from_raw(this):
 	timestamp = (this.raw.high << 32) + this.raw.low
-	return TS_EPOCH.shift(seconds = timestamp * 1e-6)
+	# NOTE: This assumes the default resolution of microseconds, as we can't see the interface from here,
+	#       timestamps at a finer resolution may end up out of range, so they are clamped, and the raw value
+	#       is still there to be converted with the right resolution
+	try:
+		return TS_EPOCH.shift(seconds = timestamp * 1e-6)
+	except (OverflowError, ValueError):
+		_warn_timestamp_range()
+		return Arrow.max
+
+@cache
+def _warn_timestamp_range() -> None:
+	log.warning('PCAPNG timestamp out of range for a microsecond resolution, clamping it, use the raw value instead')
 
 # Convert a datetime/Arrow timestamp to a PCAPNG raw timestamp for construct
 def _timestamp_to_raw(this):
@@ -60,6 +190,9 @@ timestamp = 'Timestamp' / Struct(
 class LinkType(IntEnum):
 	''' PCAPNG LinkType '''
 
+	USB_LINUX_MMAPPED = 0x00DC
+	''' LINKTYPE_USB_LINUX_MMAPPED: Linux usbmon 64-byte header followed by the transfer data '''
+
 	# User DLTs
 	USER00 = 0x0093
 	''' DLT_USER00 '''
@@ -335,7 +468,7 @@ option_value = Aligned(4, Switch(
 			BlockType.INTERFACE_DESCRIPTION: Int8ul, # IF_FCSLEN
 		}, HexDump(Bytes(this.length))),
 		0x000E: Switch(lambda this: int(this._.type), {
-			BlockType.INTERFACE_DESCRIPTION: Int64ul, # IF_TSOFFSET
+			BlockType.INTERFACE_DESCRIPTION: Int64sl, # IF_TSOFFSET
 		}, HexDump(Bytes(this.length))),
 		0x000F: Switch(lambda this: int(this._.type), {
 			BlockType.INTERFACE_DESCRIPTION: PaddedString(this.length, 'utf8'), # IF_HARDWARE
@@ -357,7 +490,8 @@ def _option_len(this) -> int:
 	if isinstance(this.value, str):
 		value = CString('utf8').build(this.value, **this)[:-1]
 	else:
-		value = option_value.build(this.value, **this)
+		# NOTE: The option length is that of the value itself, the padding is not included
+		value = option_value.subcon.build(this.value, **this)
 	return len(value)
 
 option = 'Option' / Struct(
@@ -535,7 +669,8 @@ def write_shb(
 
 
 def write_idb(
-	stream: BinaryIO, /, link_type: LinkType, snap_len: int, name: str, *, options: Iterable = ()
+	stream: BinaryIO, /, link_type: LinkType, snap_len: int, name: str, *, ts_resolution: int | None = None,
+	ts_offset: int | None = None, options: Iterable = ()
 ) -> int:
 	'''
 	Write an Interface Description Block
@@ -555,6 +690,12 @@ def write_idb(
 	name : str
 		The name of this interface.
 
+	ts_resolution : int | None
+		The ``if_tsresol`` of the packet timestamps, or None for the default of microseconds.
+
+	ts_offset : int | None
+		The ``if_tsoffset`` in seconds to add to the packet timestamps, or None for no offset.
+
 	options : Iterable
 		Any extra options to attach to the block. (default: [])
 	'''
@@ -562,9 +703,16 @@ def write_idb(
 	_options = [
 		*options,
 		{ 'type': OptionType.IF_NAME,    'value': name },
-		{ 'type': OptionType.END,        'value': None }
 	]
 
+	if ts_resolution is not None:
+		_options.append({ 'type': OptionType.IF_TSRESOL, 'value': ts_resolution })
+
+	if ts_offset is not None:
+		_options.append({ 'type': OptionType.IF_TSOFFSET, 'value': ts_offset })
+
+	_options.append({ 'type': OptionType.END, 'value': None })
+
 	return stream.write(pcapng_block.build({
 		'type': BlockType.INTERFACE_DESCRIPTION,
 		'data': {
@@ -574,8 +722,274 @@ def write_idb(
 		'options': _options
 	}))
 
+# Block Type, Block Length, Interface ID, Timestamp (High), Timestamp (Low), Captured Length, Original Length
+_EPB_HEADER: Final = PackedStruct('<7I')
+_BLOCK_TRAILER: Final = PackedStruct('<I')
+
+_PADDING: Final = bytes(3)
+_TS_EPOCH_DT: Final = TS_EPOCH.datetime
+
+# NOTE: This is only here to keep a pathological stream of unique options from eating all the memory
+_OPTIONS_CACHE_SIZE: Final = 256
+
+def _freeze_option(value):
+	''' Turn an option value into something hashable so the encoded options can be cached '''
+	if isinstance(value, dict):
+		return tuple((k, _freeze_option(v)) for k, v in value.items())
+	if isinstance(value, (list, tuple)):
+		return tuple(_freeze_option(v) for v in value)
+	return value
+
+def _timestamp_ns(ts: Arrow | datetime | None) -> int:
+	''' Get the nanoseconds since the epoch for an Arrow/datetime, or now if it's None '''
+	if ts is None:
+		return time_ns()
+	if not isinstance(ts, Arrow):
+		ts = Arrow.fromdatetime(ts)
+	value: timedelta = ts._datetime - _TS_EPOCH_DT
+	return ((value.days * 86400 + value.seconds) * 1_000_000 + value.microseconds) * 1000
+
+def _timestamp_us(ts: Arrow | datetime | None) -> int:
+	''' Get the raw PCAPNG timestamp for an Arrow/datetime the same way the ``timestamp`` struct does '''
+	if ts is None:
+		return time_ns() // 1000
+	if isinstance(ts, Arrow):
+		value: timedelta = ts._datetime - _TS_EPOCH_DT
+	else:
+		value: timedelta = Arrow.fromdatetime(ts) - TS_EPOCH
+	return int(value.total_seconds() * 1e6)
+
+class PacketEncoder:
+	'''
+	A fast encoder for Enhanced Packet Blocks and Parallel SCSI Frames.
+
+	Building packets with construct is very general but very slow, this packs the fixed headers
+	with precompiled :py:class:`struct.Struct` layouts into a reusable buffer, and only uses construct
+	to encode the options, which are then cached. The output is byte-identical to building the same
+	block with ``pcapng_block``.
+
+	Warning
+	-------
+	The :py:class:`memoryview` returned from :py:meth:`encode_epb` and :py:meth:`encode_psf` points into
+	the encoders buffer, and is only valid until the next call. An encoder should also not be shared
+	between threads.
+
+	Integer timestamps are written as-is, so timestamps from the capture hardware can be written straight
+	through, they must already be in the resolution of the interface and relative to its offset. Any
+	Arrow/datetime timestamps are converted to the resolution and offset of the encoder.
+
+	Parameters
+	----------
+	size : int
+		The initial size of the buffer, it grows as needed. (default: 4096)
+
+	ts_resolution : int
+		The ``if_tsresol`` of the interface the packets are for. (default: TS_RESOLUTION_US)
+
+	ts_offset : int
+		The ``if_tsoffset`` in seconds of the interface the packets are for. (default: 0)
+
+	'''
+
+	__slots__ = ('_buffer', '_view', '_options', '_ts_units', '_ts_offset')
+
+	def __init__(self, size: int = 4096, *, ts_resolution: int = TS_RESOLUTION_US, ts_offset: int = 0) -> None:
+		self._buffer = bytearray(size)
+		self._view   = memoryview(self._buffer)
+		self._options: dict[tuple, bytes] = {}
+
+		self._ts_units  = ts_units(ts_resolution)
+		self._ts_offset = ts_offset
+
+	def timestamp(self, ts: int | Arrow | datetime | None) -> int:
+		'''
+		Get the raw timestamp for a packet.
+
+		Parameters
+		----------
+		ts : int | Arrow | datetime | None
+			The timestamp, a raw integer timestamp is passed through as-is, and None is now.
+
+		Returns
+		-------
+		int
+			The raw timestamp in the encoders resolution.
+		'''
+
+		if isinstance(ts, int):
+			return ts
+		# NOTE: This keeps the default microsecond timestamps bit for bit with the ``timestamp`` struct
+		if self._ts_units == 1_000_000 and self._ts_offset == 0:
+			return _timestamp_us(ts)
+		return (_timestamp_ns(ts) - self._ts_offset * 1_000_000_000) * self._ts_units // 1_000_000_000
+
+	def _reserve(self, size: int) -> memoryview:
+		''' Make sure the buffer can hold at least ``size`` bytes '''
+		if size > len(self._buffer):
+			# NOTE: We replace rather than resize, as there may still be views of the old buffer around
+			self._buffer = bytearray(max(size, len(self._buffer) * 2))
+			self._view   = memoryview(self._buffer)
+		return self._view
+
+	def encode_options(self, options: Iterable) -> bytes:
+		'''
+		Encode the options for an Enhanced Packet Block, including the terminating ``END`` option.
+
+		Parameters
+		----------
+		options : Iterable
+			The options to encode.
+
+		Returns
+		-------
+		bytes
+			The encoded options, or an empty bytes if there are none.
+		'''
+
+		if len(options) == 0:
+			return b''
+
+		try:
+			key = tuple((int(opt['type']), _freeze_option(opt['value'])) for opt in options)
+			if (encoded := self._options.get(key)) is not None:
+				return encoded
+		except TypeError:
+			key = None
+
+		encoded = options_block.build(
+			[ *options, { 'type': OptionType.END, 'value': None } ], type = BlockType.ENHANCED_PACKET
+		)
+
+		if key is not None:
+			if len(self._options) >= _OPTIONS_CACHE_SIZE:
+				self._options.clear()
+			self._options[key] = encoded
+
+		return encoded
+
+	def encode_epb(
+		self, interface: int, data: BinaryIO | bytes | bytearray | memoryview, ts: int | Arrow | None = None,
+		*, options: Iterable | bytes = ()
+	) -> memoryview:
+		'''
+		Encode an Enhanced Packet Block.
+
+		Parameters
+		----------
+		interface : int
+			The interface this packet came from.
+
+		data : BinaryIO | bytes | bytearray | memoryview
+			The raw data to write into the packet.
+
+		ts : int | Arrow | None
+			The capture timestamp of this packet, see :py:meth:`timestamp`.
+
+		options : Iterable | bytes
+			Any extra options to attach to the block, or options already encoded with
+			:py:meth:`encode_options`. (default: [])
+
+		Returns
+		-------
+		memoryview
+			The encoded block.
+		'''
+
+		if not isinstance(data, (bytes, bytearray, memoryview)):
+			data = data.read()
+
+		opts     = options if isinstance(options, bytes) else self.encode_options(options)
+		data_len = len(data)
+		padding  = -data_len & 3
+		opts_at  = _EPB_HEADER.size + data_len + padding
+		blk_len  = opts_at + len(opts) + _BLOCK_TRAILER.size
+		raw_ts   = self.timestamp(ts)
+
+		view = self._reserve(blk_len)
+		_EPB_HEADER.pack_into(
+			view, 0, BlockType.ENHANCED_PACKET, blk_len, interface, raw_ts >> 32, raw_ts & 0xFFFFFFFF,
+			data_len, data_len
+		)
+		view[_EPB_HEADER.size:_EPB_HEADER.size + data_len] = data
+		view[opts_at - padding:opts_at] = _PADDING[:padding]
+		view[opts_at:opts_at + len(opts)] = opts
+		_BLOCK_TRAILER.pack_into(view, blk_len - _BLOCK_TRAILER.size, blk_len)
+
+		return view[:blk_len]
+
+	def encode_psf(
+		self, interface: int, data: BinaryIO | bytes | bytearray | memoryview, type: SCSIFrameType,
+		orig: int, dest: int, ts: int | Arrow | None = None, *, options: Iterable | bytes = ()
+	) -> memoryview:
+		'''
+		Encode a Parallel SCSI Frame wrapped in an Enhanced Packet Block.
+
+		Parameters
+		----------
+		interface : int
+			The interface this packet came from.
+
+		data : BinaryIO | bytes | bytearray | memoryview
+			The raw data to write into the frame.
+
+		type : SCSIFrameType
+			The type of Parallel SCSI Frame we're writing.
+
+		orig : int
+			The SCSI ID of the originator of the frame.
+
+		dest : int
+			The SCSI ID of the destination of the frame.
+
+		ts : int | Arrow | None
+			The capture timestamp of this packet, see :py:meth:`timestamp`.
+
+		options : Iterable | bytes
+			Any extra options to attach to the block, or options already encoded with
+			:py:meth:`encode_options`. (default: [])
+
+		Returns
+		-------
+		memoryview
+			The encoded block.
+		'''
+
+		if not isinstance(data, (bytes, bytearray, memoryview)):
+			data = data.read()
+
+		opts     = options if isinstance(options, bytes) else self.encode_options(options)
+		data_len = len(data)
+		padding  = -data_len & 3
+		# The frame is 4 byte aligned itself, so the packet data never needs any extra padding
+		data_at  = _EPB_HEADER.size + _PSF_HEADER.size
+		opts_at  = data_at + data_len + padding
+		cap_len  = opts_at - _EPB_HEADER.size
+		blk_len  = opts_at + len(opts) + _BLOCK_TRAILER.size
+		raw_ts   = self.timestamp(ts)
+
+		view = self._reserve(blk_len)
+		_EPB_HEADER.pack_into(
+			view, 0, BlockType.ENHANCED_PACKET, blk_len, interface, raw_ts >> 32, raw_ts & 0xFFFFFFFF,
+			cap_len, cap_len
+		)
+		_PSF_HEADER.pack_into(view, _EPB_HEADER.size, _PSF_HEADER.size, type, orig, dest, data_len)
+		view[data_at:data_at + data_len] = data
+		view[opts_at - padding:opts_at] = _PADDING[:padding]
+		view[opts_at:opts_at + len(opts)] = opts
+		_BLOCK_TRAILER.pack_into(view, blk_len - _BLOCK_TRAILER.size, blk_len)
+
+		return view[:blk_len]
+
+# The encoder buffer is reused, so each thread gets its own for `write_epb` and `write_psf`
+_encoders = local()
+
+def _encoder() -> PacketEncoder:
+	if (encoder := getattr(_encoders, 'encoder', None)) is None:
+		encoder = _encoders.encoder = PacketEncoder()
+	return encoder
+
 def write_epb(
-	stream: BinaryIO, /, interface: int, data: BinaryIO | bytes | bytearray, ts: Arrow | None = None,
+	stream: BinaryIO, /, interface: int, data: BinaryIO | bytes | bytearray, ts: int | Arrow | None = None,
 	*, options: Iterable = ()
 ) -> int:
 	'''
@@ -593,40 +1007,14 @@ def write_epb(
 	data : BinaryIO | bytes | bytearray
 		The raw data to write into the packet.
 
-	ts : Arrow | None
-		The capture timestamp of this packet.
+	ts : int | Arrow | None
+		The capture timestamp of this packet, raw integer timestamps are written as-is.
 
 	options : Iterable
 		Any extra options to attach to the block. (default: [])
 	'''
 
-	if len(options) > 0:
-		_options = [
-			*options,
-			{ 'type': OptionType.END, 'value': None }
-		]
-	else:
-		_options = None
-
-	if isinstance(data, (bytearray, bytes)):
-		data_len = len(data)
-	else:
-		_data_offset = data.tell()
-		data.seek(0, SEEK_END)
-		_data_end  = data.tell()
-		data_len = _data_end - _data_offset
-		data.seek(_data_offset, SEEK_SET)
-
-	return stream.write(pcapng_block.build({
-		'type': BlockType.ENHANCED_PACKET,
-		'data': {
-			'inteface_id': interface,
-			'timestamp': { 'value': ts if ts is not None else now('UTC') },
-			'captured_len': data_len,
-			'packet_data': data
-		},
-		'options': _options
-	}))
+	return stream.write(_encoder().encode_epb(interface, data, ts, options = options))
 
 def write_spb(
 	stream: BinaryIO, /, data: BinaryIO | bytes | bytearray, *, options: Iterable = ()
@@ -785,7 +1173,7 @@ def write_dsb(
 def write_psf(
 	stream: BinaryIO, /, interface: int, data: BinaryIO | bytes | bytearray, type: SCSIFrameType,
 	orig: int, dest: int,
-	ts: Arrow | None = None,
+	ts: int | Arrow | None = None,
 	*, options: Iterable = ()
 ) -> int:
 	'''
@@ -810,34 +1198,16 @@ def write_psf(
 
 	dest : int
 
-	ts : Arrow | None
-		The capture timestamp of this packet.
+	ts : int | Arrow | None
+		The capture timestamp of this packet, raw integer timestamps are written as-is.
 
 	options : Iterable
 		Any extra options to attach to the block. (default: [])
 	'''
 
-	if isinstance(data, (bytearray, bytes)):
-		data_len = len(data)
-	else:
-		_data_offset = data.tell()
-		data.seek(0, SEEK_END)
-		_data_end  = data.tell()
-		data_len = _data_end - _data_offset
-		data.seek(_data_offset, SEEK_SET)
-
-	frame_data = linktype_parallel_scsi.build({
-		'len': 0,
-		'type': type,
-		'orig_id': orig,
-		'dest_id': dest,
-		'data_len': data_len,
-		'data': data
-	})
+	return stream.write(_encoder().encode_psf(interface, data, type, orig, dest, ts, options = options))
 
-	return write_epb(stream, interface, frame_data, ts, options = options)
-
-class _PCAPNGInterface:
+class PCAPNGInterface:
 	'''
 	This is a wrapper that allows you to treat a PCAPNG interface as an object and write packets
 	and statistics with it.
@@ -862,15 +1232,32 @@ class _PCAPNGInterface:
 	def link_type(self) -> LinkType:
 		return self._link_type
 
-	def __init__(self, *, _id: int, _name: str, _type: LinkType, _data: BinaryIO) -> None:
-		self._id        = _id
-		self._name      = _name
-		self._link_type = _type
-		self._data      = _data
+	@property
+	def ts_resolution(self) -> int:
+		''' Get the interface timestamp resolution '''
+		return self._ts_resolution
 
-	def emit_packet(
-		self, data: BinaryIO | bytes | bytearray, ts: Arrow | None = None, *, options: Iterable = ()
+	@property
+	def ts_offset(self) -> int:
+		''' Get the interface timestamp offset in seconds '''
+		return self._ts_offset
+
+	def __init__(
+		self, *, _id: int, _name: str, _type: LinkType, _data: BinaryIO, _ts_resolution: int = TS_RESOLUTION_US,
+		_ts_offset: int = 0, _writer: BackgroundWriter | None = None
 	) -> None:
+		self._id            = _id
+		self._name          = _name
+		self._link_type     = _type
+		self._data          = _data
+		self._ts_resolution = _ts_resolution
+		self._ts_offset     = _ts_offset
+		self._writer        = _writer
+		self._encoder       = PacketEncoder(ts_resolution = _ts_resolution, ts_offset = _ts_offset)
+
+	def emit_packet(
+		self, data: BinaryIO | bytes | bytearray, ts: int | Arrow | None = None, *, options: Iterable = ()
+	) -> bool:
 		'''
 		Emit a packet associated to this interface
 
@@ -879,17 +1266,34 @@ class _PCAPNGInterface:
 		data : BinaryIO | bytes | bytearray
 			The raw data to write into the packet.
 
-		ts : Arrow | None
-			The capture timestamp of this packet.
+		ts : int | Arrow | None
+			The capture timestamp of this packet. A raw integer timestamp is written as-is, so it must
+			already be in the interface resolution and relative to its offset.
 
 		options : Iterable
 			Any extra options to attach to the block. (default: [])
+
+		Returns
+		-------
+		bool
+			If the packet was emitted, or False if it was dropped due to the background writer queue being full.
 		'''
 
 		if self._data.closed:
 			raise RuntimeError('PCAPNG Stream closed, unable to emit packet')
 
-		write_epb(self._data, self._id, data, ts, options = options)
+		if self._writer is None:
+			self._data.write(self._encoder.encode_epb(self._id, data, ts, options = options))
+			return True
+
+		# The packet is encoded later on the writer thread, so take a copy of anything that might change under us
+		if not isinstance(data, bytes):
+			data = bytes(data) if isinstance(data, (bytearray, memoryview)) else data.read()
+
+		# NOTE: The writer thread has its own encoder, so ours is only ever used from here
+		return self._writer.put_packet(
+			self._id, data, self._encoder.timestamp(ts), self._encoder.encode_options(options)
+		)
 
 class PCAPNGStream:
 	'''
@@ -905,8 +1309,80 @@ class PCAPNGStream:
 			for _ in range(128):
 				iface.emit_packet(randbytes(randint(128, 4096)))
 
+	When ``background`` is set, packets are put onto a bounded queue and encoded and written by a separate
+	thread, so a slow disk does not hold up the capture. What happens when the queue is full is set by
+	``overflow``, and :py:attr:`queue_depth` and :py:attr:`dropped` can be used to keep an eye on it.
+
+	For long running captures, a :py:class:`CaptureFile` can be given as the file, which coalesces the blocks
+	into large aligned vectored writes, and can preallocate the file, bypass the page cache, and periodically
+	sync it to disk. A :py:class:`RotatingFile` can be given to split the capture over a ring buffer of files,
+	or a :py:class:`FlightRecorder` to only keep the capture in memory until something interesting happens.
+
+	The capture can also be compressed as it is written by setting ``compression``, the compression is done
+	on its own thread, and :py:attr:`compression_ratio` and :py:attr:`compression_throughput` show how well
+	it is keeping up.
+
+	Parameters
+	----------
+	file : str | Path | BinaryIO | bytes | bytearray
+		The file to write the capture to.
+
+	background : bool
+		Encode and write packets on a background thread. (default: False)
+
+	queue_depth : int
+		The maximum number of packets waiting to be written when ``background`` is set. (default: 4096)
+
+	overflow : OverflowPolicy
+		What to do when the background queue is full. (default: OverflowPolicy.BLOCK)
+
+	compression : Compression
+		How to compress the capture. (default: Compression.NONE)
+
+	compression_level : int | None
+		The compression level, or None to use a fast default for the compression mode.
+
+	Raises
+	------
+	ValueError
+		If ``compression`` is set for a file that splits the capture up, such as a :py:class:`RotatingFile`,
+		use its ``opener`` to compress each file instead.
+
 	'''
 
+	@property
+	def queue_depth(self) -> int:
+		''' The number of blocks waiting on the background writer '''
+		return 0 if self._writer is None else self._writer.queued
+
+	@property
+	def queue_high_water(self) -> int:
+		''' The deepest the background writer queue has been '''
+		return 0 if self._writer is None else self._writer.high_water
+
+	@property
+	def dropped(self) -> int:
+		''' The number of packets that were dropped due to the background writer queue being full '''
+		return 0 if self._writer is None else self._writer.dropped
+
+	@property
+	def compression_ratio(self) -> float:
+		''' How many times smaller the compressed capture is than the raw one, or 0.0 if not compressing '''
+		return 0.0 if self._compressed is None else self._compressed.ratio
+
+	@property
+	def compression_throughput(self) -> float:
+		''' How many bytes per second the compression thread is getting through, or 0.0 if not compressing '''
+		return 0.0 if self._compressed is None else self._compressed.throughput
+
+	def _write_block(self, block: bytes) -> None:
+		''' Write out a header block and flush it if writing synchronously '''
+		if self._writer is None:
+			self._write_header(block)
+			self._data.flush()
+		else:
+			self._writer.put_block(block)
+
 	def emit_header(
 		self, *, hardware: str, writer: str | None = None, os: str | None = None, options: Iterable = ()
 	):
@@ -937,10 +1413,14 @@ class PCAPNGStream:
 			os = f'{uname.system} {uname.release}'
 
 		# Emit the Section Header Block to the stream and flush
-		write_shb(self._data, hardware, os, writer, options = options)
-		self._data.flush()
-
-	def emit_interface(self, type: LinkType, name: str, *, options: Iterable = ()) -> _PCAPNGInterface:
+		block = BytesIO()
+		write_shb(block, hardware, os, writer, options = options)
+		self._write_block(block.getvalue())
+
+	def emit_interface(
+		self, type: LinkType, name: str, *, ts_resolution: int = TS_RESOLUTION_US, ts_offset: int = 0,
+		options: Iterable = ()
+	) -> PCAPNGInterface:
 		'''
 		Create a new Interface Description Block and obtain a proxy object to
 		use to add packets to the PCAPNG Stream.
@@ -953,25 +1433,50 @@ class PCAPNGStream:
 		name : str
 			The name of this interface.
 
+		ts_resolution : int
+			The ``if_tsresol`` of the packet timestamps, a negative power of 10, or a negative power of 2
+			if the MSB is set. Raw integer timestamps from a hardware counter can then be written as-is.
+			(default: TS_RESOLUTION_US)
+
+		ts_offset : int
+			The ``if_tsoffset`` in seconds to add to the packet timestamps, so timestamps relative to the
+			start of a capture can be written as-is. (default: 0)
+
 		options : Iterable
 			Any extra options to attach to the block. (default: [])
 
 		Returns
 		-------
-		_PCAPNGInterface
+		PCAPNGInterface
 			A PCAPNGStream proxy object for interacting with the newly added interface
 		'''
 
-		write_idb(self._data, type, 0, name, options = options)
-		self._data.flush()
+		block = BytesIO()
+		write_idb(
+			block, type, 0, name, options = options,
+			ts_resolution = ts_resolution if ts_resolution != TS_RESOLUTION_US else None,
+			ts_offset = ts_offset if ts_offset != 0 else None,
+		)
+		self._write_block(block.getvalue())
 		self._last_interface += 1
-		return _PCAPNGInterface(_id = self._last_interface, _name = name, _type = type, _data = self._data)
+		return PCAPNGInterface(
+			_id = self._last_interface, _name = name, _type = type, _data = self._data,
+			_ts_resolution = ts_resolution, _ts_offset = ts_offset, _writer = self._writer
+		)
 
 	def flush(self) -> None:
+		''' Flush the stream, waiting for the background writer to catch up if there is one '''
 		if not self._data.closed:
-			self._data.flush()
-
-	def __init__(self, file: str | Path | BinaryIO | bytes | bytearray, /) -> None:
+			if self._writer is not None:
+				self._writer.flush()
+			else:
+				self._data.flush()
+
+	def __init__(
+		self, file: str | Path | BinaryIO | bytes | bytearray, /, *, background: bool = False,
+		queue_depth: int = 4096, overflow: OverflowPolicy = OverflowPolicy.BLOCK,
+		compression: Compression = Compression.NONE, compression_level: int | None = None
+	) -> None:
 
 		if isinstance(file, (str, Path)):
 			# This is fine as `PurePath` will just flatten the path
@@ -980,24 +1485,50 @@ class PCAPNGStream:
 		elif isinstance(file, (bytes, bytearray)):
 			# Convert a `bytes` or `bytearray` into a buffered thing
 			self._data = BytesIO(file)
-		elif isinstance(file, BinaryIO):
+		elif isinstance(file, (IOBase, BinaryIO)):
 			self._data = file
 		else:
 			raise TypeError(f'`file` must be either a string, path, bytes, bytearray, or BinaryIO, not {file!r}')
 
+		if compression != Compression.NONE:
+			if hasattr(self._data, 'write_header'):
+				raise ValueError(f'Can not compress a {type(self._data).__name__}, compress each file with its opener')
+			self._data = CompressedFile(self._data, compression = compression, level = compression_level)
+			self._compressed: CompressedFile | None = self._data
+		else:
+			self._compressed = None
+
 		self._last_interface = -1
+		# Files that need to know about the header blocks, such as `RotatingFile`, have a `write_header`
+		self._write_header = getattr(self._data, 'write_header', self._data.write)
+
+		if background:
+			self._writer: BackgroundWriter | None = BackgroundWriter(
+				self._data, depth = queue_depth, policy = overflow, encoder = PacketEncoder()
+			)
+		else:
+			self._writer = None
 
 	def close(self) -> None:
 		if not self._data.closed:
-			self._data.flush()
-			self._data.close()
+			try:
+				if self._writer is not None:
+					self._writer.close()
+			finally:
+				self._data.flush()
+				self._data.close()
 
 	def __enter__(self) -> Self:
 		return self
 
 	def __exit__(self, type: type | None, *_) -> bool | None:
-		if type is None:
+		# Always close, so the background writer is stopped and what was captured up to an exception is kept
+		try:
 			self.close()
-		else:
-			# There was an exception, bubble it up
-			return False
+		except Exception:
+			if type is None:
+				raise
+			# Don't let failing to close hide the exception that got us here
+			log.exception('Failed to close the PCAPNG stream')
+		# If there was an exception, bubble it up
+		return False
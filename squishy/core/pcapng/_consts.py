@@ -0,0 +1,36 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+The raw :py:class:`squishy.core.pcapng.BlockType`, :py:class:`squishy.core.pcapng.OptionType`, and
+:py:class:`squishy.core.pcapng.LinkType` values used by the capture readers and writers.
+
+The enums themselves live in :py:mod:`squishy.core.pcapng`, which imports the submodules that need these, so
+they are kept here as plain integers where they can be imported without a circular import, and compared without
+going through the enum on the hot paths.
+
+'''
+
+from typing import Final
+
+__all__ = ()
+
+# Block types
+_SECTION_HEADER: Final        = 0x0A0D0D0A
+_INTERFACE_DESCRIPTION: Final = 0x00000001
+_ENHANCED_PACKET: Final       = 0x00000006
+
+# Every block type we expect to see in a capture, including the obsolete Packet Block and both custom blocks
+_KNOWN_BLOCKS: Final = frozenset((
+	0x0A0D0D0A, 0x00000001, 0x00000002, 0x00000003, 0x00000004, 0x00000005, 0x00000006, 0x0000000A,
+	0x00000BAD, 0x40000BAD,
+))
+
+# Option types
+_OPT_END: Final          = 0x0000
+_OPT_IF_NAME: Final      = 0x0002
+_OPT_SHB_USERAPPL: Final = 0x0004
+_OPT_IF_TSRESOL: Final   = 0x0009
+_OPT_IF_TSOFFSET: Final  = 0x000E
+
+# Link types
+_LINKTYPE_PARALLEL_SCSI: Final = 0x009A
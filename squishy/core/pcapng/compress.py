@@ -0,0 +1,314 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`CompressedFile`, which compresses a capture as it is written, on a separate
+thread so the compression doesn't hold up whatever is producing the packets.
+
+Bus captures are very repetitive, the same commands, bus conditions, and padded out data phases over and over,
+so they compress extremely well. Wireshark can open gzip compressed captures directly, and newer versions can
+also open zstd compressed ones, which is supported if the :py:mod:`zstandard` module is installed, such as with
+the ``zstd`` extra.
+
+.. code-block:: python
+
+	with PCAPNGStream('/tmp/bus.pcapng.gz', compression = Compression.GZIP) as stream:
+		...
+
+'''
+
+import zlib
+from collections import deque
+from enum        import Enum, unique
+from io          import RawIOBase
+from threading   import Condition, Thread
+from time        import perf_counter
+from typing      import Any, BinaryIO, Final
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+__all__ = (
+	'CompressedFile',
+	'Compression',
+)
+
+# The compression level used if one isn't given, tuned more for speed than size
+_DEFAULT_LEVEL: Final = {
+	'gzip': 1,
+	'zstd': 3,
+}
+
+@unique
+class Compression(Enum):
+	''' How a capture is compressed '''
+
+	NONE = 'none'
+	''' Not compressed at all '''
+	GZIP = 'gzip'
+	''' gzip, which can be read by everything '''
+	ZSTD = 'zstd'
+	''' zstd, which is both faster and smaller, but needs the ``zstandard`` module '''
+
+	@property
+	def available(self) -> bool:
+		''' If this compression is supported '''
+		return self != Compression.ZSTD or zstandard is not None
+
+	@property
+	def extension(self) -> str:
+		''' The extension that is conventionally added to the end of the file name '''
+		match self:
+			case Compression.NONE:
+				return ''
+			case Compression.GZIP:
+				return '.gz'
+			case Compression.ZSTD:
+				return '.zst'
+
+class _GzipCompressor:
+	def __init__(self, level: int) -> None:
+		# NOTE: `wbits` of 16 + 15 gets us the gzip header and trailer rather than the zlib ones
+		self._zlib = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+	def compress(self, data: bytes) -> bytes:
+		return self._zlib.compress(data)
+
+	def sync(self) -> bytes:
+		return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+	def finish(self) -> bytes:
+		return self._zlib.flush(zlib.Z_FINISH)
+
+class _ZstdCompressor:
+	def __init__(self, level: int) -> None:
+		assert zstandard is not None
+		self._zstd = zstandard.ZstdCompressor(level = level).compressobj()
+
+	def compress(self, data: bytes) -> bytes:
+		return self._zstd.compress(data)
+
+	def sync(self) -> bytes:
+		return self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+	def finish(self) -> bytes:
+		return self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+class CompressedFile(RawIOBase):
+	'''
+	A write-only file that compresses everything written to it on a worker thread.
+
+	Writes are collected into large chunks, which are handed off to the worker to be compressed and written
+	to the underlying file. Both :py:mod:`zlib` and :py:mod:`zstandard` release the GIL while compressing, so
+	this happens in parallel with the producer.
+
+	Parameters
+	----------
+	file : BinaryIO
+		The file to write the compressed data to, it is closed when this is.
+
+	compression : Compression
+		How to compress the data. (default: Compression.GZIP)
+
+	level : int | None
+		The compression level, or None to use a fast default, 1 for gzip, and 3 for zstd.
+
+	chunk_size : int
+		How many bytes to collect before handing them off to be compressed. (default: 1MiB)
+
+	depth : int
+		The maximum number of chunks waiting to be compressed before writes block. (default: 16)
+
+	Raises
+	------
+	ValueError
+		If ``compression`` is :py:attr:`Compression.NONE`, or is not available.
+
+	'''
+
+	def __init__(
+		self, file: BinaryIO, *, compression: Compression = Compression.GZIP, level: int | None = None,
+		chunk_size: int = 1024 * 1024, depth: int = 16
+	) -> None:
+		super().__init__()
+
+		if compression == Compression.NONE:
+			raise ValueError('A CompressedFile needs a compression mode other than NONE')
+		if not compression.available:
+			raise ValueError(
+				f'{compression.value} compression needs the zstandard module, install it with the \'zstd\' extra'
+			)
+		if depth < 1:
+			raise ValueError(f'The queue depth must be at least 1, not {depth}')
+
+		if level is None:
+			level = _DEFAULT_LEVEL[compression.value]
+
+		self._file        = file
+		self._compression = compression
+		self._compressor: Any = (
+			_GzipCompressor(level) if compression == Compression.GZIP else _ZstdCompressor(level)
+		)
+		self._chunk_size  = chunk_size
+		self._depth       = depth
+
+		self._pending = bytearray()
+		# Chunks to compress, a None is a request to sync the compressed stream
+		self._queue: deque[bytes | None] = deque()
+		self._cond  = Condition()
+		self._busy  = False
+		self._stopping = False
+		self._error: BaseException | None = None
+
+		self.bytes_in  = 0
+		''' The number of uncompressed bytes that have been compressed '''
+		self.bytes_out = 0
+		''' The number of compressed bytes that have been written '''
+		self.compress_time = 0.0
+		''' How many seconds the worker has spent compressing '''
+
+		self._thread = Thread(target = self._run, name = 'squishy-pcapng-compress', daemon = True)
+		self._thread.start()
+
+	@property
+	def compression(self) -> Compression:
+		''' How the data is being compressed '''
+		return self._compression
+
+	@property
+	def ratio(self) -> float:
+		''' How many times smaller the compressed data is than the original '''
+		return self.bytes_in / self.bytes_out if self.bytes_out > 0 else 0.0
+
+	@property
+	def throughput(self) -> float:
+		''' How many uncompressed bytes per second the worker gets through '''
+		return self.bytes_in / self.compress_time if self.compress_time > 0 else 0.0
+
+	def writable(self) -> bool:
+		return True
+
+	def _check(self) -> None:
+		if self._error is not None:
+			raise RuntimeError('PCAPNG compression failed') from self._error
+
+	def _submit(self, item: bytes | None) -> None:
+		''' Hand off a chunk to the worker, waiting for space in the queue if needed '''
+
+		with self._cond:
+			while len(self._queue) >= self._depth:
+				self._check()
+				self._cond.wait()
+			self._check()
+			self._queue.append(item)
+			self._cond.notify_all()
+
+	def _wait(self) -> None:
+		''' Wait for the worker to get through everything in the queue '''
+
+		with self._cond:
+			while len(self._queue) > 0 or self._busy:
+				self._check()
+				self._cond.wait()
+			self._check()
+
+	def write(self, data: bytes | bytearray | memoryview) -> int:
+		'''
+		Write some data to the file.
+
+		The data is always copied, so it's safe to reuse the buffer afterwards.
+
+		Parameters
+		----------
+		data : bytes | bytearray | memoryview
+			The data to write.
+
+		Returns
+		-------
+		int
+			The number of bytes written, which is always all of them.
+		'''
+
+		if self.closed:
+			raise ValueError('write to closed file')
+
+		self._pending += data
+		if len(self._pending) >= self._chunk_size:
+			self._submit(bytes(self._pending))
+			self._pending.clear()
+		return len(data)
+
+	def flush(self) -> None:
+		''' Compress and write out everything written so far, so it can be read from the file '''
+
+		if self.closed or self._stopping:
+			return
+
+		if len(self._pending) > 0:
+			self._submit(bytes(self._pending))
+			self._pending.clear()
+		self._submit(None)
+		self._wait()
+
+	def close(self) -> None:
+		''' Compress and write out everything, finish off the compressed stream, and close the file '''
+
+		if self.closed:
+			return
+
+		try:
+			if len(self._pending) > 0 and self._error is None:
+				self._submit(bytes(self._pending))
+				self._pending.clear()
+		finally:
+			with self._cond:
+				self._stopping = True
+				self._cond.notify_all()
+			self._thread.join()
+
+			try:
+				self._check()
+				self._emit(self._compressor.finish())
+				self._file.flush()
+			finally:
+				self._file.close()
+				super().close()
+
+	def _emit(self, data: bytes) -> None:
+		if len(data) > 0:
+			self._file.write(data)
+			self.bytes_out += len(data)
+
+	def _run(self) -> None:
+		try:
+			while True:
+				with self._cond:
+					while len(self._queue) == 0 and not self._stopping:
+						self._cond.wait()
+					if len(self._queue) == 0:
+						break
+					chunk = self._queue.popleft()
+					self._busy = True
+					self._cond.notify_all()
+
+				start = perf_counter()
+				if chunk is None:
+					out = self._compressor.sync()
+				else:
+					out = self._compressor.compress(chunk)
+					self.bytes_in += len(chunk)
+				self.compress_time += perf_counter() - start
+
+				self._emit(out)
+				if chunk is None:
+					self._file.flush()
+
+				with self._cond:
+					self._busy = False
+					self._cond.notify_all()
+		except BaseException as e:
+			with self._cond:
+				self._error = e
+				self._busy  = False
+				self._cond.notify_all()
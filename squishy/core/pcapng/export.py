@@ -0,0 +1,395 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the :py:mod:`numpy` export of ``LINKTYPE_PARALLEL_SCSI`` captures, for doing analysis
+over whole captures with vectorized operations rather than looping over every frame in Python.
+
+A capture, or a span of time in one, is turned into a :py:class:`SCSIFrames`, which is a structured array with
+a row for every frame, along with all of the frame data packed together into a single buffer.
+
+.. code-block:: python
+
+	frames = export_scsi_frames('/tmp/bus.pcapng')
+	commands = frames.frames[frames.frames['frame_type'] == SCSIFrameType.COMMAND]
+	print(numpy.bincount(commands['dest_id'], minlength = 8))
+
+	frames.save('/tmp/bus.npz')
+
+This needs :py:mod:`numpy` to be installed, which is not otherwise a dependency of squishy, but can be pulled in
+with the ``numpy`` extra.
+
+'''
+
+from array     import array
+from pathlib   import Path
+from typing    import Any, BinaryIO, Final, Self
+
+from ._consts  import _INTERFACE_DESCRIPTION, _LINKTYPE_PARALLEL_SCSI, _SECTION_HEADER
+from .mapped   import MappedCapture
+from .reader   import _BIG_ENDIAN, EnhancedPacket, PCAPNGReader
+
+try:
+	import numpy as np
+except ImportError:
+	np = None # type: ignore[assignment]
+
+__all__ = (
+	'SCSI_FRAME_DTYPE',
+	'SCSIFrames',
+	'export_scsi_frames',
+)
+
+# The length of the Parallel SCSI Frame header, and where the EPB data starts in the block
+_PSF_HEADER: Final = 28
+_EPB_DATA: Final   = 28
+# How many bytes of frame data `_gather` copies at a time
+_GATHER_BATCH: Final = 1024 * 1024
+
+SCSI_FRAME_DTYPE: Final[Any] = np.dtype([
+	('offset',     '<u8'),
+	('timestamp',  '<i8'),
+	('interface',  '<u4'),
+	('data_len',   '<u4'),
+	('frame_type', 'u1'),
+	('orig_id',    'u1'),
+	('dest_id',    'u1'),
+	('opcode',     'u1'),
+]) if np is not None else None
+'''
+The :py:class:`numpy.dtype` of the rows of :py:attr:`SCSIFrames.frames`
+
+offset
+	The offset of the Enhanced Packet Block of the frame in the capture.
+timestamp
+	The timestamp of the frame in nanoseconds since the epoch.
+interface
+	The interface the frame was captured on, numbered over all sections of the capture.
+data_len
+	The length of the frame data, this may be more than was captured.
+frame_type
+	The :py:class:`SCSIFrameType` of the frame.
+orig_id
+	The ID of the device that sent the frame.
+dest_id
+	The ID of the device the frame was sent to.
+opcode
+	The first byte of the frame data, the CDB opcode for commands, 0 if there is no data.
+'''
+
+def _need_numpy() -> None:
+	if np is None:
+		raise ImportError('Exporting SCSI frames needs numpy, install it with the \'numpy\' extra')
+
+def _gather(buffer: Any, starts: Any, lengths: Any) -> tuple[Any, Any]:
+	''' Pack the ``lengths`` bytes at each of ``starts`` in ``buffer`` together, returning them and their offsets '''
+
+	offsets = np.zeros(len(starts) + 1, dtype = np.uint64)
+	np.cumsum(lengths, out = offsets[1:])
+	payload = np.empty(int(offsets[-1]), dtype = np.uint8)
+
+	# NOTE: Rather than looping over every frame, this builds the index of every byte of a batch of frames at
+	#       once, which is the start of its frame, plus how far it is into the packed buffer, less where its frame
+	#       starts in the packed buffer. The index is 8 bytes for every byte copied, so the batches are kept small.
+	lo = 0
+	while lo < len(starts):
+		hi = max(lo + 1, int(np.searchsorted(offsets, offsets[lo] + np.uint64(_GATHER_BATCH), side = 'right')) - 1)
+		(begin, end) = (int(offsets[lo]), int(offsets[hi]))
+
+		if hi == lo + 1:
+			# A frame big enough to fill the batch on its own can just be copied
+			start = int(starts[lo])
+			payload[begin:end] = buffer[start:start + (end - begin)]
+		else:
+			index  = np.repeat(
+				starts[lo:hi].astype(np.int64) - offsets[lo:hi].astype(np.int64), lengths[lo:hi].astype(np.int64)
+			)
+			index += np.arange(begin, end, dtype = np.int64)
+			payload[begin:end] = buffer[index]
+		lo = hi
+
+	return (payload, offsets)
+
+class SCSIFrames:
+	'''
+	The frames of a ``LINKTYPE_PARALLEL_SCSI`` capture, as :py:mod:`numpy` arrays.
+
+	Parameters
+	----------
+	frames : numpy.ndarray
+		A row for each frame, of :py:data:`SCSI_FRAME_DTYPE`.
+
+	payload : numpy.ndarray
+		The captured data of every frame, packed together, as ``uint8``.
+
+	payload_offsets : numpy.ndarray
+		Where the data of each frame starts in ``payload``, with one more at the end for the end of the last
+		frame, so the data of frame ``n`` is ``payload[payload_offsets[n]:payload_offsets[n + 1]]``.
+
+	'''
+
+	__slots__ = ('frames', 'payload', 'payload_offsets')
+
+	def __init__(self, frames: Any, payload: Any, payload_offsets: Any) -> None:
+		_need_numpy()
+
+		if len(payload_offsets) != len(frames) + 1:
+			raise ValueError(f'Expected {len(frames) + 1} payload offsets, not {len(payload_offsets)}')
+
+		self.frames = frames
+		''' A row for each frame, of :py:data:`SCSI_FRAME_DTYPE` '''
+		self.payload = payload
+		''' The captured data of every frame, packed together '''
+		self.payload_offsets = payload_offsets
+		''' Where the data of each frame starts in :py:attr:`payload`, plus the end of the last frame '''
+
+	def __len__(self) -> int:
+		return len(self.frames)
+
+	def data(self, index: int) -> Any:
+		''' Get the captured data of a frame, as a view into :py:attr:`payload` '''
+		if index < 0:
+			index += len(self.frames)
+		return self.payload[int(self.payload_offsets[index]):int(self.payload_offsets[index + 1])]
+
+	def take(self, rows: Any) -> 'SCSIFrames':
+		'''
+		Pick out some of the frames, along with their data.
+
+		Parameters
+		----------
+		rows : numpy.ndarray
+			Either the indices of the frames to take, or a boolean mask over all of the frames.
+
+		Returns
+		-------
+		SCSIFrames
+			The frames that were picked, with their data packed into a new buffer.
+		'''
+
+		rows = np.asarray(rows)
+		if rows.dtype == np.bool_:
+			rows = np.flatnonzero(rows)
+
+		starts  = self.payload_offsets[rows]
+		lengths = self.payload_offsets[rows + 1] - starts
+		(payload, offsets) = _gather(self.payload, starts, lengths)
+		return SCSIFrames(self.frames[rows], payload, offsets)
+
+	def between(self, start: int | None = None, end: int | None = None) -> 'SCSIFrames':
+		'''
+		Get the frames within a span of time.
+
+		Parameters
+		----------
+		start : int | None
+			The start of the span in nanoseconds since the epoch, or None to start from the beginning.
+
+		end : int | None
+			The end of the span in nanoseconds since the epoch, exclusive, or None to go to the end.
+
+		Returns
+		-------
+		SCSIFrames
+			The frames in the span, in the order they are in the capture.
+		'''
+
+		timestamps = self.frames['timestamp']
+		mask = np.ones(len(timestamps), dtype = np.bool_)
+		if start is not None:
+			mask &= timestamps >= start
+		if end is not None:
+			mask &= timestamps < end
+		return self.take(mask)
+
+	def save(self, path: str | Path, *, compressed: bool = True) -> None:
+		'''
+		Save the frames to a ``.npz`` file, so they can be loaded again with :py:meth:`load`.
+
+		Parameters
+		----------
+		path : str | Path
+			The file to save to.
+
+		compressed : bool
+			If the arrays should be compressed, captures tend to compress very well. (default: True)
+		'''
+
+		save = np.savez_compressed if compressed else np.savez
+		with Path(path).open('wb') as file:
+			save(file, frames = self.frames, payload = self.payload, payload_offsets = self.payload_offsets)
+
+	@classmethod
+	def load(cls, path: str | Path) -> Self:
+		''' Load frames that were saved with :py:meth:`save` '''
+
+		_need_numpy()
+		with np.load(Path(path), allow_pickle = False) as arrays:
+			frames = arrays['frames']
+			if frames.dtype != SCSI_FRAME_DTYPE:
+				raise ValueError(f'{path} does not contain SCSI frames')
+			return cls(frames, arrays['payload'], arrays['payload_offsets'])
+
+def _from_mapped(capture: MappedCapture, start: int | None, end: int | None) -> SCSIFrames:
+	''' Export the frames from a mapped capture, without ever looking at them one by one '''
+
+	interfaces = capture.interfaces
+	scsi = np.array([ iface.link_type == _LINKTYPE_PARALLEL_SCSI for iface in interfaces ], dtype = np.bool_)
+	big  = np.array([ iface._order is _BIG_ENDIAN for iface in interfaces ], dtype = np.bool_)
+
+	ifaces     = np.frombuffer(capture.packet_interfaces, dtype = np.uint32)
+	offsets    = np.frombuffer(capture.offsets, dtype = np.uint64).astype(np.int64)
+	timestamps = np.frombuffer(capture.timestamps, dtype = np.int64)
+
+	mask = scsi[ifaces] if len(interfaces) > 0 else np.zeros(0, dtype = np.bool_)
+	if start is not None:
+		mask &= timestamps >= start
+	if end is not None:
+		mask &= timestamps < end
+
+	rows       = np.flatnonzero(mask)
+	ifaces     = ifaces[rows]
+	offsets    = offsets[rows]
+	timestamps = timestamps[rows]
+
+	buffer = np.frombuffer(capture._view, dtype = np.uint8)
+	try:
+		# The EPB captured length, which is in the byte order of the section
+		raw = np.ascontiguousarray(buffer[(offsets + 20)[:, None] + np.arange(4)])
+		captured = np.where(big[ifaces], raw.view('>u4')[:, 0], raw.view('<u4')[:, 0]).astype(np.int64)
+
+		# NOTE: Frames too short to have a whole header are skipped, the same as the sidecar index does
+		valid      = np.flatnonzero(captured >= _PSF_HEADER)
+		ifaces     = ifaces[valid]
+		offsets    = offsets[valid]
+		timestamps = timestamps[valid]
+		captured   = captured[valid]
+
+		# The frame header is always little endian, no matter the section
+		header = np.ascontiguousarray(buffer[(offsets + _EPB_DATA)[:, None] + np.arange(_PSF_HEADER)])
+		data_len = header[:, 24:28].copy().view('<u4')[:, 0]
+
+		available = np.minimum(data_len.astype(np.int64), captured - _PSF_HEADER)
+		data_at   = offsets + _EPB_DATA + _PSF_HEADER
+
+		frames = np.zeros(len(offsets), dtype = SCSI_FRAME_DTYPE)
+		frames['offset']     = offsets
+		frames['timestamp']  = timestamps
+		frames['interface']  = ifaces
+		frames['data_len']   = data_len
+		frames['frame_type'] = header[:, 4]
+		frames['orig_id']    = header[:, 5]
+		frames['dest_id']    = header[:, 6]
+		frames['opcode']     = np.where(available > 0, buffer[np.where(available > 0, data_at, 0)], 0)
+
+		(payload, payload_offsets) = _gather(buffer, data_at, available)
+	finally:
+		# NOTE: Everything above is a copy, so drop our view of the mapping so it can be closed
+		del buffer
+
+	return SCSIFrames(frames, payload, payload_offsets)
+
+def _from_reader(file: str | Path | BinaryIO, start: int | None, end: int | None) -> SCSIFrames:
+	''' Export the frames from a capture that can't be mapped, by streaming through it '''
+
+	offsets    = array('Q')
+	timestamps = array('q')
+	ifaces     = array('I')
+	data_lens  = array('I')
+	headers    = bytearray()
+	payload    = bytearray()
+	payload_offsets = array('Q', (0, ))
+
+	with PCAPNGReader(file) as reader:
+		offset = 0
+		# NOTE: The reader numbers interfaces within each section, so keep our own count over all of them
+		seen = 0
+		base = 0
+		for block in reader:
+			if (
+				isinstance(block, EnhancedPacket) and block.interface is not None and
+				block.interface.link_type == _LINKTYPE_PARALLEL_SCSI and block.captured_len >= _PSF_HEADER
+			):
+				ts = block.timestamp_ns
+				if (start is None or ts >= start) and (end is None or ts < end):
+					data = block.data
+					data_len = int.from_bytes(data[24:28], 'little')
+
+					offsets.append(offset)
+					timestamps.append(ts)
+					ifaces.append(base + block.interface.id)
+					data_lens.append(data_len)
+					headers += data[4:7]
+					payload += data[_PSF_HEADER:_PSF_HEADER + data_len]
+					payload_offsets.append(len(payload))
+			elif block.type == _SECTION_HEADER:
+				base = seen
+			elif block.type == _INTERFACE_DESCRIPTION:
+				seen += 1
+			offset = reader.offset
+
+	frames = np.zeros(len(offsets), dtype = SCSI_FRAME_DTYPE)
+	frames['offset']    = np.frombuffer(offsets, dtype = np.uint64)
+	frames['timestamp'] = np.frombuffer(timestamps, dtype = np.int64)
+	frames['interface'] = np.frombuffer(ifaces, dtype = np.uint32)
+	frames['data_len']  = np.frombuffer(data_lens, dtype = np.uint32)
+
+	header = np.frombuffer(headers, dtype = np.uint8).reshape(-1, 3)
+	frames['frame_type'] = header[:, 0]
+	frames['orig_id']    = header[:, 1]
+	frames['dest_id']    = header[:, 2]
+
+	payload_at = np.frombuffer(payload_offsets, dtype = np.uint64)
+	payload_np = np.frombuffer(bytes(payload), dtype = np.uint8)
+	has_data   = payload_at[1:] > payload_at[:-1]
+	frames['opcode'][has_data] = payload_np[payload_at[:-1][has_data].astype(np.int64)]
+
+	return SCSIFrames(frames, payload_np, payload_at.copy())
+
+def export_scsi_frames(
+	capture: str | Path | BinaryIO | MappedCapture, *, start: int | None = None, end: int | None = None
+) -> SCSIFrames:
+	'''
+	Export the ``LINKTYPE_PARALLEL_SCSI`` frames in a capture to :py:mod:`numpy` arrays.
+
+	Uncompressed captures are memory mapped and exported without decoding each frame in Python, compressed
+	captures and streams are read through with a :py:class:`PCAPNGReader`.
+
+	Parameters
+	----------
+	capture : str | Path | BinaryIO | MappedCapture
+		The capture to export, frames on interfaces with any other link type are skipped.
+
+	start : int | None
+		Only export frames at or after this time in nanoseconds since the epoch.
+
+	end : int | None
+		Only export frames before this time in nanoseconds since the epoch.
+
+	Returns
+	-------
+	SCSIFrames
+		The frames, in the order they are in the capture.
+
+	Raises
+	------
+	ImportError
+		If :py:mod:`numpy` is not installed.
+
+	ValueError
+		If the capture is malformed.
+	'''
+
+	_need_numpy()
+
+	if isinstance(capture, MappedCapture):
+		return _from_mapped(capture, start, end)
+
+	if isinstance(capture, (str, Path)):
+		with Path(capture).open('rb') as file:
+			magic = file.read(4)
+		# NOTE: Anything that's not a section header is presumably compressed, so the reader has to handle it
+		if magic == _SECTION_HEADER.to_bytes(4, 'little'):
+			with MappedCapture(capture) as mapped:
+				return _from_mapped(mapped, start, end)
+
+	return _from_reader(capture, start, end)
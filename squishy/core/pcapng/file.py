@@ -0,0 +1,348 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`CaptureFile`, a raw file writer tuned for long running, high packet rate
+captures, which can be passed to :py:class:`squishy.core.pcapng.PCAPNGStream` in place of a path.
+
+Rather than a write per block, the blocks are coalesced into large batches which are written out with a
+single :py:func:`os.writev`, and each batch ends on an alignment boundary so the page cache only ever sees
+whole pages. The file can also be preallocated in large extents with :py:func:`os.posix_fallocate` to keep
+it from fragmenting, be written with ``O_DIRECT`` to bypass the page cache entirely, and have
+:py:func:`os.fdatasync` called periodically so a crash or power loss only loses a bounded amount of capture.
+
+'''
+
+import os
+from io          import RawIOBase
+from mmap        import mmap
+from pathlib     import Path
+from time        import monotonic
+from typing      import Final, NamedTuple
+
+__all__ = (
+	'CaptureFile',
+	'SyncPolicy',
+)
+
+_IOV_MAX: Final = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+# Writes smaller than this are copied together rather than each getting their own `iovec`
+_COALESCE_SIZE: Final = 16384
+
+# NOTE: macOS doesn't have `fdatasync`, but `fsync` is close enough
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+class SyncPolicy(NamedTuple):
+	''' When a :py:class:`CaptureFile` should call :py:func:`os.fdatasync` '''
+
+	interval: float | None = None
+	''' Sync if it has been this many seconds since the last sync, or None to not sync based on time '''
+	size: int | None = None
+	''' Sync if this many bytes have been written since the last sync, or None to not sync based on size '''
+
+def _align_down(value: int, alignment: int) -> int:
+	return value - (value % alignment)
+
+def _align_up(value: int, alignment: int) -> int:
+	return _align_down(value + alignment - 1, alignment)
+
+class CaptureFile(RawIOBase):
+	'''
+	A write-only file that coalesces writes into large aligned batches.
+
+	Warning
+	-------
+	When ``preallocate`` is set, the file is extended by whole extents as it grows, and is only truncated
+	to the actual length of the capture when it is closed, so anything reading the file while the capture
+	is running will see the zero filled tail.
+
+	When ``direct`` is set, writes must be a multiple of the alignment, so up to ``alignment`` bytes are
+	kept back on a :py:meth:`flush`, and are only written out when the file is closed.
+
+	Parameters
+	----------
+	path : str | Path
+		The path of the file to write, it is truncated if it already exists.
+
+	batch_size : int
+		How many bytes to coalesce before writing them out, rounded up to the alignment. (default: 1MiB)
+
+	alignment : int
+		The alignment of the batches, this needs to be at least the logical block size of the underlying
+		device when using ``direct``. (default: 4096)
+
+	preallocate : int
+		The size of the extents the file is preallocated in, or 0 to not preallocate. (default: 0)
+
+	direct : bool
+		Open the file with ``O_DIRECT`` to bypass the page cache. (default: False)
+
+	sync : SyncPolicy | None
+		When to call :py:func:`os.fdatasync`, it is also called when the file is closed. If None, the file is
+		never explicitly synced. (default: None)
+
+	Raises
+	------
+	ValueError
+		If ``direct`` is set and ``O_DIRECT`` is not supported on this platform.
+
+	OSError
+		If the file could not be opened.
+
+	'''
+
+	def __init__(
+		self, path: str | Path, *, batch_size: int = 1024 * 1024, alignment: int = 4096, preallocate: int = 0,
+		direct: bool = False, sync: SyncPolicy | None = None
+	) -> None:
+		super().__init__()
+
+		if alignment < 1 or alignment & (alignment - 1) != 0:
+			raise ValueError(f'The alignment must be a power of 2, not {alignment}')
+
+		flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_CLOEXEC', 0)
+		if direct:
+			if not hasattr(os, 'O_DIRECT'):
+				raise ValueError('O_DIRECT is not supported on this platform')
+			flags |= os.O_DIRECT
+
+		self._alignment   = alignment
+		self._batch_size  = _align_up(max(batch_size, alignment), alignment)
+		self._preallocate = _align_up(preallocate, alignment) if preallocate > 0 else 0
+		self._direct      = direct
+		self._sync        = sync
+
+		self._pending: list[bytes | bytearray] = []
+		self._pending_len = 0
+		# The last pending buffer if small writes can be appended onto it
+		self._tail: bytearray | None = None
+		self._offset      = 0
+		self._allocated   = 0
+
+		self._unsynced    = 0
+		self._last_sync   = monotonic()
+
+		# NOTE: An anonymous mapping is always page aligned, which is what `O_DIRECT` needs for the buffer
+		self._staging = mmap(-1, self._batch_size) if direct else None
+		self._staged  = 0
+
+		self._fd = os.open(path, flags, 0o644)
+
+	def fileno(self) -> int:
+		return self._fd
+
+	def writable(self) -> bool:
+		return True
+
+	def tell(self) -> int:
+		''' Get the length of the capture so far, including anything not yet written out '''
+		return self._offset + self._pending_len + self._staged
+
+	def _reserve(self, length: int) -> None:
+		''' Make sure there is space preallocated for the next ``length`` bytes '''
+
+		end = self._offset + length
+		if self._preallocate == 0 or end <= self._allocated:
+			return
+
+		extent = _align_up(end, self._preallocate)
+		try:
+			os.posix_fallocate(self._fd, self._allocated, extent - self._allocated)
+		except (AttributeError, OSError):
+			# The platform or filesystem doesn't support it, so just let the file grow as normal
+			self._preallocate = 0
+			return
+		self._allocated = extent
+
+	def _written(self, length: int) -> None:
+		''' Account for ``length`` bytes being written, and sync if the policy says we should '''
+
+		self._offset   += length
+		self._unsynced += length
+
+		if self._sync is None:
+			return
+
+		if (
+			(self._sync.size is not None and self._unsynced >= self._sync.size) or
+			(self._sync.interval is not None and monotonic() - self._last_sync >= self._sync.interval)
+		):
+			self._datasync()
+
+	def _datasync(self) -> None:
+		_fdatasync(self._fd)
+		self._unsynced  = 0
+		self._last_sync = monotonic()
+
+	def _writev(self, buffers: list[memoryview], length: int) -> None:
+		''' Write out all of the buffers, dealing with any short writes '''
+
+		self._reserve(length)
+		remaining = length
+		start     = 0
+
+		while remaining > 0:
+			count = os.writev(self._fd, buffers[start:start + _IOV_MAX])
+			remaining -= count
+
+			# Skip everything that was fully written, and trim the buffer we stopped part way through
+			while count > 0:
+				if count >= len(buffers[start]):
+					count -= len(buffers[start])
+					start += 1
+				else:
+					buffers[start] = buffers[start][count:]
+					count = 0
+
+		self._written(length)
+
+	def _write_pending(self, data: memoryview | None, *, aligned: bool) -> None:
+		''' Write out the pending buffers and ``data``, keeping back anything past the last aligned boundary '''
+
+		buffers = [ memoryview(buf) for buf in self._pending ]
+		total   = self._pending_len
+		if data is not None:
+			buffers.append(data)
+			total += len(data)
+
+		length = _align_down(self._offset + total, self._alignment) - self._offset if aligned else total
+
+		# Split the buffers at the boundary, the tail is copied so the caller can reuse their buffer
+		head: list[memoryview] = []
+		tail: list[bytes | bytearray] = []
+		last: bytearray | None        = None
+		offset = length
+		for buf in buffers:
+			if offset >= len(buf):
+				head.append(buf)
+				offset -= len(buf)
+			elif offset > 0:
+				head.append(buf[:offset])
+				last = bytearray(buf[offset:])
+				tail.append(last)
+				offset = 0
+			else:
+				last = bytearray(buf)
+				tail.append(last)
+
+		self._pending     = tail
+		self._pending_len = total - length
+		self._tail        = last
+
+		if length > 0:
+			self._writev(head, length)
+
+	def _write_staged(self, length: int) -> None:
+		''' Write out the first ``length`` bytes of the staging buffer, and move anything after it to the front '''
+
+		assert self._staging is not None
+
+		self._reserve(length)
+		view    = memoryview(self._staging)
+		written = 0
+		while written < length:
+			written += os.write(self._fd, view[written:length])
+		self._written(length)
+
+		leftover = self._staged - length
+		if leftover > 0:
+			self._staging.move(0, length, leftover)
+		self._staged = leftover
+		view.release()
+
+	def write(self, data: bytes | bytearray | memoryview) -> int:
+		'''
+		Write some data to the file.
+
+		The data is copied if it's not written out immediately, so it's safe to reuse the buffer afterwards.
+
+		Parameters
+		----------
+		data : bytes | bytearray | memoryview
+			The data to write.
+
+		Returns
+		-------
+		int
+			The number of bytes written, which is always all of them.
+		'''
+
+		length = len(data)
+
+		# Fast path, small writes are just appended onto the last pending buffer
+		if (
+			(tail := self._tail) is not None and length < _COALESCE_SIZE and
+			self._pending_len + length < self._batch_size
+		):
+			tail += data
+			self._pending_len += length
+			return length
+
+		if self.closed:
+			raise ValueError('write to closed file')
+
+		if self._staging is not None:
+			view   = memoryview(data).cast('B')
+			offset = 0
+			while offset < length:
+				count = min(length - offset, self._batch_size - self._staged)
+				self._staging[self._staged:self._staged + count] = view[offset:offset + count]
+				self._staged += count
+				offset       += count
+				if self._staged == self._batch_size:
+					self._write_staged(self._batch_size)
+			return length
+
+		if self._pending_len + length >= self._batch_size:
+			self._write_pending(memoryview(data).cast('B'), aligned = True)
+		elif length < _COALESCE_SIZE:
+			self._tail = bytearray(data)
+			self._pending.append(self._tail)
+			self._pending_len += length
+		else:
+			self._tail = None
+			self._pending.append(bytes(data))
+			self._pending_len += length
+
+		return length
+
+	def flush(self) -> None:
+		''' Write out everything that is buffered, except for any unaligned tail when using ``O_DIRECT`` '''
+
+		if self.closed:
+			return
+
+		if self._staging is not None:
+			if (length := _align_down(self._staged, self._alignment)) > 0:
+				self._write_staged(length)
+		elif self._pending_len > 0:
+			self._write_pending(None, aligned = False)
+
+	def close(self) -> None:
+		''' Write out everything, trim off any preallocated space, and close the file '''
+
+		if self.closed:
+			return
+
+		try:
+			self.flush()
+
+			end = self._offset + self._staged
+			if self._staging is not None and self._staged > 0:
+				# Pad the tail out to the alignment, and then trim it back off
+				self._staging[self._staged:_align_up(self._staged, self._alignment)] = bytes(
+					_align_up(self._staged, self._alignment) - self._staged
+				)
+				self._staged = _align_up(self._staged, self._alignment)
+				self._write_staged(self._staged)
+
+			if self._offset != end or self._allocated > end:
+				os.ftruncate(self._fd, end)
+
+			if self._sync is not None:
+				self._datasync()
+		finally:
+			self._tail = None
+			if self._staging is not None:
+				self._staging.close()
+			os.close(self._fd)
+			super().close()
@@ -11,12 +11,31 @@ format as it evolves.
 
 The framing itself is fairly simple, most of the magic involved is within the capture engine and the
 wireshark dissector.
+
+The construct definition of the frame, :py:data:`linktype_parallel_scsi`, is the reference for the format, but it
+is far too slow to go through for every frame of a capture. :py:func:`encode_frames` and :py:func:`decode_frames`
+do the same job for a whole batch of frames at once with a precompiled :py:class:`struct.Struct` for the header.
+
+.. code-block:: python
+
+	buffer = encode_frames([
+		(SCSIFrameType.COMMAND, 7, 3, bytes((0x12, 0, 0, 0, 36, 0))),
+		(SCSIFrameType.DATA_IN, 3, 7, inquiry_data),
+	])
+
+	frames = decode_frames(buffer)
+	for (frame_type, orig_id, dest_id, data) in frames:
+		...
+
 '''
 
-from enum      import IntEnum
-from typing    import Final
+from array           import array
+from collections.abc import Iterable, Iterator, Sequence
+from enum            import IntEnum
+from struct          import Struct as PackedStruct
+from typing          import Final
 
-from construct import (
+from construct       import (
 	Aligned, BitsInteger, BitStruct, Bytes, Const, Default, Enum, Flag, Hex, HexDump,
 	Int8ul, Int16ul, Int32ul, Rebuild, Struct, len_, this,
 )
@@ -27,6 +46,9 @@ __all__ = (
 	'SCSIWidth',
 	'SCSIType',
 	'SCSIFrameType',
+	'SCSIFrameBatch',
+	'decode_frames',
+	'encode_frames',
 )
 
 
@@ -103,3 +125,151 @@ linktype_parallel_scsi = 'Parallel SCSI Frame' / Aligned(4, Struct(
 	'data_len' / Rebuild(Int32ul, len_(this.data)),
 	'data'     / HexDump(Bytes(this.data_len)),
 ))
+
+# Frame Length, Frame Type, Originator ID, Destination ID, Reserved, Data Length
+_PSF_HEADER: Final = PackedStruct('<IBBB17xI')
+
+class SCSIFrameBatch:
+	'''
+	A batch of ``LINKTYPE_PARALLEL_SCSI`` frames decoded by :py:func:`decode_frames`.
+
+	The fixed fields of every frame are held in :py:class:`array.array` s, one per field, and the frame data is
+	left in the original buffer, so nothing is copied until it is asked for.
+
+	Parameters
+	----------
+	buffer : memoryview
+		The buffer the frames were decoded from.
+
+	'''
+
+	__slots__ = ('buffer', 'frame_type', 'orig_id', 'dest_id', 'data_at', 'data_len')
+
+	def __init__(self, buffer: memoryview) -> None:
+		self.buffer = buffer
+		''' The buffer the frames were decoded from '''
+		self.frame_type = array('B')
+		''' The :py:class:`SCSIFrameType` of each frame '''
+		self.orig_id = array('B')
+		''' The ID of the device that sent each frame '''
+		self.dest_id = array('B')
+		''' The ID of the device each frame was sent to '''
+		self.data_at = array('Q')
+		''' Where the data of each frame starts in :py:attr:`buffer` '''
+		self.data_len = array('I')
+		''' The length of the data of each frame '''
+
+	def __len__(self) -> int:
+		return len(self.frame_type)
+
+	def data(self, idx: int) -> memoryview:
+		'''
+		Get the data of a frame.
+
+		Parameters
+		----------
+		idx : int
+			The index of the frame in the batch.
+
+		Returns
+		-------
+		memoryview
+			The frame data, pointing into :py:attr:`buffer`.
+		'''
+
+		data_at = self.data_at[idx]
+		return self.buffer[data_at:data_at + self.data_len[idx]]
+
+	def __getitem__(self, idx: int) -> tuple[int, int, int, memoryview]:
+		return (self.frame_type[idx], self.orig_id[idx], self.dest_id[idx], self.data(idx))
+
+	def __iter__(self) -> Iterator[tuple[int, int, int, memoryview]]:
+		buffer = self.buffer
+		for (frame_type, orig_id, dest_id, data_at, data_len) in zip(
+			self.frame_type, self.orig_id, self.dest_id, self.data_at, self.data_len
+		):
+			yield (frame_type, orig_id, dest_id, buffer[data_at:data_at + data_len])
+
+def encode_frames(frames: Iterable[tuple[int, int, int, bytes | bytearray | memoryview]]) -> bytearray:
+	'''
+	Encode a batch of Parallel SCSI Frames back to back into a single buffer.
+
+	The result is byte-identical to building each frame with :py:data:`linktype_parallel_scsi` and joining them.
+
+	Parameters
+	----------
+	frames : Iterable[tuple[int, int, int, bytes | bytearray | memoryview]]
+		The frame type, originator ID, destination ID, and data of each frame.
+
+	Returns
+	-------
+	bytearray
+		The encoded frames, each one padded out to 4 bytes.
+	'''
+
+	frames = frames if isinstance(frames, Sequence) else tuple(frames)
+	header = _PSF_HEADER.size
+	# NOTE: The buffer starts out zeroed, so the reserved bytes and the padding never need to be written
+	buffer = bytearray(sum(header + ((len(data) + 3) & ~3) for (_, _, _, data) in frames))
+	pack   = _PSF_HEADER.pack_into
+
+	offset = 0
+	for (frame_type, orig_id, dest_id, data) in frames:
+		data_len = len(data)
+		pack(buffer, offset, header, frame_type, orig_id, dest_id, data_len)
+		offset += header
+		buffer[offset:offset + data_len] = data
+		offset += (data_len + 3) & ~3
+
+	return buffer
+
+def decode_frames(buffer: bytes | bytearray | memoryview) -> SCSIFrameBatch:
+	'''
+	Decode a buffer of back to back Parallel SCSI Frames, such as from :py:func:`encode_frames`.
+
+	Parameters
+	----------
+	buffer : bytes | bytearray | memoryview
+		The encoded frames, each one padded out to 4 bytes.
+
+	Returns
+	-------
+	SCSIFrameBatch
+		The decoded frames, the frame data still points into ``buffer``.
+
+	Raises
+	------
+	ValueError
+		If the last frame is cut short, or a frame has a bad frame length.
+	'''
+
+	view  = memoryview(buffer).cast('B')
+	batch = SCSIFrameBatch(view)
+	(frame_types, orig_ids, dest_ids, data_ats, data_lens) = (
+		batch.frame_type.append, batch.orig_id.append, batch.dest_id.append, batch.data_at.append,
+		batch.data_len.append
+	)
+	unpack = _PSF_HEADER.unpack_from
+	header = _PSF_HEADER.size
+	end    = len(view)
+
+	offset = 0
+	while offset < end:
+		if end - offset < header:
+			raise ValueError(f'Truncated frame header at offset {offset}, only {end - offset} bytes left')
+		(frame_len, frame_type, orig_id, dest_id, data_len) = unpack(view, offset)
+		# NOTE: The frame length is only ever the size of the header, so anything else means we've lost our place
+		if frame_len != header:
+			raise ValueError(f'Bad frame length {frame_len} at offset {offset}, expected {header}')
+		offset += header
+		if end - offset < data_len:
+			raise ValueError(f'Truncated frame data at offset {offset}, expected {data_len} bytes')
+
+		frame_types(frame_type)
+		orig_ids(orig_id)
+		dest_ids(dest_id)
+		data_ats(offset)
+		data_lens(data_len)
+		offset += (data_len + 3) & ~3
+
+	return batch
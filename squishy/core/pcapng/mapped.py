@@ -0,0 +1,427 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`MappedCapture`, a random-access PCAPNG reader for jumping around in large
+captures after the fact.
+
+The capture is memory mapped, and indexed in a single pass when it is opened. The index is a handful of flat
+:py:class:`array.array` columns, the offset and type of every block, and the offset, interface, and timestamp
+of every packet, so it costs a couple of dozen bytes per packet, rather than a Python object. From there any
+packet can be pulled out in constant time as a view straight into the mapping, and time ranges are found with
+a binary search over the timestamps.
+
+The index is cached in a ``.pcapidx`` file next to the capture, so opening the same capture again only has to
+read the columns back in. The cache records the size and modification time of the capture, and is rebuilt if
+either of them have changed.
+
+.. code-block:: python
+
+	with MappedCapture('/tmp/bus.pcapng') as capture:
+		for idx in capture.between(1832_000_000_000, 1833_000_000_000):
+			print(capture.packet(idx).data.hex())
+
+'''
+
+import logging       as log
+import mmap
+import os
+from array           import array
+from bisect          import bisect_left
+from collections.abc import Sequence
+from pathlib         import Path
+from struct          import Struct
+from typing          import Final, Self
+
+from ._consts        import _ENHANCED_PACKET, _INTERFACE_DESCRIPTION, _SECTION_HEADER
+from .reader         import (
+	_BIG_ENDIAN, _BYTE_ORDER, _BYTE_ORDER_MAGIC, _BYTE_ORDER_SWAPPED, _LITTLE_ENDIAN, EnhancedPacket,
+	InterfaceDescription
+)
+
+__all__ = (
+	'MappedCapture',
+)
+
+_CACHE_MAGIC: Final   = b'SQPCAPIX'
+_CACHE_VERSION: Final = 1
+# The magic, version, if the packets are in order, and the size and modification time of the capture
+_CACHE_HEADER: Final  = Struct('<8sHH4xQq')
+_CACHE_COUNT: Final   = Struct('<Q')
+
+# The array type code of each column in the cache, in the order they are in it
+_CACHE_COLUMNS: Final = (
+	('_block_offsets', 'Q'),
+	('_block_types',   'I'),
+	('_offsets',       'Q'),
+	('_packet_ifaces', 'I'),
+	('_timestamps',    'q'),
+)
+
+def _cache_path(capture: Path) -> Path:
+	''' Get the path of the packet index cache for a capture '''
+	return capture.with_name(f'{capture.name}.pcapidx')
+
+class MappedCapture:
+	'''
+	A memory mapped PCAPNG capture with an index of all of its blocks and packets.
+
+	Packets are numbered in the order they appear in the capture, over all sections and interfaces, and the
+	interfaces are likewise numbered over all sections, so they can be told apart in a capture that has been
+	stitched together from several.
+
+	Warning
+	-------
+	Everything handed out is a view into the mapping, so the mapping can't be closed while any of them are
+	still alive.
+
+	Parameters
+	----------
+	path : str | Path
+		The capture to open, it needs to be uncompressed so it can be mapped.
+
+	cache : bool
+		If the index should be loaded from, and saved to, the ``.pcapidx`` cache next to the capture.
+		(default: True)
+
+	Raises
+	------
+	ValueError
+		If the capture is malformed.
+
+	'''
+
+	def __init__(self, path: str | Path, *, cache: bool = True) -> None:
+		self._path = Path(path)
+
+		with self._path.open('rb') as file:
+			# NOTE: You can't map an empty file, so there's nothing to index
+			if self._path.stat().st_size == 0:
+				self._map: mmap.mmap | None = None
+				self._view = memoryview(b'')
+			else:
+				self._map  = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+				self._view = memoryview(self._map)
+
+		self._interfaces: list[InterfaceDescription] = []
+
+		self._block_offsets = array('Q')
+		self._block_types   = array('I')
+		self._offsets       = array('Q')
+		self._packet_ifaces = array('I')
+		self._timestamps    = array('q')
+		# The packet indices in timestamp order, only needed if the capture isn't in order already
+		self._order: array | None = None
+
+		try:
+			if not cache or len(self._view) == 0:
+				self._index()
+			elif not self._load_cache():
+				self._index()
+				self._save_cache()
+		except BaseException:
+			self.close()
+			raise
+
+	def _index(self) -> None:
+		''' Walk all of the blocks in the capture and fill in the index '''
+
+		view   = self._view
+		length = len(view)
+		offset = 0
+		order  = _LITTLE_ENDIAN
+		# The interfaces of the current section
+		section: list[InterfaceDescription] = []
+
+		block_offsets = self._block_offsets
+		block_types   = self._block_types
+		offsets       = self._offsets
+		packet_ifaces = self._packet_ifaces
+		timestamps    = self._timestamps
+
+		header = order.header
+		epb    = order.epb
+		last_ts  = -(1 << 63)
+		in_order = True
+
+		while offset < length:
+			if offset + 12 > length:
+				raise ValueError(f'Capture ends part way through a block header at offset {offset}')
+
+			(block_type, block_len) = header.unpack_from(view, offset)
+			if block_type == _SECTION_HEADER:
+				(magic, ) = _BYTE_ORDER.unpack_from(view, offset + 8)
+				if magic == _BYTE_ORDER_MAGIC:
+					order = _LITTLE_ENDIAN
+				elif magic == _BYTE_ORDER_SWAPPED:
+					order = _BIG_ENDIAN
+				else:
+					raise ValueError(f'Bad section header byte order magic {magic:#010x} at offset {offset}')
+				header = order.header
+				epb    = order.epb
+				(_, block_len) = header.unpack_from(view, offset)
+				section = []
+
+			if block_len < 12 or block_len & 3 != 0:
+				raise ValueError(f'Bad block length {block_len} at offset {offset}')
+			if offset + block_len > length:
+				raise ValueError(f'Capture ends part way through a block at offset {offset}')
+
+			block_offsets.append(offset)
+			block_types.append(block_type)
+
+			if block_type == _ENHANCED_PACKET:
+				(interface_id, ts_high, ts_low, _, _) = epb.unpack_from(view, offset + 8)
+				if interface_id >= len(section):
+					raise ValueError(f'Packet at offset {offset} is from undescribed interface {interface_id}')
+				interface = section[interface_id]
+
+				ts = (
+					(((ts_high << 32) | ts_low) * 1_000_000_000) // interface.ts_units +
+					interface.ts_offset * 1_000_000_000
+				)
+				if ts < last_ts:
+					in_order = False
+				last_ts = ts
+
+				offsets.append(offset)
+				packet_ifaces.append(interface.id)
+				timestamps.append(ts)
+			elif block_type == _INTERFACE_DESCRIPTION:
+				interface = InterfaceDescription(
+					block_type, view[offset + 8:offset + block_len - 4], order, len(self._interfaces)
+				)
+				section.append(interface)
+				self._interfaces.append(interface)
+
+			offset += block_len
+
+		if not in_order:
+			self._order = array('Q', sorted(range(len(timestamps)), key = timestamps.__getitem__))
+
+	def _load_cache(self) -> bool:
+		''' Load the index from the cache, returning False if there is no usable cache for the capture '''
+
+		stat = self._path.stat()
+		try:
+			data = _cache_path(self._path).read_bytes()
+		except OSError:
+			return False
+
+		view = memoryview(data)
+		if len(view) < _CACHE_HEADER.size:
+			return False
+		(magic, version, in_order, size, mtime) = _CACHE_HEADER.unpack_from(view, 0)
+		if magic != _CACHE_MAGIC or version != _CACHE_VERSION or size != stat.st_size or mtime != stat.st_mtime_ns:
+			return False
+
+		offset  = _CACHE_HEADER.size
+		columns = []
+		# The order of the packets by timestamp, and the byte order of each interface, follow the index columns
+		for code in (*(code for (_, code) in _CACHE_COLUMNS), 'Q', 'B'):
+			if offset + _CACHE_COUNT.size > len(view):
+				return False
+			(count, ) = _CACHE_COUNT.unpack_from(view, offset)
+			offset += _CACHE_COUNT.size
+
+			column = array(code)
+			length = count * column.itemsize
+			if offset + length > len(view):
+				return False
+			column.frombytes(view[offset:offset + length])
+			columns.append(column)
+			offset += (length + 7) & ~7
+
+		(*index, order, byte_orders) = columns
+		(block_offsets, block_types, offsets, packet_ifaces, timestamps) = index
+		if not (len(block_offsets) == len(block_types) and len(offsets) == len(packet_ifaces) == len(timestamps)):
+			return False
+
+		# The interface descriptions are small, so they are just parsed again from the capture itself
+		interfaces: list[InterfaceDescription] = []
+		for (block_offset, block_type) in zip(block_offsets, block_types):
+			if block_type != _INTERFACE_DESCRIPTION:
+				continue
+			if len(interfaces) >= len(byte_orders) or block_offset + 12 > len(self._view):
+				return False
+			byte_order = _BIG_ENDIAN if byte_orders[len(interfaces)] else _LITTLE_ENDIAN
+			(_, block_len) = byte_order.header.unpack_from(self._view, block_offset)
+			if block_offset + block_len > len(self._view):
+				return False
+			interfaces.append(InterfaceDescription(
+				block_type, self._view[block_offset + 8:block_offset + block_len - 4], byte_order, len(interfaces)
+			))
+
+		for ((name, _), column) in zip(_CACHE_COLUMNS, index):
+			setattr(self, name, column)
+		self._interfaces = interfaces
+		self._order      = None if in_order else order
+		return True
+
+	def _save_cache(self) -> None:
+		''' Write the index out to the cache, if we can '''
+
+		stat        = self._path.stat()
+		order       = self._order if self._order is not None else array('Q')
+		byte_orders = array('B', (interface._order is _BIG_ENDIAN for interface in self._interfaces))
+
+		path = _cache_path(self._path)
+		temp = path.with_name(f'{path.name}.tmp')
+		try:
+			with temp.open('wb') as file:
+				file.write(_CACHE_HEADER.pack(
+					_CACHE_MAGIC, _CACHE_VERSION, self._order is None, stat.st_size, stat.st_mtime_ns
+				))
+				for column in (*(getattr(self, name) for (name, _) in _CACHE_COLUMNS), order, byte_orders):
+					data = column.tobytes()
+					file.write(_CACHE_COUNT.pack(len(column)))
+					file.write(data)
+					file.write(bytes(((len(data) + 7) & ~7) - len(data)))
+			# NOTE: Swap the whole thing in at once, so nothing ever sees a half written cache
+			os.replace(temp, path)
+		except OSError as e:
+			# The capture might be somewhere we can't write to, which just means indexing it every time
+			log.debug(f'Unable to write the packet index cache for {self._path}: {e}')
+			temp.unlink(missing_ok = True)
+
+	@property
+	def path(self) -> Path:
+		''' The path of the capture '''
+		return self._path
+
+	@property
+	def interfaces(self) -> tuple[InterfaceDescription, ...]:
+		''' All of the interfaces in the capture, indexed by their :py:attr:`InterfaceDescription.id` '''
+		return tuple(self._interfaces)
+
+	@property
+	def block_offsets(self) -> array:
+		''' The offset of every block in the capture '''
+		return self._block_offsets
+
+	@property
+	def block_types(self) -> array:
+		''' The type of every block in the capture '''
+		return self._block_types
+
+	@property
+	def offsets(self) -> array:
+		''' The offset of the block of every packet '''
+		return self._offsets
+
+	@property
+	def packet_interfaces(self) -> array:
+		''' The interface of every packet '''
+		return self._packet_ifaces
+
+	@property
+	def timestamps(self) -> array:
+		''' The timestamp of every packet in nanoseconds since the epoch '''
+		return self._timestamps
+
+	@property
+	def in_order(self) -> bool:
+		''' If the packet timestamps never go backwards '''
+		return self._order is None
+
+	def __len__(self) -> int:
+		return len(self._offsets)
+
+	def block(self, index: int) -> memoryview:
+		''' Get the whole of the block at ``index``, including its type and lengths '''
+		if index < 0:
+			index += len(self._block_offsets)
+		offset = self._block_offsets[index]
+		end    = self._block_offsets[index + 1] if index + 1 < len(self._block_offsets) else len(self._view)
+		return self._view[offset:end]
+
+	def packet(self, index: int) -> EnhancedPacket:
+		'''
+		Get a packet.
+
+		Parameters
+		----------
+		index : int
+			The number of the packet in the capture.
+
+		Returns
+		-------
+		EnhancedPacket
+			The packet, with the data being a view into the mapping.
+		'''
+
+		offset    = self._offsets[index]
+		interface = self._interfaces[self._packet_ifaces[index]]
+		order     = interface._order
+
+		(_, block_len) = order.header.unpack_from(self._view, offset)
+		body = self._view[offset + 8:offset + block_len - 4]
+		(interface_id, ts_high, ts_low, captured_len, original_len) = order.epb.unpack_from(body, 0)
+
+		return EnhancedPacket(
+			_ENHANCED_PACKET, body, order, interface, interface_id, (ts_high << 32) | ts_low, captured_len,
+			original_len
+		)
+
+	def packet_data(self, index: int) -> memoryview:
+		''' Get just the data of a packet, without creating an :py:class:`EnhancedPacket` '''
+
+		offset = self._offsets[index]
+		order  = self._interfaces[self._packet_ifaces[index]]._order
+		captured_len = order.epb.unpack_from(self._view, offset + 8)[3]
+		return self._view[offset + 28:offset + 28 + captured_len]
+
+	def find(self, ts: int) -> int:
+		'''
+		Find the first packet at or after a point in time.
+
+		Parameters
+		----------
+		ts : int
+			The time in nanoseconds since the epoch.
+
+		Returns
+		-------
+		int
+			The index of the packet in timestamp order, which is the packet number if :py:attr:`in_order`,
+			or ``len(self)`` if every packet is before ``ts``.
+		'''
+
+		if self._order is None:
+			return bisect_left(self._timestamps, ts)
+		return bisect_left(self._order, ts, key = self._timestamps.__getitem__)
+
+	def between(self, start: int, end: int) -> Sequence[int]:
+		'''
+		Get all of the packets within a span of time.
+
+		Parameters
+		----------
+		start : int
+			The start of the span in nanoseconds since the epoch.
+
+		end : int
+			The end of the span in nanoseconds since the epoch, exclusive.
+
+		Returns
+		-------
+		Sequence[int]
+			The numbers of the packets in the span, in timestamp order.
+		'''
+
+		(lo, hi) = (self.find(start), self.find(end))
+		if self._order is None:
+			return range(lo, hi)
+		return self._order[lo:hi]
+
+	def close(self) -> None:
+		''' Unmap the capture '''
+		self._view.release()
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
@@ -0,0 +1,466 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:func:`export_scsi_frames_parallel`, which does the same thing as
+:py:func:`export_scsi_frames`, but splits the capture up and decodes it across several processes, for when a
+capture is large enough that a single core is the bottleneck.
+
+The capture is split into chunks of roughly equal size, which are unlikely to start on a block boundary, so
+each worker scans forward from the start of its chunk until it finds a run of blocks that look valid, and then
+walks the blocks from there until it passes the end of its chunk. The workers write out what they found into
+shared memory, and the results are stitched back together, checking that each chunk picks up exactly where the
+previous one left off, and re-decoding it from the right place if not.
+
+.. code-block:: python
+
+	frames = export_scsi_frames_parallel('/tmp/bus.pcapng', workers = 8)
+
+Like :py:func:`export_scsi_frames`, this needs :py:mod:`numpy`, from the ``numpy`` extra.
+
+'''
+
+import mmap
+from concurrent.futures   import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing      import shared_memory
+from os                   import cpu_count
+from pathlib              import Path
+from struct               import unpack_from
+from typing               import Any, Final, NamedTuple
+
+from ._consts             import (
+	_ENHANCED_PACKET, _INTERFACE_DESCRIPTION, _KNOWN_BLOCKS, _LINKTYPE_PARALLEL_SCSI, _SECTION_HEADER
+)
+from .export              import (
+	_EPB_DATA, _PSF_HEADER, SCSI_FRAME_DTYPE, SCSIFrames, _gather, _need_numpy, export_scsi_frames,
+)
+from .reader              import _BYTE_ORDER_MAGIC, _LITTLE_ENDIAN, InterfaceDescription
+
+try:
+	import numpy as np
+except ImportError:
+	np = None # type: ignore[assignment]
+
+__all__ = (
+	'export_scsi_frames_parallel',
+)
+
+# How many blocks in a row need to look right before we believe we've found a block boundary
+_RESYNC_BLOCKS: Final = 4
+# The smallest an Enhanced Packet Block can be, which bounds how many there can be in a chunk
+_MIN_EPB: Final = 32
+# The byte order magic of a big endian section, as it appears in the file
+_SWAPPED_MAGIC: Final = _BYTE_ORDER_MAGIC.to_bytes(4, 'big')
+
+# What a worker records for every Enhanced Packet Block, before we know which interfaces are SCSI ones
+_ROW_DTYPE: Final[Any] = np.dtype([
+	('offset',     '<u8'),
+	('timestamp',  '<u8'),
+	('epoch',      '<u4'),
+	('interface',  '<u4'),
+	('captured',   '<u4'),
+	('data_len',   '<u4'),
+	('frame_type', 'u1'),
+	('orig_id',    'u1'),
+	('dest_id',    'u1'),
+	('opcode',     'u1'),
+]) if np is not None else None
+
+class _Chunk(NamedTuple):
+	''' What a worker found in its chunk of the capture '''
+
+	start: int
+	''' The offset of the first block that was decoded, or -1 if the chunk didn't start where we thought it did '''
+	end: int
+	''' The offset just past the last block that was decoded '''
+	rows: int
+	''' How many Enhanced Packet Blocks were found '''
+	headers: list[tuple[int, int, bytes]]
+	'''
+	The section headers and interface descriptions in the chunk, as the epoch they're in, the block type, and
+	the block body. The epoch is how many section headers came before it in the chunk, so 0 is whichever section
+	was in effect at the start of the chunk.
+	'''
+
+def _looks_valid(view: memoryview, offset: int) -> bool:
+	''' Check if there looks like a run of valid blocks starting at ``offset`` '''
+
+	length = len(view)
+	for _ in range(_RESYNC_BLOCKS):
+		if offset == length:
+			return True
+		if offset + 12 > length:
+			return False
+
+		(block_type, block_len) = unpack_from('<II', view, offset)
+		if (
+			block_type not in _KNOWN_BLOCKS or block_len < 12 or block_len & 3 != 0 or
+			offset + block_len > length or unpack_from('<I', view, offset + block_len - 4)[0] != block_len
+		):
+			return False
+		if block_type == _ENHANCED_PACKET and (
+			block_len < _MIN_EPB or unpack_from('<I', view, offset + 20)[0] + _MIN_EPB > block_len
+		):
+			return False
+		if block_type == _SECTION_HEADER and unpack_from('<I', view, offset + 8)[0] != _BYTE_ORDER_MAGIC:
+			return False
+
+		offset += block_len
+	return True
+
+def _resync(view: memoryview, start: int, end: int) -> int:
+	''' Find the first block boundary at or after ``start``, or ``end`` if there isn't one before it '''
+
+	# NOTE: Blocks are always 32-bit aligned, so there's no point looking anywhere else
+	for offset in range((start + 3) & ~3, min(end, len(view)), 4):
+		if _looks_valid(view, offset):
+			return offset
+	return end
+
+def _decode_chunk(path: str, start: int, end: int, exact: bool, shm: str | None, capacity: int) -> Any:
+	'''
+	Decode the Enhanced Packet Blocks that start within ``start`` and ``end``.
+
+	This runs in the worker processes, the rows are written into the shared memory ``shm`` and the
+	:py:class:`_Chunk` is returned, or if ``shm`` is None the rows are returned along with it.
+	'''
+
+	with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+		view = memoryview(mapped)
+		try:
+			return _walk_chunk(view, start, end, exact, shm, capacity)
+		finally:
+			view.release()
+
+def _desynced(shm: str | None) -> Any:
+	''' The result of a chunk that turned out not to start on a block boundary '''
+	chunk = _Chunk(-1, -1, 0, [])
+	return chunk if shm is not None else (chunk, None)
+
+def _walk_chunk(view: memoryview, start: int, end: int, exact: bool, shm: str | None, capacity: int) -> Any:
+	length = len(view)
+	first  = start if exact else _resync(view, start, end)
+	offset = first
+	epoch  = 0
+
+	offsets = []
+	epochs  = []
+	headers: list[tuple[int, int, bytes]] = []
+
+	while offset < end and offset < length:
+		error = None
+		if offset + 12 > length:
+			error = f'Capture ends part way through a block header at offset {offset}'
+		else:
+			(block_type, block_len) = unpack_from('<II', view, offset)
+			if block_len < 12 or block_len & 3 != 0 or (block_type == _ENHANCED_PACKET and block_len < _MIN_EPB):
+				error = f'Bad block length {block_len} at offset {offset}'
+			elif offset + block_len > length:
+				error = f'Capture ends part way through a block at offset {offset}'
+
+		if error is not None:
+			# NOTE: If we had to guess where the blocks start then we may have just guessed wrong, so leave it
+			#       to be re-decoded from where the previous chunk ends
+			if not exact:
+				return _desynced(shm)
+			raise ValueError(error)
+
+		if block_type == _ENHANCED_PACKET:
+			offsets.append(offset)
+			epochs.append(epoch)
+		elif block_type == _SECTION_HEADER:
+			if unpack_from('<I', view, offset + 8)[0] != _BYTE_ORDER_MAGIC:
+				if not exact:
+					return _desynced(shm)
+				raise ValueError(f'Bad section header byte order magic at offset {offset}')
+			epoch += 1
+			headers.append((epoch, block_type, bytes(view[offset + 8:offset + block_len - 4])))
+		elif block_type == _INTERFACE_DESCRIPTION:
+			headers.append((epoch, block_type, bytes(view[offset + 8:offset + block_len - 4])))
+
+		offset += block_len
+
+	if len(offsets) > capacity:
+		raise ValueError(f'Found {len(offsets)} packets in a chunk, which can only fit {capacity}')
+
+	buffer = np.frombuffer(view, dtype = np.uint8)
+	block: shared_memory.SharedMemory | None = None
+	rows:  Any = None
+	try:
+		if shm is not None:
+			block = shared_memory.SharedMemory(name = shm)
+			rows  = np.ndarray((capacity, ), dtype = _ROW_DTYPE, buffer = block.buf)[:len(offsets)]
+		else:
+			rows = np.zeros(len(offsets), dtype = _ROW_DTYPE)
+
+		at = np.array(offsets, dtype = np.int64)
+		rows['offset'] = at
+		rows['epoch']  = np.array(epochs, dtype = np.uint32)
+
+		# The interface, timestamp, and captured length, all in one go
+		epb = np.ascontiguousarray(buffer[(at + 8)[:, None] + np.arange(16)])
+		rows['interface'] = epb[:, 0:4].copy().view('<u4')[:, 0]
+		rows['timestamp'] = (
+			(epb[:, 4:8].copy().view('<u4')[:, 0].astype(np.uint64) << np.uint64(32)) |
+			epb[:, 8:12].copy().view('<u4')[:, 0].astype(np.uint64)
+		)
+		captured = epb[:, 12:16].copy().view('<u4')[:, 0]
+		rows['captured'] = captured
+
+		# NOTE: We don't know which interfaces are SCSI ones yet, so pick out a frame header from everything
+		#       that's long enough to have one, and sort it out later
+		frame = np.flatnonzero(captured >= _PSF_HEADER)
+		header = np.ascontiguousarray(buffer[(at[frame] + _EPB_DATA)[:, None] + np.arange(_PSF_HEADER)])
+		data_len = header[:, 24:28].copy().view('<u4')[:, 0]
+		has_data = np.minimum(data_len, captured[frame] - _PSF_HEADER) > 0
+		data_at  = at[frame] + _EPB_DATA + _PSF_HEADER
+
+		rows['data_len'][frame]   = data_len
+		rows['frame_type'][frame] = header[:, 4]
+		rows['orig_id'][frame]    = header[:, 5]
+		rows['dest_id'][frame]    = header[:, 6]
+		rows['opcode'][frame]     = np.where(has_data, buffer[np.where(has_data, data_at, 0)], 0)
+
+		chunk = _Chunk(first, offset, len(offsets), headers)
+		return (chunk, rows) if shm is None else chunk
+	finally:
+		# NOTE: The shared memory can't be closed while we still have a view of it
+		del buffer
+		rows = None
+		if block is not None:
+			block.close()
+
+def _timestamps(raw: Any, units: int, ts_offset: int) -> Any:
+	''' Convert raw timestamps to nanoseconds since the epoch, without overflowing along the way '''
+
+	if units > 1_000_000_000:
+		# NOTE: Finer than nanoseconds is rare enough that it's not worth being clever about
+		ns = np.array([ (int(ts) * 1_000_000_000) // units for ts in raw ], dtype = np.int64)
+	else:
+		units_np = np.uint64(units)
+		ns = (
+			(raw // units_np) * np.uint64(1_000_000_000) + ((raw % units_np) * np.uint64(1_000_000_000)) // units_np
+		).astype(np.int64)
+	return ns + ts_offset * 1_000_000_000
+
+def export_scsi_frames_parallel(
+	capture: str | Path, *, workers: int | None = None, chunk_size: int | None = None, start: int | None = None,
+	end: int | None = None,
+) -> SCSIFrames:
+	'''
+	Export the ``LINKTYPE_PARALLEL_SCSI`` frames in a capture to :py:mod:`numpy` arrays using several processes.
+
+	Only little endian captures can be split up, anything with a big endian section in it is handed off to
+	:py:func:`export_scsi_frames`, as are compressed captures, as they can't be split up at all.
+
+	Parameters
+	----------
+	capture : str | Path
+		The capture to export.
+
+	workers : int | None
+		How many worker processes to use, or None for one per CPU. With a single worker everything is done
+		in this process.
+
+	chunk_size : int | None
+		How many bytes of the capture to hand to a worker at a time, or None to split it up evenly between
+		the workers, up to 64MiB at a time.
+
+	start : int | None
+		Only export frames at or after this time in nanoseconds since the epoch.
+
+	end : int | None
+		Only export frames before this time in nanoseconds since the epoch.
+
+	Returns
+	-------
+	SCSIFrames
+		The frames, in timestamp order, frames with the same timestamp are kept in the order they are in the
+		capture.
+
+	Raises
+	------
+	ImportError
+		If :py:mod:`numpy` is not installed.
+
+	ValueError
+		If the capture is malformed.
+	'''
+
+	_need_numpy()
+
+	path = Path(capture)
+	if workers is None:
+		workers = cpu_count() or 1
+	if workers < 1:
+		raise ValueError(f'Need at least 1 worker, not {workers}')
+
+	with path.open('rb') as file:
+		size = path.stat().st_size
+		magic = file.read(4)
+		if size == 0 or magic != _SECTION_HEADER.to_bytes(4, 'little'):
+			return _sorted(export_scsi_frames(path, start = start, end = end))
+
+		with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+			# NOTE: A big endian section header has its byte order magic 8 bytes after its block type
+			found = mapped.find(_SWAPPED_MAGIC)
+			while found != -1:
+				if found >= 8 and mapped[found - 8:found - 4] == _SECTION_HEADER.to_bytes(4, 'big'):
+					return _sorted(export_scsi_frames(path, start = start, end = end))
+				found = mapped.find(_SWAPPED_MAGIC, found + 1)
+
+	if chunk_size is None:
+		chunk_size = min(max(-(-size // workers), 1024 * 1024), 64 * 1024 * 1024)
+	spans = [ (offset, min(offset + chunk_size, size)) for offset in range(0, size, chunk_size) ]
+
+	chunks: list[tuple[_Chunk, Any]] = []
+	if workers == 1:
+		for (lo, hi) in spans:
+			chunks.append(_decode_chunk(str(path), lo, hi, lo == 0, None, (hi - lo) // _MIN_EPB + 1))
+	else:
+		chunks = _decode_all(path, spans, workers)
+
+	# Make sure every chunk starts where the last one ended, and re-decode any that don't
+	position = 0
+	results: list[tuple[_Chunk, Any]] = []
+	for ((lo, hi), (chunk, rows)) in zip(spans, chunks):
+		if position >= hi:
+			continue
+		if chunk.start != position:
+			(chunk, rows) = _decode_chunk(str(path), position, hi, True, None, (hi - position) // _MIN_EPB + 1)
+		results.append((chunk, rows))
+		position = chunk.end
+
+	with path.open('rb') as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+		view = memoryview(mapped)
+		try:
+			return _merge(view, results, start, end)
+		finally:
+			view.release()
+
+def _release(block: shared_memory.SharedMemory) -> None:
+	''' Close and remove a block of shared memory '''
+	block.close()
+	block.unlink()
+
+def _decode_all(path: Path, spans: list[tuple[int, int]], workers: int) -> list[tuple[_Chunk, Any]]:
+	''' Decode all of the chunks in a pool of worker processes '''
+
+	chunks: list[Any] = [ None ] * len(spans)
+	# The index of the chunk, and the shared memory it is being written into, of every chunk in flight
+	in_flight: dict[Future, tuple[int, shared_memory.SharedMemory]] = {}
+	pending = enumerate(spans)
+
+	def _submit(pool: ProcessPoolExecutor) -> None:
+		if (span := next(pending, None)) is None:
+			return
+		(idx, (lo, hi)) = span
+		capacity = (hi - lo) // _MIN_EPB + 1
+		block    = shared_memory.SharedMemory(create = True, size = capacity * _ROW_DTYPE.itemsize)
+		try:
+			future = pool.submit(_decode_chunk, str(path), lo, hi, lo == 0, block.name, capacity)
+		except BaseException:
+			_release(block)
+			raise
+		in_flight[future] = (idx, block)
+
+	try:
+		with ProcessPoolExecutor(max_workers = workers) as pool:
+			# NOTE: Each chunk needs enough shared memory for the most packets that could fit in it, so rather than
+			#       handing every chunk out at once, there are only ever as many in flight as there are workers,
+			#       with the next one handed out as each one is done, and its shared memory freed
+			for _ in range(workers):
+				_submit(pool)
+
+			while len(in_flight) > 0:
+				(done, _) = wait(in_flight, return_when = FIRST_COMPLETED)
+				for future in done:
+					(idx, block) = in_flight.pop(future)
+					try:
+						chunk: _Chunk = future.result()
+						rows = np.ndarray((chunk.rows, ), dtype = _ROW_DTYPE, buffer = block.buf).copy()
+					finally:
+						_release(block)
+					chunks[idx] = (chunk, rows)
+					_submit(pool)
+		return chunks
+	finally:
+		# Anything still in flight if something went wrong, the pool has been shut down so nothing is using it
+		for (_, block) in in_flight.values():
+			_release(block)
+
+def _merge(view: memoryview, results: list[tuple[_Chunk, Any]], start: int | None, end: int | None) -> SCSIFrames:
+	''' Work out which interface every packet belongs to, and put all of the SCSI frames together '''
+
+	interfaces: list[InterfaceDescription] = []
+	# The interfaces of the section in effect at the start of the current chunk
+	current: list[InterfaceDescription] | None = None
+
+	merged = []
+	for (chunk, rows) in results:
+		sections = [ current ]
+		for (epoch, block_type, body) in chunk.headers:
+			if block_type == _SECTION_HEADER:
+				sections.append([])
+				continue
+
+			section = sections[epoch]
+			if section is None:
+				raise ValueError('Capture does not start with a section header')
+			interface = InterfaceDescription(block_type, memoryview(body), _LITTLE_ENDIAN, len(interfaces))
+			interfaces.append(interface)
+			section.append(interface)
+		current = sections[-1]
+
+		frames = np.zeros(len(rows), dtype = SCSI_FRAME_DTYPE)
+		keep   = np.zeros(len(rows), dtype = np.bool_)
+		for epoch in np.unique(rows['epoch']):
+			in_epoch = np.flatnonzero(rows['epoch'] == epoch)
+			section = sections[int(epoch)]
+			local = rows['interface'][in_epoch]
+			if section is None or int(local.max()) >= len(section):
+				bad = int(rows['offset'][in_epoch[0]])
+				raise ValueError(f'Packet near offset {bad} is from an undescribed interface')
+
+			for (idx, interface) in enumerate(section):
+				if interface.link_type != _LINKTYPE_PARALLEL_SCSI:
+					continue
+				packets = in_epoch[local == idx]
+				frames['interface'][packets] = interface.id
+				frames['timestamp'][packets] = _timestamps(
+					rows['timestamp'][packets], interface.ts_units, interface.ts_offset
+				)
+				keep[packets] = True
+
+		keep &= rows['captured'] >= _PSF_HEADER
+		if start is not None:
+			keep &= frames['timestamp'] >= start
+		if end is not None:
+			keep &= frames['timestamp'] < end
+
+		for name in ('offset', 'data_len', 'frame_type', 'orig_id', 'dest_id', 'opcode'):
+			frames[name] = rows[name]
+		merged.append((frames[keep], rows['captured'][keep]))
+
+	frames   = np.concatenate([ frames for (frames, _) in merged ]) if merged else np.zeros(0, SCSI_FRAME_DTYPE)
+	captured = np.concatenate([ captured for (_, captured) in merged ]) if merged else np.zeros(0, np.uint32)
+
+	order = np.argsort(frames['timestamp'], kind = 'stable')
+	frames   = frames[order]
+	captured = captured[order]
+
+	buffer = np.frombuffer(view, dtype = np.uint8)
+	try:
+		available = np.minimum(frames['data_len'].astype(np.int64), captured.astype(np.int64) - _PSF_HEADER)
+		data_at   = frames['offset'].astype(np.int64) + _EPB_DATA + _PSF_HEADER
+		(payload, payload_offsets) = _gather(buffer, data_at, available)
+	finally:
+		del buffer
+
+	return SCSIFrames(frames, payload, payload_offsets)
+
+def _sorted(frames: SCSIFrames) -> SCSIFrames:
+	''' Put exported frames in timestamp order '''
+	timestamps = frames.frames['timestamp']
+	if len(timestamps) < 2 or (timestamps[1:] >= timestamps[:-1]).all():
+		return frames
+	return frames.take(np.argsort(timestamps, kind = 'stable'))
@@ -0,0 +1,710 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`Query`, a small query engine for picking frames out of ``LINKTYPE_PARALLEL_SCSI``
+captures without having to load and decode the whole thing first.
+
+Queries are Python-like expressions over the fields of each frame, which are compiled once up front.
+
++---------------+------------------------------------------------------------------+
+| Field         | Description                                                      |
++===============+==================================================================+
+| ``type``      | The :py:class:`SCSIFrameType`, which can be given by name        |
++---------------+------------------------------------------------------------------+
+| ``orig``      | The ID of the device that sent the frame                         |
++---------------+------------------------------------------------------------------+
+| ``dest``      | The ID of the device the frame was sent to                       |
++---------------+------------------------------------------------------------------+
+| ``opcode``    | The first byte of the frame data, the CDB opcode for commands    |
++---------------+------------------------------------------------------------------+
+| ``len``       | The length of the frame data, ``KiB``, ``MiB``, and ``GiB`` help |
++---------------+------------------------------------------------------------------+
+| ``ts``        | The timestamp of the frame in nanoseconds since the epoch        |
++---------------+------------------------------------------------------------------+
+| ``interface`` | The ID of the interface the frame was captured on                |
++---------------+------------------------------------------------------------------+
+| ``cdb.<x>``   | A field of the CDB of a command, decoded with                    |
+|               | :py:mod:`squishy.scsi.commands`                                  |
++---------------+------------------------------------------------------------------+
+
+Any field that isn't there, such as the ``opcode`` of a frame without any data, or a CDB field of a command
+that isn't known, is None, and never matches any comparison.
+
+.. code-block:: python
+
+	query = Query('type == COMMAND and opcode == 0x12 and dest == 3 and cdb.AllocLen >= 36')
+	for frame in query.frames('/tmp/bus.pcapng'):
+		print(frame.timestamp, frame.data.hex())
+
+	query = Query('type == DATA_IN and len > 64 * KiB and ts >= 1832000000000000000')
+	query.write('/tmp/bus.pcapng', '/tmp/big-reads.pcapng')
+
+The simple comparisons on the frame type, IDs, opcode, and timestamp that the whole query depends on are pushed
+down, if there's an up to date :py:class:`SCSIIndex` next to the capture, they are used to find the candidate
+frames without looking at the capture at all, otherwise they are checked against the frame header before doing
+anything else with the frame. Either way, CDBs are only ever decoded for the frames that get that far.
+
+'''
+
+import ast
+import mmap
+import operator
+from collections.abc import Callable, Iterator
+from contextlib      import contextmanager
+from math            import ceil, floor
+from pathlib         import Path
+from struct          import Struct, unpack_from
+from typing          import Any, BinaryIO, Final
+
+from ._consts        import _ENHANCED_PACKET, _INTERFACE_DESCRIPTION, _LINKTYPE_PARALLEL_SCSI, _SECTION_HEADER
+from .linktype       import SCSIFrameType
+from .reader         import (
+	_BYTE_ORDER_MAGIC, _BYTE_ORDER_SWAPPED, _is_uncompressed, EnhancedPacket, PCAPNGReader
+)
+from .sidecar        import SCSIIndex, build_scsi_index, scsi_index_path
+
+__all__ = (
+	'Query',
+	'QueryFrame',
+	'decode_cdb',
+)
+
+
+# The type, IDs, and data length from the Parallel SCSI Frame header
+_PSF_HEADER: Final = Struct('<4xBBB17xI')
+
+# The query fields, and the attribute of the `QueryFrame` they come from
+_FIELDS: Final = {
+	'type':      'frame_type',
+	'orig':      'orig_id',
+	'dest':      'dest_id',
+	'opcode':    'opcode',
+	'len':       'data_len',
+	'ts':        'timestamp',
+	'interface': 'interface',
+}
+
+# The fields that can be pushed down, and the `SCSIIndex.select` argument they turn into
+_PUSHDOWN: Final = {
+	'type':   'frame_type',
+	'orig':   'orig_id',
+	'dest':   'dest_id',
+	'opcode': 'opcode',
+}
+
+_CONSTANTS: Final = {
+	**{ frame_type.name: int(frame_type) for frame_type in SCSIFrameType },
+	'KiB': 1024,
+	'MiB': 1024 ** 2,
+	'GiB': 1024 ** 3,
+}
+
+_COMPARISONS: Final[dict[type, Callable[[Any, Any], bool]]] = {
+	ast.Eq:    operator.eq,
+	ast.NotEq: operator.ne,
+	ast.Lt:    operator.lt,
+	ast.LtE:   operator.le,
+	ast.Gt:    operator.gt,
+	ast.GtE:   operator.ge,
+	ast.In:    lambda lhs, rhs: lhs in rhs,
+	ast.NotIn: lambda lhs, rhs: lhs not in rhs,
+}
+
+_ARITHMETIC: Final[dict[type, Callable[[Any, Any], Any]]] = {
+	ast.Add:      operator.add,
+	ast.Sub:      operator.sub,
+	ast.Mult:     operator.mul,
+	ast.FloorDiv: operator.floordiv,
+	ast.Mod:      operator.mod,
+	ast.BitAnd:   operator.and_,
+	ast.BitOr:    operator.or_,
+	ast.BitXor:   operator.xor,
+	ast.LShift:   operator.lshift,
+	ast.RShift:   operator.rshift,
+}
+
+_UNARY: Final[dict[type, Callable[[Any], Any]]] = {
+	ast.USub:   operator.neg,
+	ast.UAdd:   operator.pos,
+	ast.Invert: operator.invert,
+}
+
+# The CDB layouts from `squishy.scsi.commands`, by opcode, filled in the first time a CDB is decoded
+_CDB_LAYOUTS: dict[int, tuple[Any, int]] | None = None
+
+def _cdb_layouts() -> dict[int, tuple[Any, int]]:
+	global _CDB_LAYOUTS
+
+	if _CDB_LAYOUTS is None:
+		# NOTE: This takes a while to import, and most queries don't need it, so only do it when we have to
+		from construct       import Bitwise
+
+		from ...scsi         import commands
+		from ...scsi.command import SCSICommand
+
+		layouts: dict[int, tuple[Any, int]] = {}
+		for name in commands.__all__:
+			module = getattr(commands, name)
+			for command in (getattr(module, member) for member in getattr(module, '__all__', ())):
+				if not isinstance(command, SCSICommand):
+					continue
+				# NOTE: Opcodes are shared between device classes, we can't know which one we're looking at
+				#       from here, so the first one wins
+				layouts.setdefault(
+					(int(command.group_code) << 5) | command.opcode, (Bitwise(command), command.command_size)
+				)
+		_CDB_LAYOUTS = layouts
+	return _CDB_LAYOUTS
+
+def decode_cdb(cdb: bytes | bytearray | memoryview) -> Any | None:
+	'''
+	Decode a CDB using the command layouts in :py:mod:`squishy.scsi.commands`.
+
+	Parameters
+	----------
+	cdb : bytes | bytearray | memoryview
+		The CDB, starting with the opcode.
+
+	Returns
+	-------
+	construct.Container | None
+		The fields of the command, or None if the opcode is not known or the CDB is too short.
+	'''
+
+	if len(cdb) == 0:
+		return None
+	layout = _cdb_layouts().get(cdb[0])
+	if layout is None:
+		return None
+
+	(command, size) = layout
+	if len(cdb) < size:
+		return None
+	try:
+		return command.parse(bytes(cdb[:size]))
+	except Exception:
+		return None
+
+class QueryFrame:
+	'''
+	A frame that was found by a :py:class:`Query`.
+
+	Parameters
+	----------
+	offset : int
+		The offset of the Enhanced Packet Block of the frame in the capture.
+
+	timestamp : int
+		The timestamp of the frame in nanoseconds since the epoch.
+
+	interface : int
+		The ID of the interface the frame was captured on, within its section.
+
+	frame : bytes
+		The whole of the Parallel SCSI Frame.
+
+	'''
+
+	__slots__ = (
+		'offset', 'timestamp', 'interface', 'frame_type', 'orig_id', 'dest_id', 'data_len', 'frame', '_cdb',
+	)
+
+	def __init__(self, offset: int, timestamp: int, interface: int, frame: bytes) -> None:
+		self.offset = offset
+		''' The offset of the Enhanced Packet Block of the frame in the capture '''
+		self.timestamp = timestamp
+		''' The timestamp of the frame in nanoseconds since the epoch '''
+		self.interface = interface
+		''' The ID of the interface the frame was captured on, within its section '''
+		self.frame = frame
+		''' The whole of the Parallel SCSI Frame '''
+
+		(self.frame_type, self.orig_id, self.dest_id, self.data_len) = _PSF_HEADER.unpack_from(frame, 0)
+		self._cdb: Any = ...
+
+	@property
+	def data(self) -> bytes:
+		''' The captured frame data '''
+		return self.frame[_PSF_HEADER.size:_PSF_HEADER.size + self.data_len]
+
+	@property
+	def opcode(self) -> int | None:
+		''' The first byte of the frame data, or None if there isn't any '''
+		if self.data_len == 0 or len(self.frame) <= _PSF_HEADER.size:
+			return None
+		return self.frame[_PSF_HEADER.size]
+
+	@property
+	def cdb(self) -> Any | None:
+		''' The decoded CDB if this is a command, see :py:func:`decode_cdb` '''
+		if self._cdb is ...:
+			self._cdb = decode_cdb(self.data) if self.frame_type == SCSIFrameType.COMMAND else None
+		return self._cdb
+
+	def __repr__(self) -> str:
+		return (
+			f'<QueryFrame offset={self.offset} ts={self.timestamp} type={self.frame_type} '
+			f'orig={self.orig_id} dest={self.dest_id} len={self.data_len}>'
+		)
+
+_Predicate = Callable[[QueryFrame], Any]
+
+def _uses_cdb(node: ast.AST) -> bool:
+	return any(isinstance(child, ast.Name) and child.id == 'cdb' for child in ast.walk(node))
+
+def _is_constant(node: ast.AST) -> bool:
+	return not any(
+		isinstance(child, ast.Name) and child.id not in _CONSTANTS for child in ast.walk(node)
+	)
+
+def _compile(node: ast.AST) -> _Predicate:
+	''' Turn a node of the query into a function that evaluates it for a frame '''
+
+	if _is_constant(node) and not isinstance(node, ast.Constant):
+		value = _compile_node(node)(None) # type: ignore[arg-type]
+		return lambda _: value
+	return _compile_node(node)
+
+def _compile_node(node: ast.AST) -> _Predicate:
+	match node:
+		case ast.Constant(value = value) if isinstance(value, (int, float)):
+			return lambda _: value
+
+		case ast.Name(id = name):
+			if name in _FIELDS:
+				return operator.attrgetter(_FIELDS[name])
+			if name in _CONSTANTS:
+				value = _CONSTANTS[name]
+				return lambda _: value
+			raise ValueError(f'Unknown field or constant \'{name}\'')
+
+		case ast.Attribute(value = ast.Name(id = 'cdb'), attr = attr):
+			def _cdb_field(frame: QueryFrame) -> Any:
+				cdb = frame.cdb
+				return None if cdb is None else getattr(cdb, attr, None)
+			return _cdb_field
+
+		case ast.BoolOp(op = op, values = values):
+			# NOTE: Decoding the CDB is by far the most expensive thing we do, so always do it last
+			terms = [ _compile(value) for value in sorted(values, key = _uses_cdb) ]
+			if isinstance(op, ast.And):
+				return lambda frame: all(term(frame) for term in terms)
+			return lambda frame: any(term(frame) for term in terms)
+
+		case ast.UnaryOp(op = ast.Not(), operand = operand):
+			term = _compile(operand)
+			return lambda frame: not term(frame)
+
+		case ast.UnaryOp(op = op, operand = operand) if type(op) in _UNARY:
+			unary = _UNARY[type(op)]
+			term  = _compile(operand)
+
+			def _unary(frame: QueryFrame) -> Any:
+				value = term(frame)
+				return None if value is None else unary(value)
+			return _unary
+
+		case ast.BinOp(left = left, op = op, right = right) if type(op) in _ARITHMETIC:
+			arithmetic = _ARITHMETIC[type(op)]
+			(lhs, rhs) = (_compile(left), _compile(right))
+
+			def _binop(frame: QueryFrame) -> Any:
+				(a, b) = (lhs(frame), rhs(frame))
+				return None if a is None or b is None else arithmetic(a, b)
+			return _binop
+
+		case ast.Compare(left = left, ops = ops, comparators = comparators):
+			if not all(type(op) in _COMPARISONS for op in ops):
+				raise ValueError('Unsupported comparison in query')
+			first = _compile(left)
+			chain = [ (_COMPARISONS[type(op)], _compile(rhs)) for (op, rhs) in zip(ops, comparators) ]
+
+			def _compare(frame: QueryFrame) -> bool:
+				lhs = first(frame)
+				for (compare, term) in chain:
+					rhs = term(frame)
+					if lhs is None or rhs is None or not compare(lhs, rhs):
+						return False
+					lhs = rhs
+				return True
+			return _compare
+
+		case ast.Tuple(elts = elts) | ast.List(elts = elts) | ast.Set(elts = elts):
+			terms = [ _compile(elt) for elt in elts ]
+			return lambda frame: frozenset(term(frame) for term in terms)
+
+	raise ValueError(f'Unsupported expression in query: {ast.unparse(node)}')
+
+def _constant(node: ast.AST) -> Any:
+	''' Evaluate a node that doesn't depend on the frame '''
+	return _compile_node(node)(None) # type: ignore[arg-type]
+
+def _pushdown(node: ast.AST) -> dict[str, Any] | None:
+	'''
+	Pull out the simple comparisons on the frame header that the whole query depends on.
+
+	Returns
+	-------
+	dict[str, Any] | None
+		The :py:meth:`SCSIIndex.select` arguments, or None if nothing can ever match.
+	'''
+
+	terms = node.values if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And) else [ node ]
+
+	values: dict[str, set[int]] = {}
+	start: int | None = None
+	end: int | None   = None
+
+	for term in terms:
+		if not isinstance(term, ast.Compare) or len(term.ops) != 1:
+			continue
+
+		(op, lhs, rhs) = (term.ops[0], term.left, term.comparators[0])
+		# Get the field on the left if it's the other way around
+		if isinstance(rhs, ast.Name) and rhs.id in _FIELDS and not isinstance(op, (ast.In, ast.NotIn)):
+			flipped: dict[type, ast.cmpop] = {
+				ast.Lt: ast.Gt(), ast.LtE: ast.GtE(), ast.Gt: ast.Lt(), ast.GtE: ast.LtE(), ast.Eq: ast.Eq(),
+			}
+			if type(op) not in flipped:
+				continue
+			(op, lhs, rhs) = (flipped[type(op)], rhs, lhs)
+
+		if not isinstance(lhs, ast.Name) or lhs.id not in _FIELDS or not _is_constant(rhs):
+			continue
+		value = _constant(rhs)
+		field = lhs.id
+
+		if field in _PUSHDOWN:
+			if isinstance(op, ast.Eq) and isinstance(value, int):
+				wanted = { value }
+			elif isinstance(op, ast.In) and isinstance(value, frozenset):
+				wanted = { item for item in value if isinstance(item, int) }
+			else:
+				continue
+			values[field] = values[field] & wanted if field in values else wanted
+		elif field == 'ts' and isinstance(value, (int, float)):
+			lo: int | None
+			hi: int | None
+			match op:
+				case ast.GtE():
+					(lo, hi) = (ceil(value), None)
+				case ast.Gt():
+					(lo, hi) = (floor(value) + 1, None)
+				case ast.Lt():
+					(lo, hi) = (None, ceil(value))
+				case ast.LtE():
+					(lo, hi) = (None, floor(value) + 1)
+				case ast.Eq():
+					(lo, hi) = (ceil(value), floor(value) + 1)
+				case _:
+					continue
+			if lo is not None:
+				start = lo if start is None else max(start, lo)
+			if hi is not None:
+				end = hi if end is None else min(end, hi)
+
+	if any(len(wanted) == 0 for wanted in values.values()):
+		return None
+	if start is not None and end is not None and start >= end:
+		return None
+
+	pushdown: dict[str, Any] = { _PUSHDOWN[field]: tuple(sorted(wanted)) for (field, wanted) in values.items() }
+	if start is not None:
+		pushdown['start'] = start
+	if end is not None:
+		pushdown['end'] = end
+	return pushdown
+
+class Query:
+	'''
+	A compiled query over the frames of ``LINKTYPE_PARALLEL_SCSI`` captures.
+
+	Parameters
+	----------
+	expression : str
+		The query, see the module documentation for the fields that can be used.
+
+	Raises
+	------
+	ValueError
+		If the query is not valid.
+
+	'''
+
+	def __init__(self, expression: str) -> None:
+		self._expression = expression
+
+		try:
+			tree = ast.parse(expression.strip(), mode = 'eval')
+		except SyntaxError as e:
+			raise ValueError(f'Bad query \'{expression}\': {e.msg}') from None
+
+		self._predicate = _compile(tree.body)
+		self._pushdown  = _pushdown(tree.body)
+
+	@property
+	def expression(self) -> str:
+		''' The query expression '''
+		return self._expression
+
+	@property
+	def pushdown(self) -> dict[str, Any] | None:
+		''' The :py:meth:`SCSIIndex.select` arguments that are pushed down, or None if nothing can match '''
+		return None if self._pushdown is None else dict(self._pushdown)
+
+	def matches(self, frame: QueryFrame) -> bool:
+		''' Check if a frame matches the query '''
+		return bool(self._predicate(frame))
+
+	def _index(self, capture: str | Path | BinaryIO, index: SCSIIndex | str | Path | bool | None) -> SCSIIndex | None:
+		''' Work out which index to use, if any '''
+
+		if index is False or not isinstance(capture, (str, Path)):
+			return None
+		# NOTE: The index offsets are into the decompressed capture, but only the raw file can be mapped
+		if not _is_uncompressed(Path(capture)):
+			return None
+		if isinstance(index, SCSIIndex):
+			return index
+		if isinstance(index, (str, Path)):
+			return SCSIIndex(index)
+
+		path = scsi_index_path(capture)
+		fresh = path.exists() and path.stat().st_mtime_ns >= Path(capture).stat().st_mtime_ns
+		if not fresh:
+			if index is not True:
+				return None
+			build_scsi_index(capture, path)
+		return SCSIIndex(path)
+
+	def _streamed(self, capture: str | Path | BinaryIO, *, blocks: bool) -> Iterator[tuple[QueryFrame | None, bytes]]:
+		'''
+		Go through the whole capture, yielding the matching frames, along with their raw blocks if ``blocks`` is
+		set, in which case the raw section and interface blocks are also yielded without a frame.
+		'''
+
+		if self._pushdown is None and not blocks:
+			return
+
+		# NOTE: If nothing can match we still need to copy the headers over to write a valid capture
+		pushdown: dict[str, Any] = self._pushdown if self._pushdown is not None else { 'frame_type': frozenset() }
+		types    = pushdown.get('frame_type')
+		origs    = pushdown.get('orig_id')
+		dests    = pushdown.get('dest_id')
+		opcodes  = pushdown.get('opcode')
+		start    = pushdown.get('start')
+		end      = pushdown.get('end')
+		header   = _PSF_HEADER
+		predicate = self._predicate
+
+		with PCAPNGReader(capture) as reader:
+			offset = 0
+			for block in reader:
+				(at, offset) = (offset, reader.offset)
+
+				if isinstance(block, EnhancedPacket):
+					interface = block.interface
+					if interface is None or interface.link_type != _LINKTYPE_PARALLEL_SCSI:
+						continue
+					data = block.data
+					if len(data) < header.size:
+						continue
+
+					# Check everything we can from the frame header before going any further
+					(frame_type, orig_id, dest_id, data_len) = header.unpack_from(data, 0)
+					if (
+						(types is not None and frame_type not in types) or
+						(origs is not None and orig_id not in origs) or
+						(dests is not None and dest_id not in dests) or
+						(opcodes is not None and (
+							data_len == 0 or len(data) <= header.size or data[header.size] not in opcodes
+						))
+					):
+						continue
+					ts = block.timestamp_ns
+					if (start is not None and ts < start) or (end is not None and ts >= end):
+						continue
+
+					frame = QueryFrame(at, ts, block.interface_id, bytes(data))
+					if predicate(frame):
+						yield (frame, block.to_bytes() if blocks else b'')
+				elif blocks and block.type in (_SECTION_HEADER, _INTERFACE_DESCRIPTION):
+					yield (None, block.to_bytes())
+
+	def _indexed(self, index: SCSIIndex, view: memoryview) -> Iterator[QueryFrame]:
+		''' Find the matching frames using the index '''
+
+		if self._pushdown is None:
+			return
+
+		predicate = self._predicate
+		for row in index.select(**self._pushdown):
+			entry  = index[row]
+			offset = entry.offset
+			if offset + 28 > len(view) or unpack_from('<I', view, offset)[0] != _ENHANCED_PACKET:
+				raise ValueError(f'The index {index.path} does not match the capture, there is no packet at {offset}')
+			(interface, _, _, captured) = unpack_from('<IIII', view, offset + 8)
+
+			frame = QueryFrame(offset, entry.timestamp, interface, bytes(view[offset + 28:offset + 28 + captured]))
+			if predicate(frame):
+				yield frame
+
+	def _headers(self, view: memoryview) -> list[bytes] | None:
+		'''
+		Get the section header and interface descriptions from the start of a capture, or None if it has more
+		than one section or is big endian, as the index can't cope with either.
+		'''
+
+		headers: list[bytes] = []
+		offset = 0
+		while offset + 12 <= len(view):
+			(block_type, block_len) = unpack_from('<II', view, offset)
+			if block_type == _ENHANCED_PACKET:
+				break
+			if block_type == _SECTION_HEADER and (offset != 0 or unpack_from('<I', view, 8)[0] != _BYTE_ORDER_MAGIC):
+				return None
+			if block_len < 12 or offset + block_len > len(view):
+				raise ValueError(f'Bad block length {block_len} at offset {offset}')
+			if block_type in (_SECTION_HEADER, _INTERFACE_DESCRIPTION):
+				headers.append(bytes(view[offset:offset + block_len]))
+			offset += block_len
+
+		# NOTE: Looking for any more section headers is done in C, so it's much cheaper than walking the blocks
+		shb    = _SECTION_HEADER.to_bytes(4, 'little')
+		mapped = view.obj
+		assert isinstance(mapped, mmap.mmap)
+		found = mapped.find(shb, 4)
+		while found != -1:
+			if found + 12 <= len(view) and unpack_from('<I', view, found + 8)[0] in (
+				_BYTE_ORDER_MAGIC, _BYTE_ORDER_SWAPPED
+			):
+				return None
+			found = mapped.find(shb, found + 1)
+		return headers
+
+	def frames(
+		self, capture: str | Path | BinaryIO, *, index: SCSIIndex | str | Path | bool | None = None
+	) -> Iterator[QueryFrame]:
+		'''
+		Find all of the frames in a capture that match the query.
+
+		Parameters
+		----------
+		capture : str | Path | BinaryIO
+			The capture to search.
+
+		index : SCSIIndex | str | Path | bool | None
+			The index to use to find the candidate frames. None uses the index next to the capture if there is
+			one and it is up to date, True builds it if not, and False never uses an index. The index is only
+			used for uncompressed captures with a single little endian section.
+
+		Returns
+		-------
+		Iterator[QueryFrame]
+			The matching frames, in the order they are in the capture.
+
+		Raises
+		------
+		ValueError
+			If the capture is malformed, or the index doesn't match it.
+		'''
+
+		sidecar = self._index(capture, index)
+		if sidecar is not None and isinstance(capture, (str, Path)):
+			try:
+				with self._map(capture) as view:
+					if self._headers(view) is not None:
+						yield from self._indexed(sidecar, view)
+						return
+			finally:
+				if sidecar is not index:
+					sidecar.close()
+
+		for (frame, _) in self._streamed(capture, blocks = False):
+			yield frame # type: ignore[misc]
+
+	def write(
+		self, capture: str | Path | BinaryIO, output: str | Path, *,
+		index: SCSIIndex | str | Path | bool | None = None
+	) -> int:
+		'''
+		Write all of the frames in a capture that match the query out to a new capture.
+
+		The section headers and interface descriptions are copied over as they are, so the frames keep their
+		interfaces, followed by the Enhanced Packet Blocks of the matching frames.
+
+		Parameters
+		----------
+		capture : str | Path | BinaryIO
+			The capture to search.
+
+		output : str | Path
+			The capture to write the matches to.
+
+		index : SCSIIndex | str | Path | bool | None
+			The index to use, the same as :py:meth:`frames`.
+
+		Returns
+		-------
+		int
+			The number of frames that were written.
+
+		Raises
+		------
+		ValueError
+			If the capture is malformed, or the index doesn't match it.
+		'''
+
+		with Path(output).open('wb') as out:
+			sidecar = self._index(capture, index)
+			if sidecar is not None and isinstance(capture, (str, Path)):
+				try:
+					with self._map(capture) as view:
+						count = self._write_indexed(sidecar, view, out)
+						if count is not None:
+							return count
+				finally:
+					if sidecar is not index:
+						sidecar.close()
+
+				# Start over, and do it the long way
+				out.seek(0)
+				out.truncate()
+
+			count = 0
+			for (frame, block) in self._streamed(capture, blocks = True):
+				out.write(block)
+				if frame is not None:
+					count += 1
+			return count
+
+	def _write_indexed(self, index: SCSIIndex, view: memoryview, out: BinaryIO) -> int | None:
+		''' Write out the matches using the index, or return None if it turns out we can't '''
+
+		headers = self._headers(view)
+		if headers is None:
+			return None
+
+		interfaces = sum(1 for block in headers if unpack_from('<I', block, 0)[0] == _INTERFACE_DESCRIPTION)
+		for block in headers:
+			out.write(block)
+
+		count = 0
+		for frame in self._indexed(index, view):
+			# NOTE: An interface that was described after the first packet would mean walking the capture
+			if frame.interface >= interfaces:
+				return None
+			(_, block_len) = unpack_from('<II', view, frame.offset)
+			out.write(view[frame.offset:frame.offset + block_len])
+			count += 1
+		return count
+
+	@staticmethod
+	@contextmanager
+	def _map(capture: str | Path) -> Iterator[memoryview]:
+		with Path(capture).open('rb') as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+			view = memoryview(mapped)
+			try:
+				yield view
+			finally:
+				view.release()
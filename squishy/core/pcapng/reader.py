@@ -0,0 +1,397 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`PCAPNGReader`, a streaming PCAPNG reader for captures that are far too large to
+parse all at once with the :py:data:`squishy.core.pcapng.pcapng` construct.
+
+Blocks are read one at a time into a single reusable buffer, so the memory use stays the same no matter how
+large the capture is, and it can read from a pipe just as well as from a file. Only the fixed fields of each
+block are decoded up front, the packet data is a :py:class:`memoryview` into the buffer, and the options are
+only decoded if they are asked for.
+
+.. code-block:: python
+
+	with PCAPNGReader('/tmp/bus.pcapng') as reader:
+		for block in reader:
+			if isinstance(block, EnhancedPacket):
+				print(block.interface.name, block.timestamp_ns, bytes(block.data[:4]))
+
+'''
+
+from collections.abc import Iterator
+from io              import BufferedReader
+from pathlib         import Path
+from struct          import Struct
+from typing          import BinaryIO, Final, Self
+
+from ._consts        import (
+	_ENHANCED_PACKET, _INTERFACE_DESCRIPTION, _OPT_END, _OPT_IF_NAME, _OPT_IF_TSOFFSET, _OPT_IF_TSRESOL, _SECTION_HEADER
+)
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+__all__ = (
+	'Block',
+	'EnhancedPacket',
+	'InterfaceDescription',
+	'PCAPNGReader',
+	'SectionHeader',
+)
+
+_BYTE_ORDER_MAGIC: Final   = 0x1A2B3C4D
+_BYTE_ORDER_SWAPPED: Final = 0x4D3C2B1A
+
+# The length at the end of every block
+_BLOCK_TRAILER: Final = 4
+# The byte order magic in the section header, which is always in the same place
+_BYTE_ORDER: Final = Struct('<I')
+
+_GZIP_MAGIC: Final = b'\x1f\x8b'
+_ZSTD_MAGIC: Final = b'\x28\xb5\x2f\xfd'
+
+class _ByteOrder:
+	''' All of the structs needed to read a section in a given byte order '''
+
+	__slots__ = ('header', 'trailer', 'shb', 'idb', 'epb', 'option', 'i64')
+
+	def __init__(self, order: str) -> None:
+		self.header  = Struct(f'{order}II')
+		self.trailer = Struct(f'{order}I')
+		self.shb     = Struct(f'{order}IHHq')
+		self.idb     = Struct(f'{order}HHI')
+		self.epb     = Struct(f'{order}IIIII')
+		self.option  = Struct(f'{order}HH')
+		self.i64     = Struct(f'{order}q')
+
+_LITTLE_ENDIAN: Final = _ByteOrder('<')
+_BIG_ENDIAN: Final    = _ByteOrder('>')
+
+def _parse_options(body: memoryview, offset: int, order: _ByteOrder) -> tuple[tuple[int, memoryview], ...]:
+	''' Get the code and value of all the options from ``offset`` in ``body``, stopping at the end option '''
+
+	options = []
+	while offset + 4 <= len(body):
+		(code, length) = order.option.unpack_from(body, offset)
+		if code == _OPT_END:
+			break
+		options.append((code, body[offset + 4:offset + 4 + length]))
+		offset += 4 + ((length + 3) & ~3)
+	return tuple(options)
+
+class Block:
+	'''
+	A PCAPNG block of a type that isn't decoded any further.
+
+	Warning
+	-------
+	The :py:attr:`body` is a view into the buffer of the :py:class:`PCAPNGReader`, so it is only valid until
+	the next block is read, it needs to be copied with :py:class:`bytes` if it is to be kept around.
+	'''
+
+	__slots__ = ('type', 'body', '_order', '_options')
+
+	# The offset of the options in the block body
+	_OPTIONS_AT = -1
+
+	def __init__(self, type: int, body: memoryview, order: _ByteOrder) -> None:
+		self.type = type
+		''' The type of the block, one of :py:class:`squishy.core.pcapng.BlockType` for the known ones '''
+		self.body = body
+		''' The body of the block, without the type and lengths '''
+		self._order   = order
+		self._options: tuple[tuple[int, memoryview], ...] | None = None
+
+	def _options_at(self) -> int:
+		return self._OPTIONS_AT
+
+	@property
+	def options(self) -> tuple[tuple[int, memoryview], ...]:
+		''' The code and raw value of each of the options on this block, if the block type has any '''
+		if self._options is None:
+			offset = self._options_at()
+			self._options = () if offset < 0 else _parse_options(self.body, offset, self._order)
+		return self._options
+
+	def to_bytes(self) -> bytes:
+		''' Get the whole of the block as it is in the capture, including its type and lengths '''
+		length = len(self.body) + 12
+		return b''.join((self._order.header.pack(self.type, length), self.body, self._order.trailer.pack(length)))
+
+	def __repr__(self) -> str:
+		return f'<{type(self).__name__} type={self.type:#010x} len={len(self.body) + 12}>'
+
+class SectionHeader(Block):
+	''' A PCAPNG Section Header Block, which starts a new section, and resets all of the interfaces '''
+
+	__slots__ = ('big_endian', 'major', 'minor', 'section_len')
+
+	_OPTIONS_AT = 16
+
+	def __init__(self, type: int, body: memoryview, order: _ByteOrder) -> None:
+		super().__init__(type, body, order)
+		(_, major, minor, section_len) = order.shb.unpack_from(body, 0)
+
+		self.big_endian = order is _BIG_ENDIAN
+		''' If the section is big endian '''
+		self.major = major
+		''' The major version of the format '''
+		self.minor = minor
+		''' The minor version of the format '''
+		self.section_len = section_len
+		''' The length of the section, or -1 if not known '''
+
+class InterfaceDescription(Block):
+	''' A PCAPNG Interface Description Block '''
+
+	__slots__ = ('id', 'link_type', 'snap_len', 'name', 'ts_resolution', 'ts_offset', 'ts_units')
+
+	_OPTIONS_AT = 8
+
+	def __init__(self, type: int, body: memoryview, order: _ByteOrder, id: int) -> None:
+		# NOTE: These need to outlive the reader buffer, but they're small and rare so just copy them
+		super().__init__(type, memoryview(bytes(body)), order)
+		(link_type, _, snap_len) = order.idb.unpack_from(body, 0)
+
+		self.id = id
+		''' The ID of the interface within the section '''
+		self.link_type = link_type
+		''' The link type of the packets, one of :py:class:`squishy.core.pcapng.LinkType` for the known ones '''
+		self.snap_len = snap_len
+		''' The maximum length of the captured packet data, or 0 for no limit '''
+		self.name: str | None = None
+		''' The name of the interface, if it has one '''
+		self.ts_resolution = 6
+		''' The ``if_tsresol`` of the packet timestamps '''
+		self.ts_offset = 0
+		''' The ``if_tsoffset`` of the packet timestamps in seconds '''
+
+		for (code, value) in self.options:
+			if code == _OPT_IF_NAME:
+				self.name = bytes(value).rstrip(b'\x00').decode('utf-8', errors = 'replace')
+			elif code == _OPT_IF_TSRESOL and len(value) >= 1:
+				self.ts_resolution = value[0]
+			elif code == _OPT_IF_TSOFFSET and len(value) >= 8:
+				(self.ts_offset, ) = order.i64.unpack_from(value, 0)
+
+		resolution = self.ts_resolution
+		self.ts_units = 2 ** (resolution & 0x7F) if resolution & 0x80 else 10 ** resolution
+		''' How many timestamp units there are in a second '''
+
+class EnhancedPacket(Block):
+	'''
+	A PCAPNG Enhanced Packet Block.
+
+	Warning
+	-------
+	Like :py:attr:`Block.body`, the :py:attr:`data` is a view into the buffer of the :py:class:`PCAPNGReader`,
+	so it is only valid until the next block is read.
+	'''
+
+	__slots__ = ('interface', 'interface_id', 'timestamp', 'captured_len', 'original_len', 'data')
+
+	def __init__(
+		self, type: int, body: memoryview, order: _ByteOrder, interface: InterfaceDescription | None,
+		interface_id: int, timestamp: int, captured_len: int, original_len: int
+	) -> None:
+		super().__init__(type, body, order)
+
+		self.interface = interface
+		''' The description of the interface this packet is from, or None if it was never described '''
+		self.interface_id = interface_id
+		''' The ID of the interface this packet is from '''
+		self.timestamp = timestamp
+		''' The raw timestamp, in the units of the interface ``if_tsresol`` '''
+		self.captured_len = captured_len
+		''' The length of the captured packet data '''
+		self.original_len = original_len
+		''' The length of the packet on the wire '''
+		self.data = body[20:20 + captured_len]
+		''' The captured packet data '''
+
+	def _options_at(self) -> int:
+		return 20 + ((self.captured_len + 3) & ~3)
+
+	@property
+	def timestamp_ns(self) -> int:
+		''' The timestamp of the packet in nanoseconds since the epoch '''
+		if self.interface is None:
+			return self.timestamp * 1000
+		return (
+			(self.timestamp * 1_000_000_000) // self.interface.ts_units + self.interface.ts_offset * 1_000_000_000
+		)
+
+def _is_uncompressed(path: Path) -> bool:
+	''' Check if a capture starts with a section header, rather than the magic of some compression format '''
+	with path.open('rb') as file:
+		return file.read(4) == _SECTION_HEADER.to_bytes(4, 'little')
+
+def _open(path: Path) -> BinaryIO:
+	''' Open a capture, decompressing it on the fly if it is compressed '''
+
+	file = path.open('rb')
+	magic = file.peek(4)[:4] if isinstance(file, BufferedReader) else b''
+
+	if magic[:2] == _GZIP_MAGIC:
+		import gzip
+		file.close()
+		return gzip.open(path, 'rb') # type: ignore[return-value]
+	elif magic == _ZSTD_MAGIC:
+		if zstandard is None:
+			file.close()
+			raise ValueError(f'{path} is zstd compressed, which needs the zstandard module from the \'zstd\' extra')
+		return zstandard.ZstdDecompressor().stream_reader(file, closefd = True)
+	return file
+
+class PCAPNGReader:
+	'''
+	Read a PCAPNG capture one block at a time.
+
+	Iterating the reader yields a :py:class:`SectionHeader`, :py:class:`InterfaceDescription`, or
+	:py:class:`EnhancedPacket` for those block types, and a plain :py:class:`Block` for everything else.
+
+	Warning
+	-------
+	To keep from copying, the packet data and block bodies are views into a buffer that is reused for the next
+	block, so anything that needs to be kept has to be copied out first. The interface descriptions are the
+	exception, as they are copied when read.
+
+	Parameters
+	----------
+	file : str | Path | BinaryIO
+		The capture to read, a path to a file, which may be gzip or zstd compressed, or an already open
+		file or pipe, which is not closed with the reader.
+
+	buffer_size : int
+		The size of the read buffer, it only ever grows if a single block is larger than this. (default: 1MiB)
+
+	Raises
+	------
+	ValueError
+		When iterating, if the capture is malformed or ends part way through a block.
+
+	'''
+
+	def __init__(self, file: str | Path | BinaryIO, *, buffer_size: int = 1024 * 1024) -> None:
+		if isinstance(file, (str, Path)):
+			self._file = _open(Path(file))
+			self._owned = True
+		else:
+			self._file = file
+			self._owned = False
+
+		self._readinto = getattr(self._file, 'readinto', None)
+
+		self._buffer = bytearray(max(buffer_size, 4096))
+		self._view   = memoryview(self._buffer)
+		self._start  = 0
+		self._end    = 0
+		self._eof    = False
+
+		self._order = _LITTLE_ENDIAN
+		self._interfaces: list[InterfaceDescription] = []
+		self.offset = 0
+		''' The offset in the capture of the next block to be read '''
+
+	@property
+	def interfaces(self) -> tuple[InterfaceDescription, ...]:
+		''' The interfaces described so far in the current section '''
+		return tuple(self._interfaces)
+
+	def _read(self, into: memoryview) -> int:
+		if self._readinto is not None:
+			return self._readinto(into) or 0
+		data = self._file.read(len(into))
+		into[:len(data)] = data
+		return len(data)
+
+	def _fill(self, length: int) -> bool:
+		''' Make sure there are at least ``length`` bytes buffered, returns False if the capture ended first '''
+
+		if self._end - self._start >= length:
+			return True
+
+		if length > len(self._buffer):
+			# NOTE: Blocks from before might still have views on the old buffer, so we can't resize it
+			buffer = bytearray(max(length, len(self._buffer) * 2))
+			buffer[:self._end - self._start] = self._view[self._start:self._end]
+			self._buffer = buffer
+			self._view   = memoryview(buffer)
+		elif self._start > 0:
+			self._view[:self._end - self._start] = self._view[self._start:self._end]
+		self._end  -= self._start
+		self._start = 0
+
+		while self._end < length and not self._eof:
+			count = self._read(self._view[self._end:])
+			if count == 0:
+				self._eof = True
+			self._end += count
+
+		return self._end >= length
+
+	def __iter__(self) -> Iterator[Block]:
+		order = self._order
+
+		while True:
+			if not self._fill(12):
+				if self._end != self._start:
+					raise ValueError(f'Capture ends part way through a block header at offset {self.offset}')
+				return
+			view  = self._view
+			start = self._start
+
+			(block_type, block_len) = order.header.unpack_from(view, start)
+			if block_type == _SECTION_HEADER:
+				# The byte order magic is always right after the length, so look at that before trusting it
+				(magic, ) = _BYTE_ORDER.unpack_from(view, start + 8)
+				if magic == _BYTE_ORDER_MAGIC:
+					order = _LITTLE_ENDIAN
+				elif magic == _BYTE_ORDER_SWAPPED:
+					order = _BIG_ENDIAN
+				else:
+					raise ValueError(f'Bad section header byte order magic {magic:#010x} at offset {self.offset}')
+				self._order = order
+				(_, block_len) = order.header.unpack_from(view, start)
+
+			if block_len < 12 or block_len & 3 != 0:
+				raise ValueError(f'Bad block length {block_len} at offset {self.offset}')
+
+			if not self._fill(block_len):
+				raise ValueError(f'Capture ends part way through a block at offset {self.offset}')
+			view  = self._view
+			start = self._start
+			body  = view[start + 8:start + block_len - _BLOCK_TRAILER]
+
+			self._start += block_len
+			self.offset += block_len
+
+			if block_type == _ENHANCED_PACKET:
+				(interface_id, ts_high, ts_low, captured_len, original_len) = order.epb.unpack_from(body, 0)
+				interfaces = self._interfaces
+				yield EnhancedPacket(
+					block_type, body, order, interfaces[interface_id] if interface_id < len(interfaces) else None,
+					interface_id, (ts_high << 32) | ts_low, captured_len, original_len
+				)
+			elif block_type == _INTERFACE_DESCRIPTION:
+				interface = InterfaceDescription(block_type, body, order, len(self._interfaces))
+				self._interfaces.append(interface)
+				yield interface
+			elif block_type == _SECTION_HEADER:
+				self._interfaces = []
+				yield SectionHeader(block_type, body, order)
+			else:
+				yield Block(block_type, body, order)
+
+	def close(self) -> None:
+		''' Close the capture if it was opened by the reader '''
+		if self._owned:
+			self._file.close()
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
@@ -0,0 +1,357 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`FlightRecorder`, which keeps the most recent part of a capture in memory, and
+only writes it out to disk when something interesting happens.
+
+The packet blocks are kept in a fixed size, preallocated ring buffer, with the oldest being overwritten as new
+ones come in. When the trigger fires, either from the predicate matching a packet, or by calling
+:py:meth:`FlightRecorder.trigger`, such as from a signal handler, everything in the ring is written out to a new
+capture file, followed by anything that comes in over the post-trigger window.
+
+.. code-block:: python
+
+	recorder = FlightRecorder(
+		'/tmp/reset.pcapng', predicate = frame_trigger(SCSIFrameType.BUS_CONDITION), post_trigger = 2.0
+	)
+	recorder.trigger_on(signal.SIGUSR1)
+
+	with PCAPNGStream(recorder) as stream:
+		...
+
+'''
+
+import signal
+from collections     import deque
+from collections.abc import Callable
+from io              import RawIOBase
+from pathlib         import Path
+from struct          import unpack_from
+from time            import monotonic, strftime
+from typing          import BinaryIO, Final
+
+from ._consts        import _ENHANCED_PACKET, _SECTION_HEADER
+from .linktype       import SCSIFrameType
+
+__all__ = (
+	'FlightRecorder',
+	'frame_trigger',
+)
+
+# The offsets of the interface ID, captured length, and data in an Enhanced Packet Block
+_EPB_INTERFACE: Final = 8
+_EPB_CAPTURED: Final  = 20
+_EPB_DATA: Final      = 28
+
+# The offsets of the frame type, data length, and data in a Parallel SCSI Frame
+_PSF_TYPE: Final     = 4
+_PSF_DATA_LEN: Final = 24
+_PSF_DATA: Final     = 28
+
+TriggerPredicate = Callable[[int, memoryview], bool]
+''' Called with the interface ID and data of each packet, returning True to fire the trigger '''
+
+def frame_trigger(
+	*types: SCSIFrameType, data: Callable[[memoryview], bool] | None = None
+) -> TriggerPredicate:
+	'''
+	Make a predicate that fires on ``LINKTYPE_PARALLEL_SCSI`` frames of the given types.
+
+	.. code-block:: python
+
+		# Fire on a bus reset, or a CHECK CONDITION status
+		frame_trigger(SCSIFrameType.BUS_CONDITION)
+		frame_trigger(SCSIFrameType.MESSAGE, data = lambda status: status[0] == 0x02)
+
+	Parameters
+	----------
+	types : SCSIFrameType
+		The frame types to fire on.
+
+	data : Callable[[memoryview], bool] | None
+		Called with the data of any frames of the right type, returning True to fire, or None to fire on
+		any frame of the right type.
+
+	Returns
+	-------
+	TriggerPredicate
+		The predicate for :py:class:`FlightRecorder`.
+	'''
+
+	frame_types = frozenset(int(frame_type) for frame_type in types)
+
+	def _predicate(_: int, frame: memoryview) -> bool:
+		if len(frame) < _PSF_DATA or frame[_PSF_TYPE] not in frame_types:
+			return False
+		if data is None:
+			return True
+		(data_len, ) = unpack_from('<I', frame, _PSF_DATA_LEN)
+		return data(frame[_PSF_DATA:_PSF_DATA + data_len])
+
+	return _predicate
+
+def _open_dump(path: Path) -> BinaryIO:
+	return path.open('wb')
+
+class FlightRecorder(RawIOBase):
+	'''
+	An in-memory capture ring that is only written out to disk when triggered.
+
+	This is meant to be given to :py:class:`squishy.core.pcapng.PCAPNGStream` in place of a file, the section
+	header and interface descriptions are kept to one side, and the packets go into the ring.
+
+	Each dump is written to a new file named after ``path``, with a sequence number and the time of the trigger,
+	so ``reset.pcapng`` becomes ``reset_00001_20240506070809.pcapng`` and so on. Firing the trigger again while
+	a dump is in progress extends the post-trigger window.
+
+	Parameters
+	----------
+	path : str | Path
+		The path to base the dump file names on.
+
+	capacity : int
+		The size of the ring buffer in bytes. (default: 64MiB)
+
+	predicate : TriggerPredicate | None
+		Called on every packet to see if the trigger should fire, or None to only trigger manually.
+
+	pre_trigger : float | None
+		Only dump packets that came in at most this many seconds before the trigger, or None for everything
+		still in the ring.
+
+	post_trigger : float | None
+		How many seconds after the trigger to keep dumping packets for, or None for no time limit. (default: 1.0)
+
+	post_packets : int | None
+		How many packets after the trigger to keep dumping for, or None for no limit.
+
+	opener : Callable[[Path], BinaryIO] | None
+		Used to open each dump file, or None to just open them normally.
+
+	'''
+
+	def __init__(
+		self, path: str | Path, *, capacity: int = 64 * 1024 * 1024, predicate: TriggerPredicate | None = None,
+		pre_trigger: float | None = None, post_trigger: float | None = 1.0, post_packets: int | None = None,
+		opener: Callable[[Path], BinaryIO] | None = None
+	) -> None:
+		super().__init__()
+
+		if capacity < 1:
+			raise ValueError(f'The ring capacity must be at least 1 byte, not {capacity}')
+
+		path = Path(path)
+		(stem, _, ext) = path.name.partition('.')
+
+		self._dir    = path.parent
+		self._stem   = stem
+		self._ext    = f'.{ext}' if ext != '' else ''
+		self._opener = opener if opener is not None else _open_dump
+
+		self._predicate    = predicate
+		self._pre_trigger  = pre_trigger
+		self._post_trigger = post_trigger
+		self._post_packets = post_packets
+
+		self._ring = bytearray(capacity)
+		self._view = memoryview(self._ring)
+		self._tail = 0
+		# The start, length, and arrival time of each block in the ring, oldest first
+		self._blocks: deque[tuple[int, int, float]] = deque()
+		self._headers: list[bytes] = []
+
+		self._triggered = False
+		self._dump: BinaryIO | None = None
+		self._dump_until   = 0.0
+		self._dump_packets = 0
+		self._sequence     = 0
+
+		self.dumps: list[Path] = []
+		''' The files that have been dumped '''
+		self.oversized = 0
+		''' The number of packets too large to fit in the ring '''
+
+	@property
+	def dumping(self) -> bool:
+		''' If a dump is currently in progress '''
+		return self._dump is not None
+
+	def writable(self) -> bool:
+		return True
+
+	def trigger(self) -> None:
+		'''
+		Fire the trigger.
+
+		This only sets a flag, so is safe to call from a signal handler or another thread, the dump is started
+		on the next write or :py:meth:`flush`.
+		'''
+		self._triggered = True
+
+	def trigger_on(self, signum: int) -> None:
+		'''
+		Fire the trigger when the process gets the given signal.
+
+		Parameters
+		----------
+		signum : int
+			The signal to fire on, such as :py:data:`signal.SIGUSR1`.
+		'''
+		signal.signal(signum, lambda *_: self.trigger())
+
+	def _store(self, block: memoryview, now: float) -> bool:
+		''' Put a block into the ring, evicting the oldest blocks to make space, returns False if it didn't fit '''
+
+		length = len(block)
+		if length > len(self._ring):
+			self.oversized += 1
+			return False
+
+		start = self._tail
+		if start + length > len(self._ring):
+			# Anything past the tail is left over from the last time around, and older than everything else
+			while len(self._blocks) > 0 and self._blocks[0][0] >= start:
+				self._blocks.popleft()
+			start = 0
+
+		# NOTE: The ring is filled in order, so the only blocks that can be in the way are the oldest ones
+		end = start + length
+		while len(self._blocks) > 0:
+			(old_start, old_len, _) = self._blocks[0]
+			if old_start >= end or old_start + old_len <= start:
+				break
+			self._blocks.popleft()
+
+		self._view[start:end] = block
+		self._blocks.append((start, length, now))
+		self._tail = end
+		return True
+
+	def _start_dump(self, now: float) -> None:
+		''' Write out the headers and everything in the ring to a new dump file '''
+
+		self._sequence += 1
+		path = self._dir / f'{self._stem}_{self._sequence:05}_{strftime("%Y%m%d%H%M%S")}{self._ext}'
+
+		self._dump = self._opener(path)
+		self.dumps.append(path)
+
+		for header in self._headers:
+			self._dump.write(header)
+
+		cutoff = None if self._pre_trigger is None else now - self._pre_trigger
+		for (start, length, arrival) in self._blocks:
+			if cutoff is None or arrival >= cutoff:
+				self._dump.write(self._view[start:start + length])
+
+	def _finish_dump(self) -> None:
+		if self._dump is not None:
+			self._dump.close()
+			self._dump = None
+
+	def _fire(self, now: float) -> None:
+		''' Start a dump, or extend the one in progress '''
+
+		self._triggered = False
+		if self._dump is None:
+			self._start_dump(now)
+		self._dump_until   = float('inf') if self._post_trigger is None else now + self._post_trigger
+		self._dump_packets = 0
+
+	def _check_dump(self, now: float) -> None:
+		''' Close out the dump if we're past the end of the post-trigger window '''
+		if self._dump is None:
+			return
+		if now >= self._dump_until or (self._post_packets is not None and self._dump_packets >= self._post_packets):
+			self._finish_dump()
+
+	def _packet(self, block: memoryview, now: float) -> None:
+		''' Put a single block into the ring and any dump in progress, and check if it fires the trigger '''
+
+		self._check_dump(now)
+		if self._dump is not None:
+			self._dump.write(block)
+			self._dump_packets += 1
+
+		stored = self._store(block, now)
+
+		(block_type, ) = unpack_from('<I', block, 0)
+		if self._predicate is not None and block_type == _ENHANCED_PACKET:
+			(interface, ) = unpack_from('<I', block, _EPB_INTERFACE)
+			(captured, )  = unpack_from('<I', block, _EPB_CAPTURED)
+			if self._predicate(interface, block[_EPB_DATA:_EPB_DATA + captured]):
+				self._triggered = True
+
+		if self._triggered:
+			dumping = self._dump is not None
+			self._fire(now)
+			# NOTE: A new dump picks this block up from the ring, unless it was too big to go in it
+			if not dumping and not stored and self._dump is not None:
+				self._dump.write(block)
+
+	def write_header(self, block: bytes | bytearray | memoryview) -> int:
+		'''
+		Write a block that needs to be at the start of every dump.
+
+		These are the section header and interface description blocks, a new section header clears out any
+		of the previous ones.
+		'''
+
+		if self.closed:
+			raise ValueError('write to closed file')
+
+		block = bytes(block)
+		if len(block) >= 4 and unpack_from('<I', block)[0] == _SECTION_HEADER:
+			self._headers.clear()
+		self._headers.append(block)
+
+		if self._dump is not None:
+			self._dump.write(block)
+		return len(block)
+
+	def write(self, data: bytes | bytearray | memoryview) -> int:
+		if self.closed:
+			raise ValueError('write to closed file')
+
+		view   = memoryview(data).cast('B')
+		now    = monotonic()
+		offset = 0
+
+		if self._triggered:
+			self._fire(now)
+
+		while offset + 12 <= len(view):
+			(length, ) = unpack_from('<I', view, offset + 4)
+			if length < 12 or offset + length > len(view):
+				break
+			self._packet(view[offset:offset + length], now)
+			offset += length
+
+		return len(view)
+
+	def flush(self) -> None:
+		''' Start any dump that was triggered, and finish any that are past their post-trigger window '''
+
+		if self.closed:
+			return
+
+		now = monotonic()
+		if self._triggered:
+			self._fire(now)
+		self._check_dump(now)
+		if self._dump is not None:
+			self._dump.flush()
+
+	def close(self) -> None:
+		''' Finish off any dump in progress, including one that was triggered and not yet started '''
+
+		if self.closed:
+			return
+
+		try:
+			if self._triggered:
+				self._fire(monotonic())
+			self._finish_dump()
+		finally:
+			self._view.release()
+			super().close()
@@ -0,0 +1,232 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`RotatingFile`, which splits a capture up over a ring buffer of files, much like
+the ``-b filesize:/duration:/files:`` options of ``dumpcap``.
+
+Each file is a complete capture on its own, as the section header and all of the interface descriptions are
+repeated at the start of each one, so it can be opened in Wireshark without needing the rest of the set. Once
+the limit on the number of files is hit, the oldest ones are removed, so a continuous capture can be left
+running unattended with a bounded amount of disk space.
+
+.. code-block:: python
+
+	with PCAPNGStream(RotatingFile('/tmp/bus.pcapng', size = 64 * 1024 * 1024, files = 16)) as stream:
+		...
+
+'''
+
+from collections     import deque
+from collections.abc import Callable
+from io              import RawIOBase
+from pathlib         import Path
+from struct          import unpack_from
+from time            import monotonic, strftime
+from typing          import BinaryIO
+
+from ._consts        import _SECTION_HEADER
+
+__all__ = (
+	'RotatingFile',
+)
+
+def _open_segment(path: Path) -> BinaryIO:
+	return path.open('wb')
+
+class RotatingFile(RawIOBase):
+	'''
+	A capture file that rolls over to a new file when it gets too big or too old.
+
+	The files are named after ``path``, with the sequence number and the time the file was started added
+	to the name, so ``bus.pcapng`` becomes ``bus_00001_20240506070809.pcapng`` and so on.
+
+	:py:class:`squishy.core.pcapng.PCAPNGStream` only ever writes whole blocks, so the file is only ever rolled
+	over on a block boundary, even when a write is a whole batch of blocks from the background writer. A file
+	only goes over the size limit if a single block doesn't fit in what's left of it.
+
+	Parameters
+	----------
+	path : str | Path
+		The path to base the file names on.
+
+	size : int | None
+		Roll over to a new file once the current one is at least this many bytes, or None for no limit.
+
+	duration : float | None
+		Roll over to a new file once the current one has been open for this many seconds, or None for no limit.
+
+	files : int | None
+		The maximum number of files to keep, the oldest ones are removed, or None to keep all of them.
+
+	opener : Callable[[Path], BinaryIO] | None
+		Used to open each new file, such as to use a :py:class:`squishy.core.pcapng.CaptureFile`, or None to
+		just open them normally.
+
+	'''
+
+	def __init__(
+		self, path: str | Path, *, size: int | None = None, duration: float | None = None,
+		files: int | None = None, opener: Callable[[Path], BinaryIO] | None = None
+	) -> None:
+		super().__init__()
+
+		if files is not None and files < 1:
+			raise ValueError(f'Must keep at least 1 file, not {files}')
+
+		path = Path(path)
+		(stem, _, ext) = path.name.partition('.')
+
+		self._dir    = path.parent
+		self._stem   = stem
+		self._ext    = f'.{ext}' if ext != '' else ''
+		self._size   = size
+		self._time   = duration
+		self._files  = files
+		self._opener = opener if opener is not None else _open_segment
+
+		self._headers: list[bytes] = []
+		self._segments: deque[Path] = deque()
+		self._sequence = 0
+
+		self._file: BinaryIO
+		self._written = 0
+		self._opened  = 0.0
+		# If anything other than the headers have been written to the current file
+		self._has_data = False
+
+		self._open_next()
+
+	@property
+	def path(self) -> Path:
+		''' The path of the file currently being written to '''
+		return self._segments[-1]
+
+	@property
+	def segments(self) -> tuple[Path, ...]:
+		''' All of the files that are being kept, oldest first '''
+		return tuple(self._segments)
+
+	def writable(self) -> bool:
+		return True
+
+	def tell(self) -> int:
+		''' Get the length of the current file '''
+		return self._written
+
+	def _open_next(self) -> None:
+		self._sequence += 1
+		path = self._dir / f'{self._stem}_{self._sequence:05}_{strftime("%Y%m%d%H%M%S")}{self._ext}'
+
+		self._file     = self._opener(path)
+		self._written  = 0
+		self._opened   = monotonic()
+		self._has_data = False
+		self._segments.append(path)
+
+		for block in self._headers:
+			self._written += self._file.write(block)
+
+		if self._files is not None:
+			while len(self._segments) > self._files:
+				self._segments.popleft().unlink(missing_ok = True)
+
+	def rotate(self) -> None:
+		''' Close the current file and start a new one '''
+		self._file.close()
+		self._open_next()
+
+	def _should_rotate(self, length: int) -> bool:
+		''' Check if the file needs to be rolled over before writing a block of ``length`` bytes '''
+		if not self._has_data:
+			return False
+		return (
+			(self._size is not None and self._written + length > self._size) or
+			(self._time is not None and monotonic() - self._opened >= self._time)
+		)
+
+	def write_header(self, block: bytes | bytearray | memoryview) -> int:
+		'''
+		Write a block that needs to be repeated at the start of every file.
+
+		These are the section header and interface description blocks, a new section header clears out any
+		of the previous ones.
+
+		Parameters
+		----------
+		block : bytes | bytearray | memoryview
+			The encoded block.
+
+		Returns
+		-------
+		int
+			The number of bytes written.
+		'''
+
+		if self.closed:
+			raise ValueError('write to closed file')
+
+		if self._should_rotate(len(block)):
+			self.rotate()
+
+		block = bytes(block)
+		if len(block) >= 4 and unpack_from('<I', block)[0] == _SECTION_HEADER:
+			self._headers.clear()
+		self._headers.append(block)
+
+		count = self._file.write(block)
+		self._written += count
+		return count
+
+	@staticmethod
+	def _block_len(data: memoryview, offset: int) -> int:
+		''' Get the length of the block at ``offset``, or everything left if it doesn't look like a block '''
+		if offset + 8 <= len(data):
+			(block_len, ) = unpack_from('<I', data, offset + 4)
+			if block_len >= 12 and offset + block_len <= len(data):
+				return block_len
+		return len(data) - offset
+
+	def _split(self, data: memoryview, offset: int) -> int:
+		''' Find the end of the blocks starting at ``offset`` that fit in the current file, always at least one '''
+
+		end = offset + self._block_len(data, offset)
+		if self._size is None:
+			return len(data)
+
+		room = self._size - self._written
+		while end < len(data):
+			block_len = self._block_len(data, end)
+			if end + block_len - offset > room:
+				break
+			end += block_len
+		return end
+
+	def write(self, data: bytes | bytearray | memoryview) -> int:
+		if self.closed:
+			raise ValueError('write to closed file')
+
+		view   = memoryview(data).cast('B')
+		offset = 0
+		while offset < len(view):
+			if self._should_rotate(self._block_len(view, offset)):
+				self.rotate()
+
+			end = self._split(view, offset)
+			self._file.write(view[offset:end])
+			self._written += end - offset
+			self._has_data = True
+			offset = end
+
+		return len(view)
+
+	def flush(self) -> None:
+		if not self.closed and not self._file.closed:
+			self._file.flush()
+
+	def close(self) -> None:
+		if self.closed:
+			return
+		try:
+			self._file.close()
+		finally:
+			super().close()
@@ -0,0 +1,636 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the SCSI sidecar index, a compact columnar file that sits next to a ``LINKTYPE_PARALLEL_SCSI``
+capture, with a row for every frame, so captures can be filtered by frame type, initiator and target, or command
+without having to decode every frame.
+
+The index can be built while capturing, by wrapping the capture file in an :py:class:`IndexedFile`, or from an
+existing capture with :py:func:`build_scsi_index`, and is then opened with :py:class:`SCSIIndex`.
+
+.. code-block:: python
+
+	with PCAPNGStream(IndexedFile(CaptureFile('/tmp/bus.pcapng'), '/tmp/bus.pcapng.scsidx')) as stream:
+		...
+
+	with SCSIIndex('/tmp/bus.pcapng.scsidx') as index:
+		# All of the READ(10) commands sent to target 3
+		rows = index.select(frame_type = SCSIFrameType.COMMAND, dest_id = 3, opcode = 0x28)
+
+The file is a short header, followed by any number of chunks of rows. Each chunk has its own header, with
+the number of rows in it, followed by each of the columns, padded out to 8 bytes, so the columns can be used
+in place once the file is mapped. As chunks are only ever appended, a capture that is cut short still leaves
+behind a usable index of everything up to the last chunk written.
+
+'''
+
+import mmap
+import re
+from array           import array
+from bisect          import bisect_left
+from collections.abc import Iterable, Iterator
+from io              import RawIOBase
+from pathlib         import Path
+from struct          import Struct, unpack_from
+from typing          import BinaryIO, Final, Literal, NamedTuple, Self
+
+from ._consts        import (
+	_ENHANCED_PACKET, _INTERFACE_DESCRIPTION, _LINKTYPE_PARALLEL_SCSI, _OPT_IF_TSOFFSET, _OPT_IF_TSRESOL,
+	_SECTION_HEADER,
+)
+from .linktype       import SCSIFrameType
+from .reader         import EnhancedPacket, PCAPNGReader
+from .rotate         import RotatingFile
+
+__all__ = (
+	'IndexedFile',
+	'SCSIIndex',
+	'SCSIIndexWriter',
+	'SCSIIndexRow',
+	'build_scsi_index',
+	'scsi_index_path',
+)
+
+
+_MAGIC: Final   = b'SQSCSIDX'
+_VERSION: Final = 1
+_FILE_HEADER: Final  = Struct('<8sHH4x')
+_CHUNK_MAGIC: Final  = b'CHNK'
+_CHUNK_HEADER: Final = Struct('<4sII4x')
+
+# The chunk flags
+_CHUNK_IN_ORDER: Final = 0x01
+
+# The name and array type code of each column, in the order they are in a chunk
+_COLUMNS: Final[tuple[tuple[str, Literal['B', 'I', 'Q', 'q']], ...]] = (
+	('offset',     'Q'),
+	('timestamp',  'q'),
+	('data_len',   'I'),
+	('frame_type', 'B'),
+	('orig_id',    'B'),
+	('dest_id',    'B'),
+	('opcode',     'B'),
+)
+
+# The Parallel SCSI Frame header, the type, initiator, and target IDs, and data length
+_PSF_HEADER: Final = Struct('<4xBBB17xI')
+
+def scsi_index_path(capture: str | Path) -> Path:
+	''' Get the path of the sidecar index for a capture '''
+	capture = Path(capture)
+	return capture.with_name(f'{capture.name}.scsidx')
+
+def _pad(length: int) -> int:
+	return (length + 7) & ~7
+
+class SCSIIndexRow(NamedTuple):
+	''' A single frame in a :py:class:`SCSIIndex` '''
+
+	offset: int
+	''' The offset of the Enhanced Packet Block of the frame in the capture '''
+	timestamp: int
+	''' The timestamp of the frame in nanoseconds since the epoch '''
+	frame_type: int
+	''' The :py:class:`SCSIFrameType` of the frame '''
+	orig_id: int
+	''' The ID of the device that sent the frame '''
+	dest_id: int
+	''' The ID of the device the frame was sent to '''
+	opcode: int
+	''' The first byte of the frame data, the CDB opcode for commands, only valid if ``data_len`` is not 0 '''
+	data_len: int
+	''' The length of the frame data '''
+
+class SCSIIndexWriter:
+	'''
+	Write a SCSI sidecar index.
+
+	Rows are collected in memory and written out a chunk at a time, rows can either be added directly, from
+	frames that have already been picked out of a capture, or by feeding it the raw blocks of a capture as they
+	are written.
+
+	Parameters
+	----------
+	path : str | Path
+		The path of the index, it is truncated if it already exists.
+
+	chunk_rows : int
+		How many rows to collect before writing them out as a chunk. (default: 65536)
+
+	'''
+
+	def __init__(self, path: str | Path, *, chunk_rows: int = 65536) -> None:
+		if chunk_rows < 1:
+			raise ValueError(f'A chunk needs at least 1 row, not {chunk_rows}')
+
+		self._file = Path(path).open('wb')
+		self._file.write(_FILE_HEADER.pack(_MAGIC, _VERSION, len(_COLUMNS)))
+		self._chunk_rows = chunk_rows
+		self._columns = tuple(array(code) for (_, code) in _COLUMNS)
+		self._last_ts  = -(1 << 63)
+		self._in_order = True
+
+		self.rows = 0
+		''' The number of rows written so far '''
+
+		# The state needed to pick frames out of raw blocks with `feed`
+		self._offset = 0
+		# The `ts_units` and `ts_offset` of each interface in the section, or None if it's not a SCSI interface
+		self._interfaces: list[tuple[int, int] | None] = []
+
+	def append(
+		self, offset: int, timestamp: int, frame_type: int, orig_id: int, dest_id: int, opcode: int, data_len: int
+	) -> None:
+		''' Add a row to the index '''
+
+		(offsets, timestamps, data_lens, frame_types, orig_ids, dest_ids, opcodes) = self._columns
+		offsets.append(offset)
+		timestamps.append(timestamp)
+		data_lens.append(data_len)
+		frame_types.append(frame_type)
+		orig_ids.append(orig_id)
+		dest_ids.append(dest_id)
+		opcodes.append(opcode)
+
+		if timestamp < self._last_ts:
+			self._in_order = False
+		self._last_ts = timestamp
+		self.rows += 1
+
+		if len(offsets) >= self._chunk_rows:
+			self._write_chunk()
+
+	def add_frame(self, offset: int, timestamp: int, frame: bytes | bytearray | memoryview) -> None:
+		'''
+		Add a row for a Parallel SCSI Frame.
+
+		Parameters
+		----------
+		offset : int
+			The offset of the Enhanced Packet Block holding the frame in the capture.
+
+		timestamp : int
+			The timestamp of the frame in nanoseconds since the epoch.
+
+		frame : bytes | bytearray | memoryview
+			The ``LINKTYPE_PARALLEL_SCSI`` frame, frames that are too short to be valid are skipped.
+		'''
+
+		if len(frame) < _PSF_HEADER.size:
+			return
+		(frame_type, orig_id, dest_id, data_len) = _PSF_HEADER.unpack_from(frame, 0)
+		opcode = frame[_PSF_HEADER.size] if data_len > 0 and len(frame) > _PSF_HEADER.size else 0
+		self.append(offset, timestamp, frame_type, orig_id, dest_id, opcode, data_len)
+
+	def feed(self, block: bytes | bytearray | memoryview) -> None:
+		'''
+		Add rows for any frames in the next block of a little endian capture.
+
+		Parameters
+		----------
+		block : bytes | bytearray | memoryview
+			The whole of the next block in the capture, this needs to be every block in order starting with
+			the section header, so the offsets and interfaces can be tracked.
+		'''
+
+		view = memoryview(block).cast('B')
+		(block_type, block_len) = unpack_from('<II', view, 0)
+
+		if block_type == _ENHANCED_PACKET:
+			(interface_id, ts_high, ts_low, captured_len) = unpack_from('<IIII', view, 8)
+			if interface_id < len(self._interfaces) and (interface := self._interfaces[interface_id]) is not None:
+				(units, ts_offset) = interface
+				ts = (((ts_high << 32) | ts_low) * 1_000_000_000) // units + ts_offset * 1_000_000_000
+				self.add_frame(self._offset, ts, view[28:28 + captured_len])
+		elif block_type == _INTERFACE_DESCRIPTION:
+			(link_type, ) = unpack_from('<H', view, 8)
+			units     = 10 ** 6
+			ts_offset = 0
+
+			# Pull out the timestamp resolution and offset from the options
+			offset = 16
+			while offset + 4 <= block_len - 4:
+				(code, length) = unpack_from('<HH', view, offset)
+				if code == 0:
+					break
+				if code == _OPT_IF_TSRESOL and length >= 1:
+					resolution = view[offset + 4]
+					units = 2 ** (resolution & 0x7F) if resolution & 0x80 else 10 ** resolution
+				elif code == _OPT_IF_TSOFFSET and length >= 8:
+					(ts_offset, ) = unpack_from('<q', view, offset + 4)
+				offset += 4 + ((length + 3) & ~3)
+
+			self._interfaces.append((units, ts_offset) if link_type == _LINKTYPE_PARALLEL_SCSI else None)
+		elif block_type == _SECTION_HEADER:
+			self._interfaces = []
+
+		self._offset += block_len
+
+	def _write_chunk(self) -> None:
+		rows = len(self._columns[0])
+		if rows == 0:
+			return
+
+		flags = _CHUNK_IN_ORDER if self._in_order else 0
+		chunk = bytearray(_CHUNK_HEADER.pack(_CHUNK_MAGIC, rows, flags))
+		for column in self._columns:
+			data   = column.tobytes()
+			chunk += data
+			chunk += bytes(_pad(len(data)) - len(data))
+		# The whole chunk goes out in one write, so it's either all there or gets dropped as cut short
+		self._file.write(chunk)
+
+		self._columns  = tuple(array(code) for (_, code) in _COLUMNS)
+		self._in_order = True
+		# NOTE: The next chunk only needs to be in order on its own, so start over from the last timestamp
+		self._last_ts  = -(1 << 63)
+
+	def flush(self, *, min_rows: int = 1) -> None:
+		'''
+		Write out the rows collected so far as a chunk.
+
+		Parameters
+		----------
+		min_rows : int
+			The fewest rows worth writing out as a chunk, with fewer than this they are held on to until there
+			are more. (default: 1)
+		'''
+
+		if len(self._columns[0]) >= min_rows:
+			self._write_chunk()
+		self._file.flush()
+
+	def close(self) -> None:
+		''' Write out any rows collected so far and close the index '''
+		if self._file.closed:
+			return
+		try:
+			self._write_chunk()
+		finally:
+			self._file.close()
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
+
+class IndexedFile(RawIOBase):
+	'''
+	A capture file that builds a SCSI sidecar index of everything written to it.
+
+	This is given to :py:class:`squishy.core.pcapng.PCAPNGStream` in place of the file, and passes everything
+	through to the real file, such as a :py:class:`squishy.core.pcapng.CaptureFile`, while feeding the blocks to
+	a :py:class:`SCSIIndexWriter`.
+
+	The index records the offset of each frame from the start of the file, so this can't be used with a
+	:py:class:`squishy.core.pcapng.RotatingFile`, as the offsets stop meaning anything once it moves on to the
+	next file.
+
+	Parameters
+	----------
+	file : str | Path | BinaryIO
+		The capture file, or the path to open it at.
+
+	index : str | Path | None
+		The path of the index, or None to put it next to ``file``, which then needs to be a path.
+
+	chunk_rows : int
+		How many rows of the index to collect before writing them out. (default: 65536)
+
+	flush_rows : int
+		The fewest rows of the index worth writing out as a chunk when the capture is flushed, so flushing after
+		every few packets doesn't leave the index in lots of tiny chunks. (default: 4096)
+
+	'''
+
+	def __init__(
+		self, file: str | Path | BinaryIO, index: str | Path | None = None, *, chunk_rows: int = 65536,
+		flush_rows: int = 4096
+	) -> None:
+		super().__init__()
+
+		if isinstance(file, RotatingFile):
+			raise ValueError('A RotatingFile can not be indexed, the offsets are only good until it rotates')
+
+		if index is None:
+			if not isinstance(file, (str, Path)):
+				raise ValueError('The index path is needed when not given a path for the capture')
+			index = scsi_index_path(file)
+
+		self._file: BinaryIO = Path(file).open('wb') if isinstance(file, (str, Path)) else file
+		self._index = SCSIIndexWriter(index, chunk_rows = chunk_rows)
+		self._flush_rows = flush_rows
+
+	@property
+	def index(self) -> SCSIIndexWriter:
+		''' The index being written '''
+		return self._index
+
+	def writable(self) -> bool:
+		return True
+
+	def _feed(self, data: memoryview) -> None:
+		offset = 0
+		while offset + 8 <= len(data):
+			(block_len, ) = unpack_from('<I', data, offset + 4)
+			if block_len < 12 or offset + block_len > len(data):
+				break
+			self._index.feed(data[offset:offset + block_len])
+			offset += block_len
+
+	def write_header(self, block: bytes | bytearray | memoryview) -> int:
+		''' Write a section header or interface description, passing it on to the file if it wants them '''
+		self._feed(memoryview(block).cast('B'))
+		return getattr(self._file, 'write_header', self._file.write)(block)
+
+	def write(self, data: bytes | bytearray | memoryview) -> int:
+		if self.closed:
+			raise ValueError('write to closed file')
+		view = memoryview(data).cast('B')
+		self._feed(view)
+		return self._file.write(view)
+
+	def flush(self) -> None:
+		if not self.closed and not self._file.closed:
+			self._file.flush()
+			self._index.flush(min_rows = self._flush_rows)
+
+	def close(self) -> None:
+		if self.closed:
+			return
+		try:
+			self._file.close()
+		finally:
+			self._index.close()
+			super().close()
+
+def build_scsi_index(capture: str | Path, index: str | Path | None = None, *, chunk_rows: int = 65536) -> Path:
+	'''
+	Build the SCSI sidecar index for an existing capture in a single pass.
+
+	Parameters
+	----------
+	capture : str | Path
+		The capture to index.
+
+	index : str | Path | None
+		The path to write the index to, or None to put it next to the capture.
+
+	chunk_rows : int
+		How many rows to put in each chunk of the index. (default: 65536)
+
+	Returns
+	-------
+	Path
+		The path of the index.
+	'''
+
+	index = Path(index) if index is not None else scsi_index_path(capture)
+
+	with PCAPNGReader(capture) as reader, SCSIIndexWriter(index, chunk_rows = chunk_rows) as writer:
+		offset = 0
+		for block in reader:
+			if (
+				isinstance(block, EnhancedPacket) and block.interface is not None and
+				block.interface.link_type == _LINKTYPE_PARALLEL_SCSI
+			):
+				writer.add_frame(offset, block.timestamp_ns, block.data)
+			offset = reader.offset
+
+	return index
+
+class _Chunk(NamedTuple):
+	base: int
+	rows: int
+	in_order: bool
+	columns: dict[str, memoryview]
+
+def _mask_table(values: int | Iterable[int]) -> bytes:
+	''' Make a translation table that maps the wanted values to 1 and everything else to 0 '''
+	wanted = { int(values) } if isinstance(values, int) else { int(value) for value in values }
+	return bytes(1 if value in wanted else 0 for value in range(256))
+
+class SCSIIndex:
+	'''
+	A memory mapped SCSI sidecar index.
+
+	The columns are used in place from the mapping, and the filtering in :py:meth:`select` is done a whole column
+	at a time, so only the matching rows ever make it out into Python.
+
+	Warning
+	-------
+	The columns handed out are views into the mapping, so the index can't be closed while they are still alive.
+
+	Parameters
+	----------
+	path : str | Path
+		The path of the index, or of the capture to open the index next to it.
+
+	Raises
+	------
+	ValueError
+		If the file is not a SCSI sidecar index.
+
+	'''
+
+	def __init__(self, path: str | Path) -> None:
+		path = Path(path)
+		if path.suffix != '.scsidx':
+			path = scsi_index_path(path)
+		self._path = path
+
+		with path.open('rb') as file:
+			# NOTE: mmap refuses to map an empty file, without saying which, so catch anything too short first
+			if path.stat().st_size < _FILE_HEADER.size:
+				raise ValueError(f'{path} is too short to be a SCSI index')
+			self._map  = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+		self._view = memoryview(self._map)
+		self._chunks: list[_Chunk] = []
+
+		try:
+			self._load()
+		except BaseException:
+			self.close()
+			raise
+
+	def _load(self) -> None:
+		view = self._view
+		if len(view) < _FILE_HEADER.size:
+			raise ValueError(f'{self._path} is too short to be a SCSI index')
+
+		(magic, version, columns) = _FILE_HEADER.unpack_from(view, 0)
+		if magic != _MAGIC:
+			raise ValueError(f'{self._path} is not a SCSI index')
+		if version != _VERSION or columns != len(_COLUMNS):
+			raise ValueError(f'{self._path} is an unsupported SCSI index version {version}')
+
+		offset = _FILE_HEADER.size
+		base   = 0
+		while offset + _CHUNK_HEADER.size <= len(view):
+			(magic, rows, flags) = _CHUNK_HEADER.unpack_from(view, offset)
+			if magic != _CHUNK_MAGIC:
+				raise ValueError(f'Bad chunk in {self._path} at offset {offset}')
+
+			start = offset + _CHUNK_HEADER.size
+			end   = start + sum(_pad(rows * array(code).itemsize) for (_, code) in _COLUMNS)
+			# A chunk that was cut short by the capture stopping part way through writing it is just dropped
+			if end > len(view):
+				break
+
+			chunk_columns = {}
+			for (name, code) in _COLUMNS:
+				length = rows * array(code).itemsize
+				chunk_columns[name] = view[start:start + length].cast(code)
+				start += _pad(length)
+
+			self._chunks.append(_Chunk(base, rows, bool(flags & _CHUNK_IN_ORDER), chunk_columns))
+			base  += rows
+			offset = end
+
+		self._rows  = base
+		self._bases = [ chunk.base for chunk in self._chunks ]
+
+	@property
+	def path(self) -> Path:
+		''' The path of the index '''
+		return self._path
+
+	def __len__(self) -> int:
+		return self._rows
+
+	def _chunk(self, row: int) -> tuple[_Chunk, int]:
+		if row < 0:
+			row += self._rows
+		if not 0 <= row < self._rows:
+			raise IndexError('SCSI index row out of range')
+		chunk = self._chunks[bisect_left(self._bases, row + 1) - 1]
+		return (chunk, row - chunk.base)
+
+	def __getitem__(self, row: int) -> SCSIIndexRow:
+		(chunk, idx) = self._chunk(row)
+		return SCSIIndexRow(*(chunk.columns[name][idx] for name in SCSIIndexRow._fields))
+
+	def __iter__(self) -> Iterator[SCSIIndexRow]:
+		for chunk in self._chunks:
+			yield from map(SCSIIndexRow._make, zip(*(chunk.columns[name] for name in SCSIIndexRow._fields)))
+
+	def column(self, name: str) -> Iterator[memoryview]:
+		'''
+		Get a column of the index.
+
+		Parameters
+		----------
+		name : str
+			The name of the column, one of the :py:class:`SCSIIndexRow` fields.
+
+		Returns
+		-------
+		Iterator[memoryview]
+			The column of each chunk in turn, as a typed view into the mapping.
+		'''
+
+		if name not in SCSIIndexRow._fields:
+			raise KeyError(f'No SCSI index column named {name!r}')
+		return (chunk.columns[name] for chunk in self._chunks)
+
+	def _time_span(self, chunk: _Chunk, start: int | None, end: int | None) -> tuple[int, int]:
+		''' Get the rows in a chunk within a span of time, assuming it is in order '''
+		timestamps = chunk.columns['timestamp']
+		lo = 0 if start is None else bisect_left(timestamps, start)
+		hi = chunk.rows if end is None else bisect_left(timestamps, end)
+		return (lo, max(lo, hi))
+
+	def select(
+		self, *, frame_type: int | Iterable[int] | None = None, orig_id: int | Iterable[int] | None = None,
+		dest_id: int | Iterable[int] | None = None, opcode: int | Iterable[int] | None = None,
+		start: int | None = None, end: int | None = None
+	) -> list[int]:
+		'''
+		Find all of the frames that match a filter.
+
+		Each of the filters can be given a single value, or a collection of values to match any of them, and
+		a frame has to match all of the filters that are given.
+
+		Parameters
+		----------
+		frame_type : int | Iterable[int] | None
+			The :py:class:`SCSIFrameType` of the frames.
+
+		orig_id : int | Iterable[int] | None
+			The ID of the device that sent the frames.
+
+		dest_id : int | Iterable[int] | None
+			The ID of the device the frames were sent to.
+
+		opcode : int | Iterable[int] | None
+			The first byte of the frame data, such as the CDB opcode, frames without any data never match.
+
+		start : int | None
+			Only frames at or after this time in nanoseconds since the epoch.
+
+		end : int | None
+			Only frames before this time in nanoseconds since the epoch.
+
+		Returns
+		-------
+		list[int]
+			The rows of the matching frames, in the order they are in the capture.
+		'''
+
+		filters = [
+			(name, _mask_table(values)) for (name, values) in (
+				('frame_type', frame_type), ('orig_id', orig_id), ('dest_id', dest_id), ('opcode', opcode)
+			) if values is not None
+		]
+
+		rows: list[int] = []
+		for chunk in self._chunks:
+			if chunk.in_order:
+				(lo, hi) = self._time_span(chunk, start, end)
+			else:
+				(lo, hi) = (0, chunk.rows)
+			if lo >= hi:
+				continue
+
+			matches: Iterable[int]
+			if len(filters) == 0:
+				matches = range(lo, hi)
+			else:
+				# Turn each column into a mask of 1s where it matches, and AND them all together
+				mask = -1
+				for (name, table) in filters:
+					mask &= int.from_bytes(chunk.columns[name][lo:hi].tobytes().translate(table), 'little')
+				matches = (lo + match.start() for match in re.finditer(b'\x01', mask.to_bytes(hi - lo, 'little')))
+
+			data_lens  = chunk.columns['data_len']
+			timestamps = chunk.columns['timestamp']
+			for row in matches:
+				if opcode is not None and data_lens[row] == 0:
+					continue
+				if not chunk.in_order and (
+					(start is not None and timestamps[row] < start) or (end is not None and timestamps[row] >= end)
+				):
+					continue
+				rows.append(chunk.base + row)
+
+		return rows
+
+	def count(self, frame_type: SCSIFrameType | int) -> int:
+		''' Count the number of frames of a given type '''
+		return sum(chunk.columns['frame_type'].tobytes().count(int(frame_type)) for chunk in self._chunks)
+
+	def close(self) -> None:
+		''' Unmap the index '''
+		for chunk in self._chunks:
+			for column in chunk.columns.values():
+				column.release()
+		self._chunks.clear()
+		self._view.release()
+		self._map.close()
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
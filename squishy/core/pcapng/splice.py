@@ -0,0 +1,402 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:func:`slice_capture` and :py:func:`merge_captures`, for cutting captures down and
+putting them back together without decoding and re-encoding every block along the way.
+
+Slicing only ever looks at the block headers, and the first few bytes of the SCSI frames if they are being
+picked by device ID, the blocks that are kept are copied over in contiguous runs by the kernel with
+:py:func:`os.copy_file_range`, or :py:func:`os.sendfile` where that's not available, so they never pass
+through Python at all.
+
+Merging streams all of the captures at once, taking the earliest packet of any of them each time, so the
+memory use only depends on the number of captures, not how large they are.
+
+.. code-block:: python
+
+	# Everything to or from device 3 in a one second window
+	slice_capture(
+		'/tmp/bus.pcapng', '/tmp/dev3.pcapng', start = 1832_000_000_000, end = 1833_000_000_000, devices = (3, )
+	)
+
+	# The traffic from two analyzers on the same bus, interleaved by time
+	merge_captures(('/tmp/bus-a.pcapng', '/tmp/bus-b.pcapng'), '/tmp/bus.pcapng')
+
+'''
+
+import errno
+import heapq
+import mmap
+import os
+from collections.abc import Generator, Iterable, Iterator, Sequence
+from itertools       import count
+from pathlib         import Path
+from struct          import Struct
+from typing          import BinaryIO, Final
+
+from ._consts        import (
+	_ENHANCED_PACKET, _INTERFACE_DESCRIPTION, _LINKTYPE_PARALLEL_SCSI, _OPT_SHB_USERAPPL, _SECTION_HEADER
+)
+from .reader         import (
+	_BIG_ENDIAN, _BYTE_ORDER, _BYTE_ORDER_MAGIC, _BYTE_ORDER_SWAPPED, _LITTLE_ENDIAN, _ByteOrder, _is_uncompressed,
+	EnhancedPacket, InterfaceDescription, PCAPNGReader, SectionHeader
+)
+
+__all__ = (
+	'merge_captures',
+	'slice_capture',
+)
+
+# The offset of the section length in a section header, and of the SCSI frame in an enhanced packet
+_SECTION_LEN: Final = 16
+_EPB_DATA: Final    = 28
+# How far into a SCSI frame the originating and destination IDs are
+_PSF_IDS: Final = 5
+
+_EPB_INTERFACE: Final = Struct('<I')
+
+# The most to copy in one go when the kernel can't do it for us
+_COPY_CHUNK: Final = 1024 * 1024
+
+def _copy_range(src: int, dst: int, offset: int, count: int) -> None:
+	'''
+	Copy ``count`` bytes from ``offset`` in ``src`` to the current position of ``dst``, in the kernel if it can
+	be done there.
+	'''
+
+	while count > 0:
+		copied = 0
+		try:
+			if hasattr(os, 'copy_file_range'):
+				copied = os.copy_file_range(src, dst, count, offset)
+			elif hasattr(os, 'sendfile'):
+				copied = os.sendfile(dst, src, offset, count)
+		except OSError as e:
+			# NOTE: Different filesystems, or a platform that can only sendfile to sockets
+			if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK):
+				raise
+
+		if copied == 0:
+			# NOTE: Windows has neither of the above nor pread, so it gets a plain seek and read
+			if hasattr(os, 'pread'):
+				chunk = os.pread(src, min(count, _COPY_CHUNK), offset)
+			else:
+				os.lseek(src, offset, os.SEEK_SET)
+				chunk = os.read(src, min(count, _COPY_CHUNK))
+			if len(chunk) == 0:
+				raise ValueError(f'Capture ends part way through a block at offset {offset}')
+			copied = os.write(dst, chunk)
+
+		offset += copied
+		count  -= copied
+
+def _check_output(captures: Iterable[str | Path | BinaryIO], output: str | Path) -> None:
+	''' Make sure we're not about to truncate one of the captures by writing over it '''
+	output = Path(output)
+	for capture in captures:
+		if isinstance(capture, (str, Path)) and output.exists() and Path(capture).exists() and output.samefile(capture):
+			raise ValueError(f'The output \'{output}\' is one of the captures being read')
+
+def _fresh_section(block: bytes | memoryview, order: _ByteOrder) -> bytes:
+	''' Get a copy of a section header with the section length cleared, as it won't be right any more '''
+	header = bytearray(block)
+	order.i64.pack_into(header, _SECTION_LEN, -1)
+	return bytes(header)
+
+def _wanted(
+	interface: InterfaceDescription, ts: int, frame: bytes | memoryview, start: int | None, end: int | None,
+	devices: frozenset[int] | None
+) -> bool:
+	''' Check if a packet is in the time window and to or from one of the devices '''
+
+	if (start is not None and ts < start) or (end is not None and ts >= end):
+		return False
+	if devices is None:
+		return True
+	if interface.link_type != _LINKTYPE_PARALLEL_SCSI or len(frame) < _PSF_IDS + 2:
+		return False
+	return frame[_PSF_IDS] in devices or frame[_PSF_IDS + 1] in devices
+
+class _Slicer:
+	''' Keeps track of what has been written out while slicing a capture '''
+
+	def __init__(self, out: int) -> None:
+		self.out = out
+		self.count = 0
+		self.sections = 0
+		# The headers of the current section that haven't been written yet, if nothing in it has been kept yet
+		self.pending: list[bytes] | None = None
+
+	def section(self, block: bytes) -> None:
+		# NOTE: The first section is always written, so even an empty slice is still a capture
+		if self.sections == 0:
+			os.write(self.out, block)
+			self.pending = None
+		else:
+			self.pending = [ block ]
+		self.sections += 1
+
+	def interface(self, block: bytes) -> bool:
+		''' Hold on to an interface description, returning False if it needs to be written out now instead '''
+		if self.pending is None:
+			return False
+		self.pending.append(block)
+		return True
+
+	def packet(self) -> None:
+		if self.pending is not None:
+			os.write(self.out, b''.join(self.pending))
+			self.pending = None
+		self.count += 1
+
+def _slice_mapped(
+	view: memoryview, src: int, out: int, start: int | None, end: int | None, devices: frozenset[int] | None
+) -> int:
+	''' Slice an uncompressed capture, walking the block headers in the mapping and copying runs of blocks '''
+
+	slicer = _Slicer(out)
+	length = len(view)
+	offset = 0
+	order  = _LITTLE_ENDIAN
+	header = order.header
+	epb    = order.epb
+	section: list[InterfaceDescription] = []
+	# The run of blocks from the capture that are to be copied over as-is
+	(run_start, run_end) = (0, 0)
+
+	def flush() -> None:
+		nonlocal run_start, run_end
+		if run_end > run_start:
+			_copy_range(src, out, run_start, run_end - run_start)
+		(run_start, run_end) = (0, 0)
+
+	def keep(offset: int, block_len: int) -> None:
+		nonlocal run_start, run_end
+		if offset != run_end:
+			flush()
+			run_start = offset
+		run_end = offset + block_len
+
+	while offset < length:
+		if offset + 12 > length:
+			raise ValueError(f'Capture ends part way through a block header at offset {offset}')
+
+		(block_type, block_len) = header.unpack_from(view, offset)
+		if block_type == _SECTION_HEADER:
+			(magic, ) = _BYTE_ORDER.unpack_from(view, offset + 8)
+			if magic == _BYTE_ORDER_MAGIC:
+				order = _LITTLE_ENDIAN
+			elif magic == _BYTE_ORDER_SWAPPED:
+				order = _BIG_ENDIAN
+			else:
+				raise ValueError(f'Bad section header byte order magic {magic:#010x} at offset {offset}')
+			header = order.header
+			epb    = order.epb
+			(_, block_len) = header.unpack_from(view, offset)
+			section = []
+
+		if block_len < 12 or block_len & 3 != 0:
+			raise ValueError(f'Bad block length {block_len} at offset {offset}')
+		if offset + block_len > length:
+			raise ValueError(f'Capture ends part way through a block at offset {offset}')
+
+		if block_type == _ENHANCED_PACKET:
+			(interface_id, ts_high, ts_low, captured, _) = epb.unpack_from(view, offset + 8)
+			if interface_id >= len(section):
+				raise ValueError(f'Packet at offset {offset} is from undescribed interface {interface_id}')
+			interface = section[interface_id]
+			ts = (
+				(((ts_high << 32) | ts_low) * 1_000_000_000) // interface.ts_units +
+				interface.ts_offset * 1_000_000_000
+			)
+			# NOTE: This is copied so there's no view into the mapping left behind if something goes wrong
+			frame = bytes(view[offset + _EPB_DATA:offset + _EPB_DATA + min(captured, _PSF_IDS + 2)])
+			if _wanted(interface, ts, frame, start, end, devices):
+				slicer.packet()
+				keep(offset, block_len)
+		elif block_type == _SECTION_HEADER:
+			flush()
+			slicer.section(_fresh_section(view[offset:offset + block_len], order))
+		elif block_type == _INTERFACE_DESCRIPTION:
+			section.append(InterfaceDescription(
+				block_type, view[offset + 8:offset + block_len - 4], order, len(section)
+			))
+			if not slicer.interface(bytes(view[offset:offset + block_len])):
+				keep(offset, block_len)
+
+		offset += block_len
+
+	flush()
+	return slicer.count
+
+def _slice_streamed(
+	capture: str | Path | BinaryIO, out: int, start: int | None, end: int | None, devices: frozenset[int] | None
+) -> int:
+	''' Slice a capture that can't be mapped, such as a compressed one, a block at a time '''
+
+	slicer = _Slicer(out)
+	with PCAPNGReader(capture) as reader:
+		for block in reader:
+			if isinstance(block, EnhancedPacket):
+				interface = block.interface
+				if interface is None:
+					raise ValueError(f'Packet is from undescribed interface {block.interface_id}')
+				if _wanted(interface, block.timestamp_ns, block.data, start, end, devices):
+					slicer.packet()
+					os.write(out, block.to_bytes())
+			elif isinstance(block, SectionHeader):
+				order = _BIG_ENDIAN if block.big_endian else _LITTLE_ENDIAN
+				slicer.section(_fresh_section(block.to_bytes(), order))
+			elif isinstance(block, InterfaceDescription):
+				data = block.to_bytes()
+				if not slicer.interface(data):
+					os.write(out, data)
+	return slicer.count
+
+def slice_capture(
+	capture: str | Path | BinaryIO, output: str | Path, *, start: int | None = None, end: int | None = None,
+	devices: Iterable[int] | None = None
+) -> int:
+	'''
+	Copy the packets from a time window of a capture, and optionally only the SCSI traffic to or from some
+	devices, out to a new capture.
+
+	The packets are copied over byte for byte, along with the section headers and interface descriptions so
+	they keep their interfaces. Sections that don't have any packets in the slice are left out, other than the
+	first. Anything else, such as interface statistics, which wouldn't be right any more, is dropped.
+
+	Parameters
+	----------
+	capture : str | Path | BinaryIO
+		The capture to slice, uncompressed captures are copied in the kernel, anything else is read through.
+
+	output : str | Path
+		The capture to write the slice to.
+
+	start : int | None
+		The timestamp in nanoseconds of the start of the slice, inclusive. (default: None)
+
+	end : int | None
+		The timestamp in nanoseconds of the end of the slice, exclusive. (default: None)
+
+	devices : Iterable[int] | None
+		Only keep the ``LINKTYPE_PARALLEL_SCSI`` frames to or from these device IDs, and drop everything else.
+		(default: None)
+
+	Returns
+	-------
+	int
+		The number of packets that were copied.
+
+	Raises
+	------
+	ValueError
+		If the capture is malformed, or is the output.
+	'''
+
+	_check_output((capture, ), output)
+	wanted = None if devices is None else frozenset(devices)
+
+	with Path(output).open('wb', buffering = 0) as out:
+		if not isinstance(capture, (str, Path)) or not _is_uncompressed(Path(capture)):
+			return _slice_streamed(capture, out.fileno(), start, end, wanted)
+
+		with Path(capture).open('rb') as file:
+			with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+				view = memoryview(mapped)
+				try:
+					return _slice_mapped(view, file.fileno(), out.fileno(), start, end, wanted)
+				finally:
+					view.release()
+
+def _section_header(writer: str) -> bytes:
+	''' Build a minimal little endian section header, with just the application that wrote it '''
+
+	value   = writer.encode('utf-8')
+	options = Struct(f'<HH{(len(value) + 3) & ~3}sHH').pack(_OPT_SHB_USERAPPL, len(value), value, 0, 0)
+	length  = 28 + len(options)
+	return b''.join((
+		_LITTLE_ENDIAN.header.pack(_SECTION_HEADER, length),
+		_LITTLE_ENDIAN.shb.pack(_BYTE_ORDER_MAGIC, 1, 0, -1),
+		options,
+		_LITTLE_ENDIAN.trailer.pack(length),
+	))
+
+def _merge_packets(
+	capture: str | Path | BinaryIO, interfaces: Iterator[int], out: BinaryIO
+) -> Generator[tuple[int, bytes], None, None]:
+	'''
+	Get the timestamp and block of every packet in a capture, with the interface ID rewritten to that of the
+	merged capture. The interface descriptions are written out as they are found, which is always before any
+	of their packets are.
+	'''
+
+	with PCAPNGReader(capture) as reader:
+		# The merged interface IDs of the interfaces in the current section
+		section: list[int] = []
+		for block in reader:
+			if isinstance(block, EnhancedPacket):
+				if block.interface_id >= len(section):
+					raise ValueError(f'Packet is from undescribed interface {block.interface_id}')
+				data = bytearray(block.to_bytes())
+				_EPB_INTERFACE.pack_into(data, 8, section[block.interface_id])
+				yield (block.timestamp_ns, bytes(data))
+			elif isinstance(block, SectionHeader):
+				# NOTE: Swapping every field of every block, options and all, is not worth it for these
+				if block.big_endian:
+					raise ValueError(f'Can\'t merge the big endian section in \'{capture}\'')
+				section = []
+			elif isinstance(block, InterfaceDescription):
+				section.append(next(interfaces))
+				out.write(block.to_bytes())
+
+def merge_captures(
+	captures: Sequence[str | Path | BinaryIO], output: str | Path, *, writer: str = 'Squishy PCAPNG Merge'
+) -> int:
+	'''
+	Merge several captures into one, interleaving their packets by timestamp.
+
+	Every interface of every capture gets an interface of its own in the merged capture, with its description
+	copied over as it is, so the packets keep their link types and timestamps. Each capture needs to be in
+	timestamp order, which is always the case for a capture from one analyzer, for the merged capture to be.
+	Packets with the same timestamp are taken from the captures in the order they are given.
+
+	Parameters
+	----------
+	captures : Sequence[str | Path | BinaryIO]
+		The captures to merge, they can be compressed.
+
+	output : str | Path
+		The capture to write the merged packets to.
+
+	writer : str
+		The ``shb_userappl`` for the merged capture. (default: 'Squishy PCAPNG Merge')
+
+	Returns
+	-------
+	int
+		The number of packets in the merged capture.
+
+	Raises
+	------
+	ValueError
+		If any of the captures are malformed, have a big endian section, or are the output.
+	'''
+
+	_check_output(captures, output)
+
+	with Path(output).open('wb') as out:
+		out.write(_section_header(writer))
+
+		interfaces = count()
+		streams    = [ _merge_packets(capture, interfaces, out) for capture in captures ]
+
+		packets = 0
+		try:
+			for (_, block) in heapq.merge(*streams, key = lambda packet: packet[0]):
+				out.write(block)
+				packets += 1
+		finally:
+			for stream in streams:
+				stream.close()
+		return packets
@@ -0,0 +1,644 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`CaptureStats`, a summary of a ``LINKTYPE_PARALLEL_SCSI`` capture that is built
+up in a single pass, and :py:func:`capture_stats` to build one for a whole capture.
+
+Everything is kept in fixed size structures, the latencies go into :py:class:`LogHistogram` s, and the bus
+utilization over time goes into a timeline with a fixed number of slots that get wider as the capture goes
+on, so the memory use doesn't depend on how long the capture is.
+
+.. code-block:: python
+
+	stats = capture_stats('/tmp/bus.pcapng')
+	print(json.dumps(stats.to_dict(), indent = 2))
+
+	console = Console()
+	for table in stats.tables():
+		console.print(table)
+
+The commands are put back together with :py:class:`TransactionAssembler`, the latencies are from the CDB to
+the status, or to the ``COMMAND COMPLETE`` if there wasn't one, and are only for the commands that completed.
+The bus is counted as busy from the first frame after it was free, until the target sends ``COMMAND COMPLETE``
+or ``DISCONNECT``, or the bus goes free some other way.
+
+'''
+
+from collections.abc import Iterable, Iterator
+from pathlib         import Path
+from typing          import Any, BinaryIO, Final
+
+from ._consts        import _LINKTYPE_PARALLEL_SCSI
+from .linktype       import SCSIFrameType
+from .reader         import EnhancedPacket, PCAPNGReader, SectionHeader
+from .transaction    import (
+	SCSITransaction, TransactionAssembler, TransactionState, _message_codes, _split_messages
+)
+
+__all__ = (
+	'CaptureStats',
+	'LogHistogram',
+	'capture_stats',
+)
+
+_MESSAGE: Final       = int(SCSIFrameType.MESSAGE)
+_ARBITRATION: Final   = int(SCSIFrameType.ARBITRATION)
+_SEL_RESEL: Final     = int(SCSIFrameType.SEL_RESEL)
+_BUS_CONDITION: Final = int(SCSIFrameType.BUS_CONDITION)
+_DATA_IN: Final       = int(SCSIFrameType.DATA_IN)
+_DATA_OUT: Final      = int(SCSIFrameType.DATA_OUT)
+_COMMAND: Final       = int(SCSIFrameType.COMMAND)
+
+# The percentiles that are reported for each histogram
+_PERCENTILES: Final = (50.0, 90.0, 99.0, 99.9)
+
+# The bars for the utilization timeline in the tables
+_SPARKS: Final = ' ▁▂▃▄▅▆▇█'
+
+class LogHistogram:
+	'''
+	A histogram of non-negative integers with logarithmically sized buckets.
+
+	Each power of two is split into ``2 ** precision`` buckets, so any value recorded can be told apart from any
+	other that's more than about ``100 / 2 ** precision`` percent away from it, the values below ``2 ** precision``
+	are exact. It takes the same amount of memory no matter how many values are recorded.
+
+	Parameters
+	----------
+	precision : int
+		The log2 of the number of buckets for each power of two. (default: 4)
+
+	Raises
+	------
+	ValueError
+		If the precision is not between 1 and 8.
+
+	'''
+
+	__slots__ = ('_precision', '_sub', '_buckets', 'count', 'total', 'min', 'max')
+
+	def __init__(self, precision: int = 4) -> None:
+		if not 1 <= precision <= 8:
+			raise ValueError(f'precision must be between 1 and 8, not {precision}')
+
+		self._precision = precision
+		self._sub = 1 << precision
+		self._buckets = [ 0 ] * ((65 - precision) * self._sub)
+		self.count = 0
+		''' The number of values recorded '''
+		self.total = 0
+		''' The sum of all of the values recorded '''
+		self.min: int | None = None
+		''' The smallest value recorded, if any '''
+		self.max: int | None = None
+		''' The largest value recorded, if any '''
+
+	def _bucket(self, value: int) -> int:
+		if value < self._sub:
+			return value
+		shift = value.bit_length() - self._precision - 1
+		return (shift + 1) * self._sub + (value >> shift) - self._sub
+
+	def _bounds(self, bucket: int) -> tuple[int, int]:
+		''' The smallest and largest values that go in a bucket '''
+		if bucket < self._sub:
+			return (bucket, bucket)
+		shift = bucket // self._sub - 1
+		base  = bucket % self._sub + self._sub
+		return (base << shift, ((base + 1) << shift) - 1)
+
+	def add(self, value: int) -> None:
+		''' Record a value, negative values are recorded as 0, and anything past 64 bits as the largest value '''
+		value = min(max(value, 0), (1 << 64) - 1)
+		self._buckets[self._bucket(value)] += 1
+		self.count += 1
+		self.total += value
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+
+	def merge(self, other: 'LogHistogram') -> None:
+		''' Add all of the values recorded in another histogram with the same precision to this one '''
+		if other._precision != self._precision:
+			raise ValueError(f'Can\'t merge a histogram with precision {other._precision} into {self._precision}')
+		self._buckets = [ a + b for (a, b) in zip(self._buckets, other._buckets) ]
+		self.count += other.count
+		self.total += other.total
+		for value in (other.min, other.max):
+			if value is not None:
+				self.min = value if self.min is None else min(self.min, value)
+				self.max = value if self.max is None else max(self.max, value)
+
+	@property
+	def mean(self) -> float | None:
+		''' The mean of the values recorded, if any '''
+		return None if self.count == 0 else self.total / self.count
+
+	def percentile(self, percentile: float) -> int | None:
+		'''
+		Get the value that the given percentage of the values recorded are at or below.
+
+		Parameters
+		----------
+		percentile : float
+			The percentile, from 0 to 100.
+
+		Returns
+		-------
+		int | None
+			The largest value of the bucket the percentile falls in, but never past the largest value recorded, or
+			None if nothing has been recorded.
+		'''
+
+		if self.count == 0 or self.max is None:
+			return None
+		rank = max(1, -(-self.count * percentile // 100))
+		seen = 0
+		for (bucket, count) in enumerate(self._buckets):
+			seen += count
+			if seen >= rank:
+				return min(self._bounds(bucket)[1], self.max)
+		return self.max
+
+	def buckets(self) -> Iterator[tuple[int, int, int]]:
+		''' Get the smallest and largest value, and the count, of each bucket that has anything in it '''
+		for (bucket, count) in enumerate(self._buckets):
+			if count != 0:
+				yield (*self._bounds(bucket), count)
+
+	def to_dict(self) -> dict[str, Any]:
+		''' Summarize the histogram, with the percentiles, for JSON '''
+		return {
+			'count': self.count,
+			'min':   self.min,
+			'max':   self.max,
+			'mean':  self.mean,
+			**{ f'p{percentile:g}': self.percentile(percentile) for percentile in _PERCENTILES },
+		}
+
+class _Timeline:
+	''' The busy time, data, and commands over time, in slots that double in width when they run out '''
+
+	__slots__ = ('start', 'width', 'busy', 'data', 'commands')
+
+	def __init__(self, slots: int) -> None:
+		self.start: int | None = None
+		# NOTE: Start at a millisecond, which is about the shortest anything interesting will be
+		self.width = 1_000_000
+		self.busy     = [ 0 ] * slots
+		self.data     = [ 0 ] * slots
+		self.commands = [ 0 ] * slots
+
+	def _origin(self, ts: int) -> int:
+		''' The start of the timeline, which is the first timestamp put on it '''
+		if self.start is None:
+			self.start = ts
+		return self.start
+
+	def _slot(self, ts: int) -> int:
+		origin = self._origin(ts)
+		ts     = max(ts, origin)
+
+		slots = len(self.busy)
+		while ts - origin >= self.width * slots:
+			for column in (self.busy, self.data, self.commands):
+				merged = [ sum(column[idx:idx + 2]) for idx in range(0, slots, 2) ]
+				column[:] = merged + [ 0 ] * (slots - len(merged))
+			self.width *= 2
+		return (ts - origin) // self.width
+
+	def add(self, ts: int, *, data: int = 0, commands: int = 0) -> None:
+		slot = self._slot(ts)
+		self.data[slot] += data
+		self.commands[slot] += commands
+
+	def add_busy(self, start: int, end: int) -> None:
+		''' Spread a busy period over the slots it covers '''
+		self._slot(end)
+		origin = self._origin(end)
+		start  = max(start, origin)
+		while start < end:
+			slot = self._slot(start)
+			slot_end = min(end, origin + (slot + 1) * self.width)
+			self.busy[slot] += slot_end - start
+			start = slot_end
+
+	def to_dict(self) -> dict[str, Any]:
+		return {
+			'start':       self.start,
+			'width':       self.width,
+			'utilization': [ busy / self.width for busy in self.busy ],
+			'data':        list(self.data),
+			'commands':    list(self.commands),
+		}
+
+class _Nexus:
+	''' The totals for one I_T_L nexus '''
+
+	__slots__ = ('commands', 'completed', 'errors', 'data_in', 'data_out', 'latency')
+
+	def __init__(self) -> None:
+		self.commands  = 0
+		self.completed = 0
+		self.errors    = 0
+		self.data_in   = 0
+		self.data_out  = 0
+		self.latency   = LogHistogram()
+
+class _Bus:
+	''' Everything that is kept track of for each bus '''
+
+	__slots__ = ('assembler', 'busy_since', 'released', 'last_ts', 'last_type')
+
+	def __init__(self, assembler: TransactionAssembler) -> None:
+		self.assembler = assembler
+		self.busy_since: int | None = None
+		# When the bus looked like it went free, until the next frame says if it did
+		self.released: int | None = None
+		self.last_ts = 0
+		self.last_type: int | None = None
+
+class CaptureStats:
+	'''
+	Statistics about the SCSI traffic in a capture, built up a frame at a time.
+
+	Parameters
+	----------
+	timeline_slots : int
+		The number of slots in the utilization timeline. (default: 120)
+
+	max_outstanding : int
+		The most commands that can be in flight on each bus, see :py:class:`TransactionAssembler`. (default: 4096)
+
+	Raises
+	------
+	ValueError
+		If there isn't at least one timeline slot.
+
+	'''
+
+	def __init__(self, *, timeline_slots: int = 120, max_outstanding: int = 4096) -> None:
+		if timeline_slots < 1:
+			raise ValueError(f'timeline_slots must be at least 1, not {timeline_slots}')
+
+		codes = _message_codes()
+		self._releases = frozenset((
+			codes['COMMAND_COMPLETE'], codes['LINK_CMD_COM'], codes['LINK_CMD_COM_F'], codes['DISCONNECT']
+		))
+
+		self._max_outstanding = max_outstanding
+		self._buses: dict[int, _Bus] = {}
+		self._timeline = _Timeline(timeline_slots)
+		self._nexuses: dict[tuple[int, int, int, int | None], _Nexus] = {}
+		self._opcodes: dict[int, LogHistogram] = {}
+		self._latency = LogHistogram()
+		self._states = { state: 0 for state in TransactionState }
+		self._frame_types: dict[int, int] = {}
+
+		self.frames = 0
+		''' The number of frames seen '''
+		self.start: int | None = None
+		''' The timestamp of the first frame '''
+		self.end: int | None = None
+		''' The timestamp of the last frame '''
+		self.connections = 0
+		''' The number of times the bus went from free to busy '''
+		self.busy = 0
+		''' How long the bus has been busy for in total, in nanoseconds '''
+
+	def _bus(self, interface: int) -> _Bus:
+		bus = self._buses.get(interface)
+		if bus is None:
+			bus = _Bus(TransactionAssembler(interface, max_outstanding = self._max_outstanding))
+			self._buses[interface] = bus
+		return bus
+
+	def _release(self, bus: _Bus, ts: int) -> None:
+		''' The bus has gone free '''
+		if bus.busy_since is not None:
+			self.busy += ts - bus.busy_since
+			self._timeline.add_busy(bus.busy_since, ts)
+			bus.busy_since = None
+		bus.released = None
+
+	def _transactions(self, transactions: Iterable[SCSITransaction]) -> None:
+		for transaction in transactions:
+			self._states[transaction.state] += 1
+
+			key = (transaction.interface, transaction.initiator, transaction.target, transaction.lun)
+			nexus = self._nexuses.get(key)
+			if nexus is None:
+				nexus = _Nexus()
+				self._nexuses[key] = nexus
+			nexus.commands += 1
+			nexus.data_in  += transaction.data_in
+			nexus.data_out += transaction.data_out
+
+			if transaction.state != TransactionState.COMPLETE:
+				continue
+			nexus.completed += 1
+			if transaction.status not in (None, 0):
+				nexus.errors += 1
+
+			latency = (
+				transaction.status_ts if transaction.status_ts is not None else transaction.end
+			) - transaction.command_ts
+			nexus.latency.add(latency)
+			self._latency.add(latency)
+			opcode = transaction.opcode
+			if opcode is not None:
+				histogram = self._opcodes.get(opcode)
+				if histogram is None:
+					histogram = LogHistogram()
+					self._opcodes[opcode] = histogram
+				histogram.add(latency)
+
+	def feed(
+		self, interface: int, ts: int, frame_type: int, orig_id: int, dest_id: int, data: bytes | memoryview
+	) -> None:
+		'''
+		Feed in the next frame.
+
+		Parameters
+		----------
+		interface : int
+			The ID of the interface the frame was captured on, each one is a separate bus.
+
+		ts : int
+			The timestamp of the frame in nanoseconds since the epoch.
+
+		frame_type : int
+			The :py:class:`SCSIFrameType` of the frame.
+
+		orig_id : int
+			The ID of the device that sent the frame.
+
+		dest_id : int
+			The ID of the device the frame was sent to.
+
+		data : bytes | memoryview
+			The frame data, which is not kept.
+		'''
+
+		self.frames += 1
+		self._frame_types[frame_type] = self._frame_types.get(frame_type, 0) + 1
+		if self.start is None:
+			self.start = ts
+			# Anchor the timeline at the first frame, rather than whatever happens to be first added to it
+			self._timeline.add(ts)
+		self.end = ts if self.end is None else max(self.end, ts)
+
+		bus = self._bus(interface)
+		if bus.released is not None:
+			# NOTE: A message can't start a connection, so what looked like the end of the last one was
+			#       actually a status byte, and the connection is still going
+			if frame_type == _MESSAGE:
+				bus.released = None
+			else:
+				self._release(bus, bus.released)
+
+		# NOTE: The bus must have gone free before an arbitration or a selection without one, even if there
+		#       was no message to say so
+		if frame_type == _ARBITRATION or (frame_type == _SEL_RESEL and bus.last_type != _ARBITRATION):
+			self._release(bus, bus.last_ts)
+		elif frame_type == _BUS_CONDITION:
+			self._release(bus, ts)
+
+		if bus.busy_since is None and frame_type != _BUS_CONDITION:
+			bus.busy_since = ts
+			self.connections += 1
+		(bus.last_ts, bus.last_type) = (ts, frame_type)
+
+		if frame_type == _DATA_IN or frame_type == _DATA_OUT:
+			self._timeline.add(ts, data = len(data))
+		elif frame_type == _COMMAND:
+			self._timeline.add(ts, commands = 1)
+		elif frame_type == _MESSAGE and len(data) > 0:
+			last = None
+			for (code, _) in _split_messages(bytes(data)):
+				last = code
+			if last in self._releases:
+				bus.released = ts
+
+		self._transactions(bus.assembler.feed(ts, frame_type, orig_id, dest_id, data))
+
+	def finish(self) -> None:
+		''' Finish off any commands still in flight and any busy periods, at the end of a capture or section '''
+		for bus in self._buses.values():
+			self._release(bus, bus.released if bus.released is not None else bus.last_ts)
+			self._transactions(bus.assembler.flush())
+		self._buses.clear()
+
+	@property
+	def duration(self) -> int:
+		''' How long the capture covers, in nanoseconds '''
+		return 0 if self.start is None or self.end is None else self.end - self.start
+
+	@property
+	def latency(self) -> LogHistogram:
+		''' The latency of all of the commands that completed '''
+		return self._latency
+
+	@property
+	def opcodes(self) -> dict[int, LogHistogram]:
+		''' The latency of the commands that completed for each opcode '''
+		return dict(self._opcodes)
+
+	def frame_count(self, frame_type: int) -> int:
+		''' The number of frames of the given :py:class:`SCSIFrameType` '''
+		return self._frame_types.get(frame_type, 0)
+
+	def to_dict(self) -> dict[str, Any]:
+		'''
+		Get all of the statistics as plain types, ready for :py:func:`json.dumps`.
+
+		Returns
+		-------
+		dict[str, Any]
+			The statistics, the timestamps and durations are all in nanoseconds, throughputs in bytes per second.
+		'''
+
+		seconds = self.duration / 1e9
+
+		def rate(count: int) -> float | None:
+			return count / seconds if seconds > 0 else None
+
+		def frame_type(value: int) -> str:
+			try:
+				return SCSIFrameType(value).name
+			except ValueError:
+				return f'{value:#04x}'
+
+		return {
+			'start':    self.start,
+			'end':      self.end,
+			'duration': self.duration,
+			'frames':   self.frames,
+			'frame_types': { frame_type(value): count for (value, count) in sorted(self._frame_types.items()) },
+			'bus': {
+				'arbitrations':   self.frame_count(_ARBITRATION),
+				'selections':     self.frame_count(_SEL_RESEL),
+				'bus_conditions': self.frame_count(_BUS_CONDITION),
+				'connections':    self.connections,
+				'connection_rate': rate(self.connections),
+				'busy':           self.busy,
+				'utilization':    self.busy / self.duration if self.duration > 0 else None,
+			},
+			'transactions': { state.name: count for (state, count) in self._states.items() },
+			'nexuses': [
+				{
+					'interface':  interface,
+					'initiator':  initiator,
+					'target':     target,
+					'lun':        lun,
+					'commands':   nexus.commands,
+					'completed':  nexus.completed,
+					'errors':     nexus.errors,
+					'data_in':    nexus.data_in,
+					'data_out':   nexus.data_out,
+					'iops':       rate(nexus.commands),
+					'throughput': rate(nexus.data_in + nexus.data_out),
+					'latency':    nexus.latency.to_dict(),
+				} for ((interface, initiator, target, lun), nexus) in sorted(
+					self._nexuses.items(), key = lambda item: (*item[0][:3], -1 if item[0][3] is None else item[0][3])
+				)
+			],
+			'latency': {
+				'all': self._latency.to_dict(),
+				**{ f'{opcode:#04x}': histogram.to_dict() for (opcode, histogram) in sorted(self._opcodes.items()) },
+			},
+			'timeline': self._timeline.to_dict(),
+		}
+
+	def tables(self) -> tuple[Any, ...]:
+		'''
+		Lay the statistics out in :py:class:`rich.table.Table` s for printing.
+
+		Returns
+		-------
+		tuple[rich.table.Table, ...]
+			The summary, the nexuses, and the latency of each opcode.
+		'''
+
+		# NOTE: Nothing else here needs rich, and it's not quick to import
+		from rich.table import Table
+
+		stats = self.to_dict()
+
+		def ns(value: float | None) -> str:
+			if value is None:
+				return '-'
+			for (unit, scale) in (('s', 1e9), ('ms', 1e6), ('µs', 1e3)):
+				if value >= scale:
+					return f'{value / scale:.2f}{unit}'
+			return f'{value:.0f}ns'
+
+		def size(value: float | None) -> str:
+			if value is None:
+				return '-'
+			for unit in ('B', 'KiB', 'MiB', 'GiB'):
+				if value < 1024 or unit == 'GiB':
+					return f'{value:.0f}{unit}' if unit == 'B' else f'{value:.2f}{unit}'
+				value /= 1024
+			return '-'
+
+		bus = stats['bus']
+		summary = Table(title = 'Capture Summary', show_header = False)
+		summary.add_column('Statistic', style = 'bold')
+		summary.add_column('Value')
+		summary.add_row('Duration', ns(stats['duration']))
+		summary.add_row('Frames', f'{stats["frames"]}')
+		summary.add_row('Commands', ', '.join(
+			f'{count} {state.lower()}' for (state, count) in stats['transactions'].items() if count > 0
+		) or '0')
+		summary.add_row('Arbitrations', f'{bus["arbitrations"]}')
+		summary.add_row('Selections', f'{bus["selections"]}')
+		summary.add_row('Bus conditions', f'{bus["bus_conditions"]}')
+		summary.add_row(
+			'Connections', f'{bus["connections"]}' + (
+				f' ({bus["connection_rate"]:.1f}/s)' if bus['connection_rate'] is not None else ''
+			)
+		)
+		summary.add_row('Bus busy', ns(bus['busy']) + (
+			f' ({bus["utilization"] * 100:.1f}%)' if bus['utilization'] is not None else ''
+		))
+		timeline = stats['timeline']
+		summary.add_row(f'Utilization ({ns(timeline["width"])}/slot)', ''.join(
+			_SPARKS[min(round(utilization * (len(_SPARKS) - 1)), len(_SPARKS) - 1)]
+			for utilization in timeline['utilization']
+		).rstrip() or '-')
+
+		nexuses = Table(title = 'Nexuses')
+		for column in (
+			'Interface', 'Initiator', 'Target', 'LUN', 'Commands', 'Errors', 'IOPS', 'In', 'Out', 'Throughput'
+		):
+			nexuses.add_column(column, justify = 'right')
+		for nexus in stats['nexuses']:
+			nexuses.add_row(
+				f'{nexus["interface"]}', f'{nexus["initiator"]}', f'{nexus["target"]}',
+				'-' if nexus['lun'] is None else f'{nexus["lun"]}', f'{nexus["commands"]}', f'{nexus["errors"]}',
+				'-' if nexus['iops'] is None else f'{nexus["iops"]:.1f}', size(nexus['data_in']),
+				size(nexus['data_out']), '-' if nexus['throughput'] is None else f'{size(nexus["throughput"])}/s'
+			)
+
+		latency = Table(title = 'Command Latency')
+		latency.add_column('Opcode')
+		for column in ('Count', 'Min', 'Mean', *(f'p{percentile:g}' for percentile in _PERCENTILES), 'Max'):
+			latency.add_column(column, justify = 'right')
+		for (opcode, histogram) in stats['latency'].items():
+			latency.add_row(
+				opcode, f'{histogram["count"]}', ns(histogram['min']), ns(histogram['mean']),
+				*(ns(histogram[f'p{percentile:g}']) for percentile in _PERCENTILES), ns(histogram['max'])
+			)
+
+		return (summary, nexuses, latency)
+
+def capture_stats(
+	capture: str | Path | BinaryIO, *, timeline_slots: int = 120, max_outstanding: int = 4096
+) -> CaptureStats:
+	'''
+	Gather the statistics for a whole capture in a single pass.
+
+	Only the ``LINKTYPE_PARALLEL_SCSI`` interfaces are looked at, each of them is taken to be a separate bus.
+
+	Parameters
+	----------
+	capture : str | Path | BinaryIO
+		The capture to read, it can be compressed.
+
+	timeline_slots : int
+		The number of slots in the utilization timeline. (default: 120)
+
+	max_outstanding : int
+		The most commands that can be in flight on each bus, see :py:class:`TransactionAssembler`. (default: 4096)
+
+	Returns
+	-------
+	CaptureStats
+		The statistics.
+
+	Raises
+	------
+	ValueError
+		If the capture is malformed.
+	'''
+
+	stats = CaptureStats(timeline_slots = timeline_slots, max_outstanding = max_outstanding)
+
+	with PCAPNGReader(capture) as reader:
+		for block in reader:
+			if isinstance(block, EnhancedPacket):
+				interface = block.interface
+				if interface is None or interface.link_type != _LINKTYPE_PARALLEL_SCSI:
+					continue
+				data = block.data
+				if len(data) < 28:
+					continue
+				data_len = int.from_bytes(data[24:28], 'little')
+				stats.feed(interface.id, block.timestamp_ns, data[4], data[5], data[6], data[28:28 + data_len])
+			elif isinstance(block, SectionHeader):
+				stats.finish()
+
+	stats.finish()
+	return stats
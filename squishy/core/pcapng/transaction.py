@@ -0,0 +1,577 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains :py:class:`TransactionAssembler`, which puts the individual frames of a
+``LINKTYPE_PARALLEL_SCSI`` capture back together into whole SCSI commands, and :py:func:`scsi_transactions`
+to do so for a whole capture in a single pass.
+
+Each :py:class:`SCSITransaction` is a single command on an I_T_L or I_T_L_Q nexus, from the arbitration or
+selection that started it, through any number of disconnects and reselections, until the target says it is
+complete, along with when each phase happened, how much data was moved, and the status.
+
+.. code-block:: python
+
+	for transaction in scsi_transactions('/tmp/bus.pcapng'):
+		print(
+			f'{transaction.initiator} -> {transaction.target}:{transaction.lun} {transaction.opcode:#04x} '
+			f'status {transaction.status} took {transaction.duration}ns'
+		)
+
+The framing has no frame type of its own for the status phase, so the status is taken to be the single byte
+``MESSAGE`` frame from the target that comes directly before the ``COMMAND COMPLETE`` message. A lone message
+from the target that could be either is taken to be the ``COMMAND COMPLETE``.
+
+Only the nexuses with a command in flight are kept track of, and there is a limit on how many of those there
+can be, so the memory use stays bounded no matter how long the capture is.
+
+'''
+
+from collections     import OrderedDict
+from collections.abc import Iterator, Sequence
+from enum            import Enum, auto
+from pathlib         import Path
+from typing          import Any, BinaryIO, Final
+
+from ._consts        import _LINKTYPE_PARALLEL_SCSI
+from .linktype       import SCSIFrameType
+from .query          import decode_cdb
+from .reader         import EnhancedPacket, PCAPNGReader, SectionHeader
+
+__all__ = (
+	'SCSITransaction',
+	'TransactionAssembler',
+	'TransactionState',
+	'scsi_transactions',
+)
+
+_COMMAND: Final       = int(SCSIFrameType.COMMAND)
+_DATA_IN: Final       = int(SCSIFrameType.DATA_IN)
+_DATA_OUT: Final      = int(SCSIFrameType.DATA_OUT)
+_MESSAGE: Final       = int(SCSIFrameType.MESSAGE)
+_ARBITRATION: Final   = int(SCSIFrameType.ARBITRATION)
+_SEL_RESEL: Final     = int(SCSIFrameType.SEL_RESEL)
+_BUS_CONDITION: Final = int(SCSIFrameType.BUS_CONDITION)
+
+_MESSAGE_CODES: dict[str, int] | None = None
+
+def _message_codes() -> dict[str, int]:
+	''' Get the values of the :py:class:`squishy.scsi.messages.MessageCodes` as plain ints '''
+	global _MESSAGE_CODES
+
+	# NOTE: Importing `squishy.scsi` pulls in all of the command sets, so only do it when we need it
+	if _MESSAGE_CODES is None:
+		from ...scsi.messages import MessageCodes
+		_MESSAGE_CODES = { code.name: int(code) for code in MessageCodes }
+	return _MESSAGE_CODES
+
+def _split_messages(data: bytes) -> Iterator[tuple[int, bytes]]:
+	''' Split up the bytes of a message phase into the code and arguments of each message '''
+
+	offset = 0
+	while offset < len(data):
+		code = data[offset]
+		if code == 0x01:
+			# Extended messages have their length up front
+			length = data[offset + 1] if offset + 1 < len(data) else 0
+			yield (code, data[offset + 2:offset + 2 + length])
+			offset += 2 + length
+		elif 0x20 <= code <= 0x2F:
+			yield (code, data[offset + 1:offset + 2])
+			offset += 2
+		else:
+			yield (code, b'')
+			offset += 1
+
+class TransactionState(Enum):
+	''' How a :py:class:`SCSITransaction` came to an end '''
+
+	COMPLETE   = auto()
+	''' The target sent ``COMMAND COMPLETE``, or one of the ``LINKED COMMAND COMPLETE`` messages '''
+	ABORTED    = auto()
+	''' The initiator sent ``ABORT`` or ``BUS DEVICE RESET`` '''
+	LOST       = auto()
+	''' Another command was started on the same nexus before this one completed '''
+	EVICTED    = auto()
+	''' There were too many commands in flight, and this was the oldest '''
+	INCOMPLETE = auto()
+	''' The capture ended before the command completed '''
+
+class SCSITransaction:
+	'''
+	A single SCSI command, put back together from the frames of a capture.
+
+	All of the timestamps are in nanoseconds since the epoch, the ones for the phases that didn't happen are None.
+
+	'''
+
+	__slots__ = (
+		'interface', 'initiator', 'target', 'lun', 'tag', 'tag_type', 'cdb', 'status', 'state', 'start',
+		'command_ts', 'data_start', 'data_end', 'status_ts', 'end', 'data_in', 'data_out', 'disconnects', '_command',
+	)
+
+	def __init__(
+		self, interface: int, initiator: int, target: int, lun: int | None, tag: int | None, tag_type: int | None,
+		cdb: bytes, start: int, command_ts: int
+	) -> None:
+		self.interface = interface
+		''' The ID of the interface the command was captured on '''
+		self.initiator = initiator
+		''' The ID of the initiator '''
+		self.target = target
+		''' The ID of the target '''
+		self.lun = lun
+		''' The LUN from the ``IDENTIFY`` message, or None if there wasn't one '''
+		self.tag = tag
+		''' The queue tag, or None if the command wasn't tagged '''
+		self.tag_type = tag_type
+		''' The :py:class:`squishy.scsi.messages.MessageCodes` of the queue tag message, if there was one '''
+		self.cdb = cdb
+		''' The raw CDB '''
+		self.status: int | None = None
+		''' The status byte, or None if it wasn't seen '''
+		self.state = TransactionState.INCOMPLETE
+		''' How the command came to an end '''
+		self.start = start
+		''' When the arbitration or selection that started the command happened, or the command itself '''
+		self.command_ts = command_ts
+		''' When the CDB was sent '''
+		self.data_start: int | None = None
+		''' When the first data was sent '''
+		self.data_end: int | None = None
+		''' When the last data was sent '''
+		self.status_ts: int | None = None
+		''' When the status was sent '''
+		self.end = command_ts
+		''' When the command was completed, or the last time anything was seen of it '''
+		self.data_in = 0
+		''' The number of bytes sent from the target to the initiator '''
+		self.data_out = 0
+		''' The number of bytes sent from the initiator to the target '''
+		self.disconnects = 0
+		''' The number of times the target disconnected part way through '''
+		self._command: Any = ...
+
+	@property
+	def nexus(self) -> tuple[int, int, int | None, int | None]:
+		''' The initiator, target, LUN, and queue tag of the command '''
+		return (self.initiator, self.target, self.lun, self.tag)
+
+	@property
+	def opcode(self) -> int | None:
+		''' The opcode of the command, or None if the CDB was empty '''
+		return self.cdb[0] if len(self.cdb) > 0 else None
+
+	@property
+	def command(self) -> Any | None:
+		''' The decoded CDB, see :py:func:`squishy.core.pcapng.decode_cdb` '''
+		if self._command is ...:
+			self._command = decode_cdb(self.cdb)
+		return self._command
+
+	@property
+	def duration(self) -> int:
+		''' How long the whole command took '''
+		return self.end - self.start
+
+	@property
+	def setup_time(self) -> int:
+		''' How long it took from the start of the command to the CDB being sent '''
+		return self.command_ts - self.start
+
+	@property
+	def data_latency(self) -> int | None:
+		''' How long it took from the CDB to the first data, or None if there was no data '''
+		return None if self.data_start is None else self.data_start - self.command_ts
+
+	@property
+	def data_time(self) -> int | None:
+		''' How long it took from the first data to the last, or None if there was no data '''
+		return None if self.data_start is None or self.data_end is None else self.data_end - self.data_start
+
+	@property
+	def status_latency(self) -> int | None:
+		''' How long it took from the CDB or the last data to the status, or None if there wasn't any '''
+		if self.status_ts is None:
+			return None
+		return self.status_ts - (self.data_end if self.data_end is not None else self.command_ts)
+
+	def __repr__(self) -> str:
+		return (
+			f'<SCSITransaction {self.initiator}->{self.target}:{self.lun} tag={self.tag} '
+			f'cdb={self.cdb.hex()} status={self.status} state={self.state.name} duration={self.duration}>'
+		)
+
+class _Connection:
+	''' The initiator and target currently connected on the bus, and what they are doing '''
+
+	__slots__ = ('initiator', 'target', 'lun', 'tag', 'tag_type', 'start', 'transaction', 'held', 'held_ts')
+
+	def __init__(self, initiator: int, target: int, start: int | None) -> None:
+		self.initiator = initiator
+		self.target = target
+		self.lun: int | None = None
+		self.tag: int | None = None
+		self.tag_type: int | None = None
+		# When the connection was started, until a command is sent on it
+		self.start = start
+		self.transaction: SCSITransaction | None = None
+		# A single byte from the target that could be the status, until we see what comes after it
+		self.held: bytes | None = None
+		self.held_ts = 0
+
+class TransactionAssembler:
+	'''
+	A streaming state machine that puts ``LINKTYPE_PARALLEL_SCSI`` frames back together into whole commands.
+
+	Frames are fed in one at a time in the order they were captured, the transactions that have come to an
+	end are handed back as soon as they do. The frames of one interface need their own assembler, as each one
+	is a separate bus.
+
+	Captures that are missing the arbitration and selection frames, or the ``IDENTIFY`` messages, are handled
+	as well as they can be, connections are implied by the commands and data, and commands without a LUN are
+	kept apart from those with one.
+
+	Parameters
+	----------
+	interface : int
+		The ID of the interface the frames are from, to tag the transactions with. (default: 0)
+
+	max_outstanding : int
+		The most commands that can be in flight at once, past which the oldest is evicted. (default: 4096)
+
+	Raises
+	------
+	ValueError
+		If ``max_outstanding`` is less than 1.
+
+	'''
+
+	def __init__(self, interface: int = 0, *, max_outstanding: int = 4096) -> None:
+		if max_outstanding < 1:
+			raise ValueError(f'max_outstanding must be at least 1, not {max_outstanding}')
+
+		codes = _message_codes()
+		self._command_complete = codes['COMMAND_COMPLETE']
+		self._completes = frozenset((codes['COMMAND_COMPLETE'], codes['LINK_CMD_COM'], codes['LINK_CMD_COM_F']))
+		self._disconnect = codes['DISCONNECT']
+		self._abort = codes['ABORT']
+		self._bus_dev_reset = codes['BUS_DEV_RESET']
+		self._identify = codes['IDENTIFY_START']
+		self._queue_tags = frozenset((
+			codes['SIMPLE_QUEUE_TAG'], codes['HEAD_OF_QUEUE_TAG'], codes['ORDERED_QUEUE_TAG']
+		))
+
+		self._interface = interface
+		self._max_outstanding = max_outstanding
+		self._outstanding: OrderedDict[tuple[int, int, int | None, int | None], SCSITransaction] = OrderedDict()
+		self._connection: _Connection | None = None
+		self._arbitration: int | None = None
+		self._done: list[SCSITransaction] = []
+
+	@property
+	def outstanding(self) -> int:
+		''' The number of commands currently in flight '''
+		return len(self._outstanding)
+
+	def _emit(self, transaction: SCSITransaction, state: TransactionState) -> None:
+		transaction.state = state
+		self._outstanding.pop(transaction.nexus, None)
+		self._done.append(transaction)
+		connection = self._connection
+		if connection is not None and connection.transaction is transaction:
+			connection.transaction = None
+
+	def _find(self, initiator: int, target: int) -> SCSITransaction | None:
+		''' Find the most recent command between an initiator and target when the nexus isn't known '''
+		for transaction in reversed(self._outstanding.values()):
+			if transaction.initiator == initiator and transaction.target == target:
+				return transaction
+		return None
+
+	def _current(self, connection: _Connection) -> SCSITransaction | None:
+		''' Get the command the connection is working on, looking it up if it reconnected '''
+
+		if connection.transaction is None:
+			nexus = (connection.initiator, connection.target, connection.lun, connection.tag)
+			transaction = self._outstanding.get(nexus)
+			if transaction is None and connection.lun is None:
+				transaction = self._find(connection.initiator, connection.target)
+			connection.transaction = transaction
+		return connection.transaction
+
+	def _connect(self, ts: int, orig_id: int, dest_id: int, *, reselect: bool) -> _Connection:
+		''' Start a new connection, working out which way around it is if it could be a reselection '''
+
+		self._release()
+		if reselect and self._find(dest_id, orig_id) is not None:
+			(initiator, target) = (dest_id, orig_id)
+		else:
+			(initiator, target) = (orig_id, dest_id)
+
+		start = self._arbitration if self._arbitration is not None else ts
+		self._arbitration = None
+		self._connection = _Connection(initiator, target, start)
+		return self._connection
+
+	def _release(self) -> None:
+		''' End the current connection, if there is one '''
+		connection = self._connection
+		if connection is not None:
+			if connection.held is not None:
+				self._message_in(connection, connection.held_ts, connection.held, None)
+			self._connection = None
+
+	def _message_out(self, connection: _Connection, ts: int, data: bytes) -> None:
+		''' Handle the messages from the initiator '''
+
+		for (code, args) in _split_messages(data):
+			if code >= self._identify:
+				connection.lun = code & 0x07
+				connection.transaction = None
+			elif code in self._queue_tags and len(args) == 1:
+				(connection.tag_type, connection.tag) = (code, args[0])
+				connection.transaction = None
+			elif code == self._abort:
+				transaction = self._current(connection)
+				if transaction is not None:
+					transaction.end = ts
+					self._emit(transaction, TransactionState.ABORTED)
+			elif code == self._bus_dev_reset:
+				for transaction in [ t for t in self._outstanding.values() if t.target == connection.target ]:
+					transaction.end = ts
+					self._emit(transaction, TransactionState.ABORTED)
+
+	def _message_in(self, connection: _Connection, ts: int, data: bytes, status: int | None) -> None:
+		''' Handle the messages from the target, along with the status that came before them, if any '''
+
+		connection.held = None
+		for (code, args) in _split_messages(data):
+			if code >= self._identify:
+				connection.lun = code & 0x07
+				connection.transaction = None
+			elif code in self._queue_tags and len(args) == 1:
+				(connection.tag_type, connection.tag) = (code, args[0])
+				connection.transaction = None
+			elif code in self._completes:
+				transaction = self._current(connection)
+				if transaction is not None:
+					if status is not None:
+						(transaction.status, transaction.status_ts) = (status, connection.held_ts)
+					transaction.end = ts
+					self._emit(transaction, TransactionState.COMPLETE)
+				status = None
+			elif code == self._disconnect:
+				transaction = self._current(connection)
+				if transaction is not None:
+					transaction.disconnects += 1
+					transaction.end = ts
+				self._connection = None
+				return
+
+	def _message(self, ts: int, orig_id: int, dest_id: int, data: bytes) -> None:
+		connection = self._connection
+		if connection is None or (orig_id, dest_id) not in (
+			(connection.initiator, connection.target), (connection.target, connection.initiator)
+		):
+			connection = self._connect(ts, orig_id, dest_id, reselect = True)
+
+		if orig_id != connection.target or dest_id != connection.initiator:
+			if connection.held is not None:
+				self._message_in(connection, connection.held_ts, connection.held, None)
+			self._message_out(connection, ts, data)
+			return
+
+		held = connection.held
+		if held is not None:
+			if len(data) > 0 and data[0] in self._completes:
+				self._message_in(connection, ts, data, held[0])
+				return
+			self._message_in(connection, connection.held_ts, held, None)
+			# NOTE: The held messages might have ended the connection
+			if self._connection is not connection:
+				connection = self._connect(ts, orig_id, dest_id, reselect = True)
+
+		if len(data) == 1:
+			(connection.held, connection.held_ts) = (data, ts)
+		else:
+			self._message_in(connection, ts, data, None)
+
+	def _command(self, ts: int, orig_id: int, dest_id: int, data: bytes) -> None:
+		connection = self._connection
+		if connection is not None and connection.held is not None:
+			self._message_in(connection, connection.held_ts, connection.held, None)
+			connection = self._connection
+		if connection is None or (connection.initiator, connection.target) != (orig_id, dest_id):
+			connection = self._connect(ts, orig_id, dest_id, reselect = False)
+
+		nexus = (connection.initiator, connection.target, connection.lun, connection.tag)
+		previous = self._outstanding.get(nexus)
+		if previous is not None:
+			self._emit(previous, TransactionState.LOST)
+
+		# NOTE: Only the first command on a connection gets the arbitration and selection time
+		start = connection.start if connection.start is not None else ts
+		connection.start = None
+
+		transaction = SCSITransaction(
+			self._interface, connection.initiator, connection.target, connection.lun, connection.tag,
+			connection.tag_type, data, start, ts
+		)
+		self._outstanding[nexus] = transaction
+		connection.transaction = transaction
+
+		if len(self._outstanding) > self._max_outstanding:
+			(_, oldest) = self._outstanding.popitem(last = False)
+			self._emit(oldest, TransactionState.EVICTED)
+
+	def _data(self, ts: int, frame_type: int, orig_id: int, dest_id: int, length: int) -> None:
+		(initiator, target) = (dest_id, orig_id) if frame_type == _DATA_IN else (orig_id, dest_id)
+
+		connection = self._connection
+		if connection is not None and connection.held is not None:
+			self._message_in(connection, connection.held_ts, connection.held, None)
+			connection = self._connection
+
+		if connection is not None and connection.initiator == initiator and connection.target == target:
+			transaction = self._current(connection)
+		else:
+			# The connection must have been missed, so find whatever this was for
+			transaction = self._find(initiator, target)
+			if transaction is not None:
+				self._release()
+				self._connection = _Connection(initiator, target, None)
+				self._connection.transaction = transaction
+
+		if transaction is None:
+			return
+
+		if transaction.data_start is None:
+			transaction.data_start = ts
+		(transaction.data_end, transaction.end) = (ts, ts)
+		if frame_type == _DATA_IN:
+			transaction.data_in += length
+		else:
+			transaction.data_out += length
+
+	def feed(
+		self, ts: int, frame_type: int, orig_id: int, dest_id: int, data: bytes | memoryview
+	) -> Sequence[SCSITransaction]:
+		'''
+		Feed in the next frame.
+
+		Parameters
+		----------
+		ts : int
+			The timestamp of the frame in nanoseconds since the epoch.
+
+		frame_type : int
+			The :py:class:`SCSIFrameType` of the frame.
+
+		orig_id : int
+			The ID of the device that sent the frame.
+
+		dest_id : int
+			The ID of the device the frame was sent to.
+
+		data : bytes | memoryview
+			The frame data, which is copied if it needs to be kept.
+
+		Returns
+		-------
+		Sequence[SCSITransaction]
+			The transactions that came to an end with this frame, if any.
+		'''
+
+		if frame_type == _DATA_IN or frame_type == _DATA_OUT:
+			self._data(ts, frame_type, orig_id, dest_id, len(data))
+		elif frame_type == _COMMAND:
+			self._command(ts, orig_id, dest_id, bytes(data))
+		elif frame_type == _MESSAGE:
+			self._message(ts, orig_id, dest_id, bytes(data))
+		elif frame_type == _SEL_RESEL:
+			self._connect(ts, orig_id, dest_id, reselect = True)
+		elif frame_type == _ARBITRATION:
+			self._release()
+			self._arbitration = ts
+		elif frame_type == _BUS_CONDITION:
+			self._release()
+			self._arbitration = None
+
+		if not self._done:
+			return ()
+		(done, self._done) = (self._done, [])
+		return done
+
+	def flush(self) -> Sequence[SCSITransaction]:
+		'''
+		Finish off at the end of a capture, anything still in flight is handed back as
+		:py:attr:`TransactionState.INCOMPLETE`.
+
+		Returns
+		-------
+		Sequence[SCSITransaction]
+			The transactions that were still in flight, oldest first.
+		'''
+
+		self._release()
+		for transaction in list(self._outstanding.values()):
+			self._emit(transaction, TransactionState.INCOMPLETE)
+		(done, self._done) = (self._done, [])
+		return done
+
+def scsi_transactions(
+	capture: str | Path | BinaryIO, *, max_outstanding: int = 4096
+) -> Iterator[SCSITransaction]:
+	'''
+	Put all of the commands in a capture back together, in a single pass.
+
+	Each ``LINKTYPE_PARALLEL_SCSI`` interface is assembled separately, everything else is skipped. Any commands
+	still in flight at the end of a section are handed back as :py:attr:`TransactionState.INCOMPLETE`.
+
+	Parameters
+	----------
+	capture : str | Path | BinaryIO
+		The capture to read, it can be compressed.
+
+	max_outstanding : int
+		The most commands that can be in flight on each interface, see :py:class:`TransactionAssembler`.
+		(default: 4096)
+
+	Returns
+	-------
+	Iterator[SCSITransaction]
+		The commands, in the order they came to an end.
+
+	Raises
+	------
+	ValueError
+		If the capture is malformed.
+	'''
+
+	assemblers: dict[int, TransactionAssembler] = {}
+
+	with PCAPNGReader(capture) as reader:
+		for block in reader:
+			if isinstance(block, EnhancedPacket):
+				interface = block.interface
+				if interface is None or interface.link_type != _LINKTYPE_PARALLEL_SCSI:
+					continue
+				data = block.data
+				if len(data) < 28:
+					continue
+
+				assembler = assemblers.get(interface.id)
+				if assembler is None:
+					assembler = TransactionAssembler(interface.id, max_outstanding = max_outstanding)
+					assemblers[interface.id] = assembler
+
+				(frame_type, orig_id, dest_id) = (data[4], data[5], data[6])
+				data_len = int.from_bytes(data[24:28], 'little')
+				yield from assembler.feed(block.timestamp_ns, frame_type, orig_id, dest_id, data[28:28 + data_len])
+			elif isinstance(block, SectionHeader):
+				for assembler in assemblers.values():
+					yield from assembler.flush()
+				assemblers.clear()
+
+	for assembler in assemblers.values():
+		yield from assembler.flush()
@@ -0,0 +1,271 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the background writer used by :py:class:`squishy.core.pcapng.PCAPNGStream` when it is
+created with ``background = True``.
+
+Producers only ever append the raw packet and its timestamp onto a bounded queue, the encoding and the actual
+writing is done on a separate thread with its own encoder, which drains the queue in batches, so a slow disk doesn't
+stall whatever is draining the capture from the device. When the queue is full, the :py:class:`OverflowPolicy`
+decides if the producer waits for space, or if a packet is dropped, with the drops being counted so a capture
+degrades in a predictable way.
+
+'''
+
+from collections import deque
+from enum        import Enum, auto, unique
+from threading   import Condition, Event, Lock, Thread
+from typing      import Any, BinaryIO, Final
+
+__all__ = (
+	'BackgroundWriter',
+	'OverflowPolicy',
+)
+
+# How often the writer thread wakes up on its own if nothing is being queued, in seconds
+_IDLE_INTERVAL: Final = 0.25
+# How many items the writer takes off the queue at a time
+_CHUNK: Final = 256
+
+@unique
+class OverflowPolicy(Enum):
+	''' What to do when a packet is emitted and the background writer queue is full '''
+
+	BLOCK       = auto()
+	''' Wait for the writer to make space in the queue '''
+	DROP_NEWEST = auto()
+	''' Drop the packet being emitted '''
+	DROP_OLDEST = auto()
+	''' Drop the oldest packet in the queue to make space '''
+
+class BackgroundWriter:
+	'''
+	A writer thread that drains a bounded queue of blocks and packets into a stream.
+
+	Warning
+	-------
+	This should not be created manually, it is created by :py:class:`squishy.core.pcapng.PCAPNGStream`.
+
+	Parameters
+	----------
+	sink : BinaryIO
+		The stream the blocks are written to.
+
+	depth : int
+		The maximum number of packets in the queue. (default: 4096)
+
+	policy : OverflowPolicy
+		What to do when the queue is full. (default: OverflowPolicy.BLOCK)
+
+	encoder : PacketEncoder
+		The encoder for the packets, this is only used by the writer thread, so it must not be shared.
+
+	batch_size : int
+		How many bytes of blocks to accumulate before writing them out. (default: 1MiB)
+
+	'''
+
+	def __init__(
+		self, sink: BinaryIO, *, depth: int = 4096, policy: OverflowPolicy = OverflowPolicy.BLOCK, encoder: Any,
+		batch_size: int = 1024 * 1024
+	) -> None:
+		if depth < 1:
+			raise ValueError(f'The queue depth must be at least 1, not {depth}')
+
+		self._sink       = sink
+		self._header     = getattr(sink, 'write_header', sink.write)
+		self._depth      = depth
+		self._policy     = policy
+		self._encoder    = encoder
+		self._batch_size = batch_size
+
+		# NOTE: Producers only hold the lock to check the depth and append to the queue, and the writer only
+		#       holds it to pull a chunk of items off the queue, the encoding and writing is done without it.
+		self._queue: deque[tuple[int | None, bytes, int, bytes]] = deque()
+		self._cond = Condition(Lock())
+		self._wake = Event()
+
+		self._flush_requested = 0
+		self._flush_done      = 0
+		self._stopping        = False
+		self._error: BaseException | None = None
+
+		self.dropped    = 0
+		''' The number of packets that have been dropped due to the queue being full '''
+		self.written    = 0
+		''' The number of blocks that have been written '''
+		self.high_water = 0
+		''' The deepest the queue has been '''
+
+		self._thread = Thread(target = self._run, name = 'squishy-pcapng-writer', daemon = True)
+		self._thread.start()
+
+	@property
+	def queued(self) -> int:
+		''' The number of blocks currently waiting to be written '''
+		return len(self._queue)
+
+	def _check(self) -> None:
+		if self._error is not None:
+			raise RuntimeError('PCAPNG background writer failed') from self._error
+		if self._stopping:
+			raise RuntimeError('PCAPNG background writer closed')
+
+	def _wait_for_space(self) -> None:
+		''' Wait for the writer to make space in the queue, this must be called with the lock held '''
+
+		while len(self._queue) >= self._depth:
+			self._check()
+			self._wake.set()
+			self._cond.wait()
+
+	def _enqueue(self, item: tuple[int | None, bytes, int, bytes]) -> None:
+		''' Append to the queue, this must be called with the lock held '''
+
+		self._queue.append(item)
+		if (depth := len(self._queue)) > self.high_water:
+			self.high_water = depth
+		self._wake.set()
+
+	def put_block(self, block: bytes) -> None:
+		'''
+		Queue an already encoded block.
+
+		This is for things like the section header and interface descriptions, which are never dropped.
+
+		Parameters
+		----------
+		block : bytes
+			The encoded block.
+		'''
+
+		with self._cond:
+			self._check()
+			self._wait_for_space()
+			self._enqueue((None, block, 0, b''))
+
+	def put_packet(self, interface: int, data: bytes, ts: int, options: bytes) -> bool:
+		'''
+		Queue a packet to be encoded into an Enhanced Packet Block by the writer.
+
+		Parameters
+		----------
+		interface : int
+			The interface this packet came from.
+
+		data : bytes
+			The raw packet data, this must not be modified after being queued.
+
+		ts : int
+			The raw timestamp of the packet, already in the resolution of its interface.
+
+		options : bytes
+			The already encoded options for the packet.
+
+		Returns
+		-------
+		bool
+			If the packet was queued, or False if it was dropped.
+		'''
+
+		with self._cond:
+			self._check()
+			# NOTE: The depth check and the append are done with the lock held, otherwise another producer
+			#       can fill the last slot in between and push the queue past its depth.
+			if len(self._queue) >= self._depth:
+				match self._policy:
+					case OverflowPolicy.BLOCK:
+						self._wait_for_space()
+					case OverflowPolicy.DROP_NEWEST:
+						self.dropped += 1
+						return False
+					case OverflowPolicy.DROP_OLDEST:
+						self.dropped += 1
+						# Blocks are never dropped, so if one is at the head, drop this packet instead
+						if self._queue[0][0] is None:
+							return False
+						self._queue.popleft()
+
+			self._enqueue((interface, data, ts, options))
+		return True
+
+	def flush(self) -> None:
+		''' Wait for everything queued to be written out and the sink to be flushed '''
+
+		with self._cond:
+			self._flush_requested += 1
+			request = self._flush_requested
+			self._wake.set()
+			while self._flush_done < request:
+				if self._error is not None:
+					raise RuntimeError('PCAPNG background writer failed') from self._error
+				self._cond.wait()
+
+	def close(self) -> None:
+		''' Write out anything still queued and stop the writer thread '''
+
+		with self._cond:
+			if self._stopping:
+				return
+			self._stopping = True
+		self._wake.set()
+		self._thread.join()
+
+		if self._error is not None:
+			raise RuntimeError('PCAPNG background writer failed') from self._error
+
+	def _drain(self) -> None:
+		''' Encode and write out everything currently in the queue '''
+
+		batch   = bytearray()
+		queue   = self._queue
+		sink    = self._sink
+		encoder = self._encoder
+
+		while len(queue) > 0:
+			with self._cond:
+				chunk = [ queue.popleft() for _ in range(min(len(queue), _CHUNK)) ]
+				self._cond.notify_all()
+
+			for (interface, data, ts, options) in chunk:
+				if interface is None:
+					# Header blocks are written on their own, so the sink can tell them apart
+					if len(batch) > 0:
+						sink.write(batch)
+						batch.clear()
+					self._header(data)
+				else:
+					batch += encoder.encode_epb(interface, data, ts, options = options)
+
+			self.written += len(chunk)
+			if len(batch) >= self._batch_size:
+				sink.write(batch)
+				batch.clear()
+
+		if len(batch) > 0:
+			sink.write(batch)
+
+	def _run(self) -> None:
+		try:
+			while True:
+				self._wake.wait(_IDLE_INTERVAL)
+				self._wake.clear()
+
+				with self._cond:
+					flush    = self._flush_requested
+					stopping = self._stopping
+
+				self._drain()
+				if flush != self._flush_done or stopping:
+					self._sink.flush()
+
+				with self._cond:
+					self._flush_done = flush
+					self._cond.notify_all()
+
+				if stopping and len(self._queue) == 0:
+					break
+		except BaseException as e:
+			with self._cond:
+				self._error = e
+				self._cond.notify_all()
@@ -0,0 +1,250 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains an opt-in tracer for USB control transfers made by :py:class:`squishy.device.SquishyDevice`.
+
+Each transfer is recorded into a fixed-size ring buffer, which can then be used to get latency percentiles per
+request type to try to figure out if slow operations are due to the host, any hubs, or the device itself.
+
+The trace can optionally be written out to a PCAPNG file with the ``LINKTYPE_USB_LINUX_MMAPPED`` link type,
+so that it can be inspected with Wireshark alongside any other USB captures.
+
+'''
+
+import errno
+from collections     import deque
+from collections.abc import Iterable
+from pathlib         import Path
+from struct          import Struct
+from typing          import Final, NamedTuple
+
+from .dfu            import DFURequests
+from .pcapng         import TS_RESOLUTION_NS, LinkType, PCAPNGInterface, PCAPNGStream
+
+__all__ = (
+	'ControlTransfer',
+	'USBControlTracer',
+)
+
+# USB `bmRequestType` bits we care about
+_REQUEST_DIR_IN: Final     = 0x80
+_REQUEST_TYPE_MASK: Final  = 0x60
+_REQUEST_TYPE_CLASS: Final = 0x20
+
+# NOTE: These are the libusb error codes, we can't import them from `usb1` here as that would
+# drag in libusb itself, which we don't want for something that is just bookkeeping.
+_LIBUSB_ERRNO: Final = {
+	-1: errno.EIO,       # LIBUSB_ERROR_IO
+	-4: errno.ENODEV,    # LIBUSB_ERROR_NO_DEVICE
+	-7: errno.ETIMEDOUT, # LIBUSB_ERROR_TIMEOUT
+	-9: errno.EPIPE,     # LIBUSB_ERROR_PIPE
+}
+
+# The Linux usbmon `struct mon_bin_hdr` followed by the 8-byte setup packet
+_USBMON_HEADER: Final       = Struct('<QcBBBHccqiiII8siiII')
+_USB_SETUP: Final           = Struct('<BBHHH')
+_USBMON_XFER_CONTROL: Final = 2
+
+class ControlTransfer(NamedTuple):
+	''' A single traced USB control transfer '''
+
+	timestamp: int
+	''' When the transfer was submitted, in nanoseconds since the Unix epoch '''
+	request_type: int
+	''' The ``bmRequestType`` of the transfer '''
+	request: int
+	''' The ``bRequest`` of the transfer '''
+	value: int
+	''' The ``wValue`` of the transfer '''
+	index: int
+	''' The ``wIndex`` of the transfer '''
+	length: int
+	''' The ``wLength`` of the transfer '''
+	duration: int
+	''' How long the transfer took to complete or fail, in nanoseconds '''
+	status: int
+	''' The libusb result of the transfer, 0 if it was successful '''
+	data: bytes
+	''' The data sent or received during the transfer '''
+
+	@property
+	def is_in(self) -> bool:
+		''' If this was a device-to-host transfer '''
+		return (self.request_type & _REQUEST_DIR_IN) != 0
+
+	@property
+	def kind(self) -> DFURequests | None:
+		''' The DFU request if this was a DFU class request, otherwise None '''
+		if (self.request_type & _REQUEST_TYPE_MASK) == _REQUEST_TYPE_CLASS:
+			try:
+				return DFURequests(self.request)
+			except ValueError:
+				pass
+		return None
+
+def _percentile(samples: list[int], pct: float) -> int:
+	''' Nearest-rank percentile of a pre-sorted list of samples '''
+	rank = max(0, -(-len(samples) * pct // 100) - 1)
+	return samples[int(rank)]
+
+class USBControlTracer:
+	'''
+	Record USB control transfers into a ring buffer, and optionally into a PCAPNG file.
+
+	Parameters
+	----------
+	depth : int
+		The number of transfers to keep around for statistics. (default: 4096)
+
+	pcapng : str | Path | None
+		If set, the path to write a PCAPNG trace of every transfer to.
+
+	Attributes
+	----------
+	total : int
+		The total number of transfers recorded, including any that have fallen out of the ring buffer.
+
+	'''
+
+	def __init__(self, depth: int = 4096, *, pcapng: str | Path | None = None) -> None:
+		if depth < 1:
+			raise ValueError(f'Tracer depth must be at least 1, not {depth}')
+
+		self._transfers: deque[ControlTransfer] = deque(maxlen = depth)
+		self.total = 0
+
+		self._stream: PCAPNGStream | None     = None
+		self._iface: PCAPNGInterface | None  = None
+
+		if pcapng is not None:
+			self._stream = PCAPNGStream(pcapng)
+			self._stream.emit_header(hardware = 'Squishy USB Host', writer = 'Squishy USB Control Tracer')
+			self._iface = self._stream.emit_interface(
+				LinkType.USB_LINUX_MMAPPED, 'squishy-usb', ts_resolution = TS_RESOLUTION_NS
+			)
+
+	@property
+	def transfers(self) -> tuple[ControlTransfer, ...]:
+		''' The transfers currently in the ring buffer, oldest first '''
+		return tuple(self._transfers)
+
+	def record(self, transfer: ControlTransfer, *, bus: int = 0, address: int = 0) -> None:
+		'''
+		Record a completed control transfer.
+
+		Parameters
+		----------
+		transfer : ControlTransfer
+			The transfer to record.
+
+		bus : int
+			The USB bus number of the device, only used for the PCAPNG trace.
+
+		address : int
+			The USB address of the device, only used for the PCAPNG trace.
+		'''
+
+		self._transfers.append(transfer)
+		self.total += 1
+
+		if self._iface is not None:
+			self._emit_usbmon(transfer, bus, address)
+
+	def percentiles(
+		self, request: DFURequests | None = None, pcts: Iterable[float] = (50, 95, 99)
+	) -> dict[float, int]:
+		'''
+		Get the latency percentiles for the transfers in the ring buffer.
+
+		Parameters
+		----------
+		request : DFURequests | None
+			Only consider transfers for this DFU request, or all of them if None.
+
+		pcts : Iterable[float]
+			The percentiles to calculate. (default: (50, 95, 99))
+
+		Returns
+		-------
+		dict[float, int]
+			The latency in nanoseconds for each of the requested percentiles, empty if there were no transfers.
+		'''
+
+		samples = sorted(
+			xfr.duration for xfr in self._transfers if request is None or xfr.kind == request
+		)
+
+		if len(samples) == 0:
+			return {}
+
+		return { pct: _percentile(samples, pct) for pct in pcts }
+
+	def summary(self, pcts: Iterable[float] = (50, 95, 99)) -> dict[DFURequests | None, tuple[int, dict[float, int]]]:
+		'''
+		Get the latency percentiles for every kind of transfer in the ring buffer.
+
+		Parameters
+		----------
+		pcts : Iterable[float]
+			The percentiles to calculate. (default: (50, 95, 99))
+
+		Returns
+		-------
+		dict[DFURequests | None, tuple[int, dict[float, int]]]
+			The number of transfers and their latency percentiles in nanoseconds keyed by DFU request, any
+			non-DFU requests are lumped together under None.
+		'''
+
+		pcts = tuple(pcts)
+		by_kind: dict[DFURequests | None, list[int]] = {}
+
+		for xfr in self._transfers:
+			by_kind.setdefault(xfr.kind, []).append(xfr.duration)
+
+		for samples in by_kind.values():
+			samples.sort()
+
+		return {
+			kind: (len(samples), { pct: _percentile(samples, pct) for pct in pcts })
+			for kind, samples in by_kind.items()
+		}
+
+	def close(self) -> None:
+		''' Flush and close the PCAPNG trace if there is one '''
+		if self._stream is not None:
+			self._stream.close()
+			self._stream = None
+			self._iface  = None
+
+	def _emit_usbmon(self, transfer: ControlTransfer, bus: int, address: int) -> None:
+		'''
+		Emit the submission and completion of the transfer as usbmon records.
+
+		For an OUT transfer, the data goes along with the submission, and for an IN
+		transfer it goes along with the completion, just like the kernel does it.
+		'''
+
+		assert self._iface is not None
+
+		urb_id = self.total
+		setup  = _USB_SETUP.pack(
+			transfer.request_type, transfer.request, transfer.value, transfer.index, transfer.length
+		)
+		epnum  = _REQUEST_DIR_IN if transfer.is_in else 0x00
+		status = -_LIBUSB_ERRNO.get(transfer.status, errno.EPROTO) if transfer.status != 0 else 0
+
+		submit_data   = b'' if transfer.is_in else transfer.data
+		complete_data = transfer.data if transfer.is_in else b''
+
+		for (ts, kind, flag_setup, urb_status, data) in (
+			(transfer.timestamp, b'S', b'\x00', -errno.EINPROGRESS, submit_data),
+			(transfer.timestamp + transfer.duration, b'C', b'-', status, complete_data),
+		):
+			(ts_sec, ts_nsec) = divmod(ts, 1_000_000_000)
+			header = _USBMON_HEADER.pack(
+				urb_id, kind, _USBMON_XFER_CONTROL, epnum, address, bus, flag_setup,
+				b'\x00' if len(data) > 0 else (b'<' if transfer.is_in else b'>'),
+				ts_sec, ts_nsec // 1000, urb_status, transfer.length, len(data), setup, 0, 0, 0, 0
+			)
+
+			self._iface.emit_packet(header + data, ts)
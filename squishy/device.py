@@ -15,23 +15,26 @@ host OS will treat Squishy like any other UAS device, assuming it has drivers fo
 '''
 
 import logging                           as log
-from collections.abc                     import Callable, Iterable
+from collections.abc                     import Callable, Generator, Iterable
 from contextlib                          import contextmanager
+from dataclasses                         import dataclass
 from datetime                            import datetime, timezone
-from itertools                           import zip_longest
-from time                                import sleep
-from typing                              import TYPE_CHECKING, Self, TypeAlias, TypeVar
+from time                                import monotonic, perf_counter_ns, sleep, time_ns
+from typing                              import TYPE_CHECKING, Any, Self, TypeAlias, TypeVar
 
+from construct                           import Container
 from rich.progress                       import Progress
-from usb1                                import USBContext, USBDevice, USBError
+from usb1                                import USBContext, USBDevice, USBError, USBInterfaceSetting
 from usb1.libusb1                        import (
-	LIBUSB_ERROR_IO, LIBUSB_ERROR_NO_DEVICE, LIBUSB_RECIPIENT_INTERFACE, LIBUSB_REQUEST_TYPE_CLASS
+	LIBUSB_ERROR_IO, LIBUSB_ERROR_NO_DEVICE, LIBUSB_ERROR_NOT_FOUND, LIBUSB_RECIPIENT_INTERFACE,
+	LIBUSB_REQUEST_TYPE_CLASS
 )
 from usb_construct.types                 import LanguageIDs
-from usb_construct.types.descriptors.dfu import FunctionalDescriptor
+from usb_construct.types.descriptors.dfu import DFUManifestationTolerant, DFUWillDetach, FunctionalDescriptor
 
 from .core.config                        import USB_APP_PID, USB_DFU_PID, USB_VID
 from .core.dfu                           import DFU_CLASS, DFURequests, DFUState, DFUStatus
+from .core.usbtrace                      import ControlTransfer, USBControlTracer
 from .gateware                           import AVAILABLE_PLATFORMS, SquishyPlatformType
 
 __all__ = (
@@ -47,8 +50,35 @@ _LIBUSB_CTX: USBContext | None = None
 # Type Alias to simplify life
 DeviceContainer: TypeAlias = tuple[str, tuple[int, int], USBDevice]
 
+# The default timeout for USB transfers in ms
+_DEFAULT_TIMEOUT = 2500
+
+# How long to wait between looking for a device to come back after it detached, in seconds
+_REATTACH_POLL_INTERVAL = 0.01
+
+# The shortest time to wait between polling the DFU state, in seconds
+_DFU_POLL_INTERVAL = 0.05
+# How many times to poll a device that is still busy writing or manifesting an image before giving up on it
+_DFU_MAX_POLLS = 200
+
 T = TypeVar('T')
 
+def _libusb_context() -> USBContext:
+	''' Get the shared libusb context, creating it if needed '''
+
+	# icky icky icky icky
+	global _LIBUSB_CTX
+
+	# If we don't have a libusb context, make one.
+	if _LIBUSB_CTX is None:
+		_LIBUSB_CTX = USBContext()
+
+	return _LIBUSB_CTX
+
+def _is_squishy(dev: USBDevice) -> bool:
+	''' Check if the given USB device is a Squishy, in either application or DFU mode '''
+	return dev.getVendorID() == USB_VID and dev.getProductID() in (USB_APP_PID, USB_DFU_PID)
+
 # This is here because `next(filter(...), None)` doesn't propagate types properly
 # TODO(aki): Maybe move to a helpers/utility module?
 def _find_if(collection: Iterable[T], predicate: Callable[[T], bool]) -> T | None:
@@ -57,10 +87,6 @@ def _find_if(collection: Iterable[T], predicate: Callable[[T], bool]) -> T | Non
 			return item
 	return None
 
-# TODO(aki): This kinda sucks, can we directly slice bytearrays?
-def _chunker(size: int, data: Iterable[T]):
-	return zip_longest(*[iter(data)] * size)
-
 @contextmanager
 def usb_device_handle(dev: USBDevice):
 	''' Wrap the usb1 dev.open()/hndl.close() in a context manager '''
@@ -71,6 +97,49 @@ def usb_device_handle(dev: USBDevice):
 		handle.close()
 
 
+# NOTE: The DFU state machine is only written once, as generators that yield these steps whenever they need to do
+#       any I/O, and both `SquishyDevice` and `AsyncSquishyDevice` then run them, each in their own way
+@dataclass(frozen = True)
+class _ControlRead:
+	''' Do a control read, the step gets the data read '''
+
+	request_type: int
+	request: int
+	value: int
+	index: int
+	length: int
+
+@dataclass(frozen = True)
+class _ControlWrite:
+	''' Do a control write, the step gets the number of bytes written '''
+
+	request_type: int
+	request: int
+	value: int
+	index: int
+	data: bytes | bytearray
+
+@dataclass(frozen = True)
+class _Sleep:
+	''' Wait for a while, in seconds '''
+
+	seconds: float
+
+@dataclass(frozen = True)
+class _Reset:
+	''' USB reset the device '''
+
+@dataclass(frozen = True)
+class _Reattach:
+	''' Wait for the device to come back and re-attach to it, the step gets if it did, see ``_reattach`` '''
+
+	pid: int | None
+	timeout: int
+
+_DFUStep: TypeAlias = _ControlRead | _ControlWrite | _Sleep | _Reset | _Reattach
+_DFUSteps: TypeAlias = Generator[_DFUStep, Any, T]
+
+
 class SquishyDevice:
 	'''
 	Squishy Hardware Device
@@ -121,6 +190,56 @@ class SquishyDevice:
 
 		return (major, minor)
 
+	def _control_read(
+		self, request_type: int, request: int, value: int, index: int, length: int, timeout: int
+	) -> bytes:
+		''' Issue a control read to the device, tracing it if we have a tracer '''
+
+		if self._tracer is None:
+			return self._usb_handle.controlRead(request_type, request, value, index, length, timeout)
+
+		data   = b''
+		status = 0
+		start  = time_ns()
+		begin  = perf_counter_ns()
+		try:
+			data = self._usb_handle.controlRead(request_type, request, value, index, length, timeout)
+			return data
+		except USBError as e:
+			status = e.value
+			raise
+		finally:
+			self._trace(ControlTransfer(
+				start, request_type, request, value, index, length, perf_counter_ns() - begin, status, bytes(data)
+			))
+
+	def _control_write(
+		self, request_type: int, request: int, value: int, index: int, data: bytes | bytearray, timeout: int
+	) -> int:
+		''' Issue a control write to the device, tracing it if we have a tracer '''
+
+		if self._tracer is None:
+			return self._usb_handle.controlWrite(request_type, request, value, index, data, timeout)
+
+		status = 0
+		start  = time_ns()
+		begin  = perf_counter_ns()
+		try:
+			return self._usb_handle.controlWrite(request_type, request, value, index, data, timeout)
+		except USBError as e:
+			status = e.value
+			raise
+		finally:
+			self._trace(ControlTransfer(
+				start, request_type, request, value, index, len(data), perf_counter_ns() - begin, status, bytes(data)
+			))
+
+	def _trace(self, transfer: ControlTransfer) -> None:
+		''' Hand a finished transfer off to the tracer along with where the device lives on the bus '''
+
+		assert self._tracer is not None
+		self._tracer.record(transfer, bus = self._dev.getBusNumber(), address = self._dev.getDeviceAddress())
+
 	def _get_dfu_interface(self) -> int | None:
 		'''
 		Get the USB Interface number that matches ``DFU_CLASS``
@@ -151,19 +270,19 @@ class SquishyDevice:
 
 		return self._dfu_iface
 
-	def _get_dfu_status(self) -> tuple[DFUStatus, DFUState]:
+	def _claim_dfu_interface(self) -> int:
 		'''
-		Get the state and status for the DFU endpoint.
+		Get the DFU interface and make sure we have it claimed.
 
 		Returns
 		-------
-		tuple[DFUStatus, DFUState]
-			The status and state of the DFU endpoint.
+		int
+			The DFU interface number.
 
 		Raises
 		------
 		RuntimeError
-			If the DFU interface is unknown, or the DFU get status request fails or times out.
+			If the DFU interface is unknown.
 		'''
 
 		# Try to get the DFU interface
@@ -174,63 +293,119 @@ class SquishyDevice:
 		# Ensure we have our grubby little paws on it
 		self._ensure_iface_claimed(interface_id)
 
+		return interface_id
+
+	def _dfu_status_steps(self) -> _DFUSteps[tuple[DFUStatus, int, DFUState]]:
+		''' The steps for :py:meth:`_get_dfu_status`, which also give the ``bwPollTimeout`` in milliseconds '''
+
+		interface_id = self._claim_dfu_interface()
+
 		# Try to request the status
-		data: bytearray | None = self._usb_handle.controlRead(
+		data: bytes | None = yield _ControlRead(
 			LIBUSB_REQUEST_TYPE_CLASS | LIBUSB_RECIPIENT_INTERFACE,
 			DFURequests.GetStatus,
 			0,
 			interface_id,
-			6,
-			self._timeout
+			6
 		)
 
 		# If we didn't get any data back (likely a timeout) then bail
-		if data is None:
+		if data is None or len(data) != 6:
 			raise RuntimeError(f'Unable to read DFU status from `{self._usb_dev_str}` on interface `{interface_id}`')
 
-		# Otherwise, return the State and Status
-		return (DFUStatus(data[0]), DFUState(data[4]))
+		# Otherwise, return the Status, how long to wait before polling again, and the State
+		return (DFUStatus(data[0]), int.from_bytes(data[1:4], byteorder = 'little'), DFUState(data[4]))
 
-	def _get_dfu_state(self) -> DFUState:
+	def _get_dfu_status(self) -> tuple[DFUStatus, DFUState]:
 		'''
-		Get the state for the DFU endpoint.
+		Get the state and status for the DFU endpoint.
 
 		Returns
 		-------
-		DFUState
-			The state of the DFU endpoint.
+		tuple[DFUStatus, DFUState]
+			The status and state of the DFU endpoint.
 
 		Raises
 		------
 		RuntimeError
-			If the DFU interface is unknown, or the DFU get state request fails or times out.
+			If the DFU interface is unknown, or the DFU get status request fails or times out.
 		'''
 
-		# Try to get the DFU interface
-		interface_id = self._get_dfu_interface()
-		if interface_id is None:
-			raise RuntimeError(f'Unable to get DFU interface id for {self._usb_dev_str}')
+		(status, _, state) = self._run(self._dfu_status_steps())
+		return (status, state)
 
-		# Ensure we have our grubby little paws on it
-		self._ensure_iface_claimed(interface_id)
+	def _dfu_state_steps(self) -> _DFUSteps[DFUState]:
+		''' The steps for :py:meth:`_get_dfu_state` '''
 
-		# Try to request the status
-		data: bytearray | None = self._usb_handle.controlRead(
+		interface_id = self._claim_dfu_interface()
+
+		# Try to request the state
+		data: bytes | None = yield _ControlRead(
 			LIBUSB_REQUEST_TYPE_CLASS | LIBUSB_RECIPIENT_INTERFACE,
 			DFURequests.GetState,
 			0,
 			interface_id,
-			1,
-			self._timeout
+			1
 		)
 
 		# If we didn't get any data back (likely a timeout) then bail
-		if data is None:
+		if data is None or len(data) != 1:
 			raise RuntimeError(f'Unable to read DFU state from `{self._usb_dev_str}` on interface `{interface_id}`')
 
-		# Otherwise, return the State and Status
 		return DFUState(data[0])
 
+	def _get_dfu_state(self) -> DFUState:
+		'''
+		Get the state for the DFU endpoint.
+
+		Returns
+		-------
+		DFUState
+			The state of the DFU endpoint.
+
+		Raises
+		------
+		RuntimeError
+			If the DFU interface is unknown, or the DFU get state request fails or times out.
+		'''
+
+		return self._run(self._dfu_state_steps())
+
+	def _dfu_detach_steps(self) -> _DFUSteps[bool]:
+		''' The steps for :py:meth:`_send_dfu_detach` '''
+
+		interface_id = self._claim_dfu_interface()
+
+		func_desc   = self._get_dfu_func_desc()
+		will_detach = (func_desc.bmAttributes & DFUWillDetach.YES) != 0
+
+		# Try to poke the device to get it to reboot, and clean up the DFU interface after
+		try:
+			sent: int = yield _ControlWrite(
+				LIBUSB_REQUEST_TYPE_CLASS | LIBUSB_RECIPIENT_INTERFACE,
+				DFURequests.Detach,
+				func_desc.wDetachTimeOut,
+				interface_id,
+				b''
+			)
+		except USBError as e:
+			# If the error is one of the not-actually-an-error errors caused by the device rebooting, palm it off
+			if e.value in (LIBUSB_ERROR_IO, LIBUSB_ERROR_NO_DEVICE):
+				sent = 0
+			# Otherwise bubble it up
+			else:
+				raise RuntimeError(
+					f'Unable to send DFU detach to `{self._usb_dev_str}` on interface `{interface_id}`'
+				)
+		finally:
+			self._ensure_iface_released(interface_id)
+
+		# If the device doesn't detach on its own, it's waiting on us to reset it [DFU 1.1, 5.1]
+		if not will_detach:
+			yield _Reset()
+
+		return sent == 0
+
 	def _send_dfu_detach(self) -> bool:
 		'''
 		Invoke a DFU detach.
@@ -246,43 +421,76 @@ class SquishyDevice:
 			If the DFU interface is unknown, or the DFU control request times out.
 		'''
 
-		# Try to get the DFU interface
-		interface_id = self._get_dfu_interface()
-		if interface_id is None:
-			raise RuntimeError(f'Unable to get DFU interface id for {self._usb_dev_str}')
+		return self._run(self._dfu_detach_steps())
 
-		# Ensure we have the DFU interface, and clean it up after
-		with self._ensure_iface(interface_id):
-			# Try to poke the device to get it to reboot
-			try:
-				sent: int = self._usb_handle.controlWrite(
-					LIBUSB_REQUEST_TYPE_CLASS | LIBUSB_RECIPIENT_INTERFACE,
-					DFURequests.Detach,
-					0,
-					interface_id,
-					bytearray(),
-					self._timeout
-				)
-			except USBError as e:
-				# If the error is one of the not-actually-an-error errors caused by the device rebooting, palm it off
-				if e.value in (LIBUSB_ERROR_IO, LIBUSB_ERROR_NO_DEVICE):
-					sent = 0
-				# Otherwise bubble it up
-				else:
-					raise RuntimeError(
-						f'Unable to send DFU detach to `{self._usb_dev_str}` on interface `{interface_id}`'
-					)
+	def _usb_reset(self) -> None:
+		''' Issue a USB bus reset to the device, it is expected to vanish from the bus while doing so. '''
 
-		return sent == 0
+		try:
+			self._usb_handle.resetDevice()
+		except USBError as e:
+			if e.value not in (LIBUSB_ERROR_NOT_FOUND, LIBUSB_ERROR_NO_DEVICE):
+				raise
 
-	def _get_dfu_altmodes(self) -> dict[int, str]:
+	def _reattach(self, pid: int | None, timeout: int) -> bool:
 		'''
-		Collect and return all of the DFU alt-modes and their name from the device.
+		Wait for the device to come back after a detach or reset and re-attach to it.
+
+		Parameters
+		----------
+		pid : int | None
+			The USB PID we expect the device to come back with, or None if any Squishy PID will do.
+
+		timeout : int
+			How long to wait for the device to come back in ms.
 
 		Returns
 		-------
-		dict[int, str]
-			A mapping of the alt-mode endpoint and it's name.
+		bool
+			True if the device came back in time, otherwise False.
+		'''
+
+		self._release_device()
+
+		# Rather than sleeping for the worst case, keep an eye out for the device to show back up
+		deadline = monotonic() + (timeout / 1000)
+		while (device := _find_if(self.enumerate(), lambda dev: self._is_same_device(dev, pid))) is None:
+			if monotonic() > deadline:
+				return False
+			sleep(_REATTACH_POLL_INTERVAL)
+
+		(_, _, dev) = device
+		self._attach_device(dev)
+
+		return True
+
+	def _release_device(self) -> None:
+		''' Close the device and its handle, forgetting everything we know about its configuration '''
+
+		self._usb_handle.close()
+		self._dev.close()
+		self._dfu_iface = None
+		self._dfu_cfg   = None
+		self._claimed_interfaces.clear()
+
+	def _attach_device(self, dev: USBDevice) -> None:
+		''' Attach to a (possibly new) instance of the device after it re-enumerated '''
+
+		self._dev        = dev
+		self._usb_handle = self._dev.open()
+
+	def _is_same_device(self, dev: DeviceContainer, pid: int | None = None) -> bool:
+		''' Check if the enumerated device is us, and optionally if it has the given USB PID '''
+		return dev[0] == self.serial and (pid is None or dev[2].getProductID() == pid)
+
+	def _get_dfu_alt_settings(self) -> list[USBInterfaceSetting]:
+		'''
+		Get all of the alt-mode settings for the DFU interface.
+
+		Returns
+		-------
+		list[usb1.USBInterfaceSetting]
+			The settings for each alt-mode of the DFU interface.
 
 		Raises
 		------
@@ -307,9 +515,28 @@ class SquishyDevice:
 		if interface is None:
 			raise AssertionError('Failed to re-locate USB DFU interface')
 
+		return list(interface)
+
+	def _get_dfu_altmodes(self) -> dict[int, str]:
+		'''
+		Collect and return all of the DFU alt-modes and their name from the device.
+
+		Returns
+		-------
+		dict[int, str]
+			A mapping of the alt-mode endpoint and it's name.
+
+		Raises
+		------
+		RuntimeError
+			If the DFU interface is unknown, or the DFU control request times out.
+		AssertionError
+			If we lose the DFU configuration or interface somehow.
+		'''
+
 		alt_modes: dict[int, str] = {}
 		# Iterate over all of the alt-modes
-		for alt in interface:
+		for alt in self._get_dfu_alt_settings():
 			mode_id: int = alt.getAlternateSetting()
 			# Try to get the alt-mode's string descriptor
 			mode_name = self._usb_handle.getStringDescriptor(
@@ -321,14 +548,14 @@ class SquishyDevice:
 
 		return alt_modes
 
-	def _get_dfu_tx_size(self) -> int | None:
+	def _get_dfu_func_desc(self) -> Container:
 		'''
-		Get the DFU transaction size in bytes.
+		Get the DFU functional descriptor for the DFU interface.
 
 		Returns
 		-------
-		int | None
-			The DFU transaction size in bytes, or if unable to be found None
+		construct.Container
+			The parsed DFU functional descriptor.
 
 		Raises
 		------
@@ -338,74 +565,62 @@ class SquishyDevice:
 			If we lose the DFU configuration or interface somehow.
 		'''
 
-		# Try to get the DFU interface
-		interface_id = self._get_dfu_interface()
-		if interface_id is None:
-			raise RuntimeError(f'Unable to get DFU interface id for {self._usb_dev_str}')
-
-		cfg_id = self._dfu_cfg
-
-		config = _find_if(self._dev.iterConfigurations(), lambda cfg: cfg.getConfigurationValue() == cfg_id)
-		if config is None:
-			raise AssertionError('Failed to re-locate USB DFU configuration')
-
-		interface = _find_if(config.iterInterfaces(), lambda ifc: next(iter(ifc)).getNumber() == interface_id)
-		if interface is None:
-			raise AssertionError('Failed to re-locate USB DFU interface')
-
 		# Get the first alt-mode
-		settings = next(iter(interface))
+		settings = self._get_dfu_alt_settings()[0]
 		extra    = settings.getExtra()
 
 		# Check to ensure there is only one functional descriptor
 		if len(extra) != 1:
 			raise RuntimeError(f'Expected only one functional descriptor in alt-mode, found {len(extra)}')
 
-		# Pull out the descriptor and get the transfer size
-		func_desc = FunctionalDescriptor.parse(extra[0])
-		if TYPE_CHECKING:
-			assert isinstance(func_desc.wTransferSize, int)
-
-		return func_desc.wTransferSize
+		return FunctionalDescriptor.parse(extra[0])
 
-	def _enter_dfu(self) -> bool:
+	def _get_dfu_tx_size(self) -> int | None:
 		'''
-		Instruct the device to enter DFU mode.
+		Get the DFU transaction size in bytes.
 
 		Returns
 		-------
-		bool
-			True if we managed to enter DFU mode, False otherwise.
+		int | None
+			The DFU transaction size in bytes, or if unable to be found None
+
+		Raises
+		------
+		RuntimeError
+			If the DFU interface is unknown, or the DFU control request times out.
+		AssertionError
+			If we lose the DFU configuration or interface somehow.
 		'''
 
+		# Pull out the descriptor and get the transfer size
+		func_desc = self._get_dfu_func_desc()
+		if TYPE_CHECKING:
+			assert isinstance(func_desc.wTransferSize, int)
+
+		return func_desc.wTransferSize
+
+	def _dfu_enter_steps(self) -> _DFUSteps[bool]:
+		''' The steps for :py:meth:`_enter_dfu` '''
+
 		# Check to see if we're not already in DFU
-		if self._get_dfu_state() == DFUState.AppIdle:
-			# We're not, so poke at the device to get use there
-			self._send_dfu_detach() # BUG(aki): We should do something about this return value, huh?
-			# Flush the device and handles
-			self._usb_handle.close()
-			self._dev.close()
-			self._dfu_iface = None
-			self._dfu_cfg   = None
+		if (yield from self._dfu_state_steps()) == DFUState.AppIdle:
+			detach_timeout: int = self._get_dfu_func_desc().wDetachTimeOut
 
-			device: DeviceContainer | None = None
+			# We're not, so poke at the device to get use there
+			if not (yield from self._dfu_detach_steps()):
+				log.warning(f'Device `{self.serial}` did not acknowledge the DFU detach')
 
-			# Re-enumerate the devices after a short timeout
+			# The device has up to `wDetachTimeOut` to go away, and then it needs to enumerate again
 			log.debug(f'Waiting for `{self.serial}` to come back')
-			sleep(self._timeout / 1000)
-			# BUG(aki): This *might* spin forever in some cases
-			while device is None:
-				device = _find_if(self.enumerate(), lambda dev: dev[0] == self.serial)
-
-			# We have the device back, re-attach
-			log.debug('Device came back, re-attaching')
-			(_, _, dev) = device
+			if not (yield _Reattach(USB_DFU_PID, detach_timeout + self._timeout)):
+				log.error(f'Timed out waiting for `{self.serial}` to come back in DFU mode')
+				return False
 
-			self._dev = dev
-			self._usb_handle = self._dev.open()
+			# We have the device back
+			log.debug('Device came back, re-attached')
 
 		# Now that we *should* be in DFU make sure we are actually there
-		dfu_state = self._get_dfu_state()
+		dfu_state = yield from self._dfu_state_steps()
 		log.debug(f'DFU State: {dfu_state}')
 
 		if dfu_state != DFUState.DFUIdle:
@@ -413,7 +628,35 @@ class SquishyDevice:
 			return False
 		return True
 
-	def _send_dfu_download(self, data: bytearray, chunk_num: int) -> bool:
+	def _enter_dfu(self) -> bool:
+		'''
+		Instruct the device to enter DFU mode.
+
+		Returns
+		-------
+		bool
+			True if we managed to enter DFU mode, False otherwise.
+		'''
+
+		return self._run(self._dfu_enter_steps())
+
+	def _dfu_download_steps(self, data: bytes | bytearray, chunk_num: int) -> _DFUSteps[bool]:
+		''' The steps for :py:meth:`_send_dfu_download` '''
+
+		interface_id = self._claim_dfu_interface()
+
+		# Stuff the data in the endpoints face
+		sent: int = yield _ControlWrite(
+			LIBUSB_REQUEST_TYPE_CLASS | LIBUSB_RECIPIENT_INTERFACE,
+			DFURequests.Download,
+			chunk_num,
+			interface_id,
+			data
+		)
+
+		return sent == len(data)
+
+	def _send_dfu_download(self, data: bytes | bytearray, chunk_num: int) -> bool:
 		'''
 		Push a chunk of data to the DFU endpoint. In DFU terminology this is a "Download"
 
@@ -428,25 +671,228 @@ class SquishyDevice:
 			If the DFU interface is unknown, or the DFU control request times out.
 		'''
 
-		# Try to get the DFU interface
-		interface_id = self._get_dfu_interface()
-		if interface_id is None:
-			raise RuntimeError(f'Unable to get DFU interface id for {self._usb_dev_str}')
+		return self._run(self._dfu_download_steps(data, chunk_num))
 
-		# Ensure we have our grubby little paws on it
-		self._ensure_iface_claimed(interface_id)
+	def _dfu_settle_steps(self, busy: tuple[DFUState, ...], poll_timeout: int, what: str) -> _DFUSteps[DFUState]:
+		'''
+		Poll the DFU state until the device is no longer in any of the ``busy`` states.
 
-		# Stuff the data in the endpoints face
-		sent: int = self._usb_handle.controlWrite(
-			LIBUSB_REQUEST_TYPE_CLASS | LIBUSB_RECIPIENT_INTERFACE,
-			DFURequests.Download,
-			chunk_num,
-			interface_id,
-			data,
-			self._timeout
+		The device is polled at most every ``bwPollTimeout``, and only so many times, so a device that is stuck
+		doesn't hang us forever.
+
+		Parameters
+		----------
+		busy : tuple[DFUState, ...]
+			The states to wait for the device to leave.
+
+		poll_timeout : int
+			The ``bwPollTimeout`` from the last status in milliseconds.
+
+		what : str
+			What the device is busy doing, for the error.
+
+		Returns
+		-------
+		DFUState
+			The state the device ended up in.
+
+		Raises
+		------
+		RuntimeError
+			If the device is still busy after too many polls.
+		'''
+
+		poll_interval = max(poll_timeout / 1000, _DFU_POLL_INTERVAL)
+		for _ in range(_DFU_MAX_POLLS):
+			state = yield from self._dfu_state_steps()
+			if state not in busy:
+				return state
+			yield _Sleep(poll_interval)
+
+		raise RuntimeError(
+			f'Device {self._usb_dev_str} was still in {state.name} after {_DFU_MAX_POLLS * poll_interval:.1f}s '
+			f'of {what}'
 		)
 
-		return sent == len(data)
+	def _dfu_download_image_steps(
+		self, interface_id: int, trans_size: int, altmode: int, data: bytes, progress: Progress | None,
+		manifest_tolerant: bool = True
+	) -> _DFUSteps[bool]:
+		'''
+		Download a single image into the given alt-mode, the device must already be in DFU mode.
+
+		Returns
+		-------
+		bool
+			True if the device took the whole image and went back to idle, or is waiting on a reset if it is not
+			manifestation tolerant, otherwise False.
+		'''
+
+		# Set (or at least try to) the alt-mode for the DFU interface
+		self._usb_handle.setInterfaceAltSetting(interface_id, altmode)
+
+		# if there is a progress bar, add task to it
+		if progress is not None:
+			prog_task = progress.add_task(f'Programming alt-mode {altmode}', start = True, total = len(data))
+
+		chunk_num = 0
+		poll_timeout = 0
+		# Iterate over our chunks
+		for (chunk_num, offset) in enumerate(range(0, len(data), trans_size)):
+			chunk = data[offset:offset + trans_size]
+
+			# Try to send the data
+			if not (yield from self._dfu_download_steps(chunk, chunk_num)):
+				log.error(f'DFU transaction failed, was unable to send any/all data for chunk {chunk_num}')
+				return False
+			# Update the upload task if we can
+			if progress is not None:
+				progress.update(prog_task, advance = len(chunk))
+
+			# Let DFU chew on the chunk and settle a bit
+			yield from self._dfu_settle_steps((DFUState.DlBusy, ), poll_timeout, f'writing chunk {chunk_num}')
+
+			# Get the status of the chunk  upload
+			_, poll_timeout, state = yield from self._dfu_status_steps()
+
+			if state != DFUState.DlSync:
+				log.error(f'DFU State is {state} not DlSync, aborting')
+				return False
+
+		chunk_num += 1
+
+		# NOTE: The bootloader commits each slot on the zero-length download, so we still need one per image
+		# Flush and make sure we go idle
+		yield from self._dfu_download_steps(b'', chunk_num)
+
+		# The device might still be storing the last few blocks it has buffered and then committing the image
+		yield from self._dfu_settle_steps(
+			(DFUState.DFUMFSync, DFUState.DFUManifest), poll_timeout, f'manifesting alt-mode {altmode}'
+		)
+
+		_, _, state = yield from self._dfu_status_steps()
+
+		# If the device is not manifestation tolerant, it is now waiting on us to reset it [DFU 1.1, A.1]
+		if not manifest_tolerant:
+			log.debug(f'Device is not manifestation tolerant, ended up in {state}')
+		elif state != DFUState.DFUIdle:
+			log.error('Device did not go idle after upload')
+			return False
+
+		log.debug(f'Wrote {chunk_num} chunks to device')
+
+		# Finally, clean up the progress bar if we were using it
+		if progress is not None:
+			progress.update(prog_task, completed = True)
+			progress.remove_task(prog_task)
+
+		return True
+
+	def _dfu_reset_steps(self, wait: bool) -> _DFUSteps[bool]:
+		''' The steps for :py:meth:`reset` '''
+
+		if not wait:
+			return (yield from self._dfu_detach_steps())
+
+		detach_timeout: int = self._get_dfu_func_desc().wDetachTimeOut
+
+		if not (yield from self._dfu_detach_steps()):
+			return False
+
+		return (yield _Reattach(None, detach_timeout + self._timeout))
+
+	def _dfu_upload_steps(
+		self, images: Iterable[tuple[int, bytes]], progress: Progress | None, reset: bool
+	) -> _DFUSteps[bool]:
+		''' The steps for :py:meth:`upload_images` '''
+
+		# First try to enter DFU mode
+		if not (yield from self._dfu_enter_steps()):
+			return False
+
+		interface_id = self._claim_dfu_interface()
+
+		# Try and get the transaction size so we know how big to make our chunks
+		func_desc  = self._get_dfu_func_desc()
+		trans_size = func_desc.wTransferSize
+		if trans_size is None:
+			raise RuntimeError(f'Unable to determine DFU transaction size for `{self._usb_dev_str}`')
+
+		manifest_tolerant = (func_desc.bmAttributes & DFUManifestationTolerant.YES) != 0
+
+		log.debug(f'DFU Transfer size: {trans_size}')
+		log.debug(f'DFU Manifestation tolerant: {manifest_tolerant}')
+
+		for (idx, (altmode, data)) in enumerate(images):
+			# A device that can't manifest in place needs a reset before it will take the next image
+			if idx > 0 and not manifest_tolerant:
+				yield _Reset()
+				if not (yield _Reattach(USB_DFU_PID, self._timeout)) or not (yield from self._dfu_enter_steps()):
+					log.error(f'Device `{self.serial}` did not come back after manifestation')
+					return False
+				self._ensure_iface_claimed(interface_id)
+
+			log.debug(f'Writing {len(data)} bytes to alt-mode {altmode}')
+			if not (yield from self._dfu_download_image_steps(
+				interface_id, trans_size, altmode, data, progress, manifest_tolerant
+			)):
+				return False
+
+		if reset:
+			log.debug('Resetting device')
+			return (yield from self._dfu_detach_steps())
+
+		return True
+
+	def _run(self, steps: _DFUSteps[T]) -> T:
+		'''
+		Run the steps of part of the DFU state machine to completion, blocking on each one.
+
+		The result of each step is sent back into the generator, and if the step fails the exception is thrown
+		into it instead, so it can be handled as if the I/O had been done in place.
+
+		Parameters
+		----------
+		steps : _DFUSteps[T]
+			The steps to run.
+
+		Returns
+		-------
+		T
+			What the steps returned.
+		'''
+
+		(result, error) = (None, None)
+		while True:
+			try:
+				step = steps.send(result) if error is None else steps.throw(error)
+			except StopIteration as e:
+				return e.value
+
+			(result, error) = (None, None)
+			try:
+				result = self._do_step(step)
+			except Exception as e:
+				error = e
+
+	def _do_step(self, step: _DFUStep) -> Any:
+		''' Do the I/O for a single step of the DFU state machine '''
+
+		match step:
+			case _ControlRead():
+				return self._control_read(
+					step.request_type, step.request, step.value, step.index, step.length, self._timeout
+				)
+			case _ControlWrite():
+				return self._control_write(
+					step.request_type, step.request, step.value, step.index, step.data, self._timeout
+				)
+			case _Sleep():
+				sleep(step.seconds)
+			case _Reset():
+				self._usb_reset()
+			case _Reattach():
+				return self._reattach(step.pid, step.timeout)
 
 	@contextmanager
 	def _ensure_iface(self, iface_id: int):
@@ -494,10 +940,13 @@ class SquishyDevice:
 		''' The formatted USB device string in the form of ``VID:PID @ BUSID``  '''
 		return f'{self._dev.getVendorID():04x}:{self._dev.getProductID():04x} @ {self._dev.getBusNumber()}'
 
-	def __init__(self, dev: USBDevice, serial: str, timeout: int = 2500) -> None:
+	def __init__(
+		self, dev: USBDevice, serial: str, timeout: int = _DEFAULT_TIMEOUT, *, tracer: USBControlTracer | None = None
+	) -> None:
 		# USB Device and handle
 		self._dev        = dev
 		self._usb_handle = self._dev.open()
+		self._tracer     = tracer
 		if not self.can_dfu():
 			raise RuntimeError(f'The device {self._usb_dev_str} is not DFU capable.')
 
@@ -525,7 +974,9 @@ class SquishyDevice:
 		return f'Squishy rev{self.rev[0]}.{self.rev[1]} SN: {self.serial}'
 
 	@classmethod
-	def get_device(cls: type[Self], *, serial: str | None = None, first: bool = True) -> Self | None:
+	def get_device(
+		cls: type[Self], *, serial: str | None = None, first: bool = True, tracer: USBControlTracer | None = None
+	) -> Self | None:
 		'''
 		Returns an instance of the first :py:class:`SquishyDevice` attached to the system,
 		or if ``serial`` is specified the device with that serial number, if possible.
@@ -542,6 +993,9 @@ class SquishyDevice:
 			If there is more than one Squishy attached, and no serial number is specified,
 			return the first that occurs in the list.
 
+		tracer : squishy.core.usbtrace.USBControlTracer | None
+			If set, all control transfers to the device are recorded with this tracer.
+
 		Returns
 		-------
 		SquishyDevice | None
@@ -549,9 +1003,23 @@ class SquishyDevice:
 
 		'''
 
-		# Get all attached Squishy devices
-		attached = SquishyDevice.enumerate()
-		count    = len(attached)
+		# Get all attached Squishy devices and pick the one we want
+		found_device = cls._select_device(SquishyDevice.enumerate(), serial, first)
+		if found_device is None:
+			return None
+
+		# Now we have a device, time to construct a SquishyDevice around it for use
+		(serial_number, _, dev) = found_device
+		# We-forward propagate the serial number incase the input one is None
+		return cls(dev, serial_number, tracer = tracer)
+
+	@staticmethod
+	def _select_device(
+		attached: list[DeviceContainer], serial: str | None, first: bool
+	) -> DeviceContainer | None:
+		''' Pick the requested device out of the enumerated devices, see :py:meth:`get_device` '''
+
+		count = len(attached)
 
 		# Bail early if we don't have any devices at all
 		if count == 0:
@@ -571,7 +1039,7 @@ class SquishyDevice:
 		# There are more the once device, and we have a serial number to look for
 		else:
 			# Try to pull out devices that match our serial number (there should only be one)
-			found = tuple(filter(lambda sn, _, __: sn == serial, attached))
+			found = tuple(filter(lambda dev: dev[0] == serial, attached))
 			num_found = len(found)
 			if num_found > 1:
 				# ohno
@@ -579,13 +1047,11 @@ class SquishyDevice:
 				return None
 			elif num_found == 0:
 				log.error(f'No Squishy device with serial number `{serial}` found')
+				return None
 			else:
 				found_device = found[0]
 
-		# Now we have a device, time to construct a SquishyDevice around it for use
-		(serial_number, _, dev) = found_device
-		# We-forward propagate the serial number incase the input one is None
-		return cls(dev, serial_number)
+		return found_device
 
 	@classmethod
 	def enumerate(cls: type[Self]) -> list[DeviceContainer]:
@@ -598,22 +1064,12 @@ class SquishyDevice:
 			A collection of Squishy hardware devices attached to the system.
 		'''
 
-		# icky icky icky icky
-		global _LIBUSB_CTX
-
-		# If we don't have a libusb context, make one.
-		if _LIBUSB_CTX is None:
-			_LIBUSB_CTX = USBContext()
-
 		devices: list[DeviceContainer] = []
 
 		# Iterate over all attached USB devices and filter out anything we're interested in
-		for dev in _LIBUSB_CTX.getDeviceIterator(skip_on_error = True):
-			dev_vid = dev.getVendorID()
-			dev_pid = dev.getProductID()
-
+		for dev in _libusb_context().getDeviceIterator(skip_on_error = True):
 			# Make sure we only try to interact with Squishies
-			if dev_vid == USB_VID and dev_pid in (USB_APP_PID, USB_DFU_PID):
+			if _is_squishy(dev):
 				try:
 					# Pull out the serial number
 					with usb_device_handle(dev) as hndl:
@@ -690,10 +1146,15 @@ class SquishyDevice:
 
 		return self._get_dfu_altmodes()
 
-	def reset(self) -> bool:
+	def reset(self, *, wait: bool = False) -> bool:
 		'''
 		Invoke a DFU detach.
 
+		Parameters
+		----------
+		wait : bool
+			Wait for the device to come back and re-attach to it. (default: False)
+
 		Returns
 		-------
 		bool
@@ -705,7 +1166,7 @@ class SquishyDevice:
 			If the DFU interface is unknown, or the DFU control request times out.
 		'''
 
-		return self._send_dfu_detach()
+		return self._run(self._dfu_reset_steps(wait))
 
 	def upload(self, data: bytes, altmode: int, progress: Progress | None = None) -> bool:
 		'''
@@ -734,74 +1195,41 @@ class SquishyDevice:
 			size.
 		'''
 
-		# First try to enter DFU mode
-		if not self._enter_dfu():
-			return False
-
-		# Try to get the DFU interface
-		interface_id = self._get_dfu_interface()
-		if interface_id is None:
-			raise RuntimeError(f'Unable to get DFU interface id for {self._usb_dev_str}')
-
-		# Ensure we have our grubby little paws on it
-		self._ensure_iface_claimed(interface_id)
-
-		# Set (or at least try to) the alt-mode for the DFU interface
-		self._usb_handle.setInterfaceAltSetting(interface_id, altmode)
-
-		# Try and get the transaction size so we know how big to make our chunks
-		trans_size = self._get_dfu_tx_size()
-		if trans_size is None:
-			raise RuntimeError(f'Unable to determine DFU transaction size for `{self._usb_dev_str}`')
-
-		log.debug(f'DFU Transfer size: {trans_size}')
-
-		# if there is a progress bar, add task to it
-		if progress is not None:
-			prog_task = progress.add_task('Programming', start = True, total = len(data))
-
-		# Iterate over our chunks
-		for (chunk_num, chunk) in enumerate(_chunker(trans_size, data)):
-			# Fold the chunk back into a bytearray
-			chunk_data = bytearray(b for b in chunk if b is not None)
+		return self.upload_images(((altmode, data),), progress)
 
-			# Try to send the data
-			if not self._send_dfu_download(chunk_data, chunk_num):
-				log.error(f'DFU transaction failed, was unable to send any/all data for chunk {chunk_num}')
-				return False
-			# Update the upload task if we can
-			if progress is not None:
-				progress.update(prog_task, advance = len(chunk_data))
-
-			# Let DFU chew on the chunk and settle a bit
-			while self._get_dfu_state() != DFUState.DlSync:
-				sleep(0.05)
+	def upload_images(
+		self, images: Iterable[tuple[int, bytes]], progress: Progress | None = None, *, reset: bool = False
+	) -> bool:
+		'''
+		Push multiple firmware/gateware images to the device in a single DFU session.
 
-			# Get the status of the chunk  upload
-			_, state = self._get_dfu_status()
+		The device is only put into DFU mode once, and each image is then written back-to-back into its
+		alt-mode, this avoids the re-enumeration and setup cost of multiple calls to :py:meth:`upload`.
 
-			if state != DFUState.DlSync:
-				log.error(f'DFU State is {state} not DlSync, aborting')
-				return False
-
-		chunk_num += 1
+		Parameters
+		----------
+		images : Iterable[tuple[int, bytes]]
+			The images to upload in the form of (alt-mode, data), they are written in order.
 
-		# Flush and make sure we go idle
-		self._send_dfu_download(bytearray(), chunk_num)
-		_, state = self._get_dfu_status()
+		progress : rich.progress.Progress | None
+			Optional Rich progressbar instance.
 
-		if state != DFUState.DFUIdle:
-			log.error('Device did not go idle after upload')
-			return False
+		reset : bool
+			Reset the device once all of the images have been written. (default: False)
 
-		log.debug(f'Wrote {chunk_num} chunks to device')
+		Returns
+		-------
+		bool
+			All of the images were uploaded successfully, otherwise False
 
-		# Finally, clean up the progress bar if we were using it
-		if progress is not None:
-			progress.update(prog_task, completed = True)
-			progress.remove_task(prog_task)
+		Raises
+		------
+		RuntimeError
+			If the DFU interface is unknown, the DFU control request times out, or we can't determine the transaction
+			size.
+		'''
 
-		return True
+		return self._run(self._dfu_upload_steps(images, progress, reset))
 
 	# TODO(aki): Should this return type be an alias of a union of possible platform?
 	def get_platform(self) -> type[SquishyPlatformType] | None:
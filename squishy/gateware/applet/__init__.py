@@ -15,6 +15,7 @@ from torii_usb.usb.usb2.request                  import USBRequestHandler
 from usb_construct.emitters.descriptors.standard import DeviceDescriptorCollection
 
 from ..platform                                  import SquishyPlatformType
+from ..usb.stream                                import USBStreamChannel
 
 __all__ = (
 	'AppletElaboratable',
@@ -34,6 +35,9 @@ class AppletElaboratable(Elaboratable, metaclass = ABCMeta):
 	usb_request_handlers : list[USBRequestHandler] | None
 		Any additional USB request handlers to register.
 
+	usb_stream_channels : list[USBStreamChannel] | None
+		Any bulk streaming channels the applet wants to talk to the host with.
+
 	'''
 
 	def __init__(self) -> None:
@@ -44,6 +48,11 @@ class AppletElaboratable(Elaboratable, metaclass = ABCMeta):
 		''' Returns a list of USB request handlers '''
 		return None
 
+	@property
+	def usb_stream_channels(self) -> list[USBStreamChannel] | None:
+		''' Returns a list of USB bulk streaming channels '''
+		return None
+
 	@classmethod
 	def usb_init_descriptors(cls: Self, desc_collection: DeviceDescriptorCollection) -> int:
 		''' Initialize USB descriptors'''
@@ -20,7 +20,7 @@ from usb_construct.types.descriptors.standard        import (
 	ApplicationSubclassCodes, DeviceClassCodes, DFUProtocolCodes, InterfaceClassCodes
 )
 
-from ...core.config                                  import USB_DFU_CONFIG
+from ...core.config                                  import USB_DFU_CONFIG, BootloaderConfig
 from ..platform                                      import SquishyPlatformType
 from ..usb.dfu                                       import DFURequestHandler
 from ..usb.quirks.windows                            import WindowsRequestHandler
@@ -79,6 +79,10 @@ class SquishyBootloader(Elaboratable):
 	revision: tuple[int, int]
 		The device revision.
 
+	config : BootloaderConfig | None
+		The DFU transfer size and bitstream FIFO depth to build the bootloader with, if None then the
+		``bootloader_cfg`` of the target platform is used.
+
 	Attributes
 	----------
 	serial_number : str
@@ -86,8 +90,11 @@ class SquishyBootloader(Elaboratable):
 
 	'''
 
-	def __init__(self, *, serial_number: str, revision: tuple[int, int]) -> None:
+	def __init__(
+		self, *, serial_number: str, revision: tuple[int, int], config: BootloaderConfig | None = None
+	) -> None:
 		self.serial_number = serial_number
+		self._config       = config
 		self._rev_raw      = revision
 		# This is so stupid but it works for now:tm:
 		self._rev_bcd      = (self._rev_raw[0] + 0.00) + round(self._rev_raw[1] * 0.1, 3)
@@ -95,6 +102,8 @@ class SquishyBootloader(Elaboratable):
 	def elaborate(self, platform: SquishyPlatformType | None) -> Module:
 		m = Module()
 
+		boot_cfg = self._config if self._config is not None else platform.bootloader_cfg
+
 		# Set up our PLL and clock domains
 		m.submodules.pll = pll = platform.clk_domain_generator()
 
@@ -152,10 +161,10 @@ class SquishyBootloader(Elaboratable):
 
 					with FunctionalDescriptor(int_desc) as func_desc:
 						func_desc.bmAttributes   = (
-							DFUWillDetach.YES | DFUManifestationTolerant.NO | DFUCanUpload.NO | DFUCanDownload.YES
+							DFUWillDetach.YES | DFUManifestationTolerant.YES | DFUCanUpload.NO | DFUCanDownload.YES
 						)
 						func_desc.wDetachTimeOut = 1000
-						func_desc.wTransferSize  = platform.flash.geometry.erase_size
+						func_desc.wTransferSize  = boot_cfg.transfer_size
 
 		# Windows needs this extra stuff for it to not be stupid
 		plat_descs = PlatformDescriptorCollection()
@@ -181,11 +190,13 @@ class SquishyBootloader(Elaboratable):
 		# NOTE(aki): We might need to domain rename the SPI stuff into USB or have a SPI domain
 		# Set up the bitstream/firmware FIFO
 		m.submodules.bit_fifo = bit_fifo = AsyncFIFO(
-			width = 8, depth = platform.flash.geometry.erase_size, r_domain = 'sync', w_domain = 'usb'
+			width = 8, depth = boot_cfg.fifo_depth, r_domain = 'sync', w_domain = 'usb'
 		)
 
 		# Set up the DFU and the special Windows compat request handlers
-		dfu_handler = DFURequestHandler(configuration = 1, interface = 0, boot_stub = False, fifo = bit_fifo)
+		dfu_handler = DFURequestHandler(
+			configuration = 1, interface = 0, boot_stub = False, fifo = bit_fifo, transfer_size = boot_cfg.transfer_size
+		)
 		win_handler = WindowsRequestHandler(plat_descs)
 
 		# Add our handlers to the endpoint
@@ -227,6 +238,7 @@ class SquishyBootloader(Elaboratable):
 			dfu_handler.slot_ack.eq(platform_interface.slot_ack),
 			dfu_handler.dl_ready.eq(platform_interface.dl_ready),
 			dfu_handler.dl_done.eq(platform_interface.dl_done),
+			dfu_handler.dl_committed.eq(platform_interface.dl_committed),
 		]
 
 		timer_range = int((platform.pll_cfg.clkp.ofreq * 1e6) // 10)
@@ -49,6 +49,9 @@ class Rev1(Elaboratable):
 	dl_completed : Signal
 		Input: Unused
 
+	dl_committed : Signal
+		Output: Always high, the flash is written in place so completed downloads are already committed.
+
 	dl_size : Signal(16)
 		Input: The size of the DFU transfer into the the FIFO
 
@@ -75,6 +78,7 @@ class Rev1(Elaboratable):
 		self.dl_ready     = Signal()
 		self.dl_done      = Signal()
 		self.dl_completed = Signal()
+		self.dl_committed = Signal()
 		self.dl_size      = Signal(16)
 
 	def elaborate(self, platform: SquishyPlatformType | None) -> Module:
@@ -167,6 +171,8 @@ class Rev1(Elaboratable):
 
 			ps_slot_ack.i.eq(slot_ack),
 			self.slot_ack.eq(ps_slot_ack.o),
+
+			self.dl_committed.eq(1),
 		]
 
 		return m
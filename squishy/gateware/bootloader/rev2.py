@@ -65,6 +65,9 @@ Upon the FPGA entering the bootloader:
 
     VII. Check FPGA configuration status
     VIII. let the FPGA boot into new bitstream
+
+5. If the host has not asked for a reboot by the time ``write_done`` is set, the FPGA returns to step 0,
+   allowing for more slots to be written in the same DFU session.
 ''' # noqa: E101
 
 from torii.hdl             import Elaboratable, Module, Signal
@@ -111,6 +114,9 @@ class Rev2(Elaboratable):
 	dl_completed : Signal
 		Input: Signal from the DFU handler when a full slot download is completed.
 
+	dl_committed : Signal
+		Output: When the supervisor has finished writing the completed slot download.
+
 	dl_size : Signal(16)
 		Input: The size of the DFU transfer into the the FIFO
 
@@ -133,6 +139,7 @@ class Rev2(Elaboratable):
 		self.dl_ready      = Signal()
 		self.dl_done       = Signal()
 		self.dl_completed  = Signal()
+		self.dl_committed  = Signal()
 		self.dl_size       = Signal(16)
 
 		self.slot_changed = Signal()
@@ -169,6 +176,7 @@ class Rev2(Elaboratable):
 		dl_ready       = Signal.like(self.dl_ready)
 		dl_done        = Signal.like(self.dl_done)
 		dl_completed   = Signal.like(self.dl_completed)
+		dl_committed   = Signal.like(self.dl_committed)
 
 		m.d.comb += [
 			regs.ctrl_rst.eq(0),
@@ -177,6 +185,7 @@ class Rev2(Elaboratable):
 
 			dl_ready.eq(psram.ready),
 			slot_ack.eq(0),
+			dl_committed.eq(0),
 		]
 
 		with m.FSM(name = 'storage'):
@@ -236,8 +245,14 @@ class Rev2(Elaboratable):
 					]
 					m.d.comb += [ regs.ctrl_rst.eq(1), ]
 
-				with m.If(regs.ctrl.write_done & trigger_reboot):
-					m.next = 'REQUEST_REBOOT'
+				with m.If(regs.ctrl.write_done):
+					m.d.comb += [ dl_committed.eq(1), ]
+					with m.If(trigger_reboot):
+						m.next = 'REQUEST_REBOOT'
+					with m.Else():
+						# The host may want to write another slot before rebooting, so start over
+						m.d.comb += [ regs.ctrl_rst.eq(1), ]
+						m.next = 'RESET'
 
 			with m.State('REQUEST_REBOOT'):
 				m.d.sync += [
@@ -257,6 +272,7 @@ class Rev2(Elaboratable):
 		m.submodules.ps_dl_start     = ps_dl_start     = PulseSynchronizer(i_domain = 'usb', o_domain = 'sync')
 		m.submodules.ps_dl_completed = ps_dl_completed = PulseSynchronizer(i_domain = 'usb', o_domain = 'sync')
 		m.submodules.ps_dl_finish    = ps_dl_finish    = PulseSynchronizer(i_domain = 'usb', o_domain = 'sync')
+		m.submodules.ps_dl_committed = ps_dl_committed = PulseSynchronizer(i_domain = 'sync', o_domain = 'usb')
 
 		m.d.comb += [
 			ps_slot_ack.i.eq(slot_ack),
@@ -273,6 +289,9 @@ class Rev2(Elaboratable):
 			ps_dl_finish.i.eq(self.dl_finish),
 			dl_finish.eq(ps_dl_finish.o),
 
+			ps_dl_committed.i.eq(dl_committed),
+			self.dl_committed.eq(ps_dl_committed.o),
+
 			psram.finish.eq(dl_finish),
 			dl_done.eq(psram.done),
 			psram.start_w.eq(dl_start),
@@ -137,10 +137,13 @@ class SPIFlash(Elaboratable):
 						self.writeAddr.eq(self.startAddr),
 					]
 				with m.If(self.start):
-					m.d.sync += [
-						op.eq(SPIFlashOp.ERASE),
-						byteCount.eq(self.byteCount),
-					]
+					m.d.sync += [ byteCount.eq(self.byteCount), ]
+					# Only erase if this transfer runs past what we've already erased, this lets us take
+					# transfers that are both smaller and larger than a single erase block.
+					with m.If(self.eraseAddr < (self.writeAddr + self.byteCount)):
+						m.d.sync += [ op.eq(SPIFlashOp.ERASE), ]
+					with m.Else():
+						m.d.sync += [ op.eq(SPIFlashOp.WRITE), ]
 					m.next = 'WRITE_ENABLE'
 			with m.State('WRITE_ENABLE'):
 				with m.Switch(enableStep):
@@ -236,8 +239,10 @@ class SPIFlash(Elaboratable):
 					with m.Case(3):
 						m.d.sync += eraseWaitStep.eq(0)
 						with m.If(~spi.rdat[0]):
-							with m.If((self.writeAddr + byteCount) <= self.endAddr):
-								m.d.sync += op.eq(SPIFlashOp.WRITE)
+							# Keep erasing until we cover the whole transfer
+							with m.If(self.eraseAddr >= (self.writeAddr + byteCount)):
+								with m.If((self.writeAddr + byteCount) <= self.endAddr):
+									m.d.sync += op.eq(SPIFlashOp.WRITE)
 							m.next = 'WRITE_ENABLE'
 			with m.State('CMD_WRITE'):
 				with m.Switch(writeCmdStep):
@@ -15,7 +15,7 @@ from torii.build.plat import Platform
 from torii.build.run  import BuildProducts
 from torii.hdl        import Elaboratable
 
-from ...core.config   import FlashConfig, PLLConfig
+from ...core.config   import BootloaderConfig, FlashConfig, PLLConfig
 
 __all__ = (
 	'SquishyPlatform',
@@ -58,6 +58,9 @@ class SquishyPlatform(metaclass = ABCMeta):
 	ephemeral_slot : int | None
 		If this platform supports ephemeral applet flashing, then this is the DFU alt-mode to use, otherwise None
 
+	bootloader_cfg : BootloaderConfig
+		The default DFU transfer size and bitstream FIFO depth for the bootloader on this platform.
+
 	Important
 	---------
 	Platforms are also still required to inherit from the appropriate :py:mod:`torii.vendor.platform`
@@ -105,6 +108,11 @@ class SquishyPlatform(metaclass = ABCMeta):
 		''' If this platform supports ephemeral applet flashing, then this is the DFU alt-mode to use '''
 		return None
 
+	@property
+	def bootloader_cfg(self) -> BootloaderConfig:
+		''' The default bootloader DFU transfer configuration, sized to fit the platforms block RAM '''
+		return BootloaderConfig(transfer_size = self.flash.geometry.erase_size)
+
 	# TODO(aki): single bitstream/artifact packing + whole image packing
 	@abstractmethod
 	def pack_artifact(self, artifact: bytes, *, args: Namespace) -> bytes:
@@ -31,7 +31,7 @@ from torii.platform.resources.memory     import SPIFlashResources
 from torii.platform.resources.user       import LEDResources
 from torii.platform.vendor.lattice.ice40 import ICE40Platform
 
-from ...core.config                      import FlashConfig, ICE40PLLConfig
+from ...core.config                      import BootloaderConfig, FlashConfig, ICE40PLLConfig
 from ...core.flash                       import Geometry as FlashGeometry
 from .                                   import SquishyPlatform
 
@@ -140,6 +140,13 @@ class SquishyRev1(SquishyPlatform, ICE40Platform):
 		}
 	)
 
+	# NOTE: The HX8K only has 16KiB of block RAM total, and the USB stack needs its share of it, so we
+	#       stick to a single erase block per DFU transfer, and can't spare the room to double-buffer it.
+	bootloader_cfg = BootloaderConfig(
+		transfer_size = 4096, # 4KiB
+		fifo_depth    = 4096,
+	)
+
 	pll_cfg = ICE40PLLConfig(
 		divr         = 2,
 		divf         = 34,
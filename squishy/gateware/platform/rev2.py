@@ -31,7 +31,7 @@ from torii.platform.resources.memory    import SDCardResources
 from torii.platform.resources.user      import LEDResources
 from torii.platform.vendor.lattice.ecp5 import ECP5Platform
 
-from ...core.config                     import ECP5PLLConfig, ECP5PLLOutput, FlashConfig
+from ...core.config                     import BootloaderConfig, ECP5PLLConfig, ECP5PLLOutput, FlashConfig
 from ...core.flash                      import FPGAID, rev2_flash_layout, rev2_flash_slot
 from ...core.flash                      import Geometry as FlashGeometry
 from .                                  import SquishyPlatform
@@ -186,6 +186,14 @@ class SquishyRev2(SquishyPlatform, ECP5Platform):
 		}
 	)
 
+	# NOTE: The LFE5UM5G-45F has ~243KiB of block RAM, so we can afford to take much larger DFU
+	#       transfers, this cuts down on the number of control round-trips per 2MiB slot by 4x, and we
+	#       double-buffer them so the next transfer can come in while the last is written to the PSRAM.
+	bootloader_cfg = BootloaderConfig(
+		transfer_size = 16384, # 16KiB
+		fifo_depth    = 32768,
+	)
+
 	# generated with `ecppll -i 100 -o 170 -f /dev/stdout`
 	pll_cfg = ECP5PLLConfig(
 		ifreq     = 100,
@@ -4,9 +4,9 @@
 
 '''
 
-from torii.hdl                           import Cat, Module, Signal
+from torii.hdl                           import Cat, DomainRenamer, Module, Signal
 from torii.hdl.ast                       import Operator
-from torii.lib.fifo                      import AsyncFIFO
+from torii.lib.fifo                      import AsyncFIFO, SyncFIFO
 from torii_usb.stream.generator          import StreamSerializer
 from torii_usb.usb.request.interface     import SetupPacket
 from torii_usb.usb.stream                import USBInStreamInterface, USBOutStreamInterface
@@ -60,7 +60,13 @@ class DFURequestHandler(USBRequestHandler):
 		generated.
 
 	fifo : AsyncFIFO | None
-		The storage FIFO.
+		The storage FIFO. If it is deep enough to hold more than one full transfer, then it is split into
+		multiple transfer sized buffers, allowing the host to send the next block while the backing storage
+		is still busy with the previous one.
+
+	transfer_size : int | None
+		The maximum size in bytes of a single DFU download, this should match the ``wTransferSize`` in the
+		DFU functional descriptor. If None, the depth of ``fifo`` is used.
 
 	Attributes
 	----------
@@ -71,7 +77,7 @@ class DFURequestHandler(USBRequestHandler):
 		Output: the flash slot address
 
 	dl_start : Signal
-		Output: Start of a DFU transfer.
+		Output: Start of a DFU transfer, only raised once the previous transfer has been acknowledged with `dl_finish`.
 
 	dl_finish : Signal
 		Output: An acknowledgement of the `dl_done` signal
@@ -83,10 +89,15 @@ class DFURequestHandler(USBRequestHandler):
 		Input: When the backing storage is done storing the data.
 
 	dl_completed : Signal
-		Output: Raised when the DFU state machine has completed a download to a slot.
+		Output: Raised when the DFU state machine has completed a download to a slot and all outstanding
+		transfers have been stored.
+
+	dl_committed : Signal
+		Input: When the backing storage has committed the completed download to the slot, until then the
+		DFU state machine is manifesting, after which it returns to idle to allow for further downloads.
 
 	dl_size : Signal(16)
-		Output: The size of the DFU transfer into the the FIFO
+		Output: The size of the DFU transfer into the the FIFO, held for the duration of the transfer.
 
 	slot_changed : Signal
 		Output: Raised when the DFU alt-mode is changed.
@@ -102,11 +113,14 @@ class DFURequestHandler(USBRequestHandler):
 	Raises
 	------
 	ValueError
-		If fifo is `None` when `boot_stub` is False.
+		If fifo is `None` when `boot_stub` is False, or if `transfer_size` is larger than the FIFO.
 
 	'''
 
-	def __init__(self, configuration: int, interface: int, boot_stub: bool, *, fifo: AsyncFIFO | None = None) -> None:
+	def __init__(
+		self, configuration: int, interface: int, boot_stub: bool, *, fifo: AsyncFIFO | None = None,
+		transfer_size: int | None = None
+	) -> None:
 		super().__init__()
 
 		# DFU interface
@@ -122,11 +136,25 @@ class DFURequestHandler(USBRequestHandler):
 
 			self._bit_fifo  = fifo
 
+			if transfer_size is None:
+				transfer_size = fifo.depth
+
+			if transfer_size > fifo.depth:
+				raise ValueError(
+					f'DFU transfer size of {transfer_size} bytes does not fit in a FIFO of depth {fifo.depth}'
+				)
+
+			self._transfer_size = transfer_size
+			# NOTE: The host is only told it can send the next block once there is a free buffer for it,
+			#       so with more than one buffer the USB side can run ahead of the backing storage.
+			self._buffers       = fifo.depth // transfer_size
+
 			self.dl_start      = Signal()
 			self.dl_finish     = Signal()
 			self.dl_ready      = Signal()
 			self.dl_done       = Signal()
 			self.dl_completed  = Signal()
+			self.dl_committed  = Signal()
 			self.dl_size       = Signal(16)
 
 			self.slot_changed = Signal()
@@ -153,10 +181,23 @@ class DFURequestHandler(USBRequestHandler):
 
 			dfu_cfg = DFUConfig()
 
+			# The sizes of the transfers that are in the FIFO, one entry per buffer
+			m.submodules.blocks = blocks = DomainRenamer(sync = 'usb')(
+				SyncFIFO(width = len(self.dl_size), depth = self._buffers)
+			)
+
+			manifest     = Signal()
+			dl_done_prev = Signal()
+
 			m.d.comb += [
 				self.dl_start.eq(0),
 				self.dl_finish.eq(0),
+				self.dl_completed.eq(0),
 				self.slot_changed.eq(0),
+
+				blocks.w_en.eq(0),
+				blocks.w_data.eq(setup_pkt.length),
+				blocks.r_en.eq(0),
 			]
 
 		m.submodules.transmitter = transmitter = StreamSerializer(
@@ -201,9 +242,9 @@ class DFURequestHandler(USBRequestHandler):
 							with m.Default():
 								m.next = 'UNHANDLED'
 				if not self._is_stub:
-					with m.If(self.dl_done):
-						m.d.comb += [ self.dl_finish.eq(1), ]
-						m.d.usb  += [ dfu_cfg.state.eq(DFUState.DlSync), ]
+					# Once the block is in and there is room for another, let the host send the next one
+					with m.If((dfu_cfg.state == DFUState.DlBusy) & blocks.w_rdy):
+						m.d.usb += [ dfu_cfg.state.eq(DFUState.DlSync), ]
 
 			with m.State('HANDLE_DETACH'):
 				with m.If(interface.status_requested):
@@ -261,18 +302,23 @@ class DFURequestHandler(USBRequestHandler):
 
 			if not self._is_stub:
 				with m.State('HANDLE_DOWNLOAD'):
-					with m.If(setup_pkt.is_in_request | (setup_pkt.length > platform.flash.geometry.erase_size)):
+					with m.If(setup_pkt.is_in_request | (setup_pkt.length > self._transfer_size)):
 						m.next = 'UNHANDLED'
 					with m.Elif(setup_pkt.length):
-						m.d.comb += [
-							self.dl_start.eq(1),
-							self.dl_size.eq(setup_pkt.length),
-						]
-						m.d.usb += [ dfu_cfg.state.eq(DFUState.DlBusy) ]
+						# The host should not send a block while we're busy, but if it does there is nowhere to put it
+						with m.If(blocks.w_rdy):
+							m.d.comb += [ blocks.w_en.eq(1), ]
+							m.d.usb  += [ dfu_cfg.state.eq(DFUState.DlBusy) ]
 
-						m.next = 'HANDLE_DOWNLOAD_DATA'
+							m.next = 'HANDLE_DOWNLOAD_DATA'
+						with m.Else():
+							m.next = 'UNHANDLED'
 					with m.Else():
-						m.d.comb += [ self.dl_completed.eq(1), ]
+						# The download is only complete once all of the outstanding blocks are stored
+						m.d.usb += [
+							dfu_cfg.state.eq(DFUState.DFUMFSync),
+							manifest.eq(1),
+						]
 						m.next = 'HANDLE_DOWNLOAD_COMPLETE'
 
 				with m.State('HANDLE_DOWNLOAD_DATA'):
@@ -294,7 +340,6 @@ class DFURequestHandler(USBRequestHandler):
 
 				with m.State('HANDLE_DOWNLOAD_COMPLETE'):
 					with m.If(interface.status_requested):
-						m.d.usb  += [ dfu_cfg.state.eq(DFUState.DFUIdle), ]
 						m.d.comb += [ self.send_zlp(), ]
 
 					with m.If(interface.handshakes_in.ack):
@@ -363,6 +408,45 @@ class DFURequestHandler(USBRequestHandler):
 
 			recv_cont = (recv_consumed < recv_count)
 
+			m.d.usb += [ dl_done_prev.eq(self.dl_done), ]
+
+			# If there is nothing buffered, the block being set up is the one going to the backing storage
+			with m.If(blocks.r_rdy):
+				m.d.comb += [ self.dl_size.eq(blocks.r_data), ]
+			with m.Else():
+				m.d.comb += [ self.dl_size.eq(setup_pkt.length), ]
+
+			# Hand the buffered blocks off to the backing storage one at a time
+			with m.FSM(domain = 'usb', name = 'storage'):
+				with m.State('IDLE'):
+					with m.If(blocks.r_rdy | blocks.w_en):
+						m.d.comb += [ self.dl_start.eq(1), ]
+						m.next = 'BUSY'
+					with m.Elif(manifest):
+						m.d.comb += [ self.dl_completed.eq(1), ]
+						m.d.usb  += [ dfu_cfg.state.eq(DFUState.DFUManifest), ]
+						m.next = 'COMMIT'
+
+				# NOTE: We are manifestation tolerant, once the slot is committed we go back to idle
+				#       rather than waiting for a reset, so the host can carry on with the next slot.
+				with m.State('COMMIT'):
+					with m.If(self.dl_committed):
+						m.d.usb += [
+							dfu_cfg.state.eq(DFUState.DFUIdle),
+							manifest.eq(0),
+						]
+						m.next = 'IDLE'
+
+				with m.State('BUSY'):
+					# NOTE: `dl_done` comes in over a synchronizer and may linger after `dl_finish`, so we
+					#       only take the rising edge as the backing storage being done with this block.
+					with m.If(self.dl_done & ~dl_done_prev):
+						m.d.comb += [
+							self.dl_finish.eq(1),
+							blocks.r_en.eq(1),
+						]
+						m.next = 'IDLE'
+
 			with m.FSM(domain = 'usb', name = 'download'):
 				with m.State('IDLE'):
 					m.d.usb += [ recv_consumed.eq(0), ]
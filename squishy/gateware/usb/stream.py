@@ -0,0 +1,216 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+This module contains the gateware side of the host to applet bulk streaming channel. It pairs with
+:py:class:`squishy.channel.StreamChannel` on the host.
+
+The channel presents a pair of simple byte streams to the applet in the applet's clock domain, and
+takes care of getting them across into the USB domain and onto a pair of bulk endpoints.
+
+'''
+
+from torii.hdl                                   import Cat, DomainRenamer, Elaboratable, Module, Signal
+from torii.lib.cdc                               import FFSynchronizer
+from torii.lib.fifo                              import AsyncFIFO, SyncFIFO
+from torii.lib.stream.simple                     import StreamInterface
+
+from torii_usb.usb2                              import USBDevice, USBStreamInEndpoint, USBStreamOutEndpoint
+
+from usb_construct.emitters.descriptors.standard import ConfigurationDescriptorEmitter
+
+from ..platform                                  import SquishyPlatformType
+
+__all__ = (
+	'USBStreamChannel',
+)
+
+# Vendor specific interface class, so the host OS leaves us alone
+_VENDOR_CLASS = 0xFF
+
+class USBStreamChannel(Elaboratable):
+	'''
+	A bulk streaming channel between an applet and the host.
+
+	The ``tx`` stream is sent to the host on the bulk IN endpoint, and anything the host sends on the bulk OUT
+	endpoint comes out of the ``rx`` stream. Either direction can be left out by setting its endpoint to None.
+
+	Both directions are buffered with a FIFO, which also moves the streams between the applet clock domain and
+	the USB domain. The ``last`` flag on the ``tx`` stream ends the current USB transfer with a short packet
+	(or ZLP), otherwise the host is sent a continuous stream of full packets.
+
+	Parameters
+	----------
+	interface : int
+		The USB interface number for the channel.
+
+	in_ep : int | None
+		The endpoint number for data going to the host. (default: 1)
+
+	out_ep : int | None
+		The endpoint number for data coming from the host. (default: 1)
+
+	max_packet_size : int
+		The ``wMaxPacketSize`` of the bulk endpoints. (default: 512)
+
+	domain : str
+		The clock domain the applet side of the streams are in. (default: sync)
+
+	fifo_depth : int
+		The depth in bytes of the FIFO in each direction. (default: 2048)
+
+	Attributes
+	----------
+	tx : StreamInterface
+		Stream from the applet to the host.
+
+	rx : StreamInterface
+		Stream from the host to the applet.
+
+	flush : Signal, in
+		Send any data that is pending in the IN endpoint as soon as possible.
+
+	usb_tx : StreamInterface
+		The USB domain side of ``tx``, this is what gets connected to the IN endpoint.
+
+	usb_rx : StreamInterface
+		The USB domain side of ``rx``, this is what gets connected to the OUT endpoint.
+
+	'''
+
+	def __init__(
+		self, *, interface: int, in_ep: int | None = 1, out_ep: int | None = 1, max_packet_size: int = 512,
+		domain: str = 'sync', fifo_depth: int = 2048
+	) -> None:
+		if in_ep is None and out_ep is None:
+			raise ValueError('A stream channel needs at least one of `in_ep` or `out_ep`')
+
+		if fifo_depth < max_packet_size:
+			raise ValueError(f'FIFO depth of {fifo_depth} must be at least one packet ({max_packet_size} bytes)')
+
+		self.interface       = interface
+		self.in_ep           = in_ep
+		self.out_ep          = out_ep
+		self.max_packet_size = max_packet_size
+		self._domain         = domain
+		self._fifo_depth     = fifo_depth
+
+		self.tx    = StreamInterface()
+		self.rx    = StreamInterface()
+		self.flush = Signal()
+
+		self.usb_tx    = StreamInterface()
+		self.usb_rx    = StreamInterface()
+		self.usb_flush = Signal()
+
+		self._in_endpoint: USBStreamInEndpoint | None   = None
+		self._out_endpoint: USBStreamOutEndpoint | None = None
+
+	def add_endpoints(self, usb: USBDevice) -> None:
+		'''
+		Create the bulk endpoints for this channel and add them to the USB device.
+
+		Parameters
+		----------
+		usb : USBDevice
+			The USB device to add the endpoints to.
+		'''
+
+		if self.in_ep is not None:
+			self._in_endpoint = USBStreamInEndpoint(
+				endpoint_number = self.in_ep, max_packet_size = self.max_packet_size
+			)
+			usb.add_endpoint(self._in_endpoint)
+
+		if self.out_ep is not None:
+			self._out_endpoint = USBStreamOutEndpoint(
+				endpoint_number = self.out_ep, max_packet_size = self.max_packet_size
+			)
+			usb.add_endpoint(self._out_endpoint)
+
+	def add_descriptors(self, cfg_desc: ConfigurationDescriptorEmitter, *, name: str | None = None) -> None:
+		'''
+		Add the interface and endpoint descriptors for this channel to a configuration.
+
+		Parameters
+		----------
+		cfg_desc : ConfigurationDescriptorEmitter
+			The configuration to add the channel interface to.
+
+		name : str | None
+			The optional name of the interface.
+		'''
+
+		with cfg_desc.InterfaceDescriptor() as int_desc:
+			int_desc.bInterfaceNumber   = self.interface
+			int_desc.bInterfaceClass    = _VENDOR_CLASS
+			int_desc.bInterfaceSubclass = 0
+			int_desc.bInterfaceProtocol = 0
+			if name is not None:
+				int_desc.iInterface = name
+
+			if self.in_ep is not None:
+				with int_desc.EndpointDescriptor() as ep_desc:
+					ep_desc.bEndpointAddress = 0x80 | self.in_ep
+					ep_desc.wMaxPacketSize   = self.max_packet_size
+					ep_desc.bInterval        = 0
+
+			if self.out_ep is not None:
+				with int_desc.EndpointDescriptor() as ep_desc:
+					ep_desc.bEndpointAddress = self.out_ep
+					ep_desc.wMaxPacketSize   = self.max_packet_size
+					ep_desc.bInterval        = 0
+
+	def _fifo(self, *, r_domain: str, w_domain: str) -> AsyncFIFO | SyncFIFO:
+		''' Get a FIFO wide enough for a stream beat between the two domains '''
+
+		# data + first + last
+		width = len(self.tx.data) + 2
+
+		if r_domain == w_domain:
+			return DomainRenamer(sync = r_domain)(SyncFIFO(width = width, depth = self._fifo_depth, fwft = True))
+		return AsyncFIFO(width = width, depth = self._fifo_depth, r_domain = r_domain, w_domain = w_domain)
+
+	@staticmethod
+	def _connect(m: Module, fifo: AsyncFIFO | SyncFIFO, *, sink: StreamInterface, source: StreamInterface) -> None:
+		''' Hook the FIFO up between the two streams '''
+
+		data_width = len(source.data)
+
+		m.d.comb += [
+			fifo.w_data.eq(Cat(source.data, source.first, source.last)),
+			fifo.w_en.eq(source.valid),
+			source.ready.eq(fifo.w_rdy),
+
+			sink.data.eq(fifo.r_data[:data_width]),
+			sink.first.eq(fifo.r_data[data_width]),
+			sink.last.eq(fifo.r_data[data_width + 1]),
+			sink.valid.eq(fifo.r_rdy),
+			fifo.r_en.eq(sink.ready),
+		]
+
+	def elaborate(self, platform: SquishyPlatformType | None) -> Module:
+		m = Module()
+
+		if self.in_ep is not None:
+			m.submodules.tx_fifo = tx_fifo = self._fifo(r_domain = 'usb', w_domain = self._domain)
+			self._connect(m, tx_fifo, sink = self.usb_tx, source = self.tx)
+
+			if self._domain == 'usb':
+				m.d.comb += [ self.usb_flush.eq(self.flush), ]
+			else:
+				m.submodules.flush_ffs = FFSynchronizer(self.flush, self.usb_flush, o_domain = 'usb')
+
+			if self._in_endpoint is not None:
+				m.d.comb += [
+					self._in_endpoint.stream.stream_eq(self.usb_tx),
+					self._in_endpoint.flush.eq(self.usb_flush),
+				]
+
+		if self.out_ep is not None:
+			m.submodules.rx_fifo = rx_fifo = self._fifo(r_domain = self._domain, w_domain = 'usb')
+			self._connect(m, rx_fifo, sink = self.rx, source = self.usb_rx)
+
+			if self._out_endpoint is not None:
+				m.d.comb += [ self.usb_rx.stream_eq(self._out_endpoint.stream), ]
+
+		return m
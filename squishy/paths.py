@@ -12,6 +12,7 @@ The following base directories are defined:
 * ``SQUISHY_CACHE`` - Used for bitstream builds and any needed cached info that can be ignored in backcups
 * ``SQUISHY_DATA``  - Used for user-defined or third-party external applets and any other runtime deps
 * ``SQUISHY_CONFIG`` - Used for any host-side configuration and/or settings for Squishy and related
+* ``SQUISHY_RUNTIME`` - Used for runtime files such as the ``squishyd`` socket, this is not created by default
 
 Within the ``SQUISHY_CACHE`` directory there are two sub-directories:
 
@@ -28,13 +29,14 @@ defined applets.
 
 '''
 
-from platformdirs import user_data_path, user_config_path, user_cache_path
+from platformdirs import user_data_path, user_config_path, user_cache_path, user_runtime_path
 
 __all__ = (
 	# Root directories
 	'SQUISHY_CACHE',
 	'SQUISHY_DATA',
 	'SQUISHY_CONFIG',
+	'SQUISHY_RUNTIME',
 	# Cache Subdirs/Files
 	'SQUISHY_ASSET_CACHE',
 	'SQUISHY_BUILD_DIR',
@@ -44,14 +46,17 @@ __all__ = (
 	'SQUISHY_APPLETS',
 	# Config Subdirs/Files
 	'SQUISHY_SETTINGS',
+	# Runtime Subdirs/Files
+	'SQUISHY_BROKER_SOCKET',
 	# Helpers
 	'initialize_dirs',
 )
 
 # Squishy-specific base directories
-SQUISHY_CACHE  = user_cache_path('squishy',  False)
-SQUISHY_DATA   = user_data_path('squishy',   False)
-SQUISHY_CONFIG = user_config_path('squishy', False)
+SQUISHY_CACHE   = user_cache_path('squishy',   False)
+SQUISHY_DATA    = user_data_path('squishy',    False)
+SQUISHY_CONFIG  = user_config_path('squishy',  False)
+SQUISHY_RUNTIME = user_runtime_path('squishy', False)
 
 # SQUISHY_CACHE subdirectories/files
 SQUISHY_ASSET_CACHE  = (SQUISHY_CACHE / 'assets')
@@ -71,6 +76,10 @@ SQUISHY_APPLETS      = (SQUISHY_DATA  / 'applets')
 SQUISHY_SETTINGS = (SQUISHY_CONFIG / 'config.json')
 ''' Squishy settings file (``$SQUISHY_CONFIG/config.json``) '''
 
+# SQUISHY_RUNTIME subdirectories/files
+SQUISHY_BROKER_SOCKET = (SQUISHY_RUNTIME / 'squishyd.sock')
+''' The squishyd device broker socket (``$SQUISHY_RUNTIME/squishyd.sock``) '''
+
 def initialize_dirs() -> None:
 	'''
 	Initialize Squishy application directories.
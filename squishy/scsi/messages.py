@@ -237,6 +237,47 @@ class MessageCodes(IntEnum):
 	The message codes between :py:const:`RESERVED_START` and :py:const`RESERVED_END`
 	are all reserved for future possible standards.
 
+	.. note::
+
+		SCSI-2 assigned some of these to the two-byte queue tag messages below.
+
+	'''
+
+	SIMPLE_QUEUE_TAG  = 0x20
+	'''
+	Simple Queue Tag (Optional, In/Out).
+
+	This two-byte message is sent by the Initiator directly after the IDENTIFY message
+	to tag the command, the second byte being the tag. Commands with a simple tag may
+	be run in any order the Target sees fit.
+
+	The Target sends it directly after the IDENTIFY message when reconnecting, so the
+	Initiator knows which of the tagged commands for the LUN is being continued.
+
+	.. note:: This is a SCSI-2 message.
+
+	'''
+
+	HEAD_OF_QUEUE_TAG = 0x21
+	'''
+	Head of Queue Tag (Optional, Out).
+
+	This two-byte message is the same as :py:const:`SIMPLE_QUEUE_TAG`, other than the
+	command being put at the head of the Target's queue, to be run next.
+
+	.. note:: This is a SCSI-2 message.
+
+	'''
+
+	ORDERED_QUEUE_TAG = 0x22
+	'''
+	Ordered Queue Tag (Optional, Out).
+
+	This two-byte message is the same as :py:const:`SIMPLE_QUEUE_TAG`, other than the
+	command being run in the order it was received, after all the commands before it.
+
+	.. note:: This is a SCSI-2 message.
+
 	'''
 
 	RESERVED_END   = 0x7F
@@ -13,10 +13,15 @@ functionality to help with writing and running Squishy-related gateware tests. T
 	* :py:class:`SPIGatewareTest` - Tests for SPI related gateware, contains helpers for driving a SPI bus for tests.
 	* :py:class:`SCSIGatewareTest` - Tests for SCSI related gateware.
 
+There is also the :py:func:`benchmark` decorator, which is used to mark test cases that are benchmarks rather than
+correctness tests, they are only run when the ``SQUISHY_TEST_BENCHMARKS`` environment variable is set.
+
 ''' # noqa: E501
 
 from collections.abc                          import Iterable
+from os                                       import getenv
 from typing                                   import Literal
+from unittest                                 import skipUnless
 
 from torii.sim                                import Settle
 from torii.test                               import ToriiTestCase
@@ -34,8 +39,21 @@ __all__ = (
 	'SPIGatewareTest',
 	'SCSIGatewareTest',
 
+	'benchmark',
 )
 
+BENCHMARKS_ENABLED = getenv('SQUISHY_TEST_BENCHMARKS') is not None
+
+def benchmark(obj):
+	'''
+	Mark a test case or test method as a benchmark.
+
+	Benchmarks are skipped unless the ``SQUISHY_TEST_BENCHMARKS`` environment variable is set, as they
+	are generally long-running and only report numbers rather than asserting correctness.
+	'''
+
+	return skipUnless(BENCHMARKS_ENABLED, 'Benchmarks not enabled, set SQUISHY_TEST_BENCHMARKS to run')(obj)
+
 class SquishyGatewareTest(ToriiTestCase):
 	'''
 	The base class for the more specialized Squishy subsystem tests.
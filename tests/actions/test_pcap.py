@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import json
+from argparse                import ArgumentParser
+from contextlib              import redirect_stdout
+from io                      import StringIO
+from pathlib                 import Path
+from tempfile                import TemporaryDirectory
+from unittest                import TestCase
+
+from squishy.actions.pcap    import PCAPAction
+from squishy.core.pcapng     import EnhancedPacket, PCAPNGReader, Query, capture_stats, slice_capture
+
+from ..core.pcapng.fixtures  import inquiry_traffic, scsi_capture
+
+class PCAPActionTests(TestCase):
+	FRAMES = inquiry_traffic(500)
+
+	def setUp(self) -> None:
+		tmp = TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+
+		self.tmp     = Path(tmp.name)
+		self.capture = self.tmp / 'capture.pcapng'
+		scsi_capture(self.capture, self.FRAMES)
+
+	def _run(self, *argv: str | Path) -> tuple[int, str]:
+		''' Run the action like the CLI would, returning what it printed '''
+
+		action = PCAPAction()
+		parser = ArgumentParser()
+		action.register_args(parser)
+		args = parser.parse_args([ str(arg) for arg in argv ])
+
+		with redirect_stdout(StringIO()) as out:
+			ret = action.run(args)
+		return (ret, out.getvalue())
+
+	def _fails(self, *argv: str | Path) -> None:
+		with self.assertLogs(level = 'ERROR'):
+			self.assertEqual(self._run(*argv)[0], 1)
+
+	def _packets(self, capture: Path) -> list[bytes]:
+		with PCAPNGReader(capture) as reader:
+			return [ bytes(block.data) for block in reader if isinstance(block, EnhancedPacket) ]
+
+	def test_query(self) -> None:
+		expression = 'type == COMMAND and opcode == 0x12'
+		expected   = list(Query(expression).frames(self.capture))
+		self.assertNotEqual(expected, [])
+
+		for opts in ((), ('--no-index', ), ('--build-index', )):
+			with self.subTest(opts = opts):
+				(ret, out) = self._run('query', self.capture, expression, *opts)
+				self.assertEqual(ret, 0)
+
+				lines = out.splitlines()
+				self.assertEqual(len(lines), len(expected))
+				for (line, frame) in zip(lines, expected):
+					self.assertEqual(line.split()[0], str(frame.timestamp))
+					self.assertIn('COMMAND', line)
+					self.assertTrue(line.endswith(frame.data.hex()))
+
+		output = self.tmp / 'matches.pcapng'
+		(ret, out) = self._run('query', self.capture, expression, '--output', output)
+		self.assertEqual((ret, out), (0, ''))
+		self.assertEqual(len(self._packets(output)), len(expected))
+
+		# Compressed captures can't use the index, but can still be queried
+		compressed = self.tmp / 'capture.pcapng.gz'
+		compressed.write_bytes(gzip.compress(self.capture.read_bytes()))
+		(ret, out) = self._run('query', compressed, expression, '--build-index')
+		self.assertEqual(ret, 0)
+		self.assertEqual(len(out.splitlines()), len(expected))
+
+	def test_query_errors(self) -> None:
+		self._fails('query', self.capture, 'type ==')
+		self._fails('query', self.tmp / 'missing.pcapng', 'type == COMMAND')
+
+	def test_slice(self) -> None:
+		output   = self.tmp / 'slice.pcapng'
+		expected = self.tmp / 'expected.pcapng'
+		slice_capture(self.capture, expected, start = 100_000, end = 200_000, devices = [ 0 ])
+		self.assertNotEqual(self._packets(expected), [])
+
+		(ret, out) = self._run('slice', self.capture, output, '-s', '100000', '-e', '200000', '-d', '0')
+		self.assertEqual((ret, out), (0, ''))
+		self.assertEqual(output.read_bytes(), expected.read_bytes())
+
+		self._fails('slice', self.tmp / 'missing.pcapng', output)
+
+	def test_merge(self) -> None:
+		other  = self.tmp / 'other.pcapng'
+		output = self.tmp / 'merged.pcapng'
+		scsi_capture(other, self.FRAMES[:100])
+
+		(ret, out) = self._run('merge', output, self.capture, other)
+		self.assertEqual((ret, out), (0, ''))
+		self.assertEqual(
+			sorted(self._packets(output)), sorted(self._packets(self.capture) + self._packets(other))
+		)
+
+		# Merging into one of the inputs would truncate it before it's read
+		self._fails('merge', other, self.capture, other)
+
+	def test_stats(self) -> None:
+		(ret, out) = self._run('stats', self.capture, '--json', '--slots', '16')
+		self.assertEqual(ret, 0)
+		self.assertEqual(
+			json.loads(out), json.loads(json.dumps(capture_stats(self.capture, timeline_slots = 16).to_dict()))
+		)
+
+		(ret, out) = self._run('stats', self.capture)
+		self.assertEqual(ret, 0)
+		self.assertNotEqual(out, '')
+
+		self._fails('stats', self.tmp / 'missing.pcapng')
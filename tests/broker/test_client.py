@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import socket
+from pathlib                 import Path
+from tempfile                import TemporaryDirectory
+from threading               import Thread
+from unittest                import TestCase
+
+from squishy.broker          import BrokerClient, BrokerDevice, BrokerError
+from squishy.broker.protocol import PROTOCOL_VERSION, FrameKind, encode_frame, recv_frame
+
+_DEVICE = { 'serial': 'SQ-0001', 'rev': [ 2, 0 ], 'bus': 1, 'address': 4, 'dfu': False }
+_CLOSED = { 'event': 'stream_closed', 'channel': 3, 'error': 'stall' }
+
+class _FakeBroker(Thread):
+	''' Just enough of squishyd to drive the client, this serves a single connection '''
+
+	def __init__(self, path: Path) -> None:
+		super().__init__(daemon = True)
+
+		self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self._listener.bind(str(path))
+		self._listener.listen(1)
+
+	def _send(self, sock: socket.socket, kind: FrameKind, **kwargs) -> None:
+		sock.sendall(b''.join(encode_frame(kind, **kwargs)))
+
+	def run(self) -> None:
+		(sock, _) = self._listener.accept()
+		with sock, self._listener:
+			while (frame := recv_frame(sock)) is not None:
+				if frame.kind != FrameKind.REQUEST:
+					continue
+
+				req      = frame.message
+				response = { 'id': req['id'] }
+				payload  = b''
+				match req['op']:
+					case 'hello':
+						response['result'] = { 'version': '0.0.0', 'protocol': PROTOCOL_VERSION }
+					case 'devices':
+						response['result'] = [ _DEVICE ]
+					case 'lease' if req['serial'] in (None, _DEVICE['serial']):
+						response['result'] = { 'lease': 1, 'device': _DEVICE }
+					case 'lease':
+						response['error'] = f'No device with serial {req["serial"]}'
+					case 'control':
+						# Echo the setup packet back as the data
+						response['result'] = { 'length': 4 }
+						payload = bytes((req['request_type'], req['request'], req['value'], req['index']))
+					case 'stream_open':
+						response['result'] = { 'channel': 3 }
+						# Send the stream data before the response to make sure it gets buffered
+						for chunk in (b'abc', b'def'):
+							self._send(sock, FrameKind.DATA, channel = 3, payload = chunk)
+					case 'subscribe':
+						response['result'] = None
+						self._send(sock, FrameKind.EVENT, message = _CLOSED)
+					case _:
+						response['result'] = None
+
+				self._send(sock, FrameKind.RESPONSE, message = response, payload = payload)
+
+class BrokerClientTests(TestCase):
+	def test_no_broker(self) -> None:
+		with TemporaryDirectory() as tmp:
+			self.assertIsNone(BrokerClient.connect(Path(tmp) / 'squishyd.sock'))
+
+	def test_stale_socket(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'squishyd.sock'
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+				sock.bind(str(path))
+
+			self.assertIsNone(BrokerClient.connect(path))
+
+	def test_unusable_broker(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'squishyd.sock'
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+				listener.bind(str(path))
+				listener.listen(2)
+
+				# It never answers the hello
+				with self.assertLogs(level = 'WARNING'):
+					self.assertIsNone(BrokerClient.connect(path, timeout = 0.1))
+
+				# It hangs up on us
+				(sock, _) = listener.accept()
+				sock.close()
+				hangup = Thread(target = lambda: listener.accept()[0].close(), daemon = True)
+				hangup.start()
+				with self.assertLogs(level = 'WARNING'):
+					self.assertIsNone(BrokerClient.connect(path))
+				hangup.join(5)
+
+	def test_client(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'squishyd.sock'
+			broker = _FakeBroker(path)
+			broker.start()
+
+			with BrokerClient.connect(path) as client:
+				self.assertEqual(client.devices(), [ BrokerDevice('SQ-0001', (2, 0), 1, 4, False) ])
+
+				with self.assertRaises(BrokerError):
+					client.lease('SQ-9999')
+
+				with client.lease() as lease:
+					self.assertEqual(lease.device.serial, 'SQ-0001')
+					self.assertEqual(lease.control_read(0xA1, 3, 0, 0, 6), b'\xA1\x03\x00\x00')
+
+					stream = lease.open_stream(interface = 1)
+					client.subscribe()
+					self.assertEqual(stream.read(), b'abc')
+					self.assertEqual(stream.read(), b'def')
+
+					with self.assertRaises(BrokerError):
+						stream.read()
+
+				self.assertEqual(client.next_event(0.1), _CLOSED)
+				self.assertIsNone(client.next_event(0.1))
+
+			broker.join(5)
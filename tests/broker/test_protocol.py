@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import asyncio
+import socket
+from unittest                 import TestCase
+
+from squishy.broker.protocol  import BrokerError, FrameKind, encode_frame, read_frame, recv_frame
+
+class BrokerProtocolTests(TestCase):
+	def test_roundtrip(self) -> None:
+		(left, right) = socket.socketpair()
+		with left, right:
+			left.sendall(b''.join(encode_frame(FrameKind.REQUEST, message = { 'id': 1, 'op': 'hello' })))
+			left.sendall(b''.join(encode_frame(FrameKind.DATA, channel = 7, payload = memoryview(b'\x00\x01\x02'))))
+			left.shutdown(socket.SHUT_WR)
+
+			frame = recv_frame(right)
+			self.assertEqual(frame.kind, FrameKind.REQUEST)
+			self.assertEqual(frame.channel, 0)
+			self.assertEqual(frame.message, { 'id': 1, 'op': 'hello' })
+			self.assertEqual(frame.payload, b'')
+
+			frame = recv_frame(right)
+			self.assertEqual(frame.kind, FrameKind.DATA)
+			self.assertEqual(frame.channel, 7)
+			self.assertIsNone(frame.message)
+			self.assertEqual(frame.payload, b'\x00\x01\x02')
+
+			self.assertIsNone(recv_frame(right))
+
+	def test_async_roundtrip(self) -> None:
+		async def _read() -> None:
+			reader = asyncio.StreamReader()
+			reader.feed_data(b''.join(encode_frame(
+				FrameKind.RESPONSE, message = { 'id': 2, 'result': None }, payload = b'data'
+			)))
+			reader.feed_eof()
+
+			frame = await read_frame(reader)
+			self.assertEqual(frame.kind, FrameKind.RESPONSE)
+			self.assertEqual(frame.message, { 'id': 2, 'result': None })
+			self.assertEqual(frame.payload, b'data')
+
+			self.assertIsNone(await read_frame(reader))
+
+		asyncio.run(_read())
+
+	def test_malformed(self) -> None:
+		async def _read(data: bytes) -> None:
+			reader = asyncio.StreamReader()
+			reader.feed_data(data)
+			reader.feed_eof()
+			await read_frame(reader)
+
+		(header, _) = encode_frame(FrameKind.EVENT, message = { 'event': 'attached' })
+
+		# Truncated in the middle of the message
+		with self.assertRaises(BrokerError):
+			asyncio.run(_read(header[:-2]))
+
+		# Unknown frame kind
+		with self.assertRaises(BrokerError):
+			asyncio.run(_read(b'\xFF' + header[1:]))
+
+		# Absurd payload length
+		with self.assertRaises(BrokerError):
+			asyncio.run(_read(header[:8] + b'\xFF\xFF\xFF\xFF' + header[12:]))
+
+		with self.assertRaises(BrokerError):
+			encode_frame(FrameKind.DATA, payload = bytes(32 * 1024 * 1024))
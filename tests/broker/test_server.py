@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import asyncio
+from pathlib                import Path
+from tempfile               import TemporaryDirectory
+from threading              import Event, Thread
+from time                   import monotonic, sleep
+from unittest               import TestCase
+from unittest.mock          import patch
+
+from squishy.broker         import BrokerClient, BrokerError
+from squishy.broker.server  import SquishyBroker
+from squishy.core.config    import USB_DFU_PID
+
+from ..fakeusb              import FakeSquishy, fake_libusb
+
+class _BrokerThread(Thread):
+	''' Run the broker on its own event loop, so the blocking client can be used against it '''
+
+	def __init__(self, broker: SquishyBroker) -> None:
+		super().__init__(daemon = True)
+
+		self._broker = broker
+		self._ready  = Event()
+		self._loop: asyncio.AbstractEventLoop | None = None
+		self._task: asyncio.Task | None              = None
+
+	def run(self) -> None:
+		asyncio.run(self._serve())
+
+	async def _serve(self) -> None:
+		self._loop = asyncio.get_running_loop()
+		self._task = asyncio.current_task()
+		self._ready.set()
+		try:
+			await self._broker.serve()
+		except asyncio.CancelledError:
+			pass
+
+	def start(self) -> None:
+		super().start()
+		self._ready.wait()
+
+	def stop(self) -> None:
+		assert self._loop is not None and self._task is not None
+		self._loop.call_soon_threadsafe(self._task.cancel)
+		self.join()
+
+def _wait_for(predicate, timeout: float = 2.0) -> None:
+	''' Wait for the broker to notice a change '''
+	deadline = monotonic() + timeout
+	while not predicate():
+		if monotonic() > deadline:
+			raise TimeoutError('Timed out waiting for the broker')
+		sleep(0.01)
+
+class SquishyBrokerTests(TestCase):
+	def setUp(self) -> None:
+		self.fake = FakeSquishy(dfu = False)
+
+		tmp       = TemporaryDirectory()
+		self.path = Path(tmp.name) / 'squishyd.sock'
+		self.addCleanup(tmp.cleanup)
+
+		libusb   = fake_libusb(self.fake)
+		self.ctx = libusb.__enter__()
+		self.addCleanup(libusb.__exit__, None, None, None)
+
+		for target, value in (
+			('squishy.broker.server._libusb_context', lambda: self.ctx),
+			('squishy.broker.server.hasCapability', lambda _: False),
+			('squishy.broker.server._HOTPLUG_SETTLE', 0),
+		):
+			patcher = patch(target, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def _start(self, *, lease_grace: float = 10.0) -> None:
+		broker = _BrokerThread(SquishyBroker(self.path, poll_interval = 0.02, lease_grace = lease_grace))
+		broker.start()
+		self.addCleanup(broker.stop)
+		_wait_for(self.path.exists)
+
+	def _connect(self) -> BrokerClient:
+		client = BrokerClient.connect(self.path)
+		self.assertIsNotNone(client)
+		self.addCleanup(client.close)
+		return client
+
+	def _unplug(self, client: BrokerClient) -> None:
+		self.ctx.devices.remove(self.fake)
+		_wait_for(lambda: len(client.devices()) == 0)
+
+	def _plug(self, client: BrokerClient, *, dfu: bool) -> None:
+		if dfu:
+			self.fake.pid = USB_DFU_PID
+		self.ctx.add(self.fake)
+		_wait_for(lambda: len(client.devices()) == 1)
+
+	def test_devices(self) -> None:
+		self._start()
+		client = self._connect()
+
+		self.assertEqual([ dev.serial for dev in client.devices() ], [ 'SQ-0001' ])
+
+	def test_stream_slow_reader(self) -> None:
+		self._start()
+		client = self._connect()
+		chunks = [ bytes((idx, )) * 32768 for idx in range(256) ]
+
+		# Keep hold of everything the transport is given, like it can until it's actually sent
+		handed: list[bytes | memoryview] = []
+		writelines = asyncio.StreamWriter.writelines
+
+		def _writelines(writer: asyncio.StreamWriter, data) -> None:
+			data = list(data)
+			handed.extend(data)
+			writelines(writer, data)
+
+		with (
+			patch('asyncio.StreamWriter.writelines', _writelines),
+			client.lease() as lease,
+			lease.open_stream(interface = 1, transfer_size = 32768, transfers = 4) as stream,
+		):
+			for chunk in chunks:
+				self.fake.send(chunk)
+
+			# Let the broker get well ahead of us, so the slots it sent from get reused while it's still sending
+			sleep(0.2)
+			received = [ stream.read(timeout = 2) for _ in chunks ]
+
+		sent = [ bytes(data) for data in handed if len(data) == 32768 ]
+		self.assertEqual(len(received), len(chunks))
+		self.assertEqual(len(sent), len(chunks))
+		# None of what the transport was given should have changed out from under it since
+		for (idx, chunk) in enumerate(chunks):
+			self.assertTrue(received[idx] == chunk, f'chunk {idx} was corrupted')
+			self.assertTrue(sent[idx] == chunk, f'chunk {idx} was changed after it was sent')
+
+	def test_lease_survives_reenumeration(self) -> None:
+		self._start()
+		client = self._connect()
+		other  = self._connect()
+
+		lease = client.lease(remote = False)
+		# Going into DFU mode, the device goes away for a while and comes back as a different USB device
+		self._unplug(other)
+		self._plug(other, dfu = True)
+
+		self.assertTrue(other.devices()[0].dfu)
+		with self.assertRaisesRegex(BrokerError, 'busy'):
+			other.lease()
+		self.assertIsNone(client.next_event(timeout = 0.1))
+
+		lease.release()
+		other.lease().release()
+
+	def test_lease_expires(self) -> None:
+		self._start(lease_grace = 0.1)
+		client = self._connect()
+		other  = self._connect()
+
+		lease = client.lease(remote = False)
+		self._unplug(other)
+
+		self.assertEqual(client.next_event(timeout = 2), { 'event': 'lease_lost', 'lease': lease.lease_id })
+
+		# Coming back after the grace period, the device is up for grabs
+		self._plug(other, dfu = True)
+		other.lease().release()
+
+	def test_remote_lease_dropped(self) -> None:
+		self._start()
+		client = self._connect()
+
+		lease = client.lease()
+		self.assertEqual(lease.control_read(0xA1, 5, 0, 0, 1), bytes((0, )))
+
+		# A remote lease can't survive the device going away, as the broker's handle to it is dead
+		self._unplug(client)
+		self.assertEqual(client.next_event(timeout = 2), { 'event': 'lease_lost', 'lease': lease.lease_id })
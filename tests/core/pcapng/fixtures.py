@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+The captures, frames, and packets shared by the :py:mod:`squishy.core.pcapng` tests, along with building them the
+slow way with construct, to check the fast paths against.
+
+'''
+
+from datetime                     import datetime, timezone
+from random                       import Random
+
+from arrow                        import Arrow
+
+from squishy.core.pcapng          import TS_RESOLUTION_NS, BlockType, LinkType, OptionType, PCAPNGStream, pcapng_block
+from squishy.core.pcapng.linktype import SCSIFrameType, linktype_parallel_scsi
+
+__all__ = (
+	'construct_epb',
+	'construct_psf',
+	'inquiry_traffic',
+	'OPTIONS',
+	'scsi_capture',
+	'scsi_frame',
+	'scsi_traffic',
+	'TIMESTAMPS',
+)
+
+TIMESTAMPS = (
+	Arrow(1970, 1, 1),
+	Arrow(2024, 5, 6, 7, 8, 9, 123456),
+	Arrow(2106, 2, 7, 6, 28, 16),
+	datetime(2023, 11, 14, 22, 13, 20, 999999, tzinfo = timezone.utc),
+)
+
+OPTIONS = (
+	(),
+	({ 'type': OptionType.COMMENT, 'value': 'a' }, ),
+	({ 'type': OptionType.COMMENT, 'value': 'meow meow' }, ),
+	({
+		'type': OptionType.EPB_FLAGS,
+		'value': {
+			'dir': 1, 'rcpt': 1, 'fcs': 0, 'chk_rdy': False, 'chk_vld': False, 'tcp_off': False, 'rsvd': 0,
+			'errors': 0
+		}
+	}, { 'type': OptionType.COMMENT, 'value': 'nya' }),
+)
+
+def construct_epb(interface: int, data: bytes, ts, options) -> bytes:
+	return pcapng_block.build({
+		'type': BlockType.ENHANCED_PACKET,
+		'data': {
+			'interface_id': interface,
+			'timestamp': { 'value': ts },
+			'captured_len': len(data),
+			'packet_data': data,
+		},
+		'options': [ *options, { 'type': OptionType.END, 'value': None } ] if len(options) > 0 else None
+	})
+
+def construct_psf(interface: int, data: bytes, type: SCSIFrameType, orig: int, dest: int, ts, options) -> bytes:
+	frame = linktype_parallel_scsi.build({
+		'len': 0,
+		'type': type,
+		'orig_id': orig,
+		'dest_id': dest,
+		'data_len': len(data),
+		'data': data
+	})
+	return construct_epb(interface, frame, ts, options)
+
+def scsi_frame(type: SCSIFrameType, data: bytes) -> bytes:
+	return linktype_parallel_scsi.build({ 'len': 0, 'type': type, 'data_len': len(data), 'data': data })
+
+def scsi_traffic(count: int) -> list[bytes]:
+	''' Make something that looks like a host reading from a disk '''
+
+	rng    = Random(0x5C51)
+	frames = []
+	lba    = 0
+	while len(frames) < count:
+		blocks = rng.choice((1, 8, 16))
+		cdb    = bytes((0x28, 0, *lba.to_bytes(4, 'big'), 0, *blocks.to_bytes(2, 'big'), 0))
+		frames.append(scsi_frame(SCSIFrameType.COMMAND, cdb))
+		for _ in range(blocks):
+			# Mostly empty sectors, with the odd one that has something in it
+			sector = rng.randbytes(rng.randint(0, 64)).ljust(512, b'\x00')
+			frames.append(scsi_frame(SCSIFrameType.DATA_IN, sector))
+		frames.append(scsi_frame(SCSIFrameType.MESSAGE, b'\x00'))
+		if rng.random() < 0.01:
+			frames.append(scsi_frame(SCSIFrameType.BUS_CONDITION, b'\x01'))
+		lba += blocks
+	return frames[:count]
+
+def scsi_capture(file, frames: list[bytes], *, background: bool = False) -> None:
+	''' Write out a capture of SCSI traffic, with the odd packet on another interface mixed in '''
+
+	rng = Random(0x5C51)
+	with PCAPNGStream(file, background = background) as pcap:
+		pcap.emit_header(hardware = 'squishy')
+		scsi  = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi', ts_resolution = TS_RESOLUTION_NS)
+		other = pcap.emit_interface(LinkType.USER00, 'nya')
+		for idx, frame in enumerate(frames):
+			scsi.emit_packet(frame, idx * 1000)
+			if rng.random() < 0.1:
+				# Device IDs are from the frame, so make sure this doesn't look like one
+				other.emit_packet(bytes(64), idx)
+
+def inquiry_traffic(count: int) -> list[bytes]:
+	''' READs from one disk, with the odd INQUIRY of other targets mixed in '''
+
+	frames = []
+	for (idx, frame) in enumerate(scsi_traffic(count)):
+		frames.append(frame)
+		if idx % 100 == 0:
+			frames.append(linktype_parallel_scsi.build({
+				'len': 0, 'type': SCSIFrameType.COMMAND, 'orig_id': 7, 'dest_id': idx % 7, 'data_len': 6,
+				'data': bytes((0x12, 0, 0, 0, 36 + (idx // 100) % 4, 0))
+			}))
+	return frames
@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import zlib
+from io                   import BytesIO
+from pathlib              import Path
+from tempfile             import TemporaryDirectory
+from time                 import perf_counter
+from unittest             import TestCase, skipUnless
+
+from squishy.core.pcapng  import CompressedFile, Compression, LinkType, PCAPNGStream, RotatingFile, pcapng
+from squishy.support.test import benchmark
+
+from .fixtures            import scsi_traffic
+
+class CompressionTests(TestCase):
+	FRAMES = scsi_traffic(2000)
+
+	def _capture(self, file, **kwargs) -> PCAPNGStream:
+		with PCAPNGStream(file, **kwargs) as pcap:
+			pcap.emit_header(hardware = 'squishy', os = 'nya')
+			iface = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi')
+			for idx, frame in enumerate(self.FRAMES):
+				iface.emit_packet(frame, idx)
+		return pcap
+
+	def test_gzip(self) -> None:
+		with TemporaryDirectory() as tmp:
+			plain = Path(tmp) / 'plain.pcapng'
+			self._capture(plain)
+
+			for background in (False, True):
+				path = Path(tmp) / 'capture.pcapng.gz'
+				pcap = self._capture(path, compression = Compression.GZIP, background = background)
+
+				self.assertEqual(gzip.decompress(path.read_bytes()), plain.read_bytes())
+				self.assertGreater(pcap.compression_ratio, 5)
+				self.assertGreater(pcap.compression_throughput, 0)
+
+	@skipUnless(Compression.ZSTD.available, 'zstandard is not installed')
+	def test_zstd(self) -> None:
+		import zstandard
+
+		with TemporaryDirectory() as tmp:
+			plain = Path(tmp) / 'plain.pcapng'
+			self._capture(plain)
+
+			path = Path(tmp) / 'capture.pcapng.zst'
+			pcap = self._capture(path, compression = Compression.ZSTD, background = True)
+
+			with zstandard.ZstdDecompressor().stream_reader(path.open('rb')) as reader:
+				self.assertEqual(reader.read(), plain.read_bytes())
+			self.assertGreater(pcap.compression_ratio, 5)
+
+	def test_flush(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng.gz'
+			file = CompressedFile(path.open('wb'))
+
+			file.write(b'meow' * 1024)
+			self.assertEqual(file.bytes_out, 0)
+
+			# Everything written so far can be read back before the stream is finished
+			file.flush()
+			self.assertEqual(file.bytes_in, 4096)
+			self.assertEqual(zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(path.read_bytes()), b'meow' * 1024)
+
+			file.write(b'nya' * 1024)
+			file.close()
+			self.assertEqual(gzip.decompress(path.read_bytes()), b'meow' * 1024 + b'nya' * 1024)
+			self.assertEqual(file.bytes_out, path.stat().st_size)
+
+	def test_rotating(self) -> None:
+		with TemporaryDirectory() as tmp:
+			file = RotatingFile(
+				Path(tmp) / 'bus.pcapng.gz', size = 64 * 1024, opener = lambda path: CompressedFile(path.open('wb'))
+			)
+			with self.assertRaises(ValueError):
+				PCAPNGStream(file, compression = Compression.GZIP)
+
+			self._capture(file)
+			self.assertGreater(len(file.segments), 1)
+			for seg in file.segments:
+				self.assertEqual(pcapng.parse(gzip.decompress(seg.read_bytes()))[0].type, 'SECTION_HEADER')
+
+	def test_args(self) -> None:
+		with self.assertRaises(ValueError):
+			CompressedFile(BytesIO(), compression = Compression.NONE)
+
+@benchmark
+class CompressionBenchmark(TestCase):
+	FRAMES = 200000
+
+	def test_throughput(self) -> None:
+		frames = scsi_traffic(self.FRAMES)
+		size   = sum(len(frame) for frame in frames)
+
+		with TemporaryDirectory() as tmp:
+			modes = [ (Compression.NONE, None), (Compression.GZIP, 1), (Compression.GZIP, 6) ]
+			if Compression.ZSTD.available:
+				modes.extend(((Compression.ZSTD, 3), (Compression.ZSTD, 9)))
+
+			for (compression, level) in modes:
+				path  = Path(tmp) / f'capture.pcapng{compression.extension}'
+				start = perf_counter()
+				with PCAPNGStream(
+					path, background = True, compression = compression, compression_level = level
+				) as pcap:
+					pcap.emit_header(hardware = 'squishy')
+					iface = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi')
+					for idx, frame in enumerate(frames):
+						iface.emit_packet(frame, idx)
+				elapsed = perf_counter() - start
+
+				print(
+					f'\n{compression.value:<5} {level if level is not None else "-":>2}: '
+					f'{size / elapsed / (1024 * 1024):>8.1f} MB/s in, '
+					f'{path.stat().st_size / elapsed / (1024 * 1024):>8.1f} MB/s to disk, '
+					f'ratio {pcap.compression_ratio:>6.1f}x, '
+					f'compressor {pcap.compression_throughput / (1024 * 1024):>8.1f} MB/s'
+				)
+				# Mostly empty sectors compress well, and the compressor shouldn't be what holds the capture up
+				self.assertGreater(size / elapsed / (1024 * 1024), 10)
+				if compression != Compression.NONE:
+					self.assertGreater(pcap.compression_ratio, 5)
@@ -0,0 +1,193 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import struct
+from io                           import BytesIO
+from pathlib                      import Path
+from random                       import Random
+from tempfile                     import TemporaryDirectory
+from time                         import perf_counter
+from unittest                     import TestCase, skipUnless
+from unittest.mock                import patch
+
+from squishy.core.pcapng          import (
+	SCSI_FRAME_DTYPE, BlockType, LinkType, MappedCapture, SCSIFrames, SCSIIndex, SCSIIndexRow, build_scsi_index,
+	export_scsi_frames,
+)
+from squishy.core.pcapng.export   import _gather
+from squishy.core.pcapng.linktype import SCSIFrameType, linktype_parallel_scsi
+from squishy.support.test         import benchmark
+
+from .fixtures                    import scsi_capture, scsi_frame, scsi_traffic
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+@skipUnless(numpy is not None, 'numpy is not installed')
+class NumPyExportTests(TestCase):
+	FRAMES = scsi_traffic(3000)
+
+	def _check(self, frames: SCSIFrames, capture: Path) -> None:
+		self.assertEqual(frames.frames.dtype, SCSI_FRAME_DTYPE)
+		with SCSIIndex(build_scsi_index(capture)) as index:
+			self.assertEqual(
+				[ tuple(int(row[name]) for name in SCSIIndexRow._fields) for row in frames.frames ], list(index)
+			)
+		self.assertEqual([ bytes(frames.data(idx)) for idx in range(len(frames)) ], [
+			frame[28:28 + int.from_bytes(frame[24:28], 'little')] for frame in self.FRAMES
+		])
+
+	def test_export(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+
+			frames = export_scsi_frames(capture)
+			self.assertEqual(len(frames), 3000)
+			self.assertTrue((frames.frames['interface'] == 0).all())
+			self._check(frames, capture)
+			self.assertEqual(bytes(frames.data(-1)), bytes(frames.data(2999)))
+
+			with MappedCapture(capture) as mapped:
+				self._check(export_scsi_frames(mapped), capture)
+
+			empty = Path(tmp) / 'empty.pcapng'
+			empty.touch()
+			self.assertEqual(len(export_scsi_frames(empty)), 0)
+
+	def test_gather(self) -> None:
+		rng     = Random(0x5C51)
+		buffer  = numpy.frombuffer(rng.randbytes(65536), dtype = numpy.uint8)
+		lengths = [ rng.choice((0, 1, 7, 28, 512, 5000)) for _ in range(200) ]
+		starts  = [ rng.randrange(len(buffer) - length) for length in lengths ]
+
+		# Small batches, so there are frames split over them, and some too big for a batch on their own
+		with patch('squishy.core.pcapng.export._GATHER_BATCH', 1024):
+			(payload, offsets) = _gather(
+				buffer, numpy.array(starts, dtype = numpy.uint64), numpy.array(lengths, dtype = numpy.uint64)
+			)
+
+		expected = [ buffer[start:start + length].tobytes() for (start, length) in zip(starts, lengths) ]
+		self.assertEqual(payload.tobytes(), b''.join(expected))
+		self.assertEqual(
+			[ payload[offsets[idx]:offsets[idx + 1]].tobytes() for idx in range(len(expected)) ], expected
+		)
+
+	def test_compressed(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			compressed = Path(tmp) / 'capture.pcapng.gz'
+			compressed.write_bytes(gzip.compress(capture.read_bytes()))
+
+			expected = export_scsi_frames(capture)
+			for frames in (export_scsi_frames(compressed), export_scsi_frames(BytesIO(capture.read_bytes()))):
+				self.assertTrue((frames.frames == expected.frames).all())
+				self.assertTrue((frames.payload == expected.payload).all())
+				self.assertTrue((frames.payload_offsets == expected.payload_offsets).all())
+
+	def test_time_range(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			frames = export_scsi_frames(capture)
+
+			for (start, end) in ((500_000, 1_500_000), (None, 10_000), (2_999_000, None), (2_000_000, 1_000_000)):
+				span = frames.between(start, end)
+				rows = [
+					idx for idx in range(3000)
+					if (start is None or idx * 1000 >= start) and (end is None or idx * 1000 < end)
+				]
+				self.assertEqual(list(span.frames['timestamp']), [ idx * 1000 for idx in rows ])
+				self.assertEqual([ bytes(span.data(idx)) for idx in range(len(span)) ], [
+					bytes(frames.data(idx)) for idx in rows
+				])
+
+				for exported in (
+					export_scsi_frames(capture, start = start, end = end),
+					export_scsi_frames(BytesIO(capture.read_bytes()), start = start, end = end),
+				):
+					self.assertTrue((exported.frames == span.frames).all())
+					self.assertTrue((exported.payload == span.payload).all())
+
+			commands = frames.take(frames.frames['frame_type'] == SCSIFrameType.COMMAND)
+			self.assertTrue((commands.frames['opcode'] == 0x28).all())
+			self.assertTrue(all(len(commands.data(idx)) == 10 for idx in range(len(commands))))
+
+	def test_save(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			frames = export_scsi_frames(capture)
+
+			for compressed in (True, False):
+				path = Path(tmp) / f'frames-{compressed}.npz'
+				frames.save(path, compressed = compressed)
+				loaded = SCSIFrames.load(path)
+				self.assertTrue((loaded.frames == frames.frames).all())
+				self.assertTrue((loaded.payload == frames.payload).all())
+				self.assertTrue((loaded.payload_offsets == frames.payload_offsets).all())
+
+			path = Path(tmp) / 'other.npz'
+			numpy.savez(path, frames = numpy.zeros(4), payload = numpy.zeros(0), payload_offsets = numpy.zeros(5))
+			with self.assertRaises(ValueError):
+				SCSIFrames.load(path)
+
+	def test_big_endian(self) -> None:
+		def block(type: int, body: bytes) -> bytes:
+			return struct.pack('>II', type, len(body) + 12) + body + struct.pack('>I', len(body) + 12)
+
+		def epb(iface: int, ts: int, frame: bytes) -> bytes:
+			header = struct.pack('>IIIII', iface, 0, ts, len(frame), len(frame))
+			return block(BlockType.ENHANCED_PACKET, header + frame.ljust((len(frame) + 3) & ~3, b'\x00'))
+
+		frame = scsi_frame(SCSIFrameType.COMMAND, bytes((0x12, 0, 0, 0, 36, 0)))
+		data = b''.join((
+			block(BlockType.SECTION_HEADER, struct.pack('>IHHq', 0x1A2B3C4D, 1, 0, -1)),
+			block(BlockType.INTERFACE_DESCRIPTION, struct.pack('>HHI', LinkType.PARALLEL_SCSI, 0, 0)),
+			block(BlockType.INTERFACE_DESCRIPTION, struct.pack('>HHI', LinkType.USER00, 0, 0)),
+			epb(0, 1, frame),
+			epb(1, 2, frame),
+			# Too short to be a frame
+			epb(0, 3, frame[:20]),
+			epb(0, 4, frame),
+		))
+
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			capture.write_bytes(data)
+
+			for frames in (export_scsi_frames(capture), export_scsi_frames(BytesIO(data))):
+				self.assertEqual(list(frames.frames['timestamp']), [ 1000, 4000 ])
+				self.assertEqual(list(frames.frames['opcode']), [ 0x12, 0x12 ])
+				self.assertEqual(list(frames.frames['data_len']), [ 6, 6 ])
+				self.assertEqual(bytes(frames.data(1)), bytes((0x12, 0, 0, 0, 36, 0)))
+
+@benchmark
+@skipUnless(numpy is not None, 'numpy is not installed')
+class NumPyExportBenchmark(TestCase):
+	FRAMES = 200_000
+
+	def test_export(self) -> None:
+		frames = scsi_traffic(self.FRAMES)
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, frames)
+
+			start = perf_counter()
+			exported = export_scsi_frames(capture)
+			elapsed = perf_counter() - start
+			self.assertEqual(len(exported), self.FRAMES)
+
+			# Decoding every frame with construct is far too slow to do the whole capture, so just do some of it
+			start = perf_counter()
+			for frame in frames[:5000]:
+				linktype_parallel_scsi.parse(frame)
+			construct_rate = 5000 / (perf_counter() - start)
+
+			rate = self.FRAMES / elapsed
+			print(f'\nnumpy export: {rate:>12,.0f} frames/s')
+			print(f'construct:    {construct_rate:>12,.0f} frames/s ({rate / construct_rate:.1f}x)')
+			self.assertGreater(rate / construct_rate, 2)
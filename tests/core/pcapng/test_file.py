@@ -0,0 +1,132 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import errno
+import os
+from random               import Random
+from pathlib              import Path
+from tempfile             import TemporaryDirectory
+from time                 import perf_counter
+from unittest             import TestCase
+
+from squishy.core.pcapng  import TS_RESOLUTION_NS, CaptureFile, LinkType, PCAPNGStream, SyncPolicy
+from squishy.support.test import benchmark
+
+def _open_direct(path: Path, **kwargs) -> CaptureFile | None:
+	''' Open a CaptureFile with O_DIRECT, or None if the platform or filesystem doesn't support it '''
+	try:
+		return CaptureFile(path, direct = True, **kwargs)
+	except ValueError:
+		return None
+	except OSError as e:
+		if e.errno == errno.EINVAL:
+			return None
+		raise
+
+class CaptureFileTests(TestCase):
+	def _chunks(self) -> list[bytes]:
+		rng = Random(0x5C51)
+		return [ rng.randbytes(rng.choice((1, 7, 32, 511, 4096, 20000, 70000))) for _ in range(400) ]
+
+	def _check(self, path: Path, capture: CaptureFile) -> None:
+		chunks = self._chunks()
+		for idx, chunk in enumerate(chunks):
+			# Reuse the buffer to make sure anything kept back was copied
+			buffer = bytearray(chunk)
+			self.assertEqual(capture.write(buffer), len(chunk))
+			buffer[:] = bytes(len(buffer))
+			if idx % 97 == 0:
+				capture.flush()
+		self.assertEqual(capture.tell(), sum(len(chunk) for chunk in chunks))
+		capture.close()
+		self.assertTrue(capture.closed)
+
+		self.assertEqual(path.read_bytes(), b''.join(chunks))
+
+	def test_write(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture'
+			self._check(path, CaptureFile(path, batch_size = 65536, sync = SyncPolicy(size = 1024 * 1024)))
+
+	def test_preallocate(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path    = Path(tmp) / 'capture'
+			capture = CaptureFile(path, batch_size = 8192, preallocate = 1024 * 1024)
+			capture.write(bytes(10000))
+			# Only the aligned part is written, but a whole extent is allocated for it
+			self.assertEqual(os.stat(path).st_size, 1024 * 1024)
+			capture.close()
+			self.assertEqual(os.stat(path).st_size, 10000)
+
+			self._check(path, CaptureFile(path, batch_size = 65536, preallocate = 1024 * 1024))
+
+	def test_direct(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture'
+			if (capture := _open_direct(path, batch_size = 65536, preallocate = 1024 * 1024)) is None:
+				self.skipTest('O_DIRECT is not supported here')
+			self._check(path, capture)
+
+	def test_alignment(self) -> None:
+		with TemporaryDirectory() as tmp:
+			with self.assertRaises(ValueError):
+				CaptureFile(Path(tmp) / 'capture', alignment = 1000)
+
+	def test_stream(self) -> None:
+		with TemporaryDirectory() as tmp:
+			plain   = Path(tmp) / 'plain.pcapng'
+			capture = Path(tmp) / 'capture.pcapng'
+
+			for file, background in ((plain, False), (CaptureFile(capture, batch_size = 4096), True)):
+				with PCAPNGStream(file, background = background) as pcap:
+					pcap.emit_header(hardware = 'squishy', os = 'nya')
+					iface = pcap.emit_interface(LinkType.USER00, 'nya')
+					for idx in range(500):
+						iface.emit_packet(bytes(idx), idx)
+
+			self.assertEqual(plain.read_bytes(), capture.read_bytes())
+
+@benchmark
+class CaptureFileBenchmark(TestCase):
+	CAPTURE_SIZE = 64 * 1024 * 1024
+
+	def _throughput(self, name: str, file, *, background: bool = False, size: int = 512) -> float:
+		data    = bytes(size)
+		packets = self.CAPTURE_SIZE // (size + 64)
+
+		start = perf_counter()
+		with PCAPNGStream(file, background = background) as pcap:
+			pcap.emit_header(hardware = 'squishy')
+			iface = pcap.emit_interface(LinkType.USER07, 'scsi', ts_resolution = TS_RESOLUTION_NS)
+			for idx in range(packets):
+				iface.emit_packet(data, idx)
+		elapsed = perf_counter() - start
+
+		rate = self.CAPTURE_SIZE / elapsed / (1024 * 1024)
+		print(f'\n{name:<32} {size:>5} byte packets: {rate:>8.1f} MB/s')
+		# Even the smallest packets with a sync every 16MiB should manage this much
+		self.assertGreater(rate, 10)
+		return rate
+
+	def test_throughput(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+
+			for size in (64, 512, 8192):
+				buffered  = self._throughput('Buffered', path, size = size)
+				coalesced = self._throughput('CaptureFile', CaptureFile(path), size = size)
+				# With big packets this is down to the writes, where the coalescing should put it at least on par
+				if size >= 8192:
+					self.assertGreater(coalesced / buffered, 0.9)
+				self._throughput(
+					'CaptureFile (preallocate)', CaptureFile(path, preallocate = 64 * 1024 * 1024), size = size
+				)
+				if (direct := _open_direct(path, preallocate = 64 * 1024 * 1024)) is not None:
+					self._throughput('CaptureFile (O_DIRECT)', direct, size = size)
+				self._throughput(
+					'CaptureFile (background)', CaptureFile(path, preallocate = 64 * 1024 * 1024),
+					size = size, background = True
+				)
+				self._throughput(
+					'CaptureFile (fdatasync 16MiB)', CaptureFile(path, sync = SyncPolicy(size = 16 * 1024 * 1024)),
+					size = size
+				)
@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from random                       import Random
+from time                         import perf_counter
+from unittest                     import TestCase
+
+from construct                    import GreedyRange
+
+from squishy.core.pcapng.linktype import (
+	SCSIFrameBatch, SCSIFrameType, decode_frames, encode_frames, linktype_parallel_scsi,
+)
+from squishy.support.test         import benchmark
+
+class FrameCodecTests(TestCase):
+	def _frames(self, count: int) -> list[tuple[int, int, int, bytes]]:
+		rng = Random(0x5C51)
+		return [
+			(
+				rng.choice(tuple(SCSIFrameType)), rng.randrange(16), rng.randrange(16),
+				rng.randbytes(rng.choice((0, 1, 2, 3, 4, 5, 6, 10, 12, 255, 512)))
+			) for _ in range(count)
+		]
+
+	def test_encode(self) -> None:
+		frames = self._frames(500)
+		encoded = encode_frames(frames)
+
+		reference = GreedyRange(linktype_parallel_scsi).build([
+			{ 'len': 0, 'type': type, 'orig_id': orig, 'dest_id': dest, 'data_len': 0, 'data': data }
+			for (type, orig, dest, data) in frames
+		])
+		self.assertEqual(bytes(encoded), reference)
+		self.assertEqual(len(encoded) % 4, 0)
+		self.assertEqual(encode_frames(iter(frames)), encoded)
+		self.assertEqual(encode_frames([]), bytearray())
+
+	def test_decode(self) -> None:
+		frames = self._frames(500)
+		reference = GreedyRange(linktype_parallel_scsi).build([
+			{ 'len': 0, 'type': type, 'orig_id': orig, 'dest_id': dest, 'data_len': 0, 'data': data }
+			for (type, orig, dest, data) in frames
+		])
+
+		batch = decode_frames(reference)
+		self.assertIsInstance(batch, SCSIFrameBatch)
+		self.assertEqual(len(batch), len(frames))
+
+		parsed = GreedyRange(linktype_parallel_scsi).parse(reference)
+		for (idx, frame) in enumerate(parsed):
+			self.assertEqual(
+				(batch.frame_type[idx], batch.orig_id[idx], batch.dest_id[idx], batch.data_len[idx]),
+				(int(frame.type), frame.orig_id, frame.dest_id, frame.data_len)
+			)
+			self.assertEqual(bytes(batch.data(idx)), frame.data)
+
+		self.assertEqual([ (type, orig, dest, bytes(data)) for (type, orig, dest, data) in batch ], frames)
+		(type, orig, dest, data) = batch[-1]
+		self.assertEqual((type, orig, dest, bytes(data)), frames[-1])
+		self.assertEqual(len(decode_frames(b'')), 0)
+
+	def test_truncated(self) -> None:
+		encoded = encode_frames([ (SCSIFrameType.DATA_IN, 3, 7, bytes(8)), (SCSIFrameType.MESSAGE, 3, 7, b'\x00') ])
+
+		# The last frame doesn't need its padding
+		self.assertEqual(len(decode_frames(encoded[:-3])), 2)
+		with self.assertRaises(ValueError):
+			decode_frames(encoded[:-4])
+		with self.assertRaises(ValueError):
+			decode_frames(encoded[:40])
+
+	def test_bad_length(self) -> None:
+		encoded = encode_frames([ (SCSIFrameType.DATA_IN, 3, 7, bytes(8)), (SCSIFrameType.MESSAGE, 3, 7, b'\x00') ])
+
+		# Garbage where the second frame length should be
+		for frame_len in (0, 27, 29, 0xFFFFFFFF):
+			with self.subTest(frame_len = frame_len):
+				corrupt = bytearray(encoded)
+				corrupt[36:40] = frame_len.to_bytes(4, 'little')
+				with self.assertRaisesRegex(ValueError, f'Bad frame length {frame_len} at offset 36'):
+					decode_frames(corrupt)
+
+		# A data length running off the end of the buffer
+		corrupt = bytearray(encoded)
+		corrupt[24:28] = (len(encoded)).to_bytes(4, 'little')
+		with self.assertRaisesRegex(ValueError, 'Truncated frame data at offset 28'):
+			decode_frames(corrupt)
+
+@benchmark
+class FrameCodecBenchmark(TestCase):
+	FRAMES = 20000
+
+	def test_throughput(self) -> None:
+		codec = GreedyRange(linktype_parallel_scsi)
+
+		for size in (0, 16, 512):
+			frames = [ (SCSIFrameType.DATA_IN, 3, 7, bytes(size)) ] * self.FRAMES
+			values = [
+				{ 'len': 0, 'type': type, 'orig_id': orig, 'dest_id': dest, 'data_len': 0, 'data': data }
+				for (type, orig, dest, data) in frames
+			]
+
+			start = perf_counter()
+			encoded = codec.build(values)
+			slow_encode = self.FRAMES / (perf_counter() - start)
+			start = perf_counter()
+			encode_frames(frames)
+			fast_encode = self.FRAMES / (perf_counter() - start)
+
+			start = perf_counter()
+			codec.parse(encoded)
+			slow_decode = self.FRAMES / (perf_counter() - start)
+			start = perf_counter()
+			decode_frames(encoded)
+			fast_decode = self.FRAMES / (perf_counter() - start)
+
+			print(
+				f'\nPSF {size:>3} bytes: encode construct {slow_encode:>9.0f} frames/s, batch {fast_encode:>9.0f} '
+				f'frames/s ({fast_encode / slow_encode:.1f}x), decode construct {slow_decode:>9.0f} frames/s, '
+				f'batch {fast_decode:>9.0f} frames/s ({fast_decode / slow_decode:.1f}x)'
+			)
+			self.assertGreaterEqual(fast_encode / slow_encode, 10)
+			self.assertGreaterEqual(fast_decode / slow_decode, 10)
@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from random               import Random
+from pathlib              import Path
+from tempfile             import TemporaryDirectory
+from time                 import perf_counter
+from unittest             import TestCase
+from unittest.mock        import patch
+
+from squishy.core.pcapng  import (
+	TS_RESOLUTION_NS, BlockType, EnhancedPacket, LinkType, MappedCapture, PCAPNGReader, PCAPNGStream,
+)
+from squishy.support.test import benchmark
+
+from .fixtures            import scsi_traffic
+
+class MappedCaptureTests(TestCase):
+	def _capture(self, path: Path, packets: int = 500, *, ts_offset: int = 0) -> None:
+		rng = Random(0x5C51)
+		with PCAPNGStream(path) as pcap:
+			pcap.emit_header(hardware = 'squishy', os = 'nya')
+			ifaces = [
+				pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi', ts_resolution = TS_RESOLUTION_NS),
+				pcap.emit_interface(LinkType.USER00, 'nya', ts_offset = ts_offset),
+			]
+			for idx in range(packets):
+				# Both interfaces tick along at 1us per packet, just in different units
+				ifaces[idx & 1].emit_packet(rng.randbytes(rng.randint(0, 200)), idx * 1000 if idx & 1 == 0 else idx)
+
+	def test_index(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+			self._capture(path)
+
+			with PCAPNGReader(path) as reader:
+				expected = [ (blk.interface_id, bytes(blk.data)) for blk in reader if isinstance(blk, EnhancedPacket) ]
+
+			with MappedCapture(path) as capture:
+				self.assertEqual(len(capture), 500)
+				self.assertTrue(capture.in_order)
+				self.assertEqual([ iface.name for iface in capture.interfaces ], [ 'scsi', 'nya' ])
+				self.assertEqual(list(capture.timestamps), [ idx * 1000 for idx in range(500) ])
+				self.assertEqual(list(capture.packet_interfaces), [ idx & 1 for idx in range(500) ])
+				self.assertEqual(list(capture.block_types[:3]), [
+					BlockType.SECTION_HEADER, BlockType.INTERFACE_DESCRIPTION, BlockType.INTERFACE_DESCRIPTION
+				])
+
+				packets = [ capture.packet(idx) for idx in range(len(capture)) ]
+				self.assertEqual([ (pkt.interface_id, bytes(pkt.data)) for pkt in packets ], expected)
+				self.assertEqual([ bytes(capture.packet_data(idx)) for idx in range(len(capture)) ], [
+					data for (_, data) in expected
+				])
+				self.assertEqual([ pkt.timestamp_ns for pkt in packets ], list(capture.timestamps))
+				del packets
+
+				# The blocks cover the whole of the file
+				data = path.read_bytes()
+				self.assertEqual(b''.join(capture.block(idx) for idx in range(len(capture.block_offsets))), data)
+				self.assertEqual(bytes(capture.block(-1)), data[capture.offsets[-1]:])
+
+	def test_between(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+			self._capture(path)
+
+			with MappedCapture(path) as capture:
+				self.assertEqual(capture.between(5000, 10000), range(5, 10))
+				self.assertEqual(capture.between(4500, 10001), range(5, 11))
+				self.assertEqual(capture.find(-1), 0)
+				self.assertEqual(capture.find(1 << 62), 500)
+				self.assertEqual(len(capture.between(1 << 62, 1 << 63)), 0)
+
+	def test_out_of_order(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+			# The second interface is 1s behind the first
+			self._capture(path, 200, ts_offset = -1)
+
+			with MappedCapture(path) as capture:
+				self.assertFalse(capture.in_order)
+
+				span = capture.between(-1_000_000_000, 0)
+				self.assertEqual(list(span), list(range(1, 200, 2)))
+				self.assertEqual(list(capture.between(0, 10_000)), list(range(0, 10, 2)))
+
+				stamps = [ capture.timestamps[idx] for idx in capture.between(-(1 << 62), 1 << 62) ]
+				self.assertEqual(stamps, sorted(capture.timestamps))
+
+	def test_sections(self) -> None:
+		with TemporaryDirectory() as tmp:
+			first  = Path(tmp) / 'first.pcapng'
+			second = Path(tmp) / 'second.pcapng'
+			path   = Path(tmp) / 'capture.pcapng'
+			self._capture(first, 10)
+			self._capture(second, 10)
+			path.write_bytes(first.read_bytes() + second.read_bytes())
+
+			with MappedCapture(path) as capture:
+				self.assertEqual(len(capture), 20)
+				self.assertEqual([ iface.id for iface in capture.interfaces ], [ 0, 1, 2, 3 ])
+				self.assertEqual(list(capture.packet_interfaces), [ 0, 1 ] * 5 + [ 2, 3 ] * 5)
+				self.assertEqual(capture.packet(15).interface_id, 1)
+
+	def _snapshot(self, capture: MappedCapture) -> tuple:
+		return (
+			list(capture.block_offsets), list(capture.block_types), list(capture.offsets),
+			list(capture.packet_interfaces), list(capture.timestamps), capture.in_order,
+			list(capture.between(-(1 << 62), 1 << 62)),
+			[ (iface.name, iface.ts_units) for iface in capture.interfaces ],
+			[ bytes(capture.packet_data(idx)) for idx in range(len(capture)) ],
+		)
+
+	def test_cache(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path  = Path(tmp) / 'capture.pcapng'
+			cache = Path(tmp) / 'capture.pcapng.pcapidx'
+			# Out of order, so the timestamp order of the packets has to come back from the cache too
+			self._capture(path, 200, ts_offset = -1)
+
+			with MappedCapture(path) as capture:
+				expected = self._snapshot(capture)
+			self.assertTrue(cache.exists())
+
+			with patch.object(MappedCapture, '_index', side_effect = AssertionError('Capture was indexed again')):
+				with MappedCapture(path) as capture:
+					self.assertEqual(self._snapshot(capture), expected)
+					self.assertEqual(capture.packet(3).interface_id, 1)
+
+			# Once the capture changes, the cache is stale
+			self._capture(path, 100)
+			with MappedCapture(path) as capture:
+				self.assertEqual(len(capture), 100)
+				self.assertTrue(capture.in_order)
+
+	def test_bad_cache(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path  = Path(tmp) / 'capture.pcapng'
+			cache = Path(tmp) / 'capture.pcapng.pcapidx'
+			self._capture(path, 50)
+
+			with MappedCapture(path, cache = False) as capture:
+				expected = self._snapshot(capture)
+			self.assertFalse(cache.exists())
+
+			with MappedCapture(path) as capture:
+				pass
+			for data in (b'', b'nya', cache.read_bytes()[:-16]):
+				cache.write_bytes(data)
+				with MappedCapture(path) as capture:
+					self.assertEqual(self._snapshot(capture), expected)
+
+	def test_malformed(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+			path.write_bytes(b'')
+			with MappedCapture(path) as capture:
+				self.assertEqual(len(capture), 0)
+
+			self._capture(path, 10)
+			data = path.read_bytes()
+			path.write_bytes(data[:-8])
+			with self.assertRaises(ValueError):
+				MappedCapture(path)
+
+@benchmark
+class MappedCaptureBenchmark(TestCase):
+	PACKETS = 200000
+
+	def test_throughput(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+			with PCAPNGStream(path) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				iface = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi', ts_resolution = TS_RESOLUTION_NS)
+				for idx, frame in enumerate(scsi_traffic(self.PACKETS)):
+					iface.emit_packet(frame, idx * 1000)
+
+			start = perf_counter()
+			with MappedCapture(path) as capture:
+				index_time = perf_counter() - start
+
+				rng     = Random(0x5C51)
+				lookups = [ rng.randrange(len(capture)) for _ in range(100000) ]
+				start   = perf_counter()
+				for idx in lookups:
+					capture.packet_data(idx)
+				lookup_time = perf_counter() - start
+
+				start = perf_counter()
+				for idx in lookups:
+					capture.between(idx * 1000, idx * 1000 + 50_000)
+				search_time = perf_counter() - start
+
+			start = perf_counter()
+			with MappedCapture(path) as capture:
+				cached_time = perf_counter() - start
+
+			print(f'\nindex:  {self.PACKETS / index_time:>10.0f} packets/s')
+			print(f'\ncached: {self.PACKETS / cached_time:>10.0f} packets/s')
+			print(f'\nlookup: {len(lookups) / lookup_time:>10.0f} packets/s')
+			print(f'\nsearch: {len(lookups) / search_time:>10.0f} ranges/s')
+			self.assertGreater(self.PACKETS / index_time, 100_000)
+			self.assertGreater(index_time / cached_time, 10)
+			self.assertGreater(len(lookups) / lookup_time, 200_000)
+			self.assertGreater(len(lookups) / search_time, 100_000)
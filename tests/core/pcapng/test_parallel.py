@@ -0,0 +1,168 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import os
+import struct
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from time                         import perf_counter
+from multiprocessing              import shared_memory
+from unittest                     import TestCase, skipUnless
+from unittest.mock                import patch
+
+from squishy.core.pcapng          import (
+	BlockType, LinkType, PCAPNGStream, export_scsi_frames, export_scsi_frames_parallel,
+)
+from squishy.core.pcapng.linktype import SCSIFrameType
+from squishy.support.test         import benchmark
+
+from .fixtures                    import scsi_capture, scsi_frame, scsi_traffic
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+class _TrackedSharedMemory(shared_memory.SharedMemory):
+	''' Keeps count of how many blocks of shared memory there are at once '''
+
+	live = 0
+	peak = 0
+
+	def __init__(self, *args, create: bool = False, **kwargs) -> None:
+		super().__init__(*args, create = create, **kwargs)
+		if create:
+			type(self).live += 1
+			type(self).peak = max(type(self).peak, type(self).live)
+
+	def unlink(self) -> None:
+		super().unlink()
+		type(self).live -= 1
+
+@skipUnless(numpy is not None, 'numpy is not installed')
+class ParallelExportTests(TestCase):
+	FRAMES = scsi_traffic(3000)
+
+	def _check(self, capture: Path, **kwargs) -> None:
+		expected = export_scsi_frames(capture)
+		expected = expected.take(numpy.argsort(expected.frames['timestamp'], kind = 'stable'))
+
+		for (workers, chunk_size) in ((1, None), (1, 4096), (2, 4096), (3, 100_000)):
+			with self.subTest(workers = workers, chunk_size = chunk_size):
+				frames = export_scsi_frames_parallel(capture, workers = workers, chunk_size = chunk_size, **kwargs)
+				self.assertTrue((frames.frames == expected.frames).all())
+				self.assertTrue((frames.payload == expected.payload).all())
+				self.assertTrue((frames.payload_offsets == expected.payload_offsets).all())
+
+	def test_export(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			self._check(capture)
+
+			frames = export_scsi_frames_parallel(
+				capture, workers = 2, chunk_size = 4096, start = 500_000, end = 900_000
+			)
+			self.assertEqual(list(frames.frames['timestamp']), list(range(500_000, 900_000, 1000)))
+
+	def test_bounded(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			expected = export_scsi_frames(capture)
+
+			_TrackedSharedMemory.live = _TrackedSharedMemory.peak = 0
+			with patch('squishy.core.pcapng.parallel.shared_memory.SharedMemory', _TrackedSharedMemory):
+				frames = export_scsi_frames_parallel(capture, workers = 2, chunk_size = 4096)
+
+			# There are a couple hundred chunks, but only one per worker should ever have been waiting on its rows
+			self.assertGreater(capture.stat().st_size // 4096, 100)
+			self.assertLessEqual(_TrackedSharedMemory.peak, 2)
+			self.assertEqual(_TrackedSharedMemory.live, 0)
+			self.assertEqual(len(frames), len(expected))
+
+	def test_sections(self) -> None:
+		with TemporaryDirectory() as tmp:
+			first  = Path(tmp) / 'first.pcapng'
+			second = Path(tmp) / 'second.pcapng'
+			scsi_capture(first, self.FRAMES)
+
+			# A second section with the interfaces the other way around, a different resolution, and timestamps
+			# that go back in time so everything has to be put back in order
+			with PCAPNGStream(second) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				pcap.emit_interface(LinkType.USER00, 'nya')
+				scsi = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi')
+				for (idx, frame) in enumerate(self.FRAMES[:1000]):
+					scsi.emit_packet(frame, idx)
+
+			capture = Path(tmp) / 'capture.pcapng'
+			capture.write_bytes(first.read_bytes() + second.read_bytes())
+			self._check(capture)
+
+			frames = export_scsi_frames_parallel(capture, workers = 2, chunk_size = 4096)
+			self.assertEqual(set(frames.frames['interface']), { 0, 3 })
+
+	def test_resync(self) -> None:
+		# Frames full of things that look like blocks, to throw off finding where the blocks start
+		fake = b''.join(struct.pack('<IIIIIIII', 6, 32, 0, 0, idx, 0, 0, 32) for idx in range(4))
+		frames = [ scsi_frame(SCSIFrameType.DATA_IN, fake * (idx % 3 + 1)) for idx in range(1000) ]
+
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, frames)
+			self._check(capture)
+			for chunk_size in (128, 256, 1000):
+				frames = export_scsi_frames_parallel(capture, workers = 1, chunk_size = chunk_size)
+				self.assertEqual(len(frames), 1000)
+
+	def test_fallback(self) -> None:
+		def block(type: int, body: bytes) -> bytes:
+			return struct.pack('>II', type, len(body) + 12) + body + struct.pack('>I', len(body) + 12)
+
+		frame = scsi_frame(SCSIFrameType.COMMAND, bytes((0x12, 0, 0, 0, 36, 0)))
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES[:100])
+
+			# A big endian section on the end
+			with capture.open('ab') as file:
+				file.write(block(BlockType.SECTION_HEADER, struct.pack('>IHHq', 0x1A2B3C4D, 1, 0, -1)))
+				file.write(block(BlockType.INTERFACE_DESCRIPTION, struct.pack('>HHI', LinkType.PARALLEL_SCSI, 0, 0)))
+				file.write(block(BlockType.ENHANCED_PACKET, struct.pack('>IIIII', 0, 0, 1, 40, 40) + frame))
+			self._check(capture)
+
+			compressed = Path(tmp) / 'capture.pcapng.gz'
+			compressed.write_bytes(gzip.compress(capture.read_bytes()))
+			self.assertEqual(len(export_scsi_frames_parallel(compressed, workers = 2)), 101)
+
+			with self.assertRaises(ValueError):
+				export_scsi_frames_parallel(capture, workers = 0)
+
+@benchmark
+@skipUnless(numpy is not None, 'numpy is not installed')
+class ParallelExportBenchmark(TestCase):
+	FRAMES = 500_000
+
+	def test_export(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, scsi_traffic(self.FRAMES))
+
+			start = perf_counter()
+			export_scsi_frames(capture)
+			serial = perf_counter() - start
+			print(f'\nserial:     {self.FRAMES / serial:>12,.0f} frames/s')
+
+			best = serial
+			for workers in sorted({ 1, 2, os.cpu_count() or 1 }):
+				start = perf_counter()
+				frames = export_scsi_frames_parallel(capture, workers = workers)
+				elapsed = perf_counter() - start
+				self.assertEqual(len(frames), self.FRAMES)
+				print(f'{workers:>2} workers: {self.FRAMES / elapsed:>12,.0f} frames/s ({serial / elapsed:.1f}x)')
+				best = min(best, elapsed)
+
+			# The worker pool and shared memory aren't free, but with enough cores they should more than pay for it
+			if (os.cpu_count() or 1) >= 4:
+				self.assertGreater(serial / best, 1.5)
@@ -0,0 +1,187 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import os
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from unittest                     import TestCase
+
+from squishy.core.pcapng          import (
+	EnhancedPacket, InterfaceDescription, LinkType, PCAPNGReader, Query, QueryFrame, SectionHeader, build_scsi_index,
+	decode_cdb, scsi_index_path,
+)
+from squishy.core.pcapng.linktype import SCSIFrameType, linktype_parallel_scsi
+
+from .fixtures                    import inquiry_traffic, scsi_capture, scsi_frame
+
+class QueryTests(TestCase):
+	FRAMES = inquiry_traffic(3000)
+
+	def _expected(self, capture: Path, check) -> list[tuple[int, bytes]]:
+		''' Find the matches the slow way '''
+
+		matches = []
+		with PCAPNGReader(capture) as reader:
+			for block in reader:
+				if not isinstance(block, EnhancedPacket) or block.interface_id != 0:
+					continue
+				frame = linktype_parallel_scsi.parse(block.data)
+				frame.type = SCSIFrameType(int(frame.type))
+				if check(frame, block.timestamp_ns):
+					matches.append((block.timestamp_ns, bytes(frame.data)))
+		return matches
+
+	def test_compile(self) -> None:
+		for expression in (
+			'', 'type ==', 'nya == 1', 'type = COMMAND', 'lambda: 1', 'opcode.nya', 'cdb', 'f(1)', 'NYA', 'len[0]'
+		):
+			with self.subTest(expression = expression):
+				with self.assertRaises(ValueError):
+					Query(expression)
+
+		self.assertEqual(Query('type == COMMAND').expression, 'type == COMMAND')
+		self.assertEqual(Query('type == COMMAND and dest in (1, 3) and opcode == 0x12').pushdown, {
+			'frame_type': (int(SCSIFrameType.COMMAND), ), 'dest_id': (1, 3), 'opcode': (0x12, )
+		})
+		self.assertEqual(Query('1000 <= ts and ts < 2000.5 and orig == 7').pushdown, {
+			'orig_id': (7, ), 'start': 1000, 'end': 2001
+		})
+		self.assertEqual(Query('ts > 10 and ts <= 20').pushdown, { 'start': 11, 'end': 21 })
+		# Nothing that has to be true of every match
+		self.assertEqual(Query('type == COMMAND or len > 4 * KiB').pushdown, {})
+		self.assertEqual(Query('not (type == COMMAND)').pushdown, {})
+		self.assertIsNone(Query('type == COMMAND and type == INVALID').pushdown)
+		self.assertIsNone(Query('ts >= 20 and ts < 10').pushdown)
+
+	def test_cdb(self) -> None:
+		inquiry = decode_cdb(bytes((0x12, 0, 0, 0, 36, 0)))
+		self.assertIsNotNone(inquiry)
+		self.assertEqual(inquiry.AllocLen, 36)
+		self.assertIsNone(decode_cdb(b''))
+		self.assertIsNone(decode_cdb(b'\x12\x00'))
+
+		query = Query('type == COMMAND and cdb.AllocLen == 36')
+		frame = QueryFrame(0, 0, 0, self.FRAMES[1])
+		self.assertEqual(frame.opcode, 0x12)
+		self.assertTrue(query.matches(frame))
+		self.assertFalse(query.matches(QueryFrame(0, 0, 0, self.FRAMES[0])))
+		self.assertFalse(query.matches(QueryFrame(0, 0, 0, scsi_frame(SCSIFrameType.COMMAND, b''))))
+		self.assertFalse(Query('opcode == 0').matches(QueryFrame(0, 0, 0, scsi_frame(SCSIFrameType.MESSAGE, b''))))
+
+	def test_frames(self) -> None:
+		queries = {
+			'type == COMMAND and opcode == 0x12 and dest == 3 and cdb.AllocLen >= 37': lambda frame, ts: (
+				frame.type == SCSIFrameType.COMMAND and frame.dest_id == 3 and frame.data[0] == 0x12 and
+				frame.data[4] >= 37
+			),
+			'type == DATA_IN and ts >= 1_000_000 and ts < 1_500_000': lambda frame, ts: (
+				frame.type == SCSIFrameType.DATA_IN and 1_000_000 <= ts < 1_500_000
+			),
+			'type in (MESSAGE, BUS_CONDITION) or (orig == 7 and dest != 0)': lambda frame, ts: (
+				frame.type in (SCSIFrameType.MESSAGE, SCSIFrameType.BUS_CONDITION) or
+				(frame.orig_id == 7 and frame.dest_id != 0)
+			),
+			# READ(10) isn't one of the commands that can be decoded, so only the `len` half matches those
+			'type == COMMAND and (cdb.AllocLen == 36 or len > 6)': lambda frame, ts: (
+				frame.type == SCSIFrameType.COMMAND and (
+					(frame.data[0] == 0x12 and frame.data[4] == 36) or frame.data_len > 6
+				)
+			),
+			'type == INVALID and type == COMMAND': lambda frame, ts: False,
+		}
+
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+
+			for (expression, check) in queries.items():
+				query    = Query(expression)
+				expected = self._expected(capture, check)
+				with self.subTest(expression = expression):
+					streamed = [ (frame.timestamp, frame.data) for frame in query.frames(capture) ]
+					self.assertEqual(streamed, expected)
+
+					indexed = [ (frame.timestamp, frame.data) for frame in query.frames(capture, index = True) ]
+					self.assertEqual(indexed, expected)
+
+					with capture.open('rb') as file:
+						self.assertEqual([ (frame.timestamp, frame.data) for frame in query.frames(file) ], expected)
+
+			self.assertTrue(scsi_index_path(capture).exists())
+
+	def test_write(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture  = Path(tmp) / 'capture.pcapng'
+			streamed = Path(tmp) / 'streamed.pcapng'
+			indexed  = Path(tmp) / 'indexed.pcapng'
+			scsi_capture(capture, self.FRAMES)
+
+			query = Query('type == COMMAND and dest == 3')
+			count = query.write(capture, streamed, index = False)
+			self.assertEqual(count, len(self._expected(
+				capture, lambda frame, ts: frame.type == SCSIFrameType.COMMAND and frame.dest_id == 3
+			)))
+			self.assertEqual(query.write(capture, indexed, index = True), count)
+			self.assertEqual(indexed.read_bytes(), streamed.read_bytes())
+
+			with PCAPNGReader(streamed) as reader:
+				blocks = list(reader)
+			self.assertIsInstance(blocks[0], SectionHeader)
+			self.assertEqual(sum(1 for block in blocks if isinstance(block, InterfaceDescription)), 2)
+			packets = [ block for block in blocks if isinstance(block, EnhancedPacket) ]
+			self.assertEqual(len(packets), count)
+			self.assertTrue(all(block.interface.link_type == LinkType.PARALLEL_SCSI for block in packets))
+			self.assertTrue(all(block.data[6] == 3 for block in packets))
+
+			# Nothing can match, but it's still a capture
+			self.assertEqual(Query('dest == 1 and dest == 2').write(capture, streamed), 0)
+			with PCAPNGReader(streamed) as reader:
+				self.assertFalse(any(isinstance(block, EnhancedPacket) for block in reader))
+
+	def test_stale_index(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES[:100])
+			build_scsi_index(capture)
+
+			# Rewrite the capture so the index doesn't match it any more
+			scsi_capture(capture, self.FRAMES[100:])
+			index = scsi_index_path(capture)
+			os.utime(index, ns = (0, 0))
+
+			query    = Query('type == COMMAND and opcode == 0x12')
+			expected = self._expected(
+				capture, lambda frame, ts: frame.type == SCSIFrameType.COMMAND and frame.data[0] == 0x12
+			)
+			for index_opt in (None, True):
+				self.assertEqual(
+					[ (frame.timestamp, frame.data) for frame in query.frames(capture, index = index_opt) ], expected
+				)
+
+			# Being given the wrong index outright is an error
+			build_scsi_index(capture)
+			scsi_capture(capture, self.FRAMES[:100])
+			with self.assertRaises(ValueError):
+				list(Query('type == DATA_IN').frames(capture, index = index))
+
+	def test_compressed(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture    = Path(tmp) / 'capture.pcapng'
+			compressed = Path(tmp) / 'capture.pcapng.gz'
+			streamed   = Path(tmp) / 'streamed.pcapng'
+			indexed    = Path(tmp) / 'indexed.pcapng'
+			scsi_capture(capture, self.FRAMES[:500])
+			compressed.write_bytes(gzip.compress(capture.read_bytes()))
+
+			# The index can't be used with a compressed capture, so it should quietly fall back to streaming
+			query    = Query('type == COMMAND and opcode == 0x12')
+			expected = [ (frame.timestamp, frame.data) for frame in query.frames(capture, index = False) ]
+			self.assertNotEqual(expected, [])
+			for index_opt in (None, True):
+				self.assertEqual(
+					[ (frame.timestamp, frame.data) for frame in query.frames(compressed, index = index_opt) ], expected
+				)
+
+			count = query.write(capture, streamed, index = False)
+			self.assertEqual(query.write(compressed, indexed, index = True), count)
+			self.assertEqual(indexed.read_bytes(), streamed.read_bytes())
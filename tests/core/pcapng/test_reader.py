@@ -0,0 +1,215 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import struct
+from io                   import BytesIO
+from random               import Random
+from pathlib              import Path
+from tempfile             import TemporaryDirectory
+from threading            import Thread
+from time                 import perf_counter
+from unittest             import TestCase
+
+from arrow                import Arrow
+
+from squishy.core.pcapng  import (
+	TS_RESOLUTION_NS, Block, BlockType, CompressedFile, EnhancedPacket, InterfaceDescription, LinkType, OptionType,
+	PCAPNGReader, PCAPNGStream, SectionHeader, pcapng, write_isb,
+)
+from squishy.support.test import benchmark
+
+from .fixtures            import OPTIONS, scsi_traffic
+
+class _ClosedBytesIO(BytesIO):
+	''' Keeps hold of what was written after being closed '''
+
+	value = b''
+
+	def close(self) -> None:
+		if not self.closed:
+			self.value = self.getvalue()
+		super().close()
+
+class PCAPNGReaderTests(TestCase):
+	def _capture(self, file = None, packets: int = 500, size: int = 200) -> bytes:
+		if file is None:
+			file = _ClosedBytesIO()
+
+		rng = Random(0x5C51)
+		with PCAPNGStream(file) as pcap:
+			pcap.emit_header(hardware = 'squishy', os = 'nya')
+			ifaces = [
+				pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi', ts_resolution = TS_RESOLUTION_NS),
+				pcap.emit_interface(LinkType.USER00, 'nya', ts_offset = 1700000000),
+			]
+			for idx in range(packets):
+				ifaces[idx & 1].emit_packet(
+					rng.randbytes(rng.randint(0, size)), idx * 1000,
+					options = OPTIONS[idx % len(OPTIONS)] if idx & 1 else ()
+				)
+
+		return file.value if isinstance(file, _ClosedBytesIO) else b''
+
+	def test_read(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+			self._capture(path)
+			with path.open('ab') as f:
+				write_isb(f, 0, Arrow(2024, 5, 6))
+
+			expected = pcapng.parse(path.read_bytes())
+			with PCAPNGReader(path, buffer_size = 4096) as reader:
+				blocks = [
+					(blk.type, blk.interface_id, blk.timestamp, bytes(blk.data), len(blk.options))
+					if isinstance(blk, EnhancedPacket) else (blk.type, type(blk))
+					for blk in reader
+				]
+
+				self.assertEqual(reader.offset, path.stat().st_size)
+				self.assertEqual([ iface.name for iface in reader.interfaces ], [ 'scsi', 'nya' ])
+				self.assertEqual([ iface.ts_units for iface in reader.interfaces ], [ 10**9, 10**6 ])
+				self.assertEqual([ iface.ts_offset for iface in reader.interfaces ], [ 0, 1700000000 ])
+
+			self.assertEqual(len(blocks), len(expected))
+			self.assertEqual(blocks[:3], [
+				(BlockType.SECTION_HEADER, SectionHeader),
+				(BlockType.INTERFACE_DESCRIPTION, InterfaceDescription),
+				(BlockType.INTERFACE_DESCRIPTION, InterfaceDescription),
+			])
+			self.assertEqual(blocks[-1], (BlockType.INTERFACE_STATISTICS, Block))
+
+			for blk, exp in zip(blocks[3:-1], expected[3:-1]):
+				self.assertEqual(blk[:4], (
+					BlockType.ENHANCED_PACKET, exp.data.interface_id,
+					(exp.data.timestamp.raw.high << 32) | exp.data.timestamp.raw.low, exp.data.packet_data
+				))
+				self.assertEqual(blk[4], 0 if exp.options is None else len(exp.options) - 1)
+
+	def test_timestamp(self) -> None:
+		capture = self._capture(packets = 4)
+
+		packets = [ blk for blk in PCAPNGReader(BytesIO(capture)) if isinstance(blk, EnhancedPacket) ]
+		self.assertEqual(
+			[ pkt.timestamp_ns for pkt in packets ], [ 0, 1700000000_001_000_000, 2000, 1700000000_003_000_000 ]
+		)
+
+	def test_options(self) -> None:
+		blocks = PCAPNGReader(BytesIO(self._capture(packets = 8)))
+		header = next(iter(blocks))
+		self.assertIsInstance(header, SectionHeader)
+		self.assertFalse(header.big_endian)
+		self.assertEqual((header.major, header.minor, header.section_len), (1, 0, -1))
+		self.assertEqual(
+			[ (code, bytes(value)) for code, value in header.options ],
+			[ (OptionType.SHB_HARDWARE, b'squishy'), (OptionType.SHB_OS, b'nya'),
+				(OptionType.SHB_USERAPPL, b'Squishy PCAPNG Stream') ]
+		)
+
+		packets = [ blk for blk in blocks if isinstance(blk, EnhancedPacket) and blk.interface_id == 1 ]
+		self.assertEqual([ (code, bytes(value)) for code, value in packets[0].options ], [ (OptionType.COMMENT, b'a') ])
+		self.assertEqual(
+			[ (code, len(value)) for code, value in packets[1].options ],
+			[ (OptionType.EPB_FLAGS, 4), (OptionType.COMMENT, 3) ]
+		)
+
+	def test_big_endian(self) -> None:
+		def block(type: int, body: bytes) -> bytes:
+			return struct.pack('>II', type, len(body) + 12) + body + struct.pack('>I', len(body) + 12)
+
+		capture = b''.join((
+			block(BlockType.SECTION_HEADER, struct.pack('>IHHq', 0x1A2B3C4D, 1, 0, -1)),
+			block(BlockType.INTERFACE_DESCRIPTION, struct.pack('>HHIHHBxxxHH', 0x93, 0, 0, 9, 1, 3, 0, 0)),
+			block(BlockType.ENHANCED_PACKET, struct.pack('>IIIII', 0, 1, 2, 4, 5) + b'meow'),
+		))
+
+		(header, iface, packet) = list(PCAPNGReader(BytesIO(capture)))
+		self.assertTrue(header.big_endian)
+		self.assertEqual((iface.link_type, iface.ts_resolution, iface.ts_units), (0x93, 3, 1000))
+		self.assertEqual(
+			(packet.timestamp, packet.captured_len, packet.original_len, bytes(packet.data)),
+			((1 << 32) | 2, 4, 5, b'meow')
+		)
+		self.assertEqual(packet.timestamp_ns, ((1 << 32) | 2) * 1_000_000)
+
+	def test_pipe(self) -> None:
+		capture = self._capture(packets = 2000)
+
+		(read_fd, write_fd) = os.pipe()
+
+		def _writer() -> None:
+			# Dribble it out in odd sized chunks, so the blocks are split across reads
+			with os.fdopen(write_fd, 'wb', buffering = 0) as pipe:
+				for offset in range(0, len(capture), 1021):
+					pipe.write(capture[offset:offset + 1021])
+
+		thread = Thread(target = _writer)
+		thread.start()
+		with os.fdopen(read_fd, 'rb', buffering = 0) as pipe:
+			packets = [
+				bytes(blk.data) for blk in PCAPNGReader(pipe, buffer_size = 4096) if isinstance(blk, EnhancedPacket)
+			]
+		thread.join()
+
+		self.assertEqual(packets, [ blk.data.packet_data for blk in pcapng.parse(capture)[3:] ])
+
+	def test_large(self) -> None:
+		capture = self._capture(packets = 20, size = 20000)
+
+		packets = [
+			bytes(blk.data) for blk in PCAPNGReader(BytesIO(capture), buffer_size = 4096)
+			if isinstance(blk, EnhancedPacket)
+		]
+		self.assertEqual(packets, [ blk.data.packet_data for blk in pcapng.parse(capture)[3:] ])
+
+	def test_compressed(self) -> None:
+		with TemporaryDirectory() as tmp:
+			plain = Path(tmp) / 'capture.pcapng'
+			self._capture(plain)
+			path = Path(tmp) / 'capture.pcapng.gz'
+			self._capture(CompressedFile(path.open('wb')))
+
+			with PCAPNGReader(plain) as reader:
+				expected = [ bytes(blk.body) for blk in reader ]
+			with PCAPNGReader(path) as reader:
+				self.assertEqual([ bytes(blk.body) for blk in reader ], expected)
+
+	def test_truncated(self) -> None:
+		capture = self._capture(packets = 4)
+
+		for length in (len(capture) - 4, len(capture) - 30):
+			with self.assertRaises(ValueError):
+				list(PCAPNGReader(BytesIO(capture[:length])))
+
+		with self.assertRaises(ValueError):
+			list(PCAPNGReader(BytesIO(capture[:8] + b'meow' + capture[12:])))
+
+@benchmark
+class PCAPNGReaderBenchmark(TestCase):
+	PACKETS = 50000
+
+	def test_throughput(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng'
+			with PCAPNGStream(path) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				iface = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi')
+				for idx, frame in enumerate(scsi_traffic(self.PACKETS)):
+					iface.emit_packet(frame, idx)
+
+			size  = path.stat().st_size
+			start = perf_counter()
+			slow  = sum(1 for blk in pcapng.parse(path.read_bytes()) if blk.type == 'ENHANCED_PACKET')
+			slow_time = perf_counter() - start
+
+			start = perf_counter()
+			with PCAPNGReader(path) as reader:
+				fast = sum(1 for blk in reader if isinstance(blk, EnhancedPacket))
+			fast_time = perf_counter() - start
+
+			self.assertEqual(slow, fast)
+			for (name, elapsed) in (('construct', slow_time), ('PCAPNGReader', fast_time)):
+				print(
+					f'\n{name:<12}: {fast / elapsed:>10.0f} packets/s, {size / elapsed / (1024 * 1024):>8.1f} MB/s'
+				)
+			print(f'\nspeedup: {slow_time / fast_time:.1f}x')
+			self.assertGreater(slow_time / fast_time, 10)
@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import signal
+from random                       import Random
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from unittest                     import TestCase
+
+from squishy.core.pcapng          import FlightRecorder, LinkType, PCAPNGStream, frame_trigger, pcapng
+from squishy.core.pcapng.linktype import SCSIFrameType
+
+from .fixtures                    import scsi_frame
+
+class FlightRecorderTests(TestCase):
+	def _packets(self, path: Path) -> list[int]:
+		''' Check the dump stands on its own, and get the timestamps of the packets in it '''
+
+		blocks = pcapng.parse(path.read_bytes())
+		self.assertEqual([ blk.type for blk in blocks[:2] ], [ 'SECTION_HEADER', 'INTERFACE_DESCRIPTION' ])
+		self.assertTrue(all(blk.type == 'ENHANCED_PACKET' for blk in blocks[2:]))
+
+		return [ blk.data.timestamp.raw.low for blk in blocks[2:] ]
+
+	def _capture(
+		self, recorder: FlightRecorder, frames: list[tuple[SCSIFrameType, bytes]], *, background: bool = False
+	) -> None:
+		with PCAPNGStream(recorder, background = background) as pcap:
+			pcap.emit_header(hardware = 'squishy', os = 'nya')
+			iface = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi')
+			for idx, (type, data) in enumerate(frames):
+				iface.emit_packet(scsi_frame(type, data), idx)
+
+	def test_predicate(self) -> None:
+		frames = [ (SCSIFrameType.DATA_IN, bytes(64)) ] * 500
+		frames[300] = (SCSIFrameType.BUS_CONDITION, b'\x01')
+
+		with TemporaryDirectory() as tmp:
+			recorder = FlightRecorder(
+				Path(tmp) / 'reset.pcapng', capacity = 4096, predicate = frame_trigger(SCSIFrameType.BUS_CONDITION),
+				post_trigger = None, post_packets = 10
+			)
+			self._capture(recorder, frames)
+
+			self.assertEqual(sorted(Path(tmp).iterdir()), recorder.dumps)
+			self.assertEqual(len(recorder.dumps), 1)
+			self.assertTrue(recorder.dumps[0].name.startswith('reset_00001_'))
+
+			# Only as much as fits in the ring before the trigger, and everything in the post-trigger window
+			packets = self._packets(recorder.dumps[0])
+			self.assertEqual(packets, list(range(packets[0], 311)))
+			self.assertLess(len(packets) - 11, 4096 // 120)
+			self.assertGreater(len(packets) - 11, 4096 // 120 - 3)
+
+	def test_data(self) -> None:
+		frames = [ (SCSIFrameType.MESSAGE, b'\x00') ] * 50
+		frames[20] = (SCSIFrameType.MESSAGE, b'\x02')
+		frames[40] = (SCSIFrameType.DATA_IN, b'\x02')
+
+		with TemporaryDirectory() as tmp:
+			recorder = FlightRecorder(
+				Path(tmp) / 'status.pcapng', post_trigger = None, post_packets = 2,
+				predicate = frame_trigger(SCSIFrameType.MESSAGE, data = lambda status: status[0] == 0x02)
+			)
+			self._capture(recorder, frames)
+
+			self.assertEqual(len(recorder.dumps), 1)
+			self.assertEqual(self._packets(recorder.dumps[0]), list(range(23)))
+
+	def test_ring(self) -> None:
+		rng = Random(0x5C51)
+		sizes = [ rng.randint(1, 1500) for _ in range(2000) ]
+
+		with TemporaryDirectory() as tmp:
+			recorder = FlightRecorder(Path(tmp) / 'ring.pcapng', capacity = 16384, post_trigger = 0)
+			with PCAPNGStream(recorder) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				iface = pcap.emit_interface(LinkType.USER00, 'nya')
+				for idx, size in enumerate(sizes):
+					iface.emit_packet(bytes([ idx & 0xFF ]) * size, idx)
+				recorder.trigger()
+
+			blocks = pcapng.parse(recorder.dumps[0].read_bytes())[2:]
+			packets = [ blk.data.timestamp.raw.low for blk in blocks ]
+
+			# Whatever is left in the ring is the tail end of the capture, and none of it is mangled
+			self.assertEqual(packets, list(range(packets[0], 2000)))
+			self.assertGreater(len(packets), 5)
+			for blk in blocks:
+				idx = blk.data.timestamp.raw.low
+				self.assertEqual(blk.data.packet_data, bytes([ idx & 0xFF ]) * sizes[idx])
+
+	def test_signal(self) -> None:
+		with TemporaryDirectory() as tmp:
+			recorder = FlightRecorder(Path(tmp) / 'signal.pcapng', post_trigger = 0)
+			previous = signal.getsignal(signal.SIGUSR1)
+			try:
+				recorder.trigger_on(signal.SIGUSR1)
+				with PCAPNGStream(recorder) as pcap:
+					pcap.emit_header(hardware = 'squishy')
+					iface = pcap.emit_interface(LinkType.USER00, 'nya')
+					for idx in range(10):
+						iface.emit_packet(bytes(16), idx)
+
+					self.assertEqual(recorder.dumps, [])
+					os.kill(os.getpid(), signal.SIGUSR1)
+					pcap.flush()
+					self.assertEqual(len(recorder.dumps), 1)
+			finally:
+				signal.signal(signal.SIGUSR1, previous)
+
+			self.assertEqual(self._packets(recorder.dumps[0]), list(range(10)))
+
+	def test_retrigger(self) -> None:
+		frames = [ (SCSIFrameType.DATA_IN, bytes(8)) ] * 100
+		for idx in (10, 15, 60):
+			frames[idx] = (SCSIFrameType.BUS_CONDITION, b'')
+
+		with TemporaryDirectory() as tmp:
+			recorder = FlightRecorder(
+				Path(tmp) / 'reset.pcapng', capacity = 1024, predicate = frame_trigger(SCSIFrameType.BUS_CONDITION),
+				post_trigger = None, post_packets = 10
+			)
+			self._capture(recorder, frames, background = True)
+
+			# The second reset is in the first window, so it gets extended rather than starting a new dump
+			self.assertEqual(len(recorder.dumps), 2)
+			first  = self._packets(recorder.dumps[0])
+			second = self._packets(recorder.dumps[1])
+			self.assertEqual(first, list(range(0, 26)))
+			self.assertEqual(second, list(range(second[0], 71)))
+			self.assertGreater(second[0], 26)
+
+	def test_args(self) -> None:
+		with self.assertRaises(ValueError):
+			FlightRecorder('reset.pcapng', capacity = 0)
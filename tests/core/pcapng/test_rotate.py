@@ -0,0 +1,78 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from pathlib             import Path
+from tempfile            import TemporaryDirectory
+from unittest            import TestCase
+
+from squishy.core.pcapng import CaptureFile, LinkType, PCAPNGStream, RotatingFile, pcapng
+
+class RotatingFileTests(TestCase):
+	def _packets(self, path: Path) -> list[int]:
+		''' Check the file stands on its own, and get the timestamps of the packets in it '''
+
+		blocks = pcapng.parse(path.read_bytes())
+		self.assertEqual(blocks[0].type, 'SECTION_HEADER')
+		self.assertEqual([ blk.data.type for blk in blocks[1:3] ], [ 'USER00', 'USER01' ])
+		self.assertTrue(all(blk.type == 'ENHANCED_PACKET' for blk in blocks[3:]))
+
+		return [ blk.data.timestamp.raw.low for blk in blocks[3:] ]
+
+	def _capture(self, file: RotatingFile, *, background: bool = False, packets: int = 200) -> None:
+		with PCAPNGStream(file, background = background) as pcap:
+			pcap.emit_header(hardware = 'squishy', os = 'nya')
+			ifaces = [ pcap.emit_interface(LinkType.USER00, 'nya') ]
+			for idx in range(packets):
+				# Interfaces that show up part way through should be in every file after
+				if idx == 1:
+					ifaces.append(pcap.emit_interface(LinkType.USER01, 'meow'))
+				ifaces[idx & 1 if idx > 0 else 0].emit_packet(bytes(100), idx)
+
+	def test_size(self) -> None:
+		with TemporaryDirectory() as tmp:
+			file = RotatingFile(Path(tmp) / 'bus.pcapng', size = 4096)
+			self._capture(file)
+
+			self.assertGreater(len(file.segments), 4)
+			self.assertEqual(sorted(Path(tmp).iterdir()), list(file.segments))
+			self.assertTrue(all(seg.name.startswith(f'bus_{idx + 1:05}_') for idx, seg in enumerate(file.segments)))
+			self.assertTrue(all(seg.name.endswith('.pcapng') for seg in file.segments))
+
+			# The first file has the second interface show up after a packet
+			blocks = pcapng.parse(file.segments[0].read_bytes())
+			self.assertEqual([ blk.type for blk in blocks[:4] ], [
+				'SECTION_HEADER', 'INTERFACE_DESCRIPTION', 'ENHANCED_PACKET', 'INTERFACE_DESCRIPTION'
+			])
+
+			packets = []
+			for seg in file.segments[1:]:
+				self.assertLessEqual(seg.stat().st_size, 4096)
+				packets.extend(self._packets(seg))
+			self.assertEqual(packets, list(range(packets[0], 200)))
+
+	def test_files(self) -> None:
+		with TemporaryDirectory() as tmp:
+			file = RotatingFile(Path(tmp) / 'bus.pcapng', duration = 0, files = 3)
+			self._capture(file, packets = 20)
+
+			# Each packet goes in its own file, and only the last 3 are kept
+			self.assertEqual(sorted(Path(tmp).iterdir()), list(file.segments))
+			self.assertEqual([ seg.name[:9] for seg in file.segments ], [ 'bus_00018', 'bus_00019', 'bus_00020' ])
+			self.assertEqual([ self._packets(seg) for seg in file.segments ], [ [ 17 ], [ 18 ], [ 19 ] ])
+
+	def test_background(self) -> None:
+		with TemporaryDirectory() as tmp:
+			file = RotatingFile(
+				Path(tmp) / 'bus.pcapng', size = 8192, opener = lambda path: CaptureFile(path, batch_size = 4096)
+			)
+			self._capture(file, background = True, packets = 2000)
+
+			packets = []
+			for seg in file.segments[1:]:
+				self.assertLessEqual(seg.stat().st_size, 8192)
+				packets.extend(self._packets(seg))
+			self.assertEqual(packets, list(range(packets[0], 2000)))
+
+	def test_args(self) -> None:
+		with TemporaryDirectory() as tmp:
+			with self.assertRaises(ValueError):
+				RotatingFile(Path(tmp) / 'bus.pcapng', files = 0)
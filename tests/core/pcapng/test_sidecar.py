@@ -0,0 +1,198 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from io                           import BytesIO
+from random                       import Random
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from time                         import perf_counter
+from unittest                     import TestCase
+
+from squishy.core.pcapng          import (
+	CaptureFile, IndexedFile, LinkType, MappedCapture, PCAPNGStream, RotatingFile, SCSIIndex, SCSIIndexRow,
+	SCSIIndexWriter, build_scsi_index, scsi_index_path,
+)
+from squishy.core.pcapng.linktype import SCSIFrameType, linktype_parallel_scsi
+from squishy.support.test         import benchmark
+
+from .fixtures                    import scsi_capture, scsi_traffic
+
+class SCSIIndexTests(TestCase):
+	FRAMES = scsi_traffic(3000)
+
+	def _expected(self, capture: Path) -> list[SCSIIndexRow]:
+		''' Get the rows by decoding every frame the slow way '''
+
+		rows = []
+		with MappedCapture(capture) as mapped:
+			for idx in range(len(mapped)):
+				if mapped.packet_interfaces[idx] != 0:
+					continue
+				frame = linktype_parallel_scsi.parse(bytes(mapped.packet_data(idx)))
+				rows.append(SCSIIndexRow(
+					mapped.offsets[idx], mapped.timestamps[idx], int(frame.type), frame.orig_id, frame.dest_id,
+					frame.data[0] if frame.data_len > 0 else 0, frame.data_len
+				))
+		return rows
+
+	def test_build(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+
+			path = build_scsi_index(capture, chunk_rows = 1000)
+			self.assertEqual(path, scsi_index_path(capture))
+			self.assertEqual(path.name, 'capture.pcapng.scsidx')
+
+			with SCSIIndex(capture) as index:
+				self.assertEqual(len(index), 3000)
+				self.assertEqual(list(index), self._expected(capture))
+				self.assertEqual(index[1234], list(index)[1234])
+				self.assertEqual(index[-1], list(index)[-1])
+				self.assertEqual(index.count(SCSIFrameType.MESSAGE), sum(
+					1 for frame in self.FRAMES if frame[4] == SCSIFrameType.MESSAGE
+				))
+				self.assertEqual(sum(len(column) for column in index.column('opcode')), 3000)
+
+	def test_incremental(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			expected = self._expected(capture)
+
+			for background in (False, True):
+				live = Path(tmp) / f'live-{background}.pcapng'
+				scsi_capture(
+					IndexedFile(CaptureFile(live), scsi_index_path(live), chunk_rows = 700), self.FRAMES,
+					background = background
+				)
+				self.assertEqual(live.read_bytes(), capture.read_bytes())
+				with SCSIIndex(live) as index:
+					self.assertEqual(list(index), expected)
+
+			# Without an index path it goes next to the capture
+			live = Path(tmp) / 'path.pcapng'
+			scsi_capture(IndexedFile(live), self.FRAMES[:10])
+			with SCSIIndex(live) as index:
+				self.assertEqual(len(index), 10)
+
+			with self.assertRaises(ValueError):
+				IndexedFile(BytesIO())
+
+			# The offsets would be wrong as soon as it rotates
+			rotating = RotatingFile(Path(tmp) / 'rotating.pcapng', size = 4096)
+			with self.assertRaisesRegex(ValueError, 'RotatingFile'):
+				IndexedFile(rotating, Path(tmp) / 'rotating.scsiidx')
+			rotating.close()
+
+	def test_select(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			build_scsi_index(capture, chunk_rows = 1000)
+
+			with SCSIIndex(capture) as index:
+				rows = list(index)
+
+				def _check(**kwargs) -> None:
+					def _match(row: SCSIIndexRow) -> bool:
+						for name in ('frame_type', 'orig_id', 'dest_id', 'opcode'):
+							if (want := kwargs.get(name)) is not None:
+								if getattr(row, name) not in (want if isinstance(want, tuple) else (want, )):
+									return False
+						if kwargs.get('opcode') is not None and row.data_len == 0:
+							return False
+						if kwargs.get('start') is not None and row.timestamp < kwargs['start']:
+							return False
+						if kwargs.get('end') is not None and row.timestamp >= kwargs['end']:
+							return False
+						return True
+
+					self.assertEqual(index.select(**kwargs), [ idx for idx, row in enumerate(rows) if _match(row) ])
+
+				_check()
+				_check(frame_type = SCSIFrameType.COMMAND)
+				_check(frame_type = (SCSIFrameType.COMMAND, SCSIFrameType.BUS_CONDITION))
+				_check(frame_type = SCSIFrameType.COMMAND, opcode = 0x28)
+				_check(frame_type = SCSIFrameType.MESSAGE, opcode = 0x00)
+				_check(opcode = 0x00)
+				_check(frame_type = SCSIFrameType.DATA_IN, start = 500_000, end = 1_500_000)
+				_check(start = 999_000, end = 2_000_001)
+				_check(start = 2_000_000, end = 1_000_000)
+				_check(dest_id = 3)
+
+	def test_out_of_order(self) -> None:
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng.scsidx'
+			with SCSIIndexWriter(path, chunk_rows = 4) as writer:
+				for (idx, ts) in enumerate((0, 10, 5, 20, 30, 40, 50, 60, 15)):
+					writer.append(idx * 100, ts, SCSIFrameType.COMMAND, 7, idx & 1, 0x12, 6)
+
+			with SCSIIndex(path) as index:
+				self.assertEqual(index.select(start = 10, end = 30), [ 1, 3, 8 ])
+				self.assertEqual(index.select(start = 10, end = 30, dest_id = 1), [ 1, 3 ])
+
+	def test_truncated(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			path = build_scsi_index(capture, chunk_rows = 1000)
+
+			# A chunk that was cut short is dropped, but the rest is still usable
+			path.write_bytes(path.read_bytes()[:-100])
+			with SCSIIndex(path) as index:
+				self.assertEqual(len(index), 2000)
+
+			path.write_bytes(b'meow' * 8)
+			with self.assertRaises(ValueError):
+				SCSIIndex(path)
+
+			path.write_bytes(b'')
+			with self.assertRaisesRegex(ValueError, 'too short to be a SCSI index'):
+				SCSIIndex(path)
+
+	def test_flush(self) -> None:
+		with TemporaryDirectory() as tmp:
+			live = Path(tmp) / 'live.pcapng'
+
+			with PCAPNGStream(IndexedFile(live, flush_rows = 1000)) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				iface = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi')
+				for (idx, frame) in enumerate(self.FRAMES):
+					iface.emit_packet(frame, idx)
+					# Flushing after every packet shouldn't leave a chunk behind for each of them
+					pcap.flush()
+
+				with SCSIIndex(live) as index:
+					self.assertEqual(len(index), 3000)
+					self.assertEqual(len(list(index.column('offset'))), 3)
+
+			with SCSIIndex(live) as index:
+				self.assertEqual(len(index), 3000)
+
+@benchmark
+class SCSIIndexBenchmark(TestCase):
+	ROWS  = 4_000_000
+	TYPES = (SCSIFrameType.COMMAND, SCSIFrameType.DATA_IN, SCSIFrameType.DATA_IN, SCSIFrameType.MESSAGE)
+
+	def test_select(self) -> None:
+		rng = Random(0x5C51)
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / 'capture.pcapng.scsidx'
+			with SCSIIndexWriter(path) as writer:
+				for idx in range(self.ROWS):
+					frame_type = SCSIFrameType.BUS_CONDITION if idx % 10_000 == 0 else rng.choice(self.TYPES)
+					writer.append(idx * 64, idx * 1000, frame_type, 7, rng.randrange(7), 0x28, 512)
+
+			for (name, kwargs) in (
+				('target', { 'dest_id': 3 }),
+				('commands to a target', { 'frame_type': SCSIFrameType.COMMAND, 'dest_id': 3, 'opcode': 0x28 }),
+				('bus conditions', { 'frame_type': SCSIFrameType.BUS_CONDITION }),
+				('1s window', { 'frame_type': SCSIFrameType.COMMAND, 'start': 1_000_000_000, 'end': 2_000_000_000 }),
+			):
+				start = perf_counter()
+				with SCSIIndex(path) as index:
+					rows = index.select(**kwargs)
+				elapsed = perf_counter() - start
+				print(f'\n{name:<24}: {len(rows):>8} of {self.ROWS} rows in {elapsed * 1000:>8.1f}ms')
+				# Each of these is a handful of passes over the mapped columns, not a walk over the rows
+				self.assertLess(elapsed, 0.5)
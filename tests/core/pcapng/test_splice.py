@@ -0,0 +1,199 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import gzip
+import os
+import struct
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from unittest                     import TestCase
+from unittest.mock                import patch
+
+from squishy.core.pcapng          import (
+	BlockType, EnhancedPacket, InterfaceDescription, LinkType, OptionType, PCAPNGReader, PCAPNGStream, SectionHeader,
+	merge_captures, slice_capture,
+)
+from squishy.core.pcapng.linktype import SCSIFrameType
+
+from .fixtures                    import inquiry_traffic, scsi_capture, scsi_frame
+
+class SpliceTests(TestCase):
+	FRAMES = inquiry_traffic(2000)
+
+	def _blocks(self, capture: Path) -> list[tuple[int, int, bytes]]:
+		''' Get the type, timestamp, and raw bytes of every block, with packets on their merged interface '''
+
+		blocks = []
+		with PCAPNGReader(capture) as reader:
+			for block in reader:
+				ts = block.timestamp_ns if isinstance(block, EnhancedPacket) else -1
+				blocks.append((block.type, ts, block.to_bytes()))
+		return blocks
+
+	def _packets(self, capture: Path) -> list[tuple[int, int, bytes]]:
+		''' Get the link type, timestamp, and data of every packet '''
+		with PCAPNGReader(capture) as reader:
+			return [
+				(block.interface.link_type, block.timestamp_ns, bytes(block.data))
+				for block in reader if isinstance(block, EnhancedPacket)
+			]
+
+	def test_slice(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			sliced  = Path(tmp) / 'sliced.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			blocks = self._blocks(capture)
+
+			for (kwargs, check) in (
+				({ }, lambda block: True),
+				({ 'start': 500_000, 'end': 700_000 }, lambda block: 500_000 <= block[1] < 700_000),
+				({ 'start': 1_900_000 }, lambda block: block[1] >= 1_900_000),
+				({ 'devices': (3, ) }, lambda block: block[2][8:12] == b'\x00' * 4 and 3 in block[2][33:35]),
+				({ 'start': 10**18 }, lambda block: False),
+			):
+				with self.subTest(**kwargs):
+					expected = [
+						block for block in blocks
+						if block[0] != BlockType.ENHANCED_PACKET or check(block)
+					]
+					self.assertEqual(slice_capture(capture, sliced, **kwargs), len(expected) - 3)
+					self.assertEqual(self._blocks(sliced)[1:], expected[1:])
+
+					# Compressed captures have to be read through, but should come out the same
+					compressed = Path(tmp) / 'capture.pcapng.gz'
+					compressed.write_bytes(gzip.compress(capture.read_bytes()))
+					data = sliced.read_bytes()
+					slice_capture(compressed, sliced, **kwargs)
+					self.assertEqual(sliced.read_bytes(), data)
+
+			# The section length is cleared, as it won't be right any more
+			with PCAPNGReader(sliced) as reader:
+				self.assertEqual(next(iter(reader)).section_len, -1)
+
+	def test_slice_fallback(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture  = Path(tmp) / 'capture.pcapng'
+			expected = Path(tmp) / 'expected.pcapng'
+			sliced   = Path(tmp) / 'sliced.pcapng'
+			scsi_capture(capture, self.FRAMES)
+			slice_capture(capture, expected, start = 500_000, end = 700_000)
+
+			# Like on Windows, where there's no way to have the kernel do the copying, or even pread
+			with (
+				patch.dict(os.__dict__),
+				patch('squishy.core.pcapng.splice._COPY_CHUNK', 1000),
+			):
+				for name in ('copy_file_range', 'sendfile', 'pread'):
+					os.__dict__.pop(name, None)
+				slice_capture(capture, sliced, start = 500_000, end = 700_000)
+
+			self.assertEqual(sliced.read_bytes(), expected.read_bytes())
+
+	def test_slice_sections(self) -> None:
+		def block(type: int, body: bytes) -> bytes:
+			return struct.pack('>II', type, len(body) + 12) + body + struct.pack('>I', len(body) + 12)
+
+		with TemporaryDirectory() as tmp:
+			first   = Path(tmp) / 'first.pcapng'
+			second  = Path(tmp) / 'second.pcapng'
+			capture = Path(tmp) / 'capture.pcapng'
+			sliced  = Path(tmp) / 'sliced.pcapng'
+			scsi_capture(first, self.FRAMES[:100])
+			scsi_capture(second, self.FRAMES[:300])
+
+			# A big endian section on the end, with an interface described after its first packet
+			frame = scsi_frame(SCSIFrameType.COMMAND, bytes((0x12, 0, 0, 0, 36, 0)))
+			data = first.read_bytes() + second.read_bytes() + b''.join((
+				block(BlockType.SECTION_HEADER, struct.pack('>IHHq', 0x1A2B3C4D, 1, 0, -1)),
+				block(BlockType.INTERFACE_DESCRIPTION, struct.pack('>HHI', LinkType.USER00, 0, 0)),
+				block(BlockType.ENHANCED_PACKET, struct.pack('>IIIII', 0, 0, 250, 4, 4) + b'nya!'),
+				block(BlockType.INTERFACE_DESCRIPTION, struct.pack('>HHI', LinkType.PARALLEL_SCSI, 0, 0)),
+				block(BlockType.ENHANCED_PACKET, struct.pack('>IIIII', 1, 0, 250, 40, 40) + frame),
+			))
+			capture.write_bytes(data)
+
+			def count(check) -> int:
+				with PCAPNGReader(capture) as reader:
+					return sum(1 for block in reader if isinstance(block, EnhancedPacket) and check(block))
+
+			def to(block: EnhancedPacket, *devices: int) -> bool:
+				return block.interface.link_type == LinkType.PARALLEL_SCSI and (
+					block.data[5] in devices or block.data[6] in devices
+				)
+
+			# Only the second and third sections have anything in them, but the first one is always kept
+			self.assertEqual(
+				slice_capture(capture, sliced, start = 200_000, end = 300_000),
+				count(lambda block: 200_000 <= block.timestamp_ns < 300_000)
+			)
+			with PCAPNGReader(sliced) as reader:
+				blocks = list(reader)
+			self.assertEqual(
+				[ type(block) for block in blocks if not isinstance(block, EnhancedPacket) ],
+				[ SectionHeader, InterfaceDescription, InterfaceDescription ] * 3
+			)
+			self.assertEqual(blocks[-1].interface.link_type, LinkType.PARALLEL_SCSI)
+			self.assertTrue(blocks[-5].big_endian)
+			self.assertEqual(bytes(blocks[-1].data), frame)
+
+			self.assertEqual(slice_capture(capture, sliced, devices = (0, )), count(lambda block: to(block, 0)))
+
+			# Nothing in the first or third sections is in the window
+			self.assertEqual(slice_capture(capture, sliced, start = 150_000, end = 160_000, devices = (0, 1)), 10)
+			with PCAPNGReader(sliced) as reader:
+				self.assertEqual(sum(1 for block in reader if isinstance(block, SectionHeader)), 2)
+
+			capture.write_bytes(data[:-4])
+			with self.assertRaises(ValueError):
+				slice_capture(capture, sliced)
+			with self.assertRaises(ValueError):
+				slice_capture(capture, capture)
+			self.assertEqual(capture.read_bytes(), data[:-4])
+
+	def test_merge(self) -> None:
+		with TemporaryDirectory() as tmp:
+			first   = Path(tmp) / 'first.pcapng'
+			second  = Path(tmp) / 'second.pcapng'
+			merged  = Path(tmp) / 'merged.pcapng'
+			scsi_capture(first, self.FRAMES[:1000])
+
+			# Another analyzer that started later, with a coarser resolution
+			with PCAPNGStream(second) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				scsi = pcap.emit_interface(LinkType.PARALLEL_SCSI, 'scsi')
+				for (idx, frame) in enumerate(self.FRAMES[1000:]):
+					scsi.emit_packet(frame, idx + 500)
+			compressed = Path(tmp) / 'second.pcapng.gz'
+			compressed.write_bytes(gzip.compress(second.read_bytes()))
+
+			packets = self._packets(first) + self._packets(second)
+			self.assertEqual(merge_captures((first, compressed), merged), len(packets))
+
+			with PCAPNGReader(merged) as reader:
+				blocks = list(reader)
+			self.assertIsInstance(blocks[0], SectionHeader)
+			self.assertEqual(blocks[0].options, ((OptionType.SHB_USERAPPL, b'Squishy PCAPNG Merge'), ))
+			interfaces = [ block for block in blocks if isinstance(block, InterfaceDescription) ]
+			self.assertEqual(
+				[ (block.id, block.link_type) for block in interfaces ],
+				[ (0, LinkType.PARALLEL_SCSI), (1, LinkType.USER00), (2, LinkType.PARALLEL_SCSI) ]
+			)
+
+			merged_packets = self._packets(merged)
+			self.assertEqual(merged_packets, sorted(packets, key = lambda packet: packet[1]))
+			self.assertEqual(
+				[ block.interface_id for block in blocks if isinstance(block, EnhancedPacket) ][-5:], [ 2 ] * 5
+			)
+
+			# Merging a capture with itself keeps the packets of the first one first
+			self.assertEqual(merge_captures((first, first), merged), 2 * len(self._packets(first)))
+			with PCAPNGReader(merged) as reader:
+				ids = [ block.interface_id for block in reader if isinstance(block, EnhancedPacket) ]
+			self.assertEqual(ids[:2], [ 0, 2 ])
+
+			big_endian = Path(tmp) / 'big.pcapng'
+			big_endian.write_bytes(
+				struct.pack('>IIIHHqI', BlockType.SECTION_HEADER, 28, 0x1A2B3C4D, 1, 0, -1, 28)
+			)
+			with self.assertRaises(ValueError):
+				merge_captures((first, big_endian), merged)
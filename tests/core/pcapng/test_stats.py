@@ -0,0 +1,145 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import json
+from io                           import StringIO
+from random                       import Random
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from unittest                     import TestCase
+
+from rich.console                 import Console
+
+from squishy.core.pcapng          import CaptureStats, LogHistogram, capture_stats
+from squishy.core.pcapng.linktype import SCSIFrameType
+
+from .fixtures                    import scsi_capture, scsi_traffic
+
+class CaptureStatsTests(TestCase):
+	def test_histogram(self) -> None:
+		histogram = LogHistogram()
+		self.assertIsNone(histogram.percentile(50))
+		self.assertIsNone(histogram.mean)
+
+		rng = Random(0x5C51)
+		values = [ rng.randint(0, 1 << rng.randint(1, 40)) for _ in range(10_000) ] + [ 0, (1 << 64) - 1 ]
+		for value in values:
+			histogram.add(value)
+		values.sort()
+
+		self.assertEqual((histogram.count, histogram.min, histogram.max), (len(values), 0, (1 << 64) - 1))
+		self.assertEqual(histogram.total, sum(values))
+		for percentile in (1, 25, 50, 90, 99, 99.9):
+			exact = values[int(-(-len(values) * percentile // 100)) - 1]
+			found = histogram.percentile(percentile)
+			self.assertGreaterEqual(found, exact)
+			self.assertLessEqual(found, exact + exact / 16 + 1)
+		self.assertEqual(histogram.percentile(100), (1 << 64) - 1)
+		self.assertEqual(sum(count for (_, _, count) in histogram.buckets()), len(values))
+
+		# Small values are exact
+		small = LogHistogram()
+		for value in (3, 3, 7, 15, -5):
+			small.add(value)
+		self.assertEqual(list(small.buckets()), [ (0, 0, 1), (3, 3, 2), (7, 7, 1), (15, 15, 1) ])
+		self.assertEqual(small.percentile(50), 3)
+
+		small.merge(histogram)
+		self.assertEqual((small.count, small.min), (histogram.count + 5, 0))
+		with self.assertRaises(ValueError):
+			small.merge(LogHistogram(2))
+		with self.assertRaises(ValueError):
+			LogHistogram(0)
+
+	def test_stats(self) -> None:
+		read = bytes((0x28, 0, 0, 0, 0, 0, 0, 0, 1, 0))
+		connection = (
+			(SCSIFrameType.ARBITRATION, 7, 0, b''),
+			(SCSIFrameType.SEL_RESEL,   7, 3, b''),
+			(SCSIFrameType.MESSAGE,     7, 3, b'\xC0'),
+			(SCSIFrameType.COMMAND,     7, 3, read),
+			(SCSIFrameType.DATA_IN,     3, 7, bytes(512)),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x02'),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x00'),
+		)
+
+		stats = CaptureStats(timeline_slots = 10)
+		ts = 0
+		for idx in range(100):
+			for (type, orig, dest, data) in connection:
+				stats.feed(0, ts, type, orig, dest, data if idx % 10 == 0 or data != b'\x02' else b'\x00')
+				ts += 1000
+			# The bus is free for a while between each command
+			ts += 3000
+		stats.feed(0, ts, SCSIFrameType.INFORMATION_UNIT, 7, 3, b'')
+		stats.finish()
+
+		result = stats.to_dict()
+		self.assertEqual(result['frames'], 701)
+		self.assertEqual(result['duration'], ts)
+		self.assertEqual(stats.frame_count(SCSIFrameType.MESSAGE), 300)
+		self.assertEqual(result['frame_types']['INFORMATION_UNIT'], 1)
+		self.assertEqual(result['bus']['arbitrations'], 100)
+		self.assertEqual(result['bus']['connections'], 101)
+		self.assertEqual(result['bus']['busy'], 100 * 6000)
+		self.assertEqual(result['transactions']['COMPLETE'], 100)
+
+		(nexus, ) = result['nexuses']
+		self.assertEqual((nexus['initiator'], nexus['target'], nexus['lun']), (7, 3, 0))
+		self.assertEqual((nexus['commands'], nexus['completed'], nexus['errors']), (100, 100, 10))
+		self.assertEqual((nexus['data_in'], nexus['data_out']), (51200, 0))
+		self.assertAlmostEqual(nexus['iops'], 100 / (ts / 1e9))
+
+		# CDB to status
+		self.assertEqual(result['latency']['0x28'], {
+			'count': 100, 'min': 2000, 'max': 2000, 'mean': 2000.0, 'p50': 2000, 'p90': 2000, 'p99': 2000,
+			'p99.9': 2000
+		})
+		self.assertEqual(stats.opcodes[0x28].count, 100)
+
+		# The whole capture is a millisecond, so it all fits in the first slot without it ever widening
+		timeline = result['timeline']
+		self.assertEqual(timeline['width'], 1_000_000)
+		self.assertEqual(sum(timeline['commands']), 100)
+		self.assertEqual(sum(timeline['data']), 51200)
+		self.assertAlmostEqual(sum(timeline['utilization']) * timeline['width'], 100 * 6000)
+
+		with self.assertRaises(ValueError):
+			CaptureStats(timeline_slots = 0)
+
+	def test_timeline(self) -> None:
+		stats = CaptureStats(timeline_slots = 7)
+		for second in range(60):
+			ts = second * 1_000_000_000
+			stats.feed(0, ts, SCSIFrameType.COMMAND, 7, 3, bytes(6))
+			stats.feed(0, ts + 500_000_000, SCSIFrameType.MESSAGE, 3, 7, b'\x00')
+		stats.finish()
+
+		timeline = stats.to_dict()['timeline']
+		self.assertEqual(len(timeline['utilization']), 7)
+		self.assertGreaterEqual(timeline['width'] * 7, 60_000_000_000)
+		self.assertEqual(sum(timeline['commands']), 60)
+		self.assertAlmostEqual(sum(timeline['utilization']) * timeline['width'], 60 * 500_000_000)
+		self.assertTrue(all(0 <= utilization <= 1 for utilization in timeline['utilization']))
+
+	def test_capture(self) -> None:
+		frames = scsi_traffic(3000)
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, frames)
+			stats = capture_stats(capture)
+
+		result = json.loads(json.dumps(stats.to_dict()))
+		commands = sum(1 for frame in frames if frame[4] == SCSIFrameType.COMMAND)
+		self.assertEqual(result['frames'], 3000)
+		self.assertEqual(result['nexuses'][0]['commands'], commands)
+		self.assertEqual(result['nexuses'][0]['data_in'], sum(
+			len(frame) - 28 for frame in frames if frame[4] == SCSIFrameType.DATA_IN
+		))
+		self.assertEqual(stats.latency.count, result['transactions']['COMPLETE'])
+
+		console = Console(file = StringIO(), width = 160)
+		for table in stats.tables():
+			console.print(table)
+		output = console.file.getvalue()
+		self.assertIn('Capture Summary', output)
+		self.assertIn('0x28', output)
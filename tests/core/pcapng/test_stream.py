@@ -0,0 +1,207 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import subprocess
+import sys
+from io                           import BytesIO
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from time                         import perf_counter
+from unittest                     import TestCase
+
+from arrow                        import Arrow
+
+from squishy.core.pcapng          import (
+	TS_RESOLUTION_NS, LinkType, OptionType, PCAPNGStream, PacketEncoder, pcapng, ts_units, _warn_timestamp_range,
+	write_epb, write_psf,
+)
+from squishy.core.pcapng.linktype import SCSIFrameType, linktype_parallel_scsi
+from squishy.support.test         import benchmark
+
+from .fixtures                    import OPTIONS, TIMESTAMPS, construct_epb, construct_psf
+
+class LazyImportTests(TestCase):
+	def test_lazy(self) -> None:
+		# NOTE: This needs a fresh interpreter, as everything is already imported by the other tests
+		modules = subprocess.run([
+			sys.executable, '-c',
+			'import sys, squishy.core.pcapng as p; p.MappedCapture; print(*sorted(sys.modules))'
+		], check = True, capture_output = True, text = True).stdout.split()
+
+		self.assertIn('squishy.core.pcapng.mapped', modules)
+		for module in ('numpy', 'squishy.core.pcapng.export', 'squishy.core.pcapng.query'):
+			self.assertNotIn(module, modules)
+
+		import squishy.core.pcapng as pcapng
+		self.assertIn('Query', dir(pcapng))
+		with self.assertRaises(AttributeError):
+			pcapng.Nope
+
+class PacketEncoderTests(TestCase):
+	def test_epb(self) -> None:
+		encoder = PacketEncoder(size = 16)
+
+		for size in (0, 1, 2, 3, 4, 5, 63, 64, 1021, 4099):
+			data = bytes(idx & 0xFF for idx in range(size))
+			for ts in TIMESTAMPS:
+				for options in OPTIONS:
+					with self.subTest(size = size, ts = ts, options = options):
+						self.assertEqual(
+							bytes(encoder.encode_epb(3, data, ts, options = options)),
+							construct_epb(3, data, ts, options)
+						)
+
+	def test_psf(self) -> None:
+		encoder = PacketEncoder(size = 16)
+
+		for size in (0, 1, 2, 3, 4, 17, 512, 4097):
+			data = bytes((idx * 7) & 0xFF for idx in range(size))
+			for type in (SCSIFrameType.COMMAND, SCSIFrameType.DATA_IN, SCSIFrameType.BUS_CONDITION):
+				for options in OPTIONS:
+					with self.subTest(size = size, type = type, options = options):
+						self.assertEqual(
+							bytes(encoder.encode_psf(1, data, type, 7, 2, TIMESTAMPS[1], options = options)),
+							construct_psf(1, data, type, 7, 2, TIMESTAMPS[1], options)
+						)
+
+	def test_stale_padding(self) -> None:
+		encoder = PacketEncoder()
+		# Dirty the buffer so any padding that isn't cleared would show up
+		encoder.encode_epb(0, b'\xFF' * 256, TIMESTAMPS[0])
+		self.assertEqual(
+			bytes(encoder.encode_epb(0, b'\xFF', TIMESTAMPS[0])), construct_epb(0, b'\xFF', TIMESTAMPS[0], ())
+		)
+
+	def test_options_cache(self) -> None:
+		encoder = PacketEncoder()
+
+		first  = encoder.encode_options(OPTIONS[3])
+		second = encoder.encode_options(list(OPTIONS[3]))
+		self.assertIs(first, second)
+		self.assertEqual(encoder.encode_options(()), b'')
+
+		# Pre-encoded options are passed through as-is
+		self.assertEqual(
+			bytes(encoder.encode_epb(0, b'abc', TIMESTAMPS[1], options = first)),
+			construct_epb(0, b'abc', TIMESTAMPS[1], OPTIONS[3])
+		)
+
+	def test_stream_data(self) -> None:
+		encoder = PacketEncoder()
+		self.assertEqual(
+			bytes(encoder.encode_epb(0, BytesIO(b'meow'), TIMESTAMPS[1])),
+			construct_epb(0, b'meow', TIMESTAMPS[1], ())
+		)
+
+	def test_write(self) -> None:
+		stream = BytesIO()
+		write_epb(stream, 2, b'abcde', TIMESTAMPS[1])
+		write_psf(stream, 1, b'xyz', SCSIFrameType.COMMAND, 7, 0, TIMESTAMPS[2])
+
+		(epb, psf) = pcapng.parse(stream.getvalue())
+		self.assertEqual(epb.data.interface_id, 2)
+		self.assertEqual(epb.data.packet_data, b'abcde')
+		self.assertEqual(psf.data.interface_id, 1)
+		self.assertEqual(psf.data.timestamp.value, TIMESTAMPS[2])
+
+		frame = linktype_parallel_scsi.parse(psf.data.packet_data)
+		self.assertEqual(frame.orig_id, 7)
+		self.assertEqual(frame.data, b'xyz')
+
+	def test_stream(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			with PCAPNGStream(capture) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				pcap.emit_interface(LinkType.USER00, 'nya')
+				iface = pcap.emit_interface(LinkType.USER01, 'meow')
+				for idx in range(4):
+					iface.emit_packet(bytes(idx), TIMESTAMPS[1])
+			blocks = pcapng.parse(capture.read_bytes())
+
+		self.assertEqual(len(blocks), 7)
+		for idx, block in enumerate(blocks[3:]):
+			self.assertEqual(block.data.interface_id, 1)
+			self.assertEqual(block.data.packet_data, bytes(idx))
+
+class TimestampTests(TestCase):
+	def test_units(self) -> None:
+		self.assertEqual(ts_units(6), 1_000_000)
+		self.assertEqual(ts_units(TS_RESOLUTION_NS), 1_000_000_000)
+		self.assertEqual(ts_units(0x80 | 20), 1 << 20)
+
+	def test_raw(self) -> None:
+		encoder = PacketEncoder(ts_resolution = TS_RESOLUTION_NS)
+		ts      = 1_700_000_000_123_456_789
+
+		(block, ) = pcapng.parse(bytes(encoder.encode_epb(0, b'nya', ts)))
+		self.assertEqual((block.data.timestamp.raw.high << 32) | block.data.timestamp.raw.low, ts)
+		self.assertEqual(encoder.timestamp(ts), ts)
+
+	def test_out_of_range(self) -> None:
+		encoder = PacketEncoder(ts_resolution = TS_RESOLUTION_NS)
+		_warn_timestamp_range.cache_clear()
+
+		# Read as microseconds this is well past the year 9999, so it's clamped rather than dropped
+		with self.assertLogs(level = 'WARNING'):
+			(block, ) = pcapng.parse(bytes(encoder.encode_epb(0, b'nya', 1_700_000_000_123_456_789)))
+		self.assertEqual(block.data.timestamp.value, Arrow.max)
+
+	def test_resolution(self) -> None:
+		ts = Arrow(2024, 5, 6, 7, 8, 9, 123456)
+
+		self.assertEqual(
+			PacketEncoder(ts_resolution = TS_RESOLUTION_NS).timestamp(ts), 1_714_979_289_123_456_000
+		)
+		self.assertEqual(
+			PacketEncoder(ts_resolution = TS_RESOLUTION_NS, ts_offset = 1_714_979_000).timestamp(ts),
+			289_123_456_000
+		)
+		self.assertEqual(PacketEncoder(ts_resolution = 0x80 | 10).timestamp(ts), (1_714_979_289 << 10) + 126)
+		self.assertEqual(PacketEncoder(ts_resolution = 3).timestamp(ts), 1_714_979_289_123)
+
+	def test_interface(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			with PCAPNGStream(capture) as pcap:
+				pcap.emit_header(hardware = 'squishy')
+				iface = pcap.emit_interface(
+					LinkType.USER00, 'nya', ts_resolution = TS_RESOLUTION_NS, ts_offset = 1_700_000_000
+				)
+				iface.emit_packet(b'meow', 1234)
+				self.assertEqual(iface.ts_resolution, TS_RESOLUTION_NS)
+				self.assertEqual(iface.ts_offset, 1_700_000_000)
+			(_, idb, epb) = pcapng.parse(capture.read_bytes())
+
+		options = { int(opt.type): opt for opt in idb.options }
+		self.assertEqual(options[OptionType.IF_TSRESOL].length, 1)
+		self.assertEqual(options[OptionType.IF_TSRESOL].value, TS_RESOLUTION_NS)
+		self.assertEqual(options[OptionType.IF_TSOFFSET].length, 8)
+		self.assertEqual(options[OptionType.IF_TSOFFSET].value, 1_700_000_000)
+		self.assertEqual(epb.data.timestamp.raw.low, 1234)
+
+@benchmark
+class PacketEncoderBenchmark(TestCase):
+	PACKETS = 2000
+
+	def _rate(self, encode) -> float:
+		start = perf_counter()
+		for _ in range(self.PACKETS):
+			encode()
+		return self.PACKETS / (perf_counter() - start)
+
+	def test_throughput(self) -> None:
+		encoder = PacketEncoder()
+		options = OPTIONS[3]
+		ts      = TIMESTAMPS[1]
+
+		for size in (16, 512, 8192):
+			data = bytes(size)
+
+			slow = self._rate(lambda: construct_psf(0, data, SCSIFrameType.DATA_IN, 7, 0, ts, options))
+			fast = self._rate(lambda: encoder.encode_psf(0, data, SCSIFrameType.DATA_IN, 7, 0, ts, options = options))
+
+			print(
+				f'\nPSF {size:>5} bytes: construct {slow:>9.0f} packets/s, PacketEncoder {fast:>9.0f} packets/s '
+				f'({fast / slow:.1f}x)'
+			)
+			self.assertGreaterEqual(fast / slow, 10)
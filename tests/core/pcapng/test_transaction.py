@@ -0,0 +1,198 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from pathlib                      import Path
+from tempfile                     import TemporaryDirectory
+from unittest                     import TestCase
+
+from squishy.core.pcapng          import SCSITransaction, TransactionAssembler, TransactionState, scsi_transactions
+from squishy.core.pcapng.linktype import SCSIFrameType, linktype_parallel_scsi
+
+from .fixtures                    import scsi_capture, scsi_traffic
+
+class TransactionTests(TestCase):
+	@staticmethod
+	def _feed(assembler: TransactionAssembler, frames) -> list[SCSITransaction]:
+		done = []
+		for (ts, (type, orig, dest, data)) in enumerate(frames):
+			done.extend(assembler.feed(ts * 100, type, orig, dest, data))
+		return done
+
+	def test_simple(self) -> None:
+		read = bytes((0x28, 0, 0, 0, 0x10, 0, 0, 0, 2, 0))
+		frames = (
+			(SCSIFrameType.ARBITRATION,   7, 0, b''),
+			(SCSIFrameType.SEL_RESEL,     7, 3, b''),
+			(SCSIFrameType.MESSAGE,       7, 3, b'\xC1'),
+			(SCSIFrameType.COMMAND,       7, 3, read),
+			(SCSIFrameType.DATA_IN,       3, 7, bytes(512)),
+			(SCSIFrameType.DATA_IN,       3, 7, bytes(512)),
+			(SCSIFrameType.MESSAGE,       3, 7, b'\x00'),
+			(SCSIFrameType.MESSAGE,       3, 7, b'\x00'),
+			(SCSIFrameType.BUS_CONDITION, 0, 0, b'\x01'),
+		)
+
+		assembler = TransactionAssembler(2)
+		(transaction, ) = self._feed(assembler, frames)
+		self.assertEqual(assembler.outstanding, 0)
+		self.assertEqual(transaction.state, TransactionState.COMPLETE)
+		self.assertEqual(transaction.interface, 2)
+		self.assertEqual(transaction.nexus, (7, 3, 1, None))
+		self.assertEqual((transaction.cdb, transaction.opcode), (read, 0x28))
+		self.assertEqual(transaction.status, 0)
+		self.assertEqual((transaction.data_in, transaction.data_out, transaction.disconnects), (1024, 0, 0))
+		self.assertEqual(
+			(transaction.start, transaction.command_ts, transaction.data_start, transaction.data_end),
+			(0, 300, 400, 500)
+		)
+		self.assertEqual((transaction.status_ts, transaction.end), (600, 700))
+		self.assertEqual(
+			(transaction.setup_time, transaction.data_latency, transaction.data_time, transaction.status_latency),
+			(300, 100, 100, 100)
+		)
+		self.assertEqual(transaction.duration, 700)
+
+		# A CHECK CONDITION, and a lone message that's taken to be the COMMAND COMPLETE
+		inquiry = bytes((0x12, 0, 0, 0, 36, 0))
+		(check, lone) = self._feed(assembler, (
+			(SCSIFrameType.SEL_RESEL, 7, 4, b''),
+			(SCSIFrameType.COMMAND,   7, 4, inquiry),
+			(SCSIFrameType.MESSAGE,   4, 7, b'\x02'),
+			(SCSIFrameType.MESSAGE,   4, 7, b'\x00'),
+			(SCSIFrameType.SEL_RESEL, 7, 4, b''),
+			(SCSIFrameType.COMMAND,   7, 4, inquiry),
+			(SCSIFrameType.DATA_IN,   4, 7, bytes(36)),
+			(SCSIFrameType.MESSAGE,   4, 7, b'\x00'),
+			(SCSIFrameType.ARBITRATION, 7, 0, b''),
+		))
+		self.assertEqual((check.status, check.state, check.lun), (2, TransactionState.COMPLETE, None))
+		self.assertEqual(check.command.AllocLen, 36)
+		self.assertEqual((lone.status, lone.state, lone.data_in), (None, TransactionState.COMPLETE, 36))
+		self.assertEqual(lone.end, 700)
+
+	def test_reselect(self) -> None:
+		def read(lba: int) -> bytes:
+			return bytes((0x28, 0, 0, 0, 0, lba, 0, 0, 1, 0))
+
+		# Two tagged commands that both disconnect, and are then finished off in the other order
+		frames = (
+			(SCSIFrameType.ARBITRATION, 7, 0, b''),
+			(SCSIFrameType.SEL_RESEL,   7, 3, b''),
+			(SCSIFrameType.MESSAGE,     7, 3, b'\xC2\x20\x05'),
+			(SCSIFrameType.COMMAND,     7, 3, read(5)),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x04'),
+			(SCSIFrameType.ARBITRATION, 7, 0, b''),
+			(SCSIFrameType.SEL_RESEL,   7, 3, b''),
+			(SCSIFrameType.MESSAGE,     7, 3, b'\xC2\x21\x06'),
+			(SCSIFrameType.COMMAND,     7, 3, read(6)),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x04'),
+			(SCSIFrameType.ARBITRATION, 3, 0, b''),
+			(SCSIFrameType.SEL_RESEL,   3, 7, b''),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x82\x20\x06'),
+			(SCSIFrameType.DATA_IN,     3, 7, bytes(512)),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x02'),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x04'),
+			(SCSIFrameType.ARBITRATION, 3, 0, b''),
+			(SCSIFrameType.SEL_RESEL,   3, 7, b''),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x82'),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x20\x05'),
+			(SCSIFrameType.DATA_IN,     3, 7, bytes(512)),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x00'),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x00'),
+			(SCSIFrameType.ARBITRATION, 3, 0, b''),
+			(SCSIFrameType.SEL_RESEL,   3, 7, b''),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x82\x20\x06'),
+			(SCSIFrameType.DATA_IN,     3, 7, bytes(512)),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x02'),
+			(SCSIFrameType.MESSAGE,     3, 7, b'\x00'),
+		)
+
+		assembler = TransactionAssembler()
+		(first, second) = self._feed(assembler, frames)
+
+		self.assertEqual((first.nexus, first.cdb[5], first.tag_type), ((7, 3, 2, 5), 5, 0x20))
+		self.assertEqual((first.status, first.data_in, first.disconnects), (0, 512, 1))
+		self.assertEqual((first.start, first.command_ts, first.data_start, first.end), (0, 300, 2000, 2200))
+
+		self.assertEqual((second.nexus, second.cdb[5], second.tag_type), ((7, 3, 2, 6), 6, 0x21))
+		self.assertEqual((second.status, second.data_in, second.disconnects), (2, 1024, 2))
+		self.assertEqual((second.start, second.data_start, second.data_end), (500, 1300, 2600))
+		self.assertEqual(assembler.flush(), [])
+
+	def test_implied(self) -> None:
+		''' Frames without any arbitration, selection, or identify, like the other tests use '''
+
+		frames = scsi_traffic(3000)
+		parsed = [ linktype_parallel_scsi.parse(frame) for frame in frames ]
+
+		assembler = TransactionAssembler()
+		done = self._feed(assembler, (
+			(int(frame.type), frame.orig_id, frame.dest_id, frame.data) for frame in parsed
+		))
+		done.extend(assembler.flush())
+
+		commands = [ frame.data for frame in parsed if int(frame.type) == SCSIFrameType.COMMAND ]
+		self.assertEqual([ transaction.cdb for transaction in done ], commands)
+		self.assertTrue(all(transaction.state == TransactionState.COMPLETE for transaction in done[:-1]))
+		self.assertEqual(done[-1].state, TransactionState.INCOMPLETE)
+		self.assertEqual(
+			[ transaction.data_in for transaction in done[:-1] ],
+			[ 512 * int.from_bytes(cdb[7:9], 'big') for cdb in commands[:-1] ]
+		)
+		self.assertTrue(all(transaction.lun is None for transaction in done))
+
+	def test_states(self) -> None:
+		command = (SCSIFrameType.COMMAND, 7, 3, bytes(6))
+
+		assembler = TransactionAssembler(max_outstanding = 2)
+		done = self._feed(assembler, (
+			# Lost to a second command on the same nexus
+			command,
+			command,
+			(SCSIFrameType.MESSAGE, 3, 7, b'\x04'),
+			# Aborted by the initiator
+			(SCSIFrameType.SEL_RESEL, 7, 3, b''),
+			(SCSIFrameType.MESSAGE, 7, 3, b'\xC1'),
+			command,
+			(SCSIFrameType.MESSAGE, 7, 3, b'\x06'),
+			# Three in flight at once, so the oldest is evicted
+			(SCSIFrameType.SEL_RESEL, 7, 2, b''),
+			(SCSIFrameType.COMMAND, 7, 2, bytes(6)),
+			(SCSIFrameType.MESSAGE, 2, 7, b'\x04'),
+			(SCSIFrameType.SEL_RESEL, 7, 1, b''),
+			(SCSIFrameType.COMMAND, 7, 1, bytes(6)),
+			(SCSIFrameType.MESSAGE, 1, 7, b'\x04'),
+		))
+		self.assertEqual(
+			[ (transaction.target, transaction.state) for transaction in done ],
+			[ (3, TransactionState.LOST), (3, TransactionState.ABORTED), (3, TransactionState.EVICTED) ]
+		)
+		self.assertEqual(assembler.outstanding, 2)
+
+		# A bus device reset clears everything on the target
+		done = self._feed(assembler, (
+			(SCSIFrameType.SEL_RESEL, 7, 2, b''),
+			(SCSIFrameType.MESSAGE, 7, 2, b'\x0C'),
+		))
+		self.assertEqual([ (t.target, t.state) for t in done ], [ (2, TransactionState.ABORTED) ])
+		self.assertEqual([ (t.target, t.state) for t in assembler.flush() ], [ (1, TransactionState.INCOMPLETE) ])
+
+		with self.assertRaises(ValueError):
+			TransactionAssembler(max_outstanding = 0)
+
+	def test_capture(self) -> None:
+		frames = scsi_traffic(2000)
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+			scsi_capture(capture, frames)
+
+			transactions = list(scsi_transactions(capture))
+			self.assertEqual(len(transactions), sum(1 for frame in frames if frame[4] == SCSIFrameType.COMMAND))
+			self.assertTrue(all(transaction.interface == 0 for transaction in transactions))
+			self.assertEqual(transactions[0].start, 0)
+			self.assertEqual(transactions[0].data_start, 1000)
+
+			# The same again in a second section, which gets the first one finished off
+			capture.write_bytes(capture.read_bytes() * 2)
+			again = list(scsi_transactions(capture))
+			self.assertEqual(len(again), 2 * len(transactions))
+			self.assertEqual(again[len(transactions) - 1].state, transactions[-1].state)
@@ -0,0 +1,171 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from io                         import BytesIO
+from pathlib                    import Path
+from tempfile                   import TemporaryDirectory
+from threading                  import Event, Thread
+from unittest                   import TestCase
+
+from squishy.core.pcapng        import TS_RESOLUTION_NS, LinkType, OverflowPolicy, PCAPNGStream, PacketEncoder, pcapng
+from squishy.core.pcapng.writer import BackgroundWriter
+
+from .fixtures                  import OPTIONS
+
+class _GatedSink(BytesIO):
+	''' A stream that holds up writes until it's opened, to stand in for a slow disk '''
+
+	def __init__(self) -> None:
+		super().__init__()
+		self.gate    = Event()
+		self.entered = Event()
+
+	def write(self, data) -> int:
+		self.entered.set()
+		self.gate.wait()
+		return super().write(data)
+
+class _BrokenSink(BytesIO):
+	def write(self, data) -> int:
+		raise OSError('No space left on device')
+
+class BackgroundWriterTests(TestCase):
+	def _capture(self, path: Path, **kwargs) -> None:
+		with PCAPNGStream(path, **kwargs) as pcap:
+			pcap.emit_header(hardware = 'squishy', os = 'nya')
+			ifaces = (
+				pcap.emit_interface(LinkType.USER00, 'nya'),
+				pcap.emit_interface(LinkType.USER01, 'meow', ts_resolution = TS_RESOLUTION_NS),
+			)
+			for idx in range(300):
+				ifaces[idx & 1].emit_packet(
+					bytearray(idx & 0xFF for _ in range(idx)), idx, options = OPTIONS[idx % len(OPTIONS)]
+				)
+			if kwargs.get('background', False):
+				pcap.flush()
+				self.assertEqual(pcap.queue_depth, 0)
+				self.assertGreater(pcap.queue_high_water, 0)
+			self.assertEqual(pcap.dropped, 0)
+
+	def test_identical(self) -> None:
+		with TemporaryDirectory() as tmp:
+			sync       = Path(tmp) / 'sync.pcapng'
+			background = Path(tmp) / 'background.pcapng'
+
+			self._capture(sync)
+			self._capture(background, background = True, queue_depth = 16)
+
+			self.assertEqual(sync.read_bytes(), background.read_bytes())
+
+	def test_drop_newest(self) -> None:
+		sink   = _GatedSink()
+		writer = BackgroundWriter(sink, depth = 4, policy = OverflowPolicy.DROP_NEWEST, encoder = PacketEncoder())
+		# Get the writer stuck on the sink
+		writer.put_block(b'HEAD')
+		self.assertTrue(sink.entered.wait(1))
+
+		queued = [ writer.put_packet(0, bytes((idx, )), idx, b'') for idx in range(64) ]
+		self.assertEqual(queued, [ True ] * 4 + [ False ] * 60)
+		self.assertEqual(writer.dropped, 60)
+		self.assertEqual(writer.queued, 4)
+		self.assertEqual(writer.high_water, 4)
+
+		sink.gate.set()
+		writer.close()
+
+		blocks = pcapng.parse(sink.getvalue()[4:])
+		# The oldest packets are the ones that make it
+		self.assertEqual([ blk.data.packet_data for blk in blocks ], [ bytes((idx, )) for idx in range(4) ])
+
+	def test_drop_oldest(self) -> None:
+		sink   = _GatedSink()
+		writer = BackgroundWriter(sink, depth = 4, policy = OverflowPolicy.DROP_OLDEST, encoder = PacketEncoder())
+
+		writer.put_block(b'HEAD')
+		self.assertTrue(sink.entered.wait(1))
+
+		for idx in range(64):
+			self.assertTrue(writer.put_packet(0, bytes((idx, )), idx, b''))
+		self.assertEqual(writer.dropped, 60)
+
+		sink.gate.set()
+		writer.close()
+
+		blocks = pcapng.parse(sink.getvalue()[4:])
+		# The newest packets are the ones that make it
+		self.assertEqual([ blk.data.packet_data for blk in blocks ], [ bytes((idx, )) for idx in range(60, 64) ])
+
+	def test_drop_oldest_producers(self) -> None:
+		sink   = _GatedSink()
+		writer = BackgroundWriter(sink, depth = 4, policy = OverflowPolicy.DROP_OLDEST, encoder = PacketEncoder())
+
+		writer.put_block(b'HEAD')
+		self.assertTrue(sink.entered.wait(1))
+
+		def _produce(producer: int) -> None:
+			for idx in range(500):
+				writer.put_packet(0, bytes((producer, )), idx, b'')
+
+		producers = [ Thread(target = _produce, args = (idx, )) for idx in range(4) ]
+		for producer in producers:
+			producer.start()
+		for producer in producers:
+			producer.join()
+
+		# However the producers interleave, the queue never goes past its depth
+		self.assertEqual(writer.high_water, 4)
+		self.assertEqual(writer.queued, 4)
+		self.assertEqual(writer.dropped, 4 * 500 - 4)
+
+		sink.gate.set()
+		writer.close()
+		self.assertEqual(len(pcapng.parse(sink.getvalue()[4:])), 4)
+
+	def test_block(self) -> None:
+		sink   = _GatedSink()
+		writer = BackgroundWriter(sink, depth = 2, policy = OverflowPolicy.BLOCK, encoder = PacketEncoder())
+		done   = Event()
+
+		writer.put_block(b'HEAD')
+		self.assertTrue(sink.entered.wait(1))
+
+		def _produce() -> None:
+			for idx in range(32):
+				writer.put_packet(0, bytes((idx, )), idx, b'')
+			done.set()
+
+		producer = Thread(target = _produce)
+		producer.start()
+		# The producer should be held up by the sink
+		self.assertFalse(done.wait(0.1))
+
+		sink.gate.set()
+		producer.join()
+		writer.close()
+
+		self.assertEqual(writer.dropped, 0)
+		self.assertEqual(len(pcapng.parse(sink.getvalue()[4:])), 32)
+
+	def test_exception(self) -> None:
+		with TemporaryDirectory() as tmp:
+			capture = Path(tmp) / 'capture.pcapng'
+
+			with self.assertRaisesRegex(ValueError, 'nya'):
+				with PCAPNGStream(capture, background = True) as pcap:
+					pcap.emit_header(hardware = 'squishy')
+					pcap.emit_interface(LinkType.USER00, 'nya').emit_packet(b'meow', 1234)
+					raise ValueError('nya')
+
+			# The stream is still closed on the way out, with everything up to the exception written
+			self.assertTrue(pcap._data.closed)
+			self.assertFalse(pcap._writer._thread.is_alive())
+			(_, _, epb) = pcapng.parse(capture.read_bytes())
+			self.assertEqual(epb.data.packet_data, b'meow')
+
+	def test_error(self) -> None:
+		writer = BackgroundWriter(_BrokenSink(), encoder = PacketEncoder())
+		writer.put_block(b'HEAD')
+
+		with self.assertRaises(RuntimeError):
+			writer.flush()
+		with self.assertRaises(RuntimeError):
+			writer.put_block(b'HEAD')
@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from pathlib                 import Path
+from struct                  import unpack_from
+from tempfile                import TemporaryDirectory
+from unittest                import TestCase
+
+from squishy.core.dfu        import DFURequests
+from squishy.core.pcapng     import TS_RESOLUTION_NS, LinkType, pcapng
+from squishy.core.usbtrace   import ControlTransfer, USBControlTracer
+
+_CLASS_IN  = 0xA1
+_CLASS_OUT = 0x21
+
+def _xfr(request: int, duration: int, *, request_type: int = _CLASS_IN, data: bytes = b'', status: int = 0):
+	return ControlTransfer(
+		1_700_000_000_000_000_000, request_type, request, 0, 0, len(data), duration, status, data
+	)
+
+class USBControlTracerTests(TestCase):
+	def test_ring(self) -> None:
+		tracer = USBControlTracer(4)
+
+		for idx in range(10):
+			tracer.record(_xfr(DFURequests.GetState, idx))
+
+		self.assertEqual(tracer.total, 10)
+		self.assertEqual(tuple(xfr.duration for xfr in tracer.transfers), (6, 7, 8, 9))
+
+	def test_percentiles(self) -> None:
+		tracer = USBControlTracer()
+
+		for idx in range(1, 101):
+			tracer.record(_xfr(DFURequests.GetStatus, idx * 1000))
+		tracer.record(_xfr(DFURequests.Download, 5, request_type = _CLASS_OUT, data = b'\x00' * 64))
+		# Standard requests should not be confused with DFU ones
+		tracer.record(_xfr(DFURequests.Download, 7, request_type = 0x00))
+
+		self.assertEqual(tracer.percentiles(DFURequests.GetStatus), { 50: 50_000, 95: 95_000, 99: 99_000 })
+		self.assertEqual(tracer.percentiles(DFURequests.Download), { 50: 5, 95: 5, 99: 5 })
+		self.assertEqual(tracer.percentiles(DFURequests.Abort), {})
+
+		summary = tracer.summary()
+		self.assertEqual(summary[DFURequests.GetStatus][0], 100)
+		self.assertEqual(summary[DFURequests.Download], (1, { 50: 5, 95: 5, 99: 5 }))
+		self.assertEqual(summary[None], (1, { 50: 7, 95: 7, 99: 7 }))
+
+	def test_pcapng(self) -> None:
+		with TemporaryDirectory() as tmp:
+			trace = Path(tmp) / 'trace.pcapng'
+
+			tracer = USBControlTracer(pcapng = trace)
+			tracer.record(_xfr(DFURequests.GetState, 1500, data = b'\x02'), bus = 3, address = 7)
+			tracer.record(
+				_xfr(DFURequests.Download, 2500, request_type = _CLASS_OUT, data = b'\xAA' * 16, status = -9),
+				bus = 3, address = 7
+			)
+			tracer.close()
+
+			blocks = pcapng.parse(trace.read_bytes())
+
+		# SHB, IDB, and then a submission and completion per transfer
+		self.assertEqual(len(blocks), 6)
+		self.assertEqual(int(blocks[1].data.type), LinkType.USB_LINUX_MMAPPED)
+		# The timestamps go straight through at nanosecond resolution
+		self.assertIn(TS_RESOLUTION_NS, [ opt.value for opt in blocks[1].options if opt.type == 'IF_TSRESOL' ])
+		raw_ts = blocks[3].data.timestamp.raw
+		self.assertEqual((raw_ts.high << 32) | raw_ts.low, 1_700_000_000_000_001_500)
+
+		packets = [ blk.data.packet_data for blk in blocks[2:] ]
+
+		(kind, xfer, epnum, devnum, busnum) = unpack_from('<cBBBH', packets[0], 8)
+		self.assertEqual((kind, xfer, epnum, devnum, busnum), (b'S', 2, 0x80, 7, 3))
+		# IN data only shows up on completion
+		self.assertEqual(len(packets[0]), 64)
+		self.assertEqual(packets[1][64:], b'\x02')
+		self.assertEqual(unpack_from('<c', packets[1], 8)[0], b'C')
+
+		# OUT data goes with the submission, and the stall is reported as -EPIPE
+		self.assertEqual(packets[2][64:], b'\xAA' * 16)
+		self.assertEqual(unpack_from('<8s', packets[2], 40)[0], bytes((_CLASS_OUT, 1, 0, 0, 0, 0, 16, 0)))
+		self.assertEqual(unpack_from('<i', packets[3], 28)[0], -32)
@@ -0,0 +1,441 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+'''
+Just enough of libusb to drive :py:class:`squishy.device.SquishyDevice` and friends without any hardware.
+
+The :py:class:`FakeSquishy` answers the DFU requests like the bootloader does, and can stream data on its bulk
+endpoints. Asynchronous transfers are only completed by :py:meth:`FakeContext.handleEventsTimeout`, just like with
+the real libusb, so they go through the event thread from :py:mod:`squishy.async_device`.
+
+'''
+
+from collections         import deque
+from collections.abc     import Iterator
+from contextlib          import contextmanager
+from queue               import Empty, SimpleQueue
+from threading           import Lock
+from unittest.mock       import patch
+
+from usb1                import (
+	TRANSFER_CANCELLED, TRANSFER_COMPLETED, TRANSFER_STALL, USBError, USBErrorNotFound, USBErrorPipe,
+)
+from usb1.libusb1        import LIBUSB_DT_STRING, LIBUSB_ENDPOINT_IN, LIBUSB_REQUEST_GET_DESCRIPTOR
+from usb_construct.types.descriptors.dfu import FunctionalDescriptor
+
+from squishy.core.config import USB_APP_PID, USB_DFU_PID, USB_VID
+from squishy.core.dfu    import DFU_CLASS, DFURequests, DFUState, DFUStatus
+
+__all__ = (
+	'FakeContext',
+	'FakeSquishy',
+	'fake_libusb',
+)
+
+_SERIAL_DESC = 3
+_ALT_DESC    = 4
+
+class FakeContext:
+	''' Stands in for :py:class:`usb1.USBContext` '''
+
+	def __init__(self) -> None:
+		self.devices: list[FakeSquishy] = []
+		self._events: SimpleQueue = SimpleQueue()
+
+	def add(self, device: 'FakeSquishy') -> 'FakeSquishy':
+		device.ctx = self
+		self.devices.append(device)
+		return device
+
+	def getDeviceIterator(self, skip_on_error: bool = False) -> Iterator['FakeSquishy']:
+		return iter(list(self.devices))
+
+	def complete(self, transfer: 'FakeTransfer', status: int, length: int = 0) -> None:
+		''' Complete a transfer the next time events are handled '''
+		self._events.put((transfer, status, length))
+
+	def handleEventsTimeout(self, tv: float = 0) -> None:
+		try:
+			event = self._events.get(timeout = tv)
+		except Empty:
+			return
+		if event is not None:
+			(transfer, status, length) = event
+			transfer._finish(status, length)
+
+	def interruptEventHandler(self) -> None:
+		self._events.put(None)
+
+class FakeTransfer:
+	''' Stands in for :py:class:`usb1.USBTransfer` '''
+
+	def __init__(self, handle: 'FakeHandle') -> None:
+		self._handle    = handle
+		self._callback  = None
+		self._user_data = None
+		self._status    = TRANSFER_COMPLETED
+		self._length    = 0
+		self._buffer: memoryview | bytearray = bytearray()
+
+		self.submitted = False
+		self.control: tuple[int, int, int, int] | None = None
+		self.endpoint  = 0
+
+	def setControl(
+		self, request_type: int, request: int, value: int, index: int, buffer_or_len, callback = None,
+		user_data = None, timeout: int = 0
+	) -> None:
+		self.control    = (request_type, request, value, index)
+		self._buffer    = bytearray(buffer_or_len)
+		self._callback  = callback
+		self._user_data = user_data
+
+	def setBulk(self, endpoint: int, buffer_or_len, callback = None, user_data = None, timeout: int = 0) -> None:
+		self.control    = None
+		self.endpoint   = endpoint
+		# NOTE: Like libusb, a writable buffer is used as-is rather than copied
+		self._buffer    = bytearray(buffer_or_len) if isinstance(buffer_or_len, (int, bytes)) else buffer_or_len
+		self._callback  = callback
+		self._user_data = user_data
+
+	def setCallback(self, callback) -> None:
+		self._callback = callback
+
+	def getUserData(self):
+		return self._user_data
+
+	def getStatus(self) -> int:
+		return self._status
+
+	def getActualLength(self) -> int:
+		return self._length
+
+	def getBuffer(self) -> memoryview:
+		return memoryview(self._buffer)
+
+	def submit(self) -> None:
+		assert not self.submitted, 'Transfer submitted twice'
+		self.submitted = True
+		self._handle.device._submit(self)
+
+	def cancel(self) -> None:
+		if not self.submitted or not self._handle.device._cancel(self):
+			raise USBErrorNotFound(USBErrorNotFound.value)
+
+	def _finish(self, status: int, length: int) -> None:
+		self.submitted = False
+		(self._status, self._length) = (status, length)
+		if self._callback is not None:
+			self._callback(self)
+
+class FakeHandle:
+	''' Stands in for :py:class:`usb1.USBDeviceHandle` '''
+
+	def __init__(self, device: 'FakeSquishy') -> None:
+		self.device = device
+		self.closed = False
+
+	def controlRead(self, request_type: int, request: int, value: int, index: int, length: int, timeout: int) -> bytes:
+		return self.device.control_in(request_type, request, value, index, length)
+
+	def controlWrite(self, request_type: int, request: int, value: int, index: int, data, timeout: int) -> int:
+		return self.device.control_out(request_type, request, value, index, bytes(data))
+
+	def bulkWrite(self, endpoint: int, data, timeout: int) -> int:
+		return self.device.bulk_out(endpoint, bytes(data))
+
+	def getTransfer(self, iso_packets: int = 0) -> FakeTransfer:
+		return FakeTransfer(self)
+
+	def getStringDescriptor(self, index: int, lang: int) -> str | None:
+		return self.device.strings.get(index)
+
+	def claimInterface(self, interface: int) -> None:
+		self.device.claimed.add(interface)
+
+	def releaseInterface(self, interface: int) -> None:
+		self.device.claimed.discard(interface)
+
+	def setInterfaceAltSetting(self, interface: int, alt: int) -> None:
+		self.device.alt = alt
+
+	def getConfiguration(self) -> int:
+		return 1
+
+	def setConfiguration(self, config: int) -> None:
+		pass
+
+	def resetDevice(self) -> None:
+		self.device.resets += 1
+		self.device._reset()
+
+	def close(self) -> None:
+		self.closed = True
+
+class _Setting:
+	def __init__(self, device: 'FakeSquishy', alt: int) -> None:
+		self._device = device
+		self._alt    = alt
+
+	def getClassTupple(self) -> tuple[int, int]:
+		return DFU_CLASS
+
+	def getNumber(self) -> int:
+		return 0
+
+	def getAlternateSetting(self) -> int:
+		return self._alt
+
+	def getDescriptor(self) -> int:
+		return _ALT_DESC + self._alt
+
+	def getExtra(self) -> list[bytes]:
+		return [ self._device.functional_descriptor ]
+
+class _Config:
+	def __init__(self, device: 'FakeSquishy') -> None:
+		self._interfaces = [ [ _Setting(device, alt) for alt in range(len(device.altmodes)) ] ]
+
+	def getConfigurationValue(self) -> int:
+		return 1
+
+	def iterInterfaces(self):
+		return iter(self._interfaces)
+
+	def __iter__(self):
+		return self.iterInterfaces()
+
+class FakeSquishy:
+	'''
+	Stands in for a :py:class:`usb1.USBDevice` of a Squishy, along with the device itself.
+
+	Parameters
+	----------
+	serial : str
+		The serial number of the device.
+
+	dfu : bool
+		If the device starts out in the bootloader rather than running an applet.
+
+	transfer_size : int
+		The ``wTransferSize`` of the DFU functional descriptor.
+
+	busy_polls : int
+		How many times the state is polled before a downloaded block is stored.
+
+	manifest_polls : int | None
+		How many times the state is polled before the image is manifested, or None to never finish.
+
+	manifest_tolerant : bool
+		The ``bitManifestationTolerant`` of the DFU functional descriptor.
+
+	'''
+
+	def __init__(
+		self, serial: str = 'SQ-0001', *, dfu: bool = True, transfer_size: int = 64, busy_polls: int = 1,
+		manifest_polls: int | None = 1, manifest_tolerant: bool = True, altmodes: tuple[str, ...] = ('slot0', 'slot1')
+	) -> None:
+		self.ctx: FakeContext | None = None
+		self.serial   = serial
+		self.pid      = USB_DFU_PID if dfu else USB_APP_PID
+		self.altmodes = altmodes
+		self.strings  = { _SERIAL_DESC: serial } | { _ALT_DESC + alt: name for (alt, name) in enumerate(altmodes) }
+
+		self.functional_descriptor = FunctionalDescriptor.build({
+			'bmAttributes':   0x0B | (0x04 if manifest_tolerant else 0),
+			'wDetachTimeOut': 100,
+			'wTransferSize':  transfer_size,
+		})
+
+		self.busy_polls     = busy_polls
+		self.manifest_polls = manifest_polls
+
+		self.state   = DFUState.DFUIdle if dfu else DFUState.AppIdle
+		self.alt     = 0
+		self.claimed: set[int] = set()
+		self.resets  = 0
+		self.detaches = 0
+		self.images: dict[int, bytearray] = {}
+		self.manifested: list[tuple[int, bytes]] = []
+		self.requests: list[tuple[int, int, int, int]] = []
+		self._polls  = 0
+
+		self._lock = Lock()
+		self._pending_in: deque[FakeTransfer] = deque()
+		self._data_in: deque[bytes] = deque()
+		self.data_out: list[bytes] = []
+
+	# usb1.USBDevice
+
+	def open(self) -> FakeHandle:
+		return FakeHandle(self)
+
+	def close(self) -> None:
+		pass
+
+	def getVendorID(self) -> int:
+		return USB_VID
+
+	def getProductID(self) -> int:
+		return self.pid
+
+	def getBusNumber(self) -> int:
+		return 1
+
+	def getDeviceAddress(self) -> int:
+		return 4
+
+	def getbcdDevice(self) -> int:
+		return 0x0200
+
+	def getSerialNumberDescriptor(self) -> int:
+		return _SERIAL_DESC
+
+	def iterConfigurations(self):
+		return iter([ _Config(self) ])
+
+	def iterSettings(self):
+		return iter(_Config(self)._interfaces[0])
+
+	# Control requests
+
+	def control_in(self, request_type: int, request: int, value: int, index: int, length: int) -> bytes:
+		self.requests.append((request_type, request, value, index))
+
+		if request_type & LIBUSB_ENDPOINT_IN and request == LIBUSB_REQUEST_GET_DESCRIPTOR and request_type & 0x60 == 0:
+			string = self.strings.get(value & 0xFF)
+			if (value >> 8) != LIBUSB_DT_STRING or string is None:
+				raise USBErrorPipe(USBErrorPipe.value)
+			data = string.encode('utf-16-le')
+			return (bytes((len(data) + 2, LIBUSB_DT_STRING)) + data)[:length]
+
+		match request:
+			case DFURequests.GetStatus:
+				state = self.state
+				if state == DFUState.DlSync:
+					self.state = DFUState.DlIdle
+				return bytes((DFUStatus.Okay, 0, 0, 0, state, 0))
+			case DFURequests.GetState:
+				self._poll()
+				return bytes((self.state, ))
+		raise USBErrorPipe(USBErrorPipe.value)
+
+	def control_out(self, request_type: int, request: int, value: int, index: int, data: bytes) -> int:
+		self.requests.append((request_type, request, value, index))
+
+		match request:
+			case DFURequests.Detach:
+				self.detaches += 1
+				self._reset()
+				return 0
+			case DFURequests.Download if len(data) > 0:
+				if self.state not in (DFUState.DFUIdle, DFUState.DlIdle):
+					raise USBErrorPipe(USBErrorPipe.value)
+				self.images.setdefault(self.alt, bytearray()).extend(data)
+				(self.state, self._polls) = (DFUState.DlBusy, self.busy_polls)
+				self._poll(0)
+				return len(data)
+			case DFURequests.Download:
+				self.manifested.append((self.alt, bytes(self.images.pop(self.alt, b''))))
+				(self.state, self._polls) = (DFUState.DFUMFSync, self.manifest_polls)
+				return 0
+		raise USBErrorPipe(USBErrorPipe.value)
+
+	def _poll(self, step: int = 1) -> None:
+		''' Let the device get on with whatever it's busy with '''
+		if self.state == DFUState.DlBusy:
+			self._polls -= step
+			if self._polls <= 0:
+				self.state = DFUState.DlSync
+		elif self.state == DFUState.DFUMFSync and self._polls is not None:
+			self._polls -= step
+			if self._polls <= 0:
+				self.state = DFUState.DFUIdle
+
+	def _reset(self) -> None:
+		''' The device re-enumerates, into the bootloader '''
+		(self.pid, self.state) = (USB_DFU_PID, DFUState.DFUIdle)
+
+	# Bulk endpoints
+
+	def send(self, data: bytes) -> None:
+		''' Send data from the device on the bulk IN endpoint '''
+		with self._lock:
+			self._data_in.append(data)
+			self._pump()
+
+	def stall(self) -> None:
+		''' Stall the next bulk IN transfer '''
+		with self._lock:
+			assert self.ctx is not None
+			self.ctx.complete(self._pending_in.popleft(), TRANSFER_STALL)
+
+	@property
+	def pending(self) -> int:
+		''' The number of bulk IN transfers waiting for data '''
+		with self._lock:
+			return len(self._pending_in)
+
+	def bulk_out(self, endpoint: int, data: bytes) -> int:
+		self.data_out.append(data)
+		return len(data)
+
+	def _pump(self) -> None:
+		assert self.ctx is not None
+		while len(self._pending_in) > 0 and len(self._data_in) > 0:
+			transfer = self._pending_in.popleft()
+			data     = self._data_in.popleft()
+			buffer   = transfer.getBuffer()
+			if len(data) > len(buffer):
+				self._data_in.appendleft(data[len(buffer):])
+				data = data[:len(buffer)]
+			buffer[:len(data)] = data
+			self.ctx.complete(transfer, TRANSFER_COMPLETED, len(data))
+
+	def _submit(self, transfer: FakeTransfer) -> None:
+		assert self.ctx is not None
+		if transfer.control is not None:
+			(request_type, request, value, index) = transfer.control
+			try:
+				if request_type & LIBUSB_ENDPOINT_IN:
+					data = self.control_in(request_type, request, value, index, len(transfer._buffer))
+					transfer._buffer[:len(data)] = data
+					self.ctx.complete(transfer, TRANSFER_COMPLETED, len(data))
+				else:
+					self.ctx.complete(
+						transfer, TRANSFER_COMPLETED,
+						self.control_out(request_type, request, value, index, bytes(transfer._buffer))
+					)
+			except USBError:
+				self.ctx.complete(transfer, TRANSFER_STALL)
+			return
+
+		with self._lock:
+			if transfer.endpoint & LIBUSB_ENDPOINT_IN:
+				self._pending_in.append(transfer)
+				self._pump()
+			else:
+				written = self.bulk_out(transfer.endpoint, bytes(transfer._buffer))
+				self.ctx.complete(transfer, TRANSFER_COMPLETED, written)
+
+	def _cancel(self, transfer: FakeTransfer) -> bool:
+		assert self.ctx is not None
+		with self._lock:
+			if transfer not in self._pending_in:
+				return False
+			self._pending_in.remove(transfer)
+			self.ctx.complete(transfer, TRANSFER_CANCELLED)
+			return True
+
+@contextmanager
+def fake_libusb(*devices: FakeSquishy) -> Iterator[FakeContext]:
+	''' Use a :py:class:`FakeContext` with the given devices attached in place of the shared libusb context '''
+
+	ctx = FakeContext()
+	for device in devices:
+		ctx.add(device)
+
+	with (
+		patch('squishy.device._libusb_context', return_value = ctx),
+		patch('squishy.async_device._libusb_context', return_value = ctx),
+	):
+		yield ctx
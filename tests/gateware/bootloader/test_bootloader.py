@@ -7,7 +7,7 @@ from usb_construct.types                       import USBPacketID
 from usb_construct.types.descriptors.dfu       import DFURequests
 from usb_construct.types.descriptors.microsoft import MicrosoftRequests
 
-from squishy.core.config                       import ECP5PLLConfig, ECP5PLLOutput, FlashConfig
+from squishy.core.config                       import BootloaderConfig, ECP5PLLConfig, ECP5PLLOutput, FlashConfig
 from squishy.core.dfu                          import DFUState, DFUStatus
 from squishy.core.flash                        import Geometry
 from squishy.gateware.bootloader               import SquishyBootloader
@@ -95,6 +95,8 @@ class DUTPlatform:
 		}
 	)
 
+	bootloader_cfg = BootloaderConfig(transfer_size = 4096)
+
 	clk_domain_generator = DUTPlatformClockGenerator
 	ephemeral_slot = 3
 	device = 'TEST'
@@ -71,6 +71,7 @@ class DUTWrapper(Elaboratable):
 			self.dfu.slot_ack.eq(self.rev1.slot_ack),
 			self.dfu.dl_ready.eq(self.rev1.dl_ready),
 			self.dfu.dl_done.eq(self.rev1.dl_done),
+			self.dfu.dl_committed.eq(self.rev1.dl_committed),
 		]
 
 		return m
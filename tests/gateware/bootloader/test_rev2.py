@@ -102,6 +102,7 @@ class DUTWrapper(Elaboratable):
 			self.dfu.slot_ack.eq(self.rev2.slot_ack),
 			self.dfu.dl_ready.eq(self.rev2.dl_ready),
 			self.dfu.dl_done.eq(self.rev2.dl_done),
+			self.dfu.dl_committed.eq(self.rev2.dl_committed),
 		]
 
 		m.d.supervisor += [
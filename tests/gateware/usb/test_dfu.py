@@ -1,6 +1,6 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
-from torii.hdl                import Elaboratable, Module, Record
+from torii.hdl                import Elaboratable, Module, Record, Signal
 from torii.hdl.rec            import Direction
 from torii.lib.fifo           import AsyncFIFO
 from torii.sim                import Settle
@@ -9,7 +9,7 @@ from torii.test               import ToriiTestCase
 from squishy.core.config      import FlashConfig
 from squishy.core.flash       import Geometry
 from squishy.gateware.usb.dfu import DFURequestHandler, DFUState
-from squishy.support.test     import DFUGatewareTest, USBGatewareTest
+from squishy.support.test     import DFUGatewareTest, USBGatewareTest, benchmark
 
 _DFU_DATA = (
 	0xff, 0x00, 0x00, 0xff, 0x7e, 0xaa, 0x99, 0x7e, 0x51, 0x00, 0x01, 0x05, 0x92, 0x00, 0x20, 0x62,
@@ -193,3 +193,233 @@ class DFURequestHandlerTests(USBGatewareTest, DFUGatewareTest):
 		self.assertEqual((yield self.dut.dfu.trigger_reboot), 1)
 		yield
 		yield from self.step(10)
+
+
+class DrainWrapper(Elaboratable):
+	'''
+	A DFU handler backed by a storage "device" that consumes the FIFO as fast as it fills, and then takes
+	``store_cycles`` to "program" each block, unless held off by ``hold``, which also holds off the commit
+	of a completed download.
+	'''
+
+	def __init__(self, *, transfer_size: int, fifo_depth: int | None = None, store_cycles: int = 0) -> None:
+		self.fifo = AsyncFIFO(
+			width = 8, depth = transfer_size if fifo_depth is None else fifo_depth, r_domain = 'usb', w_domain = 'usb'
+		)
+
+		self.dfu = DFURequestHandler(1, 0, False, fifo = self.fifo, transfer_size = transfer_size)
+
+		self._store_cycles = store_cycles
+
+		self.interface = self.dfu.interface
+		self.cycles    = Signal(32)
+		self.hold      = Signal()
+
+	def elaborate(self, platform) -> Module:
+		m = Module()
+
+		m.submodules.fifo = fifo = self.fifo
+		m.submodules.dfu  = dfu  = self.dfu
+
+		pending = Signal.like(dfu.dl_size)
+		drained = Signal.like(dfu.dl_size)
+		storing = Signal(range(self._store_cycles + 1))
+
+		m.d.usb += [ self.cycles.eq(self.cycles + 1), ]
+
+		m.d.comb += [
+			dfu.dl_ready.eq(1),
+			dfu.dl_committed.eq(~self.hold),
+			fifo.r_en.eq(fifo.r_rdy & (drained < pending) & ~self.hold),
+		]
+
+		with m.If(dfu.dl_start):
+			m.d.usb += [
+				pending.eq(dfu.dl_size),
+				drained.eq(0),
+			]
+		with m.Elif(fifo.r_en):
+			m.d.usb += [ drained.eq(drained + 1), ]
+
+		# Hold `dl_done` until the DFU handler acknowledges it like the real storage back-ends do
+		with m.If(dfu.dl_finish):
+			m.d.usb += [ dfu.dl_done.eq(0), ]
+		with m.Elif((pending != 0) & (drained == pending) & ~self.hold):
+			with m.If(storing == self._store_cycles):
+				m.d.usb += [
+					dfu.dl_done.eq(1),
+					pending.eq(0),
+					storing.eq(0),
+				]
+			with m.Else():
+				m.d.usb += [ storing.eq(storing + 1), ]
+
+		return m
+
+class DFUTransferSizeTests(USBGatewareTest, DFUGatewareTest):
+	dut: DrainWrapper = DrainWrapper
+	dut_args = {
+		'transfer_size': 256,
+	}
+	domains = ()
+
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+
+	@ToriiTestCase.simulation
+	@ToriiTestCase.sync_domain(domain = 'usb')
+	def test_transfer_size(self):
+		yield self.dut.interface.active_config.eq(1)
+		yield from self.step(4)
+		# Anything larger than the transfer size must be rejected
+		yield from self.send_dfu_download(length = 512)
+		yield from self.ensure_stall()
+		yield from self.send_dfu_get_status()
+		yield from self.receive_data(data = (0, 0, 0, 0, DFUState.DFUIdle, 0))
+		# But a full sized transfer must go through
+		yield from self.send_dfu_download(length = 256)
+		yield from self.send_data(data = _DFU_DATA)
+		yield from self.step(16)
+		yield from self.send_dfu_get_state()
+		yield from self.receive_data(data = (DFUState.DlSync, ))
+		yield from self.send_dfu_get_status()
+		yield from self.receive_data(data = (0, 0, 0, 0, DFUState.DlSync, 0))
+
+class DFUDoubleBufferTests(USBGatewareTest, DFUGatewareTest):
+	dut: DrainWrapper = DrainWrapper
+	dut_args = {
+		'transfer_size': 256,
+		'fifo_depth':    512,
+	}
+	domains = ()
+
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+
+	def download_block(self, *, expected_state: DFUState):
+		yield from self.send_dfu_download(length = len(_DFU_DATA))
+		yield from self.send_data(data = _DFU_DATA)
+		yield from self.step(4)
+		yield from self.send_dfu_get_status()
+		yield from self.receive_data(data = (0, 0, 0, 0, expected_state, 0))
+
+	@ToriiTestCase.simulation
+	@ToriiTestCase.sync_domain(domain = 'usb')
+	def test_double_buffer(self):
+		yield self.dut.interface.active_config.eq(1)
+		yield self.dut.hold.eq(1)
+		yield from self.step(4)
+		# The first block goes into the first buffer, the second is free, so the host can keep going
+		yield from self.download_block(expected_state = DFUState.DlSync)
+		self.assertEqual((yield self.dut.dfu.dl_size), len(_DFU_DATA))
+		yield from self.send_dfu_get_state()
+		yield from self.receive_data(data = (DFUState.DlIdle, ))
+		# The second block fills up the second buffer, and the storage is still busy with the first
+		yield from self.download_block(expected_state = DFUState.DlBusy)
+		# There is no room for a third
+		yield from self.send_dfu_download(length = len(_DFU_DATA))
+		yield from self.ensure_stall()
+		# Let the storage catch up
+		yield self.dut.hold.eq(0)
+		yield from self.step(len(_DFU_DATA) + 16)
+		yield from self.send_dfu_get_status()
+		yield from self.receive_data(data = (0, 0, 0, 0, DFUState.DlSync, 0))
+		# Hold off the storage again and make sure the download isn't completed until it's done
+		yield self.dut.hold.eq(1)
+		yield from self.send_dfu_download(length = 0)
+		yield from self.send_data(data = ())
+		yield from self.send_dfu_get_state()
+		yield from self.receive_data(data = (DFUState.DFUMFSync, ))
+		yield self.dut.hold.eq(0)
+		yield from self.wait_until_high(self.dut.dfu.dl_completed)
+		# Until the slot is committed we are manifesting
+		yield self.dut.hold.eq(1)
+		yield from self.step(2)
+		yield from self.send_dfu_get_state()
+		yield from self.receive_data(data = (DFUState.DFUManifest, ))
+		yield self.dut.hold.eq(0)
+		yield from self.step(2)
+		# After which we are manifestation tolerant, so should be back to idle
+		yield from self.send_dfu_get_status()
+		yield from self.receive_data(data = (0, 0, 0, 0, DFUState.DFUIdle, 0))
+
+@benchmark
+class DFUTransferSizeBenchmark(USBGatewareTest, DFUGatewareTest):
+	dut: DrainWrapper = DrainWrapper
+	dut_args = {
+		'transfer_size': 1024,
+	}
+	domains = ()
+
+	PAYLOAD_SIZE = 32768
+	# USB High-Speed clock cycles in a 1ms frame
+	FRAME_CYCLES = 60000
+	# NOTE: The simulation has no host, so we charge each control transfer a single 125us
+	#       microframe of host scheduling latency, which is the best case for a real host.
+	HOST_TURNAROUND = FRAME_CYCLES // 8
+	# How long the host waits between polls of a busy device
+	POLL_INTERVAL   = 1024
+
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+
+	@ToriiTestCase.simulation
+	@ToriiTestCase.sync_domain(domain = 'usb')
+	def test_download_throughput(self):
+		transfer_size = self.dut_args['transfer_size']
+		buffers       = self.dut_args.get('fifo_depth', transfer_size) // transfer_size
+		payload       = bytes(idx & 0xFF for idx in range(self.PAYLOAD_SIZE))
+		ctrl_xfers    = 0
+
+		yield self.dut.interface.active_config.eq(1)
+		yield from self.step(4)
+
+		start = yield self.dut.cycles
+		for offset in range(0, len(payload), transfer_size):
+			chunk = payload[offset:offset + transfer_size]
+			yield from self.send_dfu_download(length = len(chunk))
+			yield from self.send_data(data = chunk)
+			ctrl_xfers += 1
+
+			# Spin like the host does until the storage has ingested the block
+			while True:
+				yield from self.send_dfu_get_state()
+				ctrl_xfers += 1
+				if (yield from self.receive_data(data = (DFUState.DlSync, ), check = False)):
+					break
+				yield from self.step(self.POLL_INTERVAL)
+
+			yield from self.send_dfu_get_status()
+			yield from self.receive_data(data = (0, 0, 0, 0, DFUState.DlSync, 0))
+			ctrl_xfers += 1
+		cycles = (yield self.dut.cycles) - start
+
+		frames = (cycles + ctrl_xfers * self.HOST_TURNAROUND) / self.FRAME_CYCLES
+		print(
+			f'\nDFU wTransferSize {transfer_size:>5} x{buffers}: {ctrl_xfers:>4} control transfers, '
+			f'{cycles:>7} gateware cycles, {self.PAYLOAD_SIZE / frames:>8.1f} bytes/frame'
+		)
+
+class DFUTransferSize4KBenchmark(DFUTransferSizeBenchmark):
+	dut_args = {
+		'transfer_size': 4096,
+	}
+
+class DFUTransferSize16KBenchmark(DFUTransferSizeBenchmark):
+	dut_args = {
+		'transfer_size': 16384,
+	}
+
+class DFUSingleBufferBenchmark(DFUTransferSizeBenchmark):
+	dut_args = {
+		'transfer_size': 4096,
+		'fifo_depth':    4096,
+		'store_cycles':  8192,
+	}
+
+class DFUDoubleBufferBenchmark(DFUTransferSizeBenchmark):
+	dut_args = {
+		'transfer_size': 4096,
+		'fifo_depth':    8192,
+		'store_cycles':  8192,
+	}
@@ -0,0 +1,169 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from unittest                                    import TestCase
+
+from torii.sim                                   import Settle
+from torii.test                                  import ToriiTestCase
+
+from usb_construct.emitters.descriptors.standard import DeviceDescriptorCollection
+
+from squishy.gateware.usb.stream                 import USBStreamChannel
+from squishy.support.test                        import SquishyGatewareTest
+
+_STREAM_DATA = tuple(range(48))
+
+class USBStreamChannelTests(SquishyGatewareTest):
+	dut: USBStreamChannel = USBStreamChannel
+	dut_args = {
+		'interface':       1,
+		'max_packet_size': 16,
+		'fifo_depth':      16,
+	}
+	domains = (('sync', 48e6), ('usb', 60e6))
+
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+
+	@ToriiTestCase.simulation
+	def test_tx(self):
+		@ToriiTestCase.sync_domain(domain = 'sync')
+		def applet(self):
+			yield self.dut.tx.valid.eq(1)
+			for idx, byte in enumerate(_STREAM_DATA):
+				yield self.dut.tx.data.eq(byte)
+				yield self.dut.tx.first.eq(idx == 0)
+				yield self.dut.tx.last.eq(idx == len(_STREAM_DATA) - 1)
+				yield Settle()
+				# The FIFO is shallower than the data, so we need to be held off at some point
+				while not (yield self.dut.tx.ready):
+					yield
+					yield Settle()
+				yield
+			yield self.dut.tx.valid.eq(0)
+			yield
+
+		@ToriiTestCase.sync_domain(domain = 'usb')
+		def host(self):
+			self.assertEqual((yield self.dut.usb_tx.valid), 0)
+			# Let the FIFO fill up before draining it
+			yield from self.step(32)
+			yield self.dut.usb_tx.ready.eq(1)
+			for idx, byte in enumerate(_STREAM_DATA):
+				yield Settle()
+				while not (yield self.dut.usb_tx.valid):
+					yield
+					yield Settle()
+				self.assertEqual((yield self.dut.usb_tx.data), byte)
+				self.assertEqual((yield self.dut.usb_tx.first), int(idx == 0))
+				self.assertEqual((yield self.dut.usb_tx.last), int(idx == len(_STREAM_DATA) - 1))
+				yield
+			yield Settle()
+			self.assertEqual((yield self.dut.usb_tx.valid), 0)
+
+		applet(self)
+		host(self)
+
+	@ToriiTestCase.simulation
+	def test_rx(self):
+		@ToriiTestCase.sync_domain(domain = 'usb')
+		def host(self):
+			yield self.dut.usb_rx.valid.eq(1)
+			for byte in _STREAM_DATA:
+				yield self.dut.usb_rx.data.eq(byte)
+				yield Settle()
+				while not (yield self.dut.usb_rx.ready):
+					yield
+					yield Settle()
+				yield
+			yield self.dut.usb_rx.valid.eq(0)
+			yield
+
+		@ToriiTestCase.sync_domain(domain = 'sync')
+		def applet(self):
+			yield from self.step(32)
+			yield self.dut.rx.ready.eq(1)
+			for byte in _STREAM_DATA:
+				yield Settle()
+				while not (yield self.dut.rx.valid):
+					yield
+					yield Settle()
+				self.assertEqual((yield self.dut.rx.data), byte)
+				yield
+			yield Settle()
+			self.assertEqual((yield self.dut.rx.valid), 0)
+
+		host(self)
+		applet(self)
+
+	@ToriiTestCase.simulation
+	def test_flush(self):
+		@ToriiTestCase.sync_domain(domain = 'sync')
+		def applet(self):
+			yield self.dut.flush.eq(1)
+			yield
+			yield self.dut.flush.eq(0)
+			yield
+
+		@ToriiTestCase.sync_domain(domain = 'usb')
+		def host(self):
+			yield from self.wait_until_high(self.dut.usb_flush, timeout = 8)
+			yield from self.wait_until_low(self.dut.usb_flush, timeout = 8)
+
+		applet(self)
+		host(self)
+
+class USBStreamChannelUSBDomainTests(SquishyGatewareTest):
+	dut: USBStreamChannel = USBStreamChannel
+	dut_args = {
+		'interface':       1,
+		'out_ep':          None,
+		'max_packet_size': 16,
+		'fifo_depth':      16,
+		'domain':          'usb',
+	}
+	domains = (('usb', 60e6), )
+
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+
+	@ToriiTestCase.simulation
+	@ToriiTestCase.sync_domain(domain = 'usb')
+	def test_tx(self):
+		yield self.dut.usb_tx.ready.eq(1)
+		yield self.dut.tx.valid.eq(1)
+		yield self.dut.tx.last.eq(1)
+		yield self.dut.tx.data.eq(0xA5)
+		yield
+		yield self.dut.tx.valid.eq(0)
+		yield Settle()
+		self.assertEqual((yield self.dut.usb_tx.valid), 1)
+		self.assertEqual((yield self.dut.usb_tx.data), 0xA5)
+		self.assertEqual((yield self.dut.usb_tx.last), 1)
+		yield
+		yield Settle()
+		self.assertEqual((yield self.dut.usb_tx.valid), 0)
+
+class USBStreamChannelDescriptorTests(TestCase):
+	def test_args(self):
+		with self.assertRaises(ValueError):
+			USBStreamChannel(interface = 0, in_ep = None, out_ep = None)
+
+		with self.assertRaises(ValueError):
+			USBStreamChannel(interface = 0, max_packet_size = 512, fifo_depth = 256)
+
+	def test_descriptors(self):
+		channel = USBStreamChannel(interface = 2, in_ep = 3, out_ep = 4, max_packet_size = 512)
+
+		descriptors = DeviceDescriptorCollection()
+		with descriptors.ConfigurationDescriptor() as cfg_desc:
+			cfg_desc.bConfigurationValue = 1
+			channel.add_descriptors(cfg_desc)
+
+		config = descriptors.get_descriptor_bytes(0x02)
+		# Configuration (9) + Interface (9) + 2x Endpoint (7)
+		self.assertEqual(len(config), 32)
+		self.assertEqual(config[9:18], bytes((
+			0x09, 0x04, 0x02, 0x00, 0x02, 0xFF, 0x00, 0x00, 0x00
+		)))
+		self.assertEqual(config[18:25], bytes((0x07, 0x05, 0x83, 0x02, 0x00, 0x02, 0x00)))
+		self.assertEqual(config[25:32], bytes((0x07, 0x05, 0x04, 0x02, 0x00, 0x02, 0x00)))
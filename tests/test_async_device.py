@@ -0,0 +1,78 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from unittest              import IsolatedAsyncioTestCase
+from unittest.mock         import patch
+
+from squishy.async_device  import _EVENT_THREADS, AsyncSquishyDevice
+from squishy.core.config   import USB_DFU_PID
+from squishy.core.dfu      import DFURequests, DFUState
+
+from .fakeusb              import FakeSquishy, fake_libusb
+
+class AsyncSquishyDeviceTests(IsolatedAsyncioTestCase):
+	def setUp(self) -> None:
+		poll = patch('squishy.device._DFU_POLL_INTERVAL', 0)
+		poll.start()
+		self.addCleanup(poll.stop)
+
+	async def test_enumerate(self) -> None:
+		with fake_libusb(FakeSquishy('SQ-0001'), FakeSquishy('SQ-0002', dfu = False)):
+			devices = await AsyncSquishyDevice.enumerate()
+			dev     = await AsyncSquishyDevice.get_device(serial = 'SQ-0002', first = False)
+
+		self.assertEqual([ serial for (serial, _, _) in devices ], [ 'SQ-0001', 'SQ-0002' ])
+		self.assertEqual(dev.serial, 'SQ-0002')
+
+	async def test_open_close(self) -> None:
+		with fake_libusb(FakeSquishy()) as ctx:
+			dev = await AsyncSquishyDevice.get_device()
+			self.assertFalse(dev.is_open)
+			with self.assertRaisesRegex(RuntimeError, 'not open'):
+				await dev.get_altmodes()
+
+			async with dev:
+				self.assertTrue(dev.is_open)
+				self.assertEqual(_EVENT_THREADS[id(ctx)].users, 1)
+				# Opening it again is a no-op
+				await dev.open()
+				self.assertEqual(_EVENT_THREADS[id(ctx)].users, 1)
+
+			self.assertFalse(dev.is_open)
+			self.assertNotIn(id(ctx), _EVENT_THREADS)
+
+	async def test_altmodes(self) -> None:
+		with fake_libusb(FakeSquishy()):
+			async with await AsyncSquishyDevice.get_device() as dev:
+				self.assertEqual(await dev.get_altmodes(), { 0: 'slot0', 1: 'slot1' })
+
+	async def test_upload(self) -> None:
+		fake  = FakeSquishy(dfu = False, transfer_size = 64, busy_polls = 3, manifest_polls = 5)
+		image = bytes(range(256)) * 3
+
+		with fake_libusb(fake):
+			async with await AsyncSquishyDevice.get_device() as dev:
+				self.assertTrue(await dev.upload_images(((1, image), (0, b'second')), reset = True))
+
+		self.assertEqual(fake.manifested, [ (1, image), (0, b'second') ])
+		self.assertEqual(fake.detaches, 2)
+		self.assertEqual(fake.pid, USB_DFU_PID)
+
+	async def test_upload_stuck_manifest(self) -> None:
+		fake = FakeSquishy(manifest_polls = None)
+
+		with fake_libusb(fake), patch('squishy.device._DFU_MAX_POLLS', 10):
+			async with await AsyncSquishyDevice.get_device() as dev:
+				with self.assertRaisesRegex(RuntimeError, 'manifesting alt-mode 0'):
+					await dev.upload(b'image', 0)
+
+		self.assertEqual(fake.state, DFUState.DFUMFSync)
+
+	async def test_upload_bad_state(self) -> None:
+		fake = FakeSquishy()
+		fake.state = DFUState.Error
+
+		with fake_libusb(fake):
+			async with await AsyncSquishyDevice.get_device() as dev:
+				self.assertFalse(await dev.upload(b'image', 0))
+
+		self.assertEqual([ req for req in fake.requests if req[1] == DFURequests.Download ], [])
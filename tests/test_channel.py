@@ -0,0 +1,194 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import asyncio
+from time                  import monotonic, perf_counter, sleep
+from unittest              import IsolatedAsyncioTestCase, TestCase
+
+from usb1                  import USBErrorPipe
+
+from squishy.async_device  import _EVENT_THREADS
+from squishy.channel       import StreamChannel
+from squishy.device        import SquishyDevice
+from squishy.support.test  import benchmark
+
+from .fakeusb              import FakeSquishy, fake_libusb
+
+_SIZE = 512
+
+def _wait_for(predicate, timeout: float = 1.0) -> None:
+	''' Wait for the event thread to catch up '''
+	deadline = monotonic() + timeout
+	while not predicate():
+		if monotonic() > deadline:
+			raise TimeoutError('Timed out waiting for the event thread')
+		sleep(0.001)
+
+class StreamChannelTests(TestCase):
+	def setUp(self) -> None:
+		self.fake = FakeSquishy(dfu = False)
+		libusb    = fake_libusb(self.fake)
+		self.ctx  = libusb.__enter__()
+		self.addCleanup(libusb.__exit__, None, None, None)
+		self.dev  = SquishyDevice.get_device()
+
+	def _channel(self, transfers: int = 2) -> StreamChannel:
+		return StreamChannel(self.dev, interface = 1, transfer_size = _SIZE, transfers = transfers)
+
+	def test_bad_args(self) -> None:
+		with self.assertRaises(ValueError):
+			StreamChannel(self.dev, interface = 1, in_ep = None, out_ep = None)
+		with self.assertRaises(ValueError):
+			StreamChannel(self.dev, interface = 1, transfer_size = 1000)
+		with self.assertRaises(ValueError):
+			StreamChannel(self.dev, interface = 1, transfers = 0)
+
+	def test_open_close(self) -> None:
+		chan = self._channel()
+		with chan:
+			self.assertTrue(chan.is_open)
+			self.assertIn(1, self.fake.claimed)
+			self.assertIn(id(self.ctx), _EVENT_THREADS)
+			self.assertEqual(self.fake.pending, 2)
+
+		# All of the transfers should have been cancelled, and everything given back
+		self.assertFalse(chan.is_open)
+		self.assertEqual(chan._inflight, 0)
+		self.assertEqual(self.fake.pending, 0)
+		self.assertNotIn(1, self.fake.claimed)
+		self.assertNotIn(id(self.ctx), _EVENT_THREADS)
+		self.assertIsNone(chan.read())
+
+	def test_slot_recycling(self) -> None:
+		with self._channel() as chan:
+			self.fake.send(b'a' * _SIZE)
+			self.fake.send(b'b' * 100)
+
+			first = chan.read(timeout = 1)
+			self.assertEqual(first, b'a' * _SIZE)
+			_wait_for(lambda: chan.backlog == 1)
+			# The slot is still held by us, so it must not have been given back yet
+			self.assertEqual(self.fake.pending, 0)
+
+			second = chan.read(timeout = 1)
+			self.assertEqual(second, b'b' * 100)
+			# Reading the second chunk gives the first slot back to libusb, which the device then fills
+			self.assertEqual(self.fake.pending, 1)
+			self.fake.send(b'c' * 10)
+			self.assertEqual(chan.read(timeout = 1), b'c' * 10)
+			self.assertEqual(first[:10], b'c' * 10)
+
+			# Releasing explicitly does the same
+			chan.release()
+			self.assertEqual(self.fake.pending, 2)
+
+		self.assertEqual(chan.bytes_received, _SIZE + 110)
+		self.assertEqual(chan.transfers_completed, 3)
+
+	def test_overflow(self) -> None:
+		chunks = [ bytes((idx, )) * _SIZE for idx in range(6) ]
+
+		with self._channel() as chan:
+			for chunk in chunks:
+				self.fake.send(chunk)
+
+			# Only as many transfers as there are slots complete, the rest waits on the device
+			_wait_for(lambda: chan.backlog == 2)
+			sleep(0.01)
+			self.assertEqual(chan.backlog, 2)
+			self.assertEqual(chan.bytes_received, 2 * _SIZE)
+
+			# Nothing got dropped or overwritten once we catch up
+			self.assertEqual([ bytes(chan.read(timeout = 1)) for _ in chunks ], chunks)
+
+	def test_zlp(self) -> None:
+		with self._channel() as chan:
+			self.fake.send(b'')
+			self.fake.send(b'data')
+			self.assertEqual(chan.read(timeout = 1), b'data')
+			self.assertEqual(chan.transfers_completed, 1)
+
+	def test_timeout(self) -> None:
+		with self._channel() as chan:
+			with self.assertRaises(TimeoutError):
+				chan.read(timeout = 0.01)
+
+	def test_error(self) -> None:
+		with self._channel() as chan:
+			self.fake.send(b'data')
+			_wait_for(lambda: chan.backlog == 1)
+			self.fake.stall()
+
+			# The data received before the failure is still read first
+			self.assertEqual(chan.read(timeout = 1), b'data')
+			with self.assertRaises(USBErrorPipe):
+				chan.read(timeout = 1)
+			self.assertEqual(chan.errors, 1)
+
+	def test_write(self) -> None:
+		with self._channel() as chan:
+			self.assertEqual(chan.write(b'hello'), 5)
+
+		self.assertEqual(self.fake.data_out, [ b'hello' ])
+
+		with StreamChannel(self.dev, interface = 1, out_ep = None) as chan:
+			with self.assertRaises(ValueError):
+				chan.write(b'hello')
+
+class AsyncStreamChannelTests(IsolatedAsyncioTestCase):
+	def setUp(self) -> None:
+		self.fake = FakeSquishy(dfu = False)
+		libusb    = fake_libusb(self.fake)
+		libusb.__enter__()
+		self.addCleanup(libusb.__exit__, None, None, None)
+		self.dev  = SquishyDevice.get_device()
+
+	async def test_aread(self) -> None:
+		async with StreamChannel(self.dev, interface = 1, transfer_size = _SIZE, transfers = 2) as chan:
+			self.fake.send(b'hello')
+			self.fake.send(b'world')
+
+			received = []
+			async for chunk in chan:
+				received.append(bytes(chunk))
+				if len(received) == 2:
+					break
+
+			self.assertEqual(received, [ b'hello', b'world' ])
+			self.assertEqual(await chan.awrite(bytearray(b'data')), 4)
+
+		self.assertEqual(self.fake.data_out, [ b'data' ])
+
+	async def test_close_wakes(self) -> None:
+		chan = StreamChannel(self.dev, interface = 1, transfer_size = _SIZE, transfers = 2)
+		chan.open()
+
+		reader = asyncio.create_task(chan.aread())
+		await asyncio.sleep(0.01)
+		self.assertFalse(reader.done())
+
+		chan.close()
+		self.assertIsNone(await reader)
+
+@benchmark
+class StreamChannelBenchmark(TestCase):
+	def test_throughput(self) -> None:
+		fake  = FakeSquishy(dfu = False)
+		chunk = bytes(range(256)) * 256
+		total = 256
+
+		with fake_libusb(fake):
+			dev = SquishyDevice.get_device()
+			with StreamChannel(dev, interface = 1, transfer_size = len(chunk), transfers = 16) as chan:
+				start = perf_counter()
+				for _ in range(total):
+					fake.send(chunk)
+					view = chan.read(timeout = 1)
+					assert view is not None and len(view) == len(chunk)
+				elapsed = perf_counter() - start
+
+		mib_s = (total * len(chunk)) / elapsed / 2**20
+		print(f'\nStreamChannel: {mib_s:.1f} MiB/s')
+
+		self.assertEqual(chan.bytes_received, total * len(chunk))
+		# Each chunk only costs the one copy into the slot by the fake device, anything else would show up here
+		self.assertGreater(mib_s, 100)
@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from unittest        import TestCase
+from unittest.mock   import patch
+
+from squishy.core.config import USB_DFU_PID
+from squishy.core.dfu    import DFURequests, DFUState
+from squishy.device      import SquishyDevice
+
+from .fakeusb            import FakeSquishy, fake_libusb
+
+class SquishyDeviceTests(TestCase):
+	def setUp(self) -> None:
+		poll = patch('squishy.device._DFU_POLL_INTERVAL', 0)
+		poll.start()
+		self.addCleanup(poll.stop)
+
+	def test_enumerate(self) -> None:
+		with fake_libusb(FakeSquishy('SQ-0001'), FakeSquishy('SQ-0002', dfu = False)):
+			self.assertEqual([ serial for (serial, _, _) in SquishyDevice.enumerate() ], [ 'SQ-0001', 'SQ-0002' ])
+			self.assertEqual(SquishyDevice.get_device(serial = 'SQ-0002', first = False).serial, 'SQ-0002')
+
+	def test_altmodes(self) -> None:
+		with fake_libusb(FakeSquishy()):
+			dev = SquishyDevice.get_device()
+			self.assertEqual(dev.get_altmodes(), { 0: 'slot0', 1: 'slot1' })
+
+	def test_upload(self) -> None:
+		fake  = FakeSquishy(transfer_size = 64, busy_polls = 3, manifest_polls = 5)
+		image = bytes(range(256)) * 3
+
+		with fake_libusb(fake):
+			dev = SquishyDevice.get_device()
+			self.assertTrue(dev.upload(image, 1))
+
+		self.assertEqual(fake.manifested, [ (1, image) ])
+		self.assertEqual(fake.state, DFUState.DFUIdle)
+		# One block per transfer size, and then the zero-length download to manifest it
+		downloads = [ req for req in fake.requests if req[1] == DFURequests.Download ]
+		self.assertEqual([ block for (_, _, block, _) in downloads ], list(range(13)))
+
+	def test_upload_images_from_app(self) -> None:
+		fake = FakeSquishy(dfu = False)
+
+		with fake_libusb(fake):
+			dev = SquishyDevice.get_device()
+			self.assertTrue(dev.upload_images(((0, b'first'), (1, b'second')), reset = True))
+
+		self.assertEqual(fake.manifested, [ (0, b'first'), (1, b'second') ])
+		# Once to get into the bootloader, and once to reset afterwards
+		self.assertEqual(fake.detaches, 2)
+		self.assertEqual(fake.pid, USB_DFU_PID)
+
+	def test_upload_not_manifest_tolerant(self) -> None:
+		fake = FakeSquishy(manifest_tolerant = False)
+
+		with fake_libusb(fake):
+			dev = SquishyDevice.get_device()
+			self.assertTrue(dev.upload_images(((0, b'first'), (1, b'second'))))
+
+		self.assertEqual(fake.manifested, [ (0, b'first'), (1, b'second') ])
+		# The device needs to be reset between the images
+		self.assertEqual(fake.resets, 1)
+
+	def test_upload_stuck_manifest(self) -> None:
+		fake = FakeSquishy(manifest_polls = None)
+
+		with fake_libusb(fake), patch('squishy.device._DFU_MAX_POLLS', 10):
+			dev = SquishyDevice.get_device()
+			with self.assertRaisesRegex(RuntimeError, 'manifesting alt-mode 0'):
+				dev.upload(b'image', 0)
+
+		# Twice to get into DFU mode, once for the only block, and then it gives up after the maximum number of polls
+		polls = [ req for req in fake.requests if req[1] == DFURequests.GetState ]
+		self.assertEqual(len(polls), 3 + 10)
+
+	def test_reset(self) -> None:
+		fake = FakeSquishy(dfu = False)
+
+		with fake_libusb(fake):
+			dev = SquishyDevice.get_device()
+			self.assertTrue(dev.reset(wait = True))
+
+		self.assertEqual(fake.detaches, 1)
+		self.assertEqual(dev._dev.getProductID(), USB_DFU_PID)